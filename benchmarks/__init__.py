@@ -0,0 +1,14 @@
+# -*- coding: utf-8 -*-
+
+"""
+End-to-end benchmarks of NightShift: Sierra dump parsing, enhancement of
+WorldCat full bibs, inserts and retrieval queries of the database, and full
+`process_resources` runs against local fake services.
+
+Results are saved as JSON and compared with a baseline results file; the run
+fails when any measurement is worse than its baseline beyond the tolerance:
+
+    python -m benchmarks --db --out baseline.json
+    python -m benchmarks --db --baseline baseline.json --tolerance 0.15
+"""
+from .results import Measurement, Regression, compare, load_results, save_results
@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+
+"""
+Command line interface of the benchmark suite. Run `python -m benchmarks -h`
+from the root of the repository for the list of options.
+"""
+import argparse
+import logging
+import sys
+from typing import Optional
+
+from .cases import CASES, Options
+from .results import compare, load_results, save_results
+
+
+def _table_sizes(value: str) -> list[int]:
+    try:
+        return [int(n) for n in value.split(",")]
+    except ValueError:
+        raise argparse.ArgumentTypeError(
+            "Table sizes must be a comma separated list of integers."
+        )
+
+
+def main(args: Optional[list] = None) -> int:
+    """
+    Runs benchmarks and compares results with a baseline.
+
+    Returns:
+        exit code: 1 if any measurement regressed beyond the tolerance, otherwise 0
+    """
+    parser = argparse.ArgumentParser(
+        prog="python -m benchmarks", description="Runs NightShift benchmarks."
+    )
+    parser.add_argument(
+        "--only", nargs="+", choices=sorted(CASES), help="benchmarks to run"
+    )
+    parser.add_argument(
+        "--db",
+        action="store_true",
+        help="run database benchmarks; drops all tables of the database set by "
+        "POSTGRES_* environmental variables",
+    )
+    parser.add_argument("--records", type=int, default=1000)
+    parser.add_argument(
+        "--table-sizes",
+        type=_table_sizes,
+        default=[1000, 10000],
+        help="comma separated resource table sizes of query latency benchmark",
+    )
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument(
+        "--latency",
+        type=float,
+        default=0.0,
+        help="latency of fake services in seconds",
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", help="path of JSON file to save results to")
+    parser.add_argument("--baseline", help="path of JSON file with baseline results")
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.2,
+        help="accepted relative worsening compared to baseline (default: 0.2)",
+    )
+    ns = parser.parse_args(args)
+
+    # keep per-record log messages of the bot and the fake SFTP off the console
+    for name in ("nightshift", "paramiko"):
+        logging.getLogger(name).addHandler(logging.NullHandler())
+
+    names = ns.only or sorted(CASES)
+    if not ns.db:
+        skipped = [n for n in names if CASES[n].needsDb]
+        if ns.only and skipped:
+            parser.error(f"benchmarks {skipped} require --db option")
+        names = [n for n in names if n not in skipped]
+
+    options = Options(ns.records, ns.table_sizes, ns.repeat, ns.latency, ns.seed)
+    measurements = []
+    for name in names:
+        for m in CASES[name].func(options):
+            print(f"{m.name:<70}{m.value:>14.3f} {m.unit}")
+            measurements.append(m)
+
+    if ns.out:
+        save_results(ns.out, measurements, options._asdict())
+        print(f"Saved results to {ns.out}.")
+
+    if ns.baseline:
+        regressions = compare(measurements, load_results(ns.baseline), ns.tolerance)
+        for r in regressions:
+            print(
+                f"REGRESSION {r.name}: {r.current:.3f} vs baseline "
+                f"{r.baseline:.3f} ({r.change:+.1%})"
+            )
+        if regressions:
+            return 1
+        print(f"No regressions beyond {ns.tolerance:.0%} tolerance.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,384 @@
+# -*- coding: utf-8 -*-
+
+"""
+Benchmark cases. Each case takes `Options` and returns a list of
+`results.Measurement` tuples. Records are generated with
+`tests.fake_services.synthetic.SyntheticCatalog`, so results of runs with
+the same options are comparable.
+
+Cases marked with `needsDb` drop and recreate all tables of the database set
+by POSTGRES_* environmental variables.
+"""
+from collections import namedtuple
+from datetime import datetime, timedelta, timezone
+from io import BytesIO
+from itertools import cycle, islice
+import logging
+import os
+import statistics
+import tempfile
+import time
+from typing import Callable
+
+from sqlalchemy import create_engine, insert
+
+from nightshift.comms.worldcat import Worldcat
+from nightshift.constants import LIBRARIES, RESOURCE_CATEGORIES
+from nightshift.datastore import (
+    Base,
+    DataAccessLayer,
+    Resource,
+    SourceFile,
+    WorldcatQuery,
+    session_scope,
+)
+from nightshift.datastore_transactions import (
+    ResCatById,
+    ResCatByName,
+    add_resource,
+    init_db,
+    parse_query_days,
+    retrieve_expired_resources,
+    retrieve_new_resources,
+    retrieve_open_matched_resources_with_full_bib_obtained,
+    retrieve_open_matched_resources_without_full_bib,
+    retrieve_open_older_resources,
+)
+from nightshift.manager import process_resources
+from nightshift.marc.marc_parser import BibReader
+from nightshift.marc.marc_writer import BibEnhancer
+
+from tests.fake_services import FakeServices, ServiceConfig, SyntheticCatalog
+
+from .results import Measurement
+
+
+Options = namedtuple("Options", ["records", "tableSizes", "repeat", "latency", "seed"])
+
+# benchmark function and whether it needs a scratch database
+Case = namedtuple("Case", ["func", "needsDb"])
+
+LIBRARY = "NYP"
+LIBRARY_ID = LIBRARIES[LIBRARY]["nid"]
+DUMP_HANDLE = f"{LIBRARY}-benchmark-pout.mrc"
+
+# number of timed calls of each debug statement
+DEBUG_CALLS = 20000
+
+
+def _res_cat_by_name() -> dict[str, ResCatByName]:
+    data = dict()
+    for name, v in RESOURCE_CATEGORIES.items():
+        data[name] = ResCatByName(
+            v["nid"],
+            v["sierraBibFormatBpl"],
+            v["sierraBibFormatNyp"],
+            v["srcTags2Keep"].split(","),
+            v["dstTags2Delete"].split(","),
+            parse_query_days(v["queryDays"]),
+        )
+    return data
+
+
+def _res_cat_by_id() -> dict[int, ResCatById]:
+    return {v.nid: ResCatById(name, *v[1:]) for name, v in _res_cat_by_name().items()}
+
+
+def _dump(options: Options) -> BytesIO:
+    """
+    Returns synthetic Sierra dump of `options.records` records.
+    """
+    dump = BytesIO()
+    SyntheticCatalog(LIBRARY, seed=options.seed).write_dump(dump, options.records)
+    dump.seek(0)
+    return dump
+
+
+def _resources(options: Options) -> list[Resource]:
+    return list(BibReader(_dump(options), LIBRARY, LIBRARY_ID, _res_cat_by_name()))
+
+
+def _reset_db() -> None:
+    """
+    Drops all tables and initiates the database from scratch.
+    """
+    engine = create_engine(DataAccessLayer().conn)
+    Base.metadata.drop_all(engine)
+    engine.dispose()
+    init_db()
+
+
+def _throughput(name: str, n: int, seconds: list[float]) -> Measurement:
+    return Measurement(name, n / min(seconds), "records/s", True)
+
+
+def bib_reader(options: Options) -> list[Measurement]:
+    """
+    Parsing of Sierra dumps into `Resource` instances.
+    """
+    res_cat = _res_cat_by_name()
+    seconds = []
+    for _ in range(options.repeat):
+        dump = _dump(options)
+        start = time.perf_counter()
+        n = sum(1 for _ in BibReader(dump, LIBRARY, LIBRARY_ID, res_cat))
+        seconds.append(time.perf_counter() - start)
+    return [_throughput("bib_reader", n, seconds)]
+
+
+def bib_enhancer(options: Options) -> list[Measurement]:
+    """
+    Parsing and manipulation of WorldCat full bibs of matched resources.
+    """
+    catalog = SyntheticCatalog(LIBRARY, seed=options.seed)
+    resources = []
+    for resource in _resources(options):
+        for identifier in (resource.distributorNumber, resource.standardNumber):
+            oclcNumber = catalog.match(identifier) if identifier else None
+            if oclcNumber:
+                resource.oclcMatchNumber = oclcNumber
+                resource.fullBib = catalog.full_bib(oclcNumber)
+                resources.append(resource)
+                break
+
+    res_cat = _res_cat_by_id()
+    seconds = []
+    for _ in range(options.repeat):
+        start = time.perf_counter()
+        for resource in resources:
+            BibEnhancer(resource, LIBRARY, res_cat).manipulate()
+        seconds.append(time.perf_counter() - start)
+    return [_throughput("bib_enhancer", len(resources), seconds)]
+
+
+def _per_call(func: Callable, args: list, seconds: list[float]) -> None:
+    start = time.perf_counter()
+    for arg in islice(cycle(args), DEBUG_CALLS):
+        func(arg)
+    seconds.append(time.perf_counter() - start)
+
+
+def debug_logging(options: Options) -> list[Measurement]:
+    """
+    Cost of hot-path debug messages when DEBUG level is disabled: per call cost
+    of eagerly formatted (f-string) and lazily formatted (%-style) messages of
+    `BibReader._map_data` and `Worldcat._prep_resource_queries_payloads`, and
+    throughput of `Worldcat._prep_resource_queries_payloads`.
+    """
+    logger = logging.getLogger("nightshift")
+    resources = _resources(options)
+    worldcat = Worldcat(LIBRARY, connect=False)
+    templates = worldcat.build_query_templates({})
+    payloads = [
+        (r, worldcat._prep_resource_queries_payloads(r, templates)) for r in resources
+    ]
+
+    statements: dict[str, tuple[Callable, list]] = {
+        "parsed_resource_eager": (
+            lambda r: logger.debug(f"Parsed resource: {r}"),
+            resources,
+        ),
+        "parsed_resource_lazy": (
+            lambda r: logger.debug("Parsed resource: %s", r),
+            resources,
+        ),
+        "query_payload_eager": (
+            lambda p: logger.debug(
+                f"Query payload for {LIBRARY} Sierra bib # b{p[0].sierraId}a: "
+                f"{p[1]}."
+            ),
+            payloads,
+        ),
+        "query_payload_lazy": (
+            lambda p: logger.debug(
+                "Query payload for %s Sierra bib # b%sa: %s.",
+                LIBRARY,
+                p[0].sierraId,
+                p[1],
+            ),
+            payloads,
+        ),
+    }
+
+    level = logger.level
+    logger.setLevel(logging.INFO)
+    try:
+        measurements = []
+        for name, (func, args) in statements.items():
+            seconds: list[float] = []
+            for _ in range(options.repeat):
+                _per_call(func, args, seconds)
+            measurements.append(
+                Measurement(
+                    f"debug_{name}", min(seconds) / DEBUG_CALLS * 1e6, "us/call", False
+                )
+            )
+
+        seconds = []
+        for _ in range(options.repeat):
+            start = time.perf_counter()
+            for resource in resources:
+                worldcat._prep_resource_queries_payloads(resource, templates)
+            seconds.append(time.perf_counter() - start)
+        measurements.append(_throughput("prep_query_payloads", len(resources), seconds))
+    finally:
+        logger.setLevel(level)
+    return measurements
+
+
+def add_resources(options: Options) -> list[Measurement]:
+    """
+    Inserts of new resources with `datastore_transactions.add_resource`.
+    """
+    seconds = []
+    for _ in range(options.repeat):
+        _reset_db()
+        resources = _resources(options)
+        with session_scope() as db_session:
+            source = SourceFile(libraryId=LIBRARY_ID, handle=DUMP_HANDLE)
+            db_session.add(source)
+            db_session.commit()
+            start = time.perf_counter()
+            for resource in resources:
+                resource.sourceId = source.nid
+                add_resource(db_session, resource)
+            db_session.commit()
+            seconds.append(time.perf_counter() - start)
+    return [_throughput("add_resource", len(resources), seconds)]
+
+
+def _populate(db_session, size: int) -> None:
+    """
+    Bulk inserts `size` resources spread evenly over e-resource categories,
+    bib dates in the last 180 days and stages of the process: new,
+    queried without a match, matched, and matched with a full bib.
+    """
+    source = SourceFile(libraryId=LIBRARY_ID, handle=DUMP_HANDLE)
+    db_session.add(source)
+    db_session.commit()
+
+    today = datetime.now(timezone.utc).date()
+    categories = [RESOURCE_CATEGORIES[n]["nid"] for n in ("ebook", "eaudio", "evideo")]
+    resources, queries = [], []
+    for nid in range(1, size + 1):
+        stage = nid % 4
+        bibDate = today - timedelta(days=nid % 180)
+        resources.append(
+            dict(
+                nid=nid,
+                sierraId=20000000 + nid,
+                libraryId=LIBRARY_ID,
+                resourceCategoryId=categories[nid % len(categories)],
+                bibDate=bibDate,
+                title=f"Benchmark title {nid}",
+                distributorNumber=f"ODN{nid:07}",
+                sourceId=source.nid,
+                oclcMatchNumber=str(1000000000 + nid) if stage >= 2 else None,
+                fullBib=b"<record/>" if stage == 3 else None,
+                status="open",
+            )
+        )
+        if stage:
+            queries.append(
+                dict(
+                    resourceId=nid,
+                    match=stage >= 2,
+                    timestamp=datetime.combine(bibDate, datetime.min.time()),
+                )
+            )
+    db_session.execute(insert(Resource), resources)
+    if queries:
+        db_session.execute(insert(WorldcatQuery), queries)
+    db_session.commit()
+
+
+def retrieve_latency(options: Options) -> list[Measurement]:
+    """
+    Latency of queries selecting resources for each stage of the process
+    at each of `options.tableSizes` sizes of the resource table.
+    """
+    ebook = RESOURCE_CATEGORIES["ebook"]["nid"]
+    queries: dict[str, Callable] = {
+        "retrieve_new_resources": lambda s: retrieve_new_resources(s, LIBRARY_ID),
+        "retrieve_open_older_resources": lambda s: retrieve_open_older_resources(
+            s, LIBRARY_ID, ebook, 30, 90
+        ),
+        "retrieve_open_matched_resources_without_full_bib": lambda s: (
+            retrieve_open_matched_resources_without_full_bib(s, LIBRARY_ID)
+        ),
+        "retrieve_open_matched_resources_with_full_bib_obtained": lambda s: (
+            retrieve_open_matched_resources_with_full_bib_obtained(s, LIBRARY_ID, ebook)
+        ),
+        "retrieve_expired_resources": lambda s: retrieve_expired_resources(
+            s, ebook, 90
+        ),
+    }
+
+    measurements = []
+    for size in options.tableSizes:
+        _reset_db()
+        with session_scope() as db_session:
+            _populate(db_session, size)
+            for name, query in queries.items():
+                seconds = []
+                for _ in range(options.repeat):
+                    start = time.perf_counter()
+                    query(db_session)
+                    seconds.append(time.perf_counter() - start)
+                    db_session.expunge_all()
+                measurements.append(
+                    Measurement(
+                        f"{name}@{size}",
+                        statistics.median(seconds) * 1000,
+                        "ms",
+                        False,
+                    )
+                )
+    return measurements
+
+
+def run_process_resources(options: Options) -> list[Measurement]:
+    """
+    Wall time of `manager.process_resources` run on a synthetic dump against
+    local fake services.
+    """
+    catalog = SyntheticCatalog(LIBRARY, seed=options.seed)
+    config = ServiceConfig(latency=options.latency)
+    seconds = []
+    cwd = os.getcwd()
+    for _ in range(options.repeat):
+        _reset_db()
+        with tempfile.TemporaryDirectory() as root:
+            with FakeServices(
+                sftpRoot=root,
+                worldcat=config,
+                platform=config,
+                solr=config,
+                sftp=config,
+                catalog=catalog,
+            ):
+                dump = os.path.join(root, "sierra_dumps_dir", DUMP_HANDLE)
+                with open(dump, "wb") as out:
+                    catalog.write_dump(out, options.records)
+
+                # temporary MARC21 files are written to the working directory
+                os.chdir(root)
+                try:
+                    start = time.perf_counter()
+                    process_resources()
+                    seconds.append(time.perf_counter() - start)
+                finally:
+                    os.chdir(cwd)
+    return [
+        Measurement(f"process_resources@{options.records}", min(seconds), "s", False)
+    ]
+
+
+CASES = {
+    "bib_reader": Case(bib_reader, False),
+    "bib_enhancer": Case(bib_enhancer, False),
+    "debug_logging": Case(debug_logging, False),
+    "add_resource": Case(add_resources, True),
+    "retrieve_latency": Case(retrieve_latency, True),
+    "process_resources": Case(run_process_resources, True),
+}
@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+
+"""
+Storage of benchmark results and their comparison with a baseline.
+"""
+from collections import namedtuple
+from datetime import datetime, timezone
+import json
+import platform
+
+
+# single benchmark result; `higherIsBetter` is True for throughputs and False
+# for latencies and wall times
+Measurement = namedtuple("Measurement", ["name", "value", "unit", "higherIsBetter"])
+
+# measurement that is worse than its baseline beyond the tolerance;
+# `change` is a relative change of the value (-0.25 means 25% lower)
+Regression = namedtuple("Regression", ["name", "baseline", "current", "change"])
+
+
+def compare(
+    measurements: list[Measurement],
+    baseline: list[Measurement],
+    tolerance: float = 0.2,
+) -> list[Regression]:
+    """
+    Compares measurements with baseline measurements of the same name.
+    Measurements without a baseline are ignored.
+
+    Args:
+        measurements:           current `Measurement` tuples
+        baseline:               baseline `Measurement` tuples
+        tolerance:              accepted relative worsening (0.2 means 20%)
+
+    Returns:
+        list of `Regression` tuples
+
+    Raises:
+        ValueError
+    """
+    if tolerance < 0:
+        raise ValueError("Tolerance must be a non-negative number.")
+
+    baseline_idx = {m.name: m for m in baseline}
+    regressions = []
+    for m in measurements:
+        base = baseline_idx.get(m.name)
+        if base is None or not base.value:
+            continue
+        change = (m.value - base.value) / base.value
+        if m.higherIsBetter:
+            regressed = m.value < base.value * (1 - tolerance)
+        else:
+            regressed = m.value > base.value * (1 + tolerance)
+        if regressed:
+            regressions.append(Regression(m.name, base.value, m.value, change))
+    return regressions
+
+
+def load_results(file_path: str) -> list[Measurement]:
+    """
+    Reads measurements from a JSON results file.
+
+    Args:
+        file_path:              path of the results file
+
+    Returns:
+        list of `Measurement` tuples
+    """
+    with open(file_path, "r") as f:
+        data = json.load(f)
+    return [Measurement(**m) for m in data["measurements"]]
+
+
+def save_results(
+    file_path: str, measurements: list[Measurement], options: dict
+) -> None:
+    """
+    Saves measurements as a JSON results file that can be used as a baseline
+    in later runs.
+
+    Args:
+        file_path:              path of the results file
+        measurements:           `Measurement` tuples
+        options:                benchmark options the measurements were taken with
+    """
+    data = {
+        "created": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "options": options,
+        "measurements": [m._asdict() for m in measurements],
+    }
+    with open(file_path, "w") as f:
+        json.dump(data, f, indent=2)
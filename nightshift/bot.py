@@ -1,18 +1,16 @@
 """
 Launches NightShift application
+
+Modules needed by actions are imported by functions performing them, so short
+actions like `init` or `stats` do not pay for importing WorldCat, Sierra, SFTP
+and MARC clients at launch.
 """
+
 import argparse
 import logging
-import logging.config
-import loggly.handlers
 import os
 import sys
-
-from sqlalchemy.exc import IntegrityError
-import yaml
-
-from nightshift import datastore_transactions, manager
-from nightshift.config.logging_conf import log_conf
+from typing import Optional
 
 
 def config_local_env_variables(
@@ -26,6 +24,8 @@ def config_local_env_variables(
         config_file:            path to config file that includes environmental
                                 variables
     """
+    import yaml
+
     with open(config_file, "r") as f:
         data = yaml.safe_load(f)
         for k, v in data.items():
@@ -39,6 +39,10 @@ def configure_database(env: str = "prod") -> None:
     Args:
         env:                    environment to set up database
     """
+    from sqlalchemy.exc import IntegrityError
+
+    from nightshift import datastore_transactions
+
     if env == "local":
         config_local_env_variables()
     try:
@@ -55,7 +59,34 @@ def configure_database(env: str = "prod") -> None:
         print(f"Created database has invalid structure. Error: {exc}.")
 
 
-def run(env: str = "prod") -> None:
+def upgrade_database(env: str = "prod") -> None:
+    """
+    Upgrades database created with an earlier version of NightShift
+
+    Args:
+        env:                    environment of upgraded database
+    """
+    from nightshift import datastore_transactions
+
+    if env == "local":
+        config_local_env_variables()
+
+    copied = datastore_transactions.upgrade_db()
+    if copied is None:
+        print(f"NightShift {env} database is up to date.")
+    else:
+        print(
+            f"NightShift {env} database successfully upgraded. "
+            f"Copied {copied} event(s) to the partitioned event table."
+        )
+
+
+def run(
+    env: str = "prod",
+    streaming: bool = False,
+    resume: bool = False,
+    profile: bool = False,
+) -> None:
     """
     Launches processing of new and older resources and performs
     database maintenance. This is the main NightShift process.
@@ -68,22 +99,150 @@ def run(env: str = "prod") -> None:
 
     Args:
         env:                    application environment: 'local' or 'prod'
+        streaming:              processes resources in the streaming mode
+                                when True
+        resume:                 continues the last interrupted run skipping
+                                already completed steps when True
+        profile:                profiles the whole run with cProfile when True
+
+    At the end of the run, including a failed one, a JSON report with wall time,
+    item counts, API calls, retries, database round trips and bytes transferred
+    for each stage is saved in the `RUN_REPORT_DIR` directory.
+
+    Metrics are served on a local HTTP endpoint during the run if `METRICS_PORT`
+    is set, and written at the end of the run to `METRICS_TEXTFILE` if set.
+
+    Profiles of the run and of stages listed in `PROFILE_STAGES` are saved in
+    the `PROFILE_DIR` directory and their top functions are written to the log.
     """
+    from nightshift import instrumentation, manager, metrics, profiling
+    from nightshift.config.logging_conf import configure_logging
 
     if env == "local":
         config_local_env_variables()
 
-    conf = log_conf()
-    logging.config.dictConfig(conf)
+    configure_logging()
     logger = logging.getLogger("nightshift")
 
     logger.info(f"Launching {env} NightShift...")
 
-    manager.process_resources()
-    logger.info("Processing resources completed.")
+    metrics_textfile, metrics_port = metrics.metrics_config()
+    metrics_server = None
+    if metrics_port is not None:
+        metrics_server = metrics.start_http_server(metrics_port)
+
+    profile_config = profiling.profile_config()
+    runId = manager.begin_run(resume=resume)
+    instrumentation.start_report(runId)
+    profiling.start_profiling(run=profile, stages=profile_config.stages)
+
+    try:
+        if streaming:
+            manager.process_resources_streaming(runId=runId)
+        else:
+            manager.process_resources(runId=runId)
+        logger.info("Processing resources completed.")
+
+        manager.perform_db_maintenance(runId=runId)
+        logger.info("Database maintenance completed.")
+
+        manager.complete_run(runId)
+    finally:
+        profiling.save_profiles(profile_config.outDir, runId, profile_config.topN)
+        report_fh = instrumentation.save_report()
+        logger.info(f"Run report saved to {report_fh}.")
+        if metrics_textfile:
+            metrics.write_textfile(metrics_textfile)
+            logger.info(f"Metrics saved to {metrics_textfile}.")
+        if metrics_server is not None:
+            metrics_server.shutdown()
 
-    manager.perform_db_maintenance()
-    logger.info("Database maintenance completed.")
+
+def plan(env: str = "prod") -> None:
+    """
+    Prints numbers of resources and requests to WorldCat, Sierra and SFTP
+    the next run would make, and its estimated duration, without making any
+    requests.
+
+    Args:
+        env:                    application environment: 'local' or 'prod'
+    """
+    from datetime import timedelta
+
+    from nightshift import manager
+
+    if env == "local":
+        config_local_env_variables()
+
+    rates = manager.plan_rates()
+    rows = manager.plan_run()
+    print(f"NightShift {env} run plan:")
+    if not rows:
+        print("No resources to process.")
+    for row in rows:
+        print(
+            f"{row.library}\t{row.resourceCategory}\t{row.stage}\t"
+            f"{row.resources}\t{row.requests}\t{row.uniqueRequests}"
+        )
+    for stage in manager.PLAN_STAGES:
+        stage_rows = [r for r in rows if r.stage == stage]
+        if stage_rows:
+            print(
+                f"Total {stage}: {sum(r.resources for r in stage_rows)} resources, "
+                f"{sum(r.requests for r in stage_rows)} requests "
+                f"({sum(r.uniqueRequests for r in stage_rows)} unique)."
+            )
+    duration = timedelta(seconds=round(manager.plan_duration(rows, rates)))
+    print(f"Estimated duration of requests: {duration}.")
+
+
+def purge(
+    env: str = "prod", dry_run: bool = False, archive_dir: Optional[str] = None
+) -> None:
+    """
+    Deletes from the database aged-out resources in batches.
+
+    Args:
+        env:                    application environment: 'local' or 'prod'
+        dry_run:                only reports number of resources to be deleted
+                                when True
+        archive_dir:            directory where deleted rows are archived before
+                                deletion
+    """
+    from nightshift import manager
+    from nightshift.config.logging_conf import configure_logging
+
+    if env == "local":
+        config_local_env_variables()
+
+    configure_logging()
+    logger = logging.getLogger("nightshift")
+
+    logger.info(f"Launching {env} NightShift purge of aged-out resources...")
+    manager.purge_aged_resources(dry_run=dry_run, archive_dir=archive_dir)
+    logger.info("Purge completed.")
+
+
+def stats(env: str = "prod", days: int = 30) -> None:
+    """
+    Prints counts of events per library, resource category, and status
+    in the last number of days.
+
+    Args:
+        env:                    application environment: 'local' or 'prod'
+        days:                   number of days including today
+    """
+    from nightshift import manager
+
+    if env == "local":
+        config_local_env_variables()
+
+    rows = manager.event_stats(days)
+    print(f"NightShift {env} events in the last {days} day(s):")
+    if not rows:
+        print("No events found.")
+    for row in rows:
+        print(f"{row.library}\t{row.resourceCategory}\t{row.status}\t{row.tally}")
 
 
 def main(args: list) -> None:
@@ -99,9 +258,9 @@ def main(args: list) -> None:
 
     parser.add_argument(
         "action",
-        help="'init' sets up database ; 'run' launches processing records and db maintenance",
+        help="'init' sets up database ; 'upgrade' upgrades database created with an earlier version ; 'run' launches processing records and db maintenance ; 'resume' continues interrupted run ; 'plan' estimates requests of the next run without making them ; 'purge' deletes aged-out resources ; 'stats' reports event counts",
         type=str,
-        choices=["init", "run"],
+        choices=["init", "upgrade", "run", "resume", "plan", "purge", "stats"],
     )
     parser.add_argument(
         "environment",
@@ -109,15 +268,69 @@ def main(args: list) -> None:
         type=str,
         choices=["prod", "local"],
     )
+    parser.add_argument(
+        "--streaming",
+        help="overlaps WorldCat searches, full bib downloads and enhancement of records",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--profile",
+        help="profiles 'run' or 'resume' with cProfile and logs the top functions",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--dry-run",
+        help="reports number of resources to be deleted by 'purge' without deleting them",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--archive-dir",
+        help="directory where 'purge' archives deleted rows to compressed files",
+        type=str,
+    )
+    parser.add_argument(
+        "--days",
+        help="number of days reported by 'stats' (default 30)",
+        type=int,
+        default=30,
+    )
 
     pargs = parser.parse_args(args)
 
     if pargs.action == "run":
-        run(env=pargs.environment)
+        run(
+            env=pargs.environment,
+            streaming=pargs.streaming,
+            profile=pargs.profile,
+        )
+
+    elif pargs.action == "resume":
+        run(
+            env=pargs.environment,
+            streaming=pargs.streaming,
+            resume=True,
+            profile=pargs.profile,
+        )
+
+    elif pargs.action == "plan":
+        plan(env=pargs.environment)
+
+    elif pargs.action == "purge":
+        purge(
+            env=pargs.environment,
+            dry_run=pargs.dry_run,
+            archive_dir=pargs.archive_dir,
+        )
+
+    elif pargs.action == "stats":
+        stats(env=pargs.environment, days=pargs.days)
 
     elif pargs.action == "init":
         configure_database(env=pargs.environment)
 
+    elif pargs.action == "upgrade":
+        upgrade_database(env=pargs.environment)
+
 
 if __name__ == "__main__":
     main(sys.argv[1:])  # pragma: no cover
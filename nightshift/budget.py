@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+
+"""
+This module limits work done by a single run.
+
+Caps on the number of API calls and on wall time can be set for the whole run
+(`RUN_MAX_API_CALLS`, `RUN_MAX_SECONDS`) and for each library
+(`LIBRARY_MAX_API_CALLS`, `LIBRARY_MAX_SECONDS`). API calls are counted by
+the `instrumentation` module, so WorldCat, NYPL Platform, BPL Solr and SFTP
+requests made in any stage of the run count toward the budget. A cap that is
+not set is not enforced.
+"""
+from collections import namedtuple
+import logging
+import os
+import time
+from typing import Optional
+
+from nightshift import instrumentation
+from nightshift.ns_exceptions import BudgetExhausted
+
+
+logger = logging.getLogger("nightshift")
+
+
+BudgetConfig = namedtuple(
+    "BudgetConfig",
+    ["runApiCalls", "runSeconds", "libraryApiCalls", "librarySeconds"],
+    defaults=[None, None, None, None],
+)
+
+
+def _cap(name: str) -> Optional[int]:
+    value = os.getenv(name)
+    if not value:
+        return None
+    try:
+        cap = int(value)
+    except ValueError:
+        raise ValueError(f"Invalid {name} value. Must be an integer.")
+    if cap < 1:
+        raise ValueError(f"Invalid {name} value. Must be a positive integer.")
+    return cap
+
+
+def budget_config() -> BudgetConfig:
+    """
+    Reads caps of the run budget from environmental variables.
+
+    Returns:
+        `BudgetConfig` tuple
+
+    Raises:
+        ValueError
+    """
+    return BudgetConfig(
+        _cap("RUN_MAX_API_CALLS"),
+        _cap("RUN_MAX_SECONDS"),
+        _cap("LIBRARY_MAX_API_CALLS"),
+        _cap("LIBRARY_MAX_SECONDS"),
+    )
+
+
+class RunBudget:
+    """
+    Tracks API calls and wall time spent by a run and by each library
+    against caps of the budget.
+    """
+
+    def __init__(self, config: BudgetConfig = BudgetConfig()) -> None:
+        """
+        Args:
+            config:                     `BudgetConfig` tuple
+        """
+        self.config = config
+        self.started = time.monotonic()
+        self._run_calls = self._api_calls()
+        self._libraries: dict[str, tuple[float, int]] = dict()
+
+    def _api_calls(self, library: Optional[str] = None) -> int:
+        report = instrumentation.current_report()
+        return report.total("apiCalls", library)
+
+    def start_library(self, library: str) -> None:
+        """
+        Begins tracking of work done for the library.
+
+        Args:
+            library:                    'NYP' or 'BPL'
+        """
+        self._libraries[library] = (time.monotonic(), self._api_calls(library))
+
+    def spent(self, library: Optional[str] = None) -> tuple[int, float]:
+        """
+        Returns API calls and seconds spent by the run or, if given, by
+        the library since `start_library` was called.
+
+        Args:
+            library:                    'NYP' or 'BPL'
+
+        Returns:
+            (API calls, seconds) tuple
+        """
+        if library is None:
+            return (
+                self._api_calls() - self._run_calls,
+                time.monotonic() - self.started,
+            )
+        started, calls = self._libraries.get(library, (self.started, 0))
+        return self._api_calls(library) - calls, time.monotonic() - started
+
+    def exhausted(self, library: Optional[str] = None) -> Optional[str]:
+        """
+        Checks caps of the run and, if given, of the library.
+
+        Args:
+            library:                    'NYP' or 'BPL'
+
+        Returns:
+            description of the exhausted cap or None
+        """
+        calls, seconds = self.spent()
+        if self.config.runApiCalls is not None and calls >= self.config.runApiCalls:
+            return f"run budget of {self.config.runApiCalls} API calls exhausted"
+        if self.config.runSeconds is not None and seconds >= self.config.runSeconds:
+            return f"run budget of {self.config.runSeconds} seconds exhausted"
+
+        if library is not None:
+            calls, seconds = self.spent(library)
+            cap = self.config.libraryApiCalls
+            if cap is not None and calls >= cap:
+                return f"{library} budget of {cap} API calls exhausted"
+            cap = self.config.librarySeconds
+            if cap is not None and seconds >= cap:
+                return f"{library} budget of {cap} seconds exhausted"
+        return None
+
+    def check(self, library: Optional[str] = None) -> None:
+        """
+        Raises `BudgetExhausted` exception if any cap of the run or the library
+        has been reached.
+
+        Args:
+            library:                    'NYP' or 'BPL'
+
+        Raises:
+            BudgetExhausted
+        """
+        reason = self.exhausted(library)
+        if reason is not None:
+            raise BudgetExhausted(reason)
@@ -15,7 +15,7 @@ from bookops_bpl_solr import SolrSession
 from bookops_bpl_solr.session import BookopsSolrError
 from requests import Response
 
-from .. import __title__, __version__
+from .. import __title__, __version__, instrumentation, metrics
 from ..ns_exceptions import SierraSearchPlatformError
 
 logger = logging.getLogger("nightshift")
@@ -269,7 +269,9 @@ class NypPlatform(PlatformSession):
         """
         try:
 
-            response = self.get_bib(sierraId)
+            with metrics.SIERRA_REQUEST_SECONDS.time(library="NYP"):
+                response = self.get_bib(sierraId)
+            instrumentation.record("apiCalls")
             logger.debug(
                 f"NYPL Platform request ({response.status_code}): {response.url}."
             )
@@ -321,17 +323,19 @@ class BplSolr(SolrSession):
             `ns_exceptions.SierraSearchPlatformError`
         """
         try:
-            response = self.search_bibNo(
-                sierraId,
-                default_response_fields=False,
-                response_fields=[
-                    "id",
-                    "suppressed",
-                    "call_number",
-                    "ss_marc_tag_003",
-                    # "bs_deleted_in_sierra",
-                ],
-            )
+            with metrics.SIERRA_REQUEST_SECONDS.time(library="BPL"):
+                response = self.search_bibNo(
+                    sierraId,
+                    default_response_fields=False,
+                    response_fields=[
+                        "id",
+                        "suppressed",
+                        "call_number",
+                        "ss_marc_tag_003",
+                        # "bs_deleted_in_sierra",
+                    ],
+                )
+            instrumentation.record("apiCalls")
             logger.debug(f"BPL Solr request ({response.status_code}): {response.url}.")
             search_response = SearchResponse(sierraId, "BPL", response)
 
@@ -14,6 +14,7 @@ from paramiko.transport import Transport
 from paramiko.sftp_client import SFTPClient
 from paramiko.ssh_exception import SSHException
 
+from .. import instrumentation, metrics
 from ..ns_exceptions import DriveError
 
 
@@ -114,7 +115,12 @@ class Drive:
                 with self.sftp.file(src_file_path, mode="r") as file:
                     file_size = file.stat().st_size
                     file.prefetch(file_size)
-                    return BytesIO(file.read(file_size))
+                    data = BytesIO(file.read(file_size))
+                fetched = len(data.getbuffer())
+                instrumentation.record("apiCalls")
+                instrumentation.record("bytes", fetched)
+                metrics.SFTP_BYTES.inc(fetched, direction="fetch")
+                return data
             except IOError as exc:
                 logger.error(
                     f"Unable to fetch file {src_file_path} from the SFTP. {exc}."
@@ -133,7 +139,9 @@ class Drive:
             raise DriveError
         else:
             try:
-                return self.sftp.listdir(path=self.src_dir)
+                handles = self.sftp.listdir(path=self.src_dir)
+                instrumentation.record("apiCalls")
+                return handles
             except IOError as exc:
                 logger.error(f"Unable to reach {self.src_dir} on the SFTP. {exc}")
                 raise DriveError
@@ -156,7 +164,11 @@ class Drive:
             try:
 
                 remote_file_path = self._construct_dst_file_path(remote_file_name_base)
-                self.sftp.put(local_file_path, remote_file_path)
+                attrs = self.sftp.put(local_file_path, remote_file_path)
+                file_size = attrs.st_size or 0
+                instrumentation.record("apiCalls")
+                instrumentation.record("bytes", file_size)
+                metrics.SFTP_BYTES.inc(file_size, direction="output")
                 logger.info(f"Successfully created {remote_file_path} on the SFTP.")
                 return os.path.basename(remote_file_path)
 
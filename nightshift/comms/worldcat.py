@@ -3,10 +3,12 @@
 """
 This module handles WorldCat Metadata API requests.
 """
-from collections.abc import Iterator
+from collections import namedtuple
+from collections.abc import Iterable, Iterator
+from itertools import islice
 import os
 import logging
-from typing import Any
+from typing import Any, Mapping, Optional, Sequence, Union, cast
 
 from bookops_worldcat import WorldcatAccessToken, MetadataSession
 from bookops_worldcat.errors import (
@@ -15,27 +17,56 @@ from bookops_worldcat.errors import (
 )
 from requests import Response
 
-from nightshift import __title__, __version__
+from nightshift import __title__, __version__, instrumentation, metrics
+from nightshift.constants import RESOURCE_CATEGORIES
 from nightshift.datastore import Resource
+from nightshift.datastore_transactions import ResQueryData
 
 
 logger = logging.getLogger("nightshift")
 
 
+# `packField` is the brief record field listing identifiers searched by the template
+# (for example 'isbns'); only such templates can be used in packed queries
+QueryTemplate = namedtuple(
+    "QueryTemplate",
+    ["field", "prefix", "suffix", "params", "packField"],
+    defaults=[None],
+)
+
+# max number of brief records returned by a single search
+PACKED_QUERY_LIMIT = 50
+
+
+# characters indicating broken diacritics in WorldCat records
+ENCODING_ARTIFACTS = ("\u00a9", "\u2117")  # "©", "℗"
+
+
 class BriefBibResponse:
-    def __init__(self, response: Response):
-        self.as_json = response.json()
-        self.is_match = self._is_match()
+    def __init__(self, response: Union[Response, dict]):
+        """
+        Args:
+            response:               brief bib search response or its JSON data
+        """
+        if isinstance(response, dict):
+            self.as_json = response
+        else:
+            self.as_json = response.json()
         self.oclc_number = self._parse_oclc_number()
+        self.rejection = self._prescreen()
+        self.is_match = self._is_match()
 
     def _is_match(self) -> bool:
         """
         Determines if Worldcat brief bib search response returned matching record
+        that passed the pre-screen
         Returns:
             bool
         """
         if self.as_json["numberOfRecords"] == 0:
             return False
+        elif self.rejection is not None:
+            return False
         else:
             return True
 
@@ -51,15 +82,50 @@ class BriefBibResponse:
         except (IndexError, KeyError):
             return None
 
+    def _prescreen(self) -> Optional[str]:
+        """
+        Applies to the matched brief record those minimum criteria of
+        `marc.marc_writer.BibEnhancer` that can be checked without the full bib
+        (uppercase title and broken diacritics), so records that would be
+        rejected during enhancement are not downloaded.
+
+        Returns:
+            reason of rejection or None if the record passed
+        """
+        try:
+            record = self.as_json["briefRecords"][0]
+        except (IndexError, KeyError):
+            return None
+
+        title = record.get("title") or ""
+        author = record.get("creator") or ""
+        if title.isupper():
+            return "uppercase title"
+        for artifact in ENCODING_ARTIFACTS:
+            if artifact in title or artifact in author:
+                return "characters encoding"
+        return None
+
+
+def _normalize_identifier(identifier: str) -> str:
+    """
+    Normalizes identifier to match different forms of the same ISBN
+    or distributor number.
+    """
+    return str(identifier).replace("-", "").strip().upper()
+
 
 class Worldcat:
-    def __init__(self, library: str):
+    def __init__(self, library: str, connect: bool = True):
         """
         Initiate reader by obtaining MetadataAPI access token and by creating
         a session
 
         Args:
             library:                'NYP' or "BPL"
+            connect:                obtains access token and opens a session
+                                    when True; otherwise the instance can only
+                                    prepare queries without making any requests
         """
         if library not in ("NYP", "BPL", "nyp", "bpl"):
             raise ValueError(
@@ -67,16 +133,19 @@ class Worldcat:
             )
 
         self.library = library.upper()
+        self.connected = connect
 
-        creds = self._get_credentials()
-        token = self._get_access_token(creds)
-        self.session = self._create_worldcat_session(token)
+        if connect:
+            creds = self._get_credentials()
+            token = self._get_access_token(creds)
+            self.session = self._create_worldcat_session(token)
 
     def __enter__(self):
         return self
 
     def __exit__(self, *args):
-        self.session.close()
+        if self.connected:
+            self.session.close()
 
     def _create_worldcat_session(
         self, access_token: WorldcatAccessToken
@@ -93,7 +162,7 @@ class Worldcat:
             return session
 
     def _format_rotten_apples(
-        self, resource_category_id: int, rotten_apples: dict[int, list[str]]
+        self, resource_category_id: int, rotten_apples: Mapping[int, Sequence[str]]
     ) -> str:
         """
         Formats a list of forbidden org codes to be includes in a Worldcat query
@@ -150,162 +219,397 @@ class Worldcat:
             agent=f"{__title__}/{__version__}",
         )
 
+    def _pack_size(self) -> int:
+        """
+        Reads from `WORLDCAT_PACK_SIZE` environmental variable the max number of
+        identifiers combined in a single packed brief bib query. Packing is
+        disabled when the size is 1 (default).
+
+        Returns:
+            pack size
+
+        Raises:
+            ValueError
+        """
+        value = os.getenv("WORLDCAT_PACK_SIZE") or "1"
+        try:
+            size = int(value)
+        except ValueError:
+            raise ValueError("Invalid WORLDCAT_PACK_SIZE value. Must be an integer.")
+        if not 1 <= size <= PACKED_QUERY_LIMIT:
+            raise ValueError(
+                "Invalid WORLDCAT_PACK_SIZE value. Must be between 1 and "
+                f"{PACKED_QUERY_LIMIT}."
+            )
+        return size
+
     def _prep_resource_queries_payloads(
-        self, resource: Resource, rotten_apples: dict[int, list[str]]
+        self,
+        resource: Union[Resource, ResQueryData],
+        query_templates: Mapping[int, tuple[QueryTemplate, ...]],
     ) -> list[dict]:
         """
         Prepares payloads with query parameters for different resources.
 
         Args:
-            resource:                   `datastore.Resource` instance
-            rotten_apples:              dictionary of OCLC organization codes
-                                        to be excluded from results;
-                                        dict key is `ResourceCategory.nid`.
+            resource:                   `datastore.Resource` instance or
+                                        `datastore_transactions.ResQueryData`
+                                        tuple
+            query_templates:            query templates of resource categories
+                                        created by `build_query_templates`
 
         Returns:
             payloads
         """
         payloads = []
-
-        forbidden_sources = self._format_rotten_apples(
-            resource.resourceCategoryId, rotten_apples
-        )
-
-        if resource.resourceCategoryId == 1:
-            # ebook
-            if resource.distributorNumber:
+        for template in query_templates.get(resource.resourceCategoryId, ()):
+            value = getattr(resource, template.field)
+            if value:
                 payloads.append(
                     dict(
-                        q=(
-                            f"sn={resource.distributorNumber} "
-                            f"NOT lv:3{forbidden_sources}"
-                        ),
-                        itemType="book",
-                        itemSubType="book-digital",
+                        q=f"{template.prefix}{value}{template.suffix}",
+                        **template.params,
                     )
                 )
-        elif resource.resourceCategoryId == 2:
-            # eaudio
-            if resource.distributorNumber:
-                payloads.append(
-                    dict(
-                        q=f"sn={resource.distributorNumber} NOT lv:3{forbidden_sources}",
-                        itemType="audiobook",
-                        itemSubType="audiobook-digital",
+        logger.debug(
+            "Query payload for %s Sierra bib # b%sa: %s.",
+            self.library,
+            resource.sierraId,
+            payloads,
+        )
+        return payloads
+
+    def _search_brief_bibs(self, payload: dict, limit: int = 1) -> Response:
+        """
+        Performs a brief bib search ordered by the number of holdings.
+
+        Args:
+            payload:                    query parameters
+            limit:                      max number of returned brief records
+
+        Returns:
+            `requests.Response` instance
+        """
+        with metrics.WORLDCAT_REQUEST_SECONDS.time(
+            library=self.library, endpoint="brief_bibs_search"
+        ):
+            response = cast(
+                Response,
+                self.session.brief_bibs_search(
+                    **payload,
+                    inCatalogLanguage="eng",
+                    orderBy="mostWidelyHeld",
+                    limit=limit,
+                ),
+            )
+        instrumentation.record("apiCalls")
+        instrumentation.record("bytes", len(response.content))
+        return response
+
+    def _search_packed(
+        self,
+        resources: list[Union[Resource, ResQueryData]],
+        query_templates: Mapping[int, tuple[QueryTemplate, ...]],
+    ) -> dict[int, BriefBibResponse]:
+        """
+        Searches for resources of the batch in packed queries. Identifiers
+        of resources of the same category that can be queried with the
+        category's first template are combined into a single query, and
+        returned brief records are mapped back to the resources by
+        identifiers listed in the template's `packField` of the records.
+        Records are ordered by the number of holdings, so each resource is
+        matched to the most widely held record with its identifier.
+
+        Args:
+            resources:                  batch of `datastore.Resource` instances
+                                        or `ResQueryData` tuples
+            query_templates:            query templates of resource categories
+                                        created by `build_query_templates`
+
+        Returns:
+            responses of matched resources by their position in the batch
+        """
+        # positions of resources by identifier for each category
+        groups: dict[int, dict[str, list[int]]] = dict()
+        for n, resource in enumerate(resources):
+            templates = query_templates.get(resource.resourceCategoryId, ())
+            if not templates or templates[0].packField is None:
+                continue
+            value = getattr(resource, templates[0].field)
+            if value:
+                group = groups.setdefault(resource.resourceCategoryId, dict())
+                group.setdefault(_normalize_identifier(value), []).append(n)
+
+        matched = dict()
+        for category_id, group in groups.items():
+            if len(group) < 2:
+                continue
+            template = query_templates[category_id][0]
+            packed = len(group)
+            terms = " OR ".join(f"{template.prefix}{value}" for value in group)
+            payload = dict(q=f"({terms}){template.suffix}", **template.params)
+            response = self._search_brief_bibs(payload, limit=PACKED_QUERY_LIMIT)
+            logger.debug(
+                "Packed brief bib Worldcat query for %s %s identifiers: %s",
+                packed,
+                self.library,
+                response.url,
+            )
+
+            resolved = 0
+            for record in response.json().get("briefRecords", []):
+                for identifier in record.get(template.packField) or []:
+                    positions = group.pop(_normalize_identifier(identifier), [])
+                    if not positions:
+                        continue
+                    brief_bib_response = BriefBibResponse(
+                        dict(numberOfRecords=1, briefRecords=[record])
                     )
+                    # resources of rejected records are searched again with
+                    # all templates as when packing is disabled
+                    if brief_bib_response.is_match:
+                        resolved += 1
+                        for n in positions:
+                            matched[n] = brief_bib_response
+            logger.debug(
+                "Packed brief bib Worldcat query for %s resolved %s identifier(s); "
+                "%s left for single queries.",
+                self.library,
+                resolved,
+                packed - resolved,
+            )
+        return matched
+
+    def _search_single(
+        self,
+        resource: Union[Resource, ResQueryData],
+        query_templates: Mapping[int, tuple[QueryTemplate, ...]],
+    ) -> Optional[BriefBibResponse]:
+        """
+        Searches for the resource with queries of its category's templates
+        until a match is found.
+
+        Args:
+            resource:                   `datastore.Resource` instance or
+                                        `ResQueryData` tuple
+            query_templates:            query templates of resource categories
+                                        created by `build_query_templates`
+
+        Returns:
+            response of the last query or None if no query could be created
+        """
+        payloads = self._prep_resource_queries_payloads(resource, query_templates)
+        if not payloads:
+            logger.warning(
+                f"Unable to create a payload for brief bib query for "
+                f"{self.library} resource nid={resource.nid}, "
+                f"sierraId=b{resource.sierraId}a."
+            )
+            return None
+
+        for n, payload in enumerate(payloads):
+            if n:
+                instrumentation.record("retries")
+            response = self._search_brief_bibs(payload)
+
+            brief_bib_response = BriefBibResponse(response)
+            logger.debug(
+                "Brief bib Worldcat query for %s Sierra bib # b%sa: %s",
+                self.library,
+                resource.sierraId,
+                response.url,
+            )
+            if brief_bib_response.is_match:
+                logger.debug(
+                    "Match found for %s Sierra bib # b%sa.",
+                    self.library,
+                    resource.sierraId,
                 )
-        elif resource.resourceCategoryId == 3:
-            # evideo
-            if resource.distributorNumber:
-                payloads.append(
-                    dict(
-                        q=f"sn={resource.distributorNumber} NOT lv:3 NOT lv:M{forbidden_sources}",
-                        itemType="video",
-                        itemSubType="video-digital",
-                    )
+                break
+            elif brief_bib_response.rejection is not None:
+                logger.debug(
+                    "Worldcat record # %s for %s Sierra bib # b%sa failed "
+                    "pre-screen (%s).",
+                    brief_bib_response.oclc_number,
+                    self.library,
+                    resource.sierraId,
+                    brief_bib_response.rejection,
                 )
-        elif resource.resourceCategoryId in range(4, 12):
-            # print monograph materials
-            if resource.standardNumber:
-                payloads.append(
-                    dict(
-                        q=f"bn:{resource.standardNumber}{forbidden_sources}",
-                        itemType="book",
-                        itemSubType="book-printbook",
-                        catalogSource="DLC",
-                    )
+            else:
+                logger.debug(
+                    "No matches found for %s Sierra bib # b%sa: %s",
+                    self.library,
+                    resource.sierraId,
+                    response.url,
                 )
-            if resource.congressNumber:
-                payloads.append(
-                    dict(
-                        q=f"ln:{resource.congressNumber}{forbidden_sources}",
-                        itemType="book",
-                        itemSubType="book-printbook",
-                        catalogSource="DLC",
+        return brief_bib_response
+
+    def build_query_templates(
+        self, rotten_apples: Mapping[int, Sequence[str]]
+    ) -> dict[int, tuple[QueryTemplate, ...]]:
+        """
+        Compiles query templates of each resource category defined in
+        `constants.RESOURCE_CATEGORIES` with any forbidden org codes of
+        the category appended to the query string.
+
+        Args:
+            rotten_apples:              dictionary of OCLC organization codes
+                                        to be excluded from results;
+                                        dict key is `ResourceCategory.nid`.
+
+        Returns:
+            dictionary of query templates; key is `ResourceCategory.nid`
+        """
+        templates = dict()
+        for category in RESOURCE_CATEGORIES.values():
+            nid = cast(int, category["nid"])
+            forbidden_sources = self._format_rotten_apples(nid, rotten_apples)
+            compiled = []
+            for template in cast(list, category["queryTemplates"]):
+                params = {
+                    k: v
+                    for k, v in template.items()
+                    if k not in ("field", "q", "packField")
+                }
+                prefix, suffix = template["q"].split("{}")
+                compiled.append(
+                    QueryTemplate(
+                        template["field"],
+                        prefix,
+                        f"{suffix}{forbidden_sources}",
+                        params,
+                        template.get("packField"),
                     )
                 )
-        logger.debug(
-            f"Query payload for {self.library} Sierra bib # b{resource.sierraId}a: "
-            f"{payloads}."
-        )
-        return payloads
+            templates[nid] = tuple(compiled)
+        return templates
 
     def get_brief_bibs(
-        self, resources: list[Resource], rotten_apples: dict[int, list[str]] = {}
-    ) -> Iterator[tuple[Resource, BriefBibResponse]]:
+        self,
+        resources: Iterable[Union[Resource, ResQueryData]],
+        rotten_apples: Mapping[int, Sequence[str]] = {},
+        pack_size: Optional[int] = None,
+        query_templates: Optional[Mapping[int, tuple[QueryTemplate, ...]]] = None,
+    ) -> Iterator[tuple[Union[Resource, ResQueryData], BriefBibResponse]]:
         """
         Performs WorldCat queries for each resource in the passed library batch.
-        Resources must belong to the same library.
+        Resources must belong to the same library. Lightweight `ResQueryData`
+        tuples can be passed instead of `Resource` instances to avoid loading
+        full records from the database.
+
+        When packing is enabled, resources are searched in batches of `pack_size`
+        resources. Identifiers of a batch are first combined in packed queries
+        (see `_search_packed`) and resources left unresolved are searched
+        individually. Packing applies only to query templates with `packField`.
 
         Args:
-            resources:                  `datastore.Resource` instances
+            resources:                  `datastore.Resource` instances or
+                                        `datastore_transactions.ResQueryData`
+                                        tuples
             rotten_apples:              use to exclude a particular contributor to
                                         Worldcat from the results;
                                         pass as a dictionary where key is
                                         `ResourceCategory.nid` and value a list of
                                         OCLC organization codes
+            pack_size:                  max number of identifiers in a packed
+                                        query; read from `WORLDCAT_PACK_SIZE`
+                                        environmental variable if not given
+            query_templates:            query templates created earlier by
+                                        `build_query_templates`; compiled
+                                        with `rotten_apples` if not given
 
         yields:
-            (`Resource`, `BriefBibResponse`)
+            (`Resource` or `ResQueryData`, `BriefBibResponse`)
 
         """
+        if query_templates is None:
+            query_templates = self.build_query_templates(rotten_apples)
+        if pack_size is None:
+            pack_size = self._pack_size()
+        resources = iter(resources)
         try:
-            for resource in resources:
-
-                payloads = self._prep_resource_queries_payloads(resource, rotten_apples)
-                if not payloads:
-                    logger.warning(
-                        f"Unable to create a payload for brief bib query for "
-                        f"{self.library} resource nid={resource.nid}, "
-                        f"sierraId=b{resource.sierraId}a."
-                    )
-                    continue
-
-                for payload in payloads:
-                    response = self.session.brief_bibs_search(
-                        **payload,
-                        inCatalogLanguage="eng",
-                        orderBy="mostWidelyHeld",
-                        limit=1,
-                    )
-
-                    brief_bib_response = BriefBibResponse(response)
-                    logger.debug(
-                        f"Brief bib Worldcat query for {self.library} Sierra bib "
-                        f"# b{resource.sierraId}a: {response.url}"
-                    )
-                    if brief_bib_response.is_match:
-                        logger.debug(
-                            f"Match found for {self.library} Sierra bib # "
-                            f"b{resource.sierraId}a."
-                        )
-                        break
-                    else:
+            while True:
+                batch = list(islice(resources, pack_size))
+                if not batch:
+                    break
+
+                if pack_size > 1:
+                    matched = self._search_packed(batch, query_templates)
+                else:
+                    matched = dict()
+
+                for n, resource in enumerate(batch):
+                    if n in matched:
                         logger.debug(
-                            f"No matches found for {self.library} Sierra bib # "
-                            f"b{resource.sierraId}a: {response.url}"
+                            "Match found for %s Sierra bib # b%sa in packed query.",
+                            self.library,
+                            resource.sierraId,
                         )
+                        yield (resource, matched[n])
+                        continue
 
-                yield (resource, brief_bib_response)
+                    brief_bib_response = self._search_single(resource, query_templates)
+                    if brief_bib_response is not None:
+                        yield (resource, brief_bib_response)
 
         except WorldcatRequestError:
             logger.error(f"WorldcatRequestError. Aborting.")
             raise
 
     def get_full_bibs(
-        self, resources: list[Resource]
-    ) -> Iterator[tuple[Resource, bytes]]:
+        self, resources: Iterable[Union[Resource, ResQueryData]]
+    ) -> Iterator[tuple[Union[Resource, ResQueryData], bytes]]:
         """
         Makes MetadataAPI requests for full bibliographic resources
         """
         try:
             for resource in resources:
-                response = self.session.bib_get(oclcNumber=resource.oclcMatchNumber)
+                with metrics.WORLDCAT_REQUEST_SECONDS.time(
+                    library=self.library, endpoint="bib_get"
+                ):
+                    response = self.session.bib_get(oclcNumber=resource.oclcMatchNumber)
+                instrumentation.record("apiCalls")
+                instrumentation.record("bytes", len(response.content))
                 logger.debug(
-                    f"Full bib Worldcat request for {self.library} Sierra bib # "
-                    f"b{resource.sierraId}a: {response.url}."
+                    "Full bib Worldcat request for %s Sierra bib # b%sa: %s.",
+                    self.library,
+                    resource.sierraId,
+                    response.url,
                 )
                 yield (resource, response.content)
         except WorldcatRequestError:
             logger.error("WorldcatRequestError. Aborting.")
             raise
+
+    def plan_queries(
+        self,
+        resources: Iterable[Union[Resource, ResQueryData]],
+        rotten_apples: Mapping[int, Sequence[str]] = {},
+        query_templates: Optional[Mapping[int, tuple[QueryTemplate, ...]]] = None,
+    ) -> Iterator[tuple[Union[Resource, ResQueryData], list[dict]]]:
+        """
+        Prepares payloads of WorldCat brief bib queries `get_brief_bibs` would
+        make for each resource without sending any requests. Payloads of
+        a resource are listed in the order they would be tried.
+
+        Args:
+            resources:                  `datastore.Resource` instances or
+                                        `datastore_transactions.ResQueryData`
+                                        tuples
+            rotten_apples:              dictionary of OCLC organization codes
+                                        to be excluded from results;
+                                        dict key is `ResourceCategory.nid`
+            query_templates:            query templates created earlier by
+                                        `build_query_templates`; compiled
+                                        with `rotten_apples` if not given
+
+        yields:
+            (`Resource` or `ResQueryData`, list of payloads)
+        """
+        if query_templates is None:
+            query_templates = self.build_query_templates(rotten_apples)
+        for resource in resources:
+            yield (
+                resource,
+                self._prep_resource_queries_payloads(resource, query_templates),
+            )
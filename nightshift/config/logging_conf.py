@@ -1,9 +1,168 @@
 # -*- coding: utf-8 -*-
 
 """
-Configures app logging
+Configures app logging.
+
+Records of the app logger are put on a bounded queue by `BoundedQueueHandler`
+and written to console, file and Loggly by a `logging.handlers.QueueListener`
+running in a separate thread, so slow logging backends do not add latency to
+processing. Loggly records are shipped in batches by `LogglyBulkHandler`.
 """
+import atexit
+import logging
+import logging.config
+import logging.handlers
 import os
+import queue
+import sys
+import threading
+import time
+from typing import Optional
+
+import requests
+
+
+class BoundedQueueHandler(logging.handlers.QueueHandler):
+    """
+    Puts log records on a bounded queue. When the queue is full, with the 'block'
+    policy the handler waits for room in the queue; with the 'drop' policy
+    records below WARNING level are dropped and counted, while more severe
+    records wait for room in the queue.
+    """
+
+    def __init__(self, log_queue: queue.Queue, policy: str = "drop") -> None:
+        """
+        Args:
+            log_queue:                  bounded `queue.Queue` instance
+            policy:                     'drop' or 'block'
+
+        Raises:
+            ValueError
+        """
+        if policy not in ("drop", "block"):
+            raise ValueError("Invalid logging queue policy. Must be 'drop' or 'block'.")
+        super().__init__(log_queue)
+        self.bounded_queue = log_queue
+        self.policy = policy
+        self.dropped = 0
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        if self.policy == "block" or record.levelno >= logging.WARNING:
+            self.bounded_queue.put(record)
+        else:
+            try:
+                self.bounded_queue.put_nowait(record)
+            except queue.Full:
+                self.dropped += 1
+
+
+class LogglyBulkHandler(logging.handlers.BufferingHandler):
+    """
+    Ships log records to Loggly's bulk endpoint in batches. A batch is sent when
+    it reaches the given capacity, when a record of `flushLevel` or higher is
+    added, when `flushInterval` seconds passed since the last shipment (checked
+    by a timer thread, so buffered records are shipped even if no more records
+    arrive), or when the handler is flushed or closed.
+    """
+
+    def __init__(
+        self,
+        url: str,
+        capacity: int = 100,
+        flushInterval: float = 5.0,
+        flushLevel: int = logging.ERROR,
+    ) -> None:
+        """
+        Args:
+            url:                        Loggly bulk endpoint URL
+            capacity:                   max number of records in a batch
+            flushInterval:              max number of seconds between shipments
+            flushLevel:                 records of this level or higher are
+                                        shipped immediately
+        """
+        super().__init__(capacity)
+        self.url = url
+        self.flushInterval = flushInterval
+        self.flushLevel = flushLevel
+        self._last_flush = time.monotonic()
+        self._session = requests.Session()
+        self._closed = threading.Event()
+        self._timer: Optional[threading.Thread] = None
+        if flushInterval > 0:
+            self._timer = threading.Thread(target=self._flush_periodically, daemon=True)
+            self._timer.start()
+
+    def _flush_periodically(self) -> None:
+        while not self._closed.wait(self.flushInterval):
+            if (
+                self.buffer
+                and time.monotonic() - self._last_flush >= self.flushInterval
+            ):
+                self.flush()
+
+    def _report_rejected(self, count: int, status_code: int) -> None:
+        """
+        Reports a batch rejected by the bulk endpoint to stderr. The report
+        bypasses the app logger, so it does not end up in the next batch.
+        """
+        record = logging.makeLogRecord(
+            dict(
+                name="nightshift",
+                levelno=logging.ERROR,
+                levelname="ERROR",
+                msg="Loggly rejected a batch of %s log record(s) with HTTP status %s.",
+                args=(count, status_code),
+            )
+        )
+        if logging.lastResort is not None:
+            logging.lastResort.handle(record)
+        else:
+            sys.stderr.write(f"{record.getMessage()}\n")
+
+    def shouldFlush(self, record: logging.LogRecord) -> bool:
+        return (
+            len(self.buffer) >= self.capacity
+            or record.levelno >= self.flushLevel
+            or time.monotonic() - self._last_flush >= self.flushInterval
+        )
+
+    def flush(self) -> None:
+        self.acquire()
+        try:
+            if self.buffer:
+                # Loggly bulk endpoint expects one event per line
+                payload = "\n".join(
+                    self.format(record).replace("\n", "\\n") for record in self.buffer
+                )
+                try:
+                    response = self._session.post(
+                        self.url,
+                        data=payload.encode("utf-8"),
+                        headers={"Content-Type": "text/plain"},
+                        timeout=10,
+                    )
+                except requests.RequestException:
+                    self.handleError(self.buffer[-1])
+                else:
+                    if not 200 <= response.status_code < 300:
+                        self._report_rejected(len(self.buffer), response.status_code)
+                self.buffer = []
+            self._last_flush = time.monotonic()
+        finally:
+            self.release()
+
+    def close(self) -> None:
+        self._closed.set()
+        if self._timer is not None:
+            self._timer.join()
+        try:
+            super().close()
+        finally:
+            self._session.close()
+
+
+_listener: Optional[logging.handlers.QueueListener] = None
+_queue_handler: Optional[BoundedQueueHandler] = None
 
 
 def get_handlers() -> list:
@@ -24,6 +183,30 @@ def get_handlers() -> list:
         return handlers.split(",")
 
 
+def get_queue_settings() -> tuple[int, str]:
+    """
+    Retrieves from env variables size of the logging queue and policy applied
+    when the queue is full
+
+    Returns:
+        (queue size, policy)
+
+    Raises:
+        ValueError
+    """
+    size = os.getenv("LOG_QUEUE_SIZE") or "10000"
+    policy = os.getenv("LOG_QUEUE_POLICY") or "drop"
+    try:
+        queue_size = int(size)
+    except ValueError:
+        raise ValueError("Invalid LOG_QUEUE_SIZE value. Must be an integer.")
+    if queue_size < 1:
+        raise ValueError("Invalid LOG_QUEUE_SIZE value. Must be greater than 0.")
+    if policy not in ("drop", "block"):
+        raise ValueError("Invalid LOG_QUEUE_POLICY value. Must be 'drop' or 'block'.")
+    return (queue_size, policy)
+
+
 def get_token() -> str:
     """
     Retrieves from env variables loggly customer token
@@ -77,17 +260,89 @@ def log_conf() -> dict:
             },
             "loggly": {
                 "level": "WARN",
-                "class": "loggly.handlers.HTTPSHandler",
+                "class": "nightshift.config.logging_conf.LogglyBulkHandler",
                 "formatter": "json",
-                "url": f"https://logs-01.loggly.com/inputs/{log_token}/tag/python",
+                "url": f"https://logs-01.loggly.com/bulk/{log_token}/tag/python/",
+                "capacity": 100,
+                "flushInterval": 5.0,
+                "flushLevel": logging.ERROR,
             },
         },
         "loggers": {
             "nightshift": {
                 "handlers": handlers,
-                "level": "DEBUG",
+                "level": os.getenv("LOG_LEVEL") or "DEBUG",
                 "propagate": True,
             }
         },
     }
     return logging_config
+
+
+def configure_logging(
+    logger_name: str = "nightshift",
+) -> logging.handlers.QueueListener:
+    """
+    Configures logging using `log_conf` and routes records of the app logger
+    through a bounded queue to its handlers running in a listener thread.
+    Level of the logger is raised to the lowest level of its handlers.
+    Any listener started earlier is stopped first.
+
+    Returns:
+        started `logging.handlers.QueueListener` instance
+    """
+    global _listener, _queue_handler
+
+    queue_size, policy = get_queue_settings()
+    stop_logging()
+    logging.config.dictConfig(log_conf())
+
+    logger = logging.getLogger(logger_name)
+    handlers = list(logger.handlers)
+    for handler in handlers:
+        logger.removeHandler(handler)
+
+    # records below level of all handlers are discarded already by the logger
+    # so they are never created, formatted or queued
+    if handlers:
+        logger.setLevel(max(logger.level, min(h.level for h in handlers)))
+
+    _queue_handler = BoundedQueueHandler(queue.Queue(maxsize=queue_size), policy)
+    logger.addHandler(_queue_handler)
+    _listener = logging.handlers.QueueListener(
+        _queue_handler.queue, *handlers, respect_handler_level=True
+    )
+    _listener.start()
+    return _listener
+
+
+def stop_logging() -> None:
+    """
+    Detaches the queue from the app logger, writes out records waiting in it,
+    stops the listener thread and flushes its handlers. Reports number of records dropped
+    because the queue was full.
+    """
+    global _listener, _queue_handler
+
+    if _listener is None:
+        return
+
+    if _queue_handler is not None and _queue_handler.dropped:
+        logging.getLogger("nightshift").warning(
+            f"Dropped {_queue_handler.dropped} log record(s) because "
+            "the logging queue was full."
+        )
+    if _queue_handler is not None:
+        logging.getLogger("nightshift").removeHandler(_queue_handler)
+        _queue_handler = None
+    _listener.stop()
+    for handler in _listener.handlers:
+        try:
+            handler.flush()
+        except (OSError, ValueError):
+            # stream may be already closed at interpreter exit
+            pass
+    _listener = None
+
+
+atexit.register(stop_logging)
@@ -18,6 +18,19 @@ Use following patterns to record data:
 
         multiple time periods will trigger as many query attempts, one in each period
         
+    queryTemplates:
+        list of WorldCat brief bib query templates tried in order until a match is
+        found; "field" is the name of the resource attribute used in the query,
+        "q" the query string with "{}" placeholder for the attribute value, and
+        any other keys are passed as search parameters, example:
+        {"field": "distributorNumber", "q": "sn={} NOT lv:3", "itemType": "book"}
+
+        optional "packField" names the field of WorldCat brief records listing
+        the identifiers searched by the template (for example "isbns"); values of
+        several resources can then be combined in a single packed query (see
+        WORLDCAT_PACK_SIZE) and results mapped back to the resources; distributor
+        numbers and LCCNs are not returned in brief records and can not be packed
+
 """
 
 
@@ -25,6 +38,23 @@ LIBRARIES = {"NYP": {"nid": 1}, "BPL": {"nid": 2}}
 
 PRINT_TAGS_TO_DELETE = "029,090,263,936,938"
 PRINT_QUERY_DAYS = "15-30,30-45"
+PRINT_QUERY_TEMPLATES = [
+    {
+        "field": "standardNumber",
+        "q": "bn:{}",
+        "packField": "isbns",
+        "itemType": "book",
+        "itemSubType": "book-printbook",
+        "catalogSource": "DLC",
+    },
+    {
+        "field": "congressNumber",
+        "q": "ln:{}",
+        "itemType": "book",
+        "itemSubType": "book-printbook",
+        "catalogSource": "DLC",
+    },
+]
 
 BPL_SIERRA_FORMAT = {
     "ebook": "x",
@@ -52,6 +82,14 @@ RESOURCE_CATEGORIES = {
         "srcTags2Keep": "020,037,856",
         "dstTags2Delete": "020,029,037,090,263,856,910,938",
         "queryDays": "30-90,90-180",
+        "queryTemplates": [
+            {
+                "field": "distributorNumber",
+                "q": "sn={} NOT lv:3",
+                "itemType": "book",
+                "itemSubType": "book-digital",
+            }
+        ],
     },
     "eaudio": {
         "nid": 2,
@@ -61,6 +99,14 @@ RESOURCE_CATEGORIES = {
         "srcTags2Keep": "020,037,856",
         "dstTags2Delete": "020,029,037,090,263,856,910,938",
         "queryDays": "30-90,90-180",
+        "queryTemplates": [
+            {
+                "field": "distributorNumber",
+                "q": "sn={} NOT lv:3",
+                "itemType": "audiobook",
+                "itemSubType": "audiobook-digital",
+            }
+        ],
     },
     "evideo": {
         "nid": 3,
@@ -70,6 +116,14 @@ RESOURCE_CATEGORIES = {
         "srcTags2Keep": "020,037,856",
         "dstTags2Delete": "020,029,037,090,263,856,910,938",
         "queryDays": "30-90",
+        "queryTemplates": [
+            {
+                "field": "distributorNumber",
+                "q": "sn={} NOT lv:3 NOT lv:M",
+                "itemType": "video",
+                "itemSubType": "video-digital",
+            }
+        ],
     },
     "print_eng_adult_fic": {
         "nid": 4,
@@ -79,6 +133,7 @@ RESOURCE_CATEGORIES = {
         "srcTags2Keep": "910",
         "dstTags2Delete": PRINT_TAGS_TO_DELETE,
         "queryDays": PRINT_QUERY_DAYS,
+        "queryTemplates": PRINT_QUERY_TEMPLATES,
     },
     "print_eng_adult_bio": {
         "nid": 5,
@@ -88,6 +143,7 @@ RESOURCE_CATEGORIES = {
         "srcTags2Keep": "910",
         "dstTags2Delete": PRINT_TAGS_TO_DELETE,
         "queryDays": PRINT_QUERY_DAYS,
+        "queryTemplates": PRINT_QUERY_TEMPLATES,
     },
     "print_eng_adult_nonfic": {
         "nid": 6,
@@ -97,6 +153,7 @@ RESOURCE_CATEGORIES = {
         "srcTags2Keep": "910",
         "dstTags2Delete": PRINT_TAGS_TO_DELETE,
         "queryDays": PRINT_QUERY_DAYS,
+        "queryTemplates": PRINT_QUERY_TEMPLATES,
     },
     "print_eng_adult_mystery": {
         "nid": 7,
@@ -106,6 +163,7 @@ RESOURCE_CATEGORIES = {
         "srcTags2Keep": "910",
         "dstTags2Delete": PRINT_TAGS_TO_DELETE,
         "queryDays": PRINT_QUERY_DAYS,
+        "queryTemplates": PRINT_QUERY_TEMPLATES,
     },
     "print_eng_adult_scifi": {
         "nid": 8,
@@ -115,6 +173,7 @@ RESOURCE_CATEGORIES = {
         "srcTags2Keep": "910",
         "dstTags2Delete": PRINT_TAGS_TO_DELETE,
         "queryDays": PRINT_QUERY_DAYS,
+        "queryTemplates": PRINT_QUERY_TEMPLATES,
     },
     "print_eng_juv_fic": {
         "nid": 9,
@@ -124,6 +183,7 @@ RESOURCE_CATEGORIES = {
         "srcTags2Keep": "910",
         "dstTags2Delete": PRINT_TAGS_TO_DELETE,
         "queryDays": PRINT_QUERY_DAYS,
+        "queryTemplates": PRINT_QUERY_TEMPLATES,
     },
     "print_eng_juv_bio": {
         "nid": 10,
@@ -133,6 +193,7 @@ RESOURCE_CATEGORIES = {
         "srcTags2Keep": "910",
         "dstTags2Delete": PRINT_TAGS_TO_DELETE,
         "queryDays": PRINT_QUERY_DAYS,
+        "queryTemplates": PRINT_QUERY_TEMPLATES,
     },
     "print_eng_juv_nonfic": {
         "nid": 11,
@@ -142,6 +203,7 @@ RESOURCE_CATEGORIES = {
         "srcTags2Keep": "910",
         "dstTags2Delete": PRINT_TAGS_TO_DELETE,
         "queryDays": PRINT_QUERY_DAYS,
+        "queryTemplates": PRINT_QUERY_TEMPLATES,
     },
 }
 
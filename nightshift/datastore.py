@@ -13,6 +13,8 @@ from sqlalchemy import (
     create_engine,
     Date,
     DateTime,
+    DDL,
+    event,
     ForeignKey,
     Integer,
     PickleType,
@@ -93,12 +95,19 @@ class Event(Base):
     WorldCat matches/upgrades, resources being dropped out from the process because
     they were cataloged or deleted by cataloging staff, finally, marks resources
     that expired from the process because of they age.
+
+    The table is partitioned by month of the timestamp. Rows that do not fit
+    any monthly partition land in the default partition (event_default).
+    Monthly partitions are created ahead of time by
+    `datastore_transactions.create_event_partitions`. Each insert is rolled up
+    into daily counts in the EventDailyStats table by a database trigger.
     """
 
     __tablename__ = "event"
+    __table_args__ = {"postgresql_partition_by": "RANGE (timestamp)"}
 
-    nid = Column(Integer, primary_key=True)
-    timestamp = Column(DateTime, nullable=False, default=datetime.now(timezone.utc))
+    nid = Column(Integer, primary_key=True, autoincrement=True)
+    timestamp = Column(DateTime, primary_key=True, default=datetime.now(timezone.utc))
     libraryId = Column(Integer, ForeignKey("library.nid"), nullable=False)
     sierraId = Column(Integer, nullable=False)
     bibDate = Column(Date, nullable=False)
@@ -117,6 +126,30 @@ class Event(Base):
         )
 
 
+class EventDailyStats(Base):
+    """
+    Daily counts of events per library, resource category, and status.
+    Maintained incrementally by a trigger on the Event table.
+    """
+
+    __tablename__ = "event_daily_stats"
+
+    day = Column(Date, primary_key=True)
+    libraryId = Column(Integer, ForeignKey("library.nid"), primary_key=True)
+    resourceCategoryId = Column(
+        Integer, ForeignKey("resource_category.nid"), primary_key=True
+    )
+    status = Column(STATUS, primary_key=True)
+    tally = Column(Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return (
+            f"<EventDailyStats(day='{self.day}', libraryId='{self.libraryId}', "
+            f"resourceCategoryId='{self.resourceCategoryId}', "
+            f"status='{self.status}', tally='{self.tally}')>"
+        )
+
+
 class Library(Base):
     """
     Library system.
@@ -280,6 +313,36 @@ class RottenAppleResource(Base):
         )
 
 
+class RunLedger(Base):
+    """
+    Ledger of NightShift runs.
+    Records each unit of work (stage, library, resource category and query window)
+    completed during a run, so an interrupted run can be resumed from the point
+    of failure.
+    """
+
+    __tablename__ = "run_ledger"
+
+    nid = Column(Integer, primary_key=True)
+    runId = Column(Integer, nullable=False, index=True)
+    stage = Column(String, nullable=False)
+    libraryId = Column(Integer, ForeignKey("library.nid"))
+    resourceCategoryId = Column(Integer, ForeignKey("resource_category.nid"))
+    queryWindow = Column(String)
+    timestamp = Column(DateTime, nullable=False)
+
+    def __repr__(self):
+        return (
+            f"<RunLedger(nid='{self.nid}', "
+            f"runId='{self.runId}', "
+            f"stage='{self.stage}', "
+            f"libraryId='{self.libraryId}', "
+            f"resourceCategoryId='{self.resourceCategoryId}', "
+            f"queryWindow='{self.queryWindow}', "
+            f"timestamp='{self.timestamp}')>"
+        )
+
+
 class SourceFile(Base):
     """
     Source MARC file info.
@@ -324,3 +387,42 @@ class WorldcatQuery(Base):
             f"match='{self.match}', "
             f"timestamp='{self.timestamp}')>"
         )
+
+
+# partitioning of the Event table and maintenance of the daily stats rollup
+event.listen(
+    Event.__table__,
+    "after_create",
+    DDL("CREATE TABLE IF NOT EXISTS event_default PARTITION OF event DEFAULT"),
+)
+event.listen(
+    Event.__table__,
+    "after_create",
+    DDL(
+        """
+        CREATE OR REPLACE FUNCTION event_daily_stats_rollup() RETURNS trigger AS $$
+        BEGIN
+            INSERT INTO event_daily_stats
+                (day, "libraryId", "resourceCategoryId", status, tally)
+            SELECT
+                "timestamp"::date, "libraryId", "resourceCategoryId", status, count(*)
+            FROM new_events
+            WHERE status IS NOT NULL
+            GROUP BY 1, 2, 3, 4
+            ON CONFLICT (day, "libraryId", "resourceCategoryId", status)
+            DO UPDATE SET tally = event_daily_stats.tally + EXCLUDED.tally;
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql
+        """
+    ),
+)
+event.listen(
+    Event.__table__,
+    "after_create",
+    DDL(
+        "CREATE TRIGGER event_daily_stats_rollup AFTER INSERT ON event "
+        "REFERENCING NEW TABLE AS new_events FOR EACH STATEMENT "
+        "EXECUTE FUNCTION event_daily_stats_rollup()"
+    ),
+)
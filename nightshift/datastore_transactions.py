@@ -1,10 +1,28 @@
 # -*- coding: utf-8 -*-
 from collections import namedtuple
-from datetime import datetime, timedelta, timezone
-from typing import Optional
-
-from sqlalchemy import and_, create_engine, delete, func, inspect, update
-from sqlalchemy.orm import Session
+from datetime import date, datetime, timedelta, timezone
+from typing import Any, Iterator, Optional, Union
+
+from sqlalchemy import (
+    and_,
+    any_,
+    cast,
+    create_engine,
+    Date,
+    delete,
+    event,
+    func,
+    insert,
+    inspect,
+    Integer,
+    literal,
+    select,
+    text,
+    tuple_,
+    update,
+)
+from sqlalchemy.dialects.postgresql import ARRAY
+from sqlalchemy.orm import Query, Session
 from sqlalchemy.orm.exc import NoResultFound
 
 # from nightshift.constants import LIBRARIES, RESOURCE_CATEGORIES
@@ -12,12 +30,14 @@ from nightshift import constants
 from nightshift.datastore import (
     DataAccessLayer,
     Event,
+    EventDailyStats,
     Library,
     OutputFile,
     Resource,
     ResourceCategory,
     RottenApple,
     RottenAppleResource,
+    RunLedger,
     SourceFile,
     WorldcatQuery,
 )
@@ -34,6 +54,29 @@ ResCatById = namedtuple(
     ],
 )
 
+DailyStats = namedtuple(
+    "DailyStats", ["library", "resourceCategory", "status", "tally"]
+)
+
+# lightweight projection of a resource carrying only data needed to query WorldCat
+ResQueryData = namedtuple(
+    "ResQueryData",
+    [
+        "nid",
+        "sierraId",
+        "libraryId",
+        "resourceCategoryId",
+        "bibDate",
+        "distributorNumber",
+        "standardNumber",
+        "congressNumber",
+        "oclcMatchNumber",
+    ],
+)
+
+# unit of work of a NightShift run: (stage, libraryId, resourceCategoryId, queryWindow)
+RunUnit = tuple[str, Optional[int], Optional[int], Optional[str]]
+
 ResCatByName = namedtuple(
     "ResCatByName",
     [
@@ -47,6 +90,168 @@ ResCatByName = namedtuple(
 )
 
 
+class EventSink:
+    """
+    Buffers events and writes them to the Event table in bulk.
+    Buffered events are inserted with a single executemany statement when
+    the session commits, bypassing creation of ORM `Event` instances.
+    The sink starts listening to session's commits when the first event
+    is added.
+    Events buffered in a transaction that is rolled back are discarded.
+    Use `of_session` to share a single sink, and a single set of session
+    listeners, between all users of a session.
+    """
+
+    def __init__(self, session: Session) -> None:
+        """
+        Args:
+            session:                `sqlalchemy.Session` instance
+        """
+        self.session = session
+        self.buffer: list[tuple] = []
+        self._listening = False
+
+    @classmethod
+    def of_session(cls, session: Session) -> "EventSink":
+        """
+        Returns the event sink of the session creating it on the first call.
+
+        Args:
+            session:                `sqlalchemy.Session` instance
+
+        Returns:
+            `EventSink` instance kept in `session.info`
+        """
+        sink = session.info.get("eventSink")
+        if sink is None:
+            sink = cls(session)
+            session.info["eventSink"] = sink
+        return sink
+
+    def _after_rollback(self, session: Session) -> None:
+        self.buffer.clear()
+
+    def _before_commit(self, session: Session) -> None:
+        self.flush()
+
+    def add(self, resource: Union[Resource, ResQueryData], status: str) -> None:
+        """
+        Buffers an event of a resource.
+
+        Args:
+            resource:               datastore Resource record or `ResQueryData`
+            status:                 one of `datastore.Event.outcome` enum values
+        """
+        if not self._listening:
+            event.listen(self.session, "before_commit", self._before_commit)
+            event.listen(self.session, "after_rollback", self._after_rollback)
+            self._listening = True
+        self.buffer.append(
+            (
+                resource.libraryId,
+                resource.sierraId,
+                resource.bibDate,
+                resource.resourceCategoryId,
+                status,
+                datetime.now(timezone.utc),
+            )
+        )
+
+    def close(self) -> None:
+        """
+        Stops listening to session's commits. Buffered events are discarded.
+        """
+        if self._listening:
+            event.remove(self.session, "before_commit", self._before_commit)
+            event.remove(self.session, "after_rollback", self._after_rollback)
+            self._listening = False
+        self.buffer.clear()
+
+    def flush(self) -> int:
+        """
+        Inserts buffered events.
+
+        Returns:
+            number of inserted events
+        """
+        if not self.buffer:
+            return 0
+        rows = [
+            dict(
+                libraryId=libraryId,
+                sierraId=sierraId,
+                bibDate=bibDate,
+                resourceCategoryId=resourceCategoryId,
+                status=status,
+                timestamp=timestamp,
+            )
+            for (
+                libraryId,
+                sierraId,
+                bibDate,
+                resourceCategoryId,
+                status,
+                timestamp,
+            ) in self.buffer
+        ]
+        self.buffer = []
+        self.session.execute(insert(Event.__table__), rows)
+        return len(rows)
+
+
+def _paginate_by_keyset(
+    query: Query, key_columns: tuple, page_size: int
+) -> Iterator[Any]:
+    """
+    Yields results of the query retrieved from the database in pages.
+    Consecutive pages are selected by comparing key columns with values
+    of the last row of the previous page (keyset pagination), so each page is
+    retrieved with an index scan regardless of how far the iteration got.
+
+    Args:
+        query:                  `sqlalchemy.orm.Query` instance without ordering
+        key_columns:            unique combination of columns to order and
+                                paginate results by; must be included in
+                                queried entities
+        page_size:              max number of rows retrieved at once
+
+    Yields:
+        query results
+
+    Raises:
+        ValueError
+    """
+    if page_size < 1:
+        raise ValueError("Invalid 'page_size' argument. Must be greater than 0.")
+
+    last_key = None
+    while True:
+        page_query = query
+        if last_key is not None:
+            page_query = page_query.filter(tuple_(*key_columns) > tuple_(*last_key))
+        page = page_query.order_by(*key_columns).limit(page_size).all()
+        yield from page
+        if len(page) < page_size:
+            break
+        last_key = tuple(getattr(page[-1], c.key) for c in key_columns)
+
+
+def _resource_entities(columns: Optional[tuple], key_columns: tuple) -> tuple:
+    """
+    Determines entities to be queried by streaming retrieval functions.
+    """
+    if columns is None:
+        return (Resource,)
+    return tuple(columns) + tuple(c for c in key_columns if c not in columns)
+
+
+def _res_query_data_columns() -> tuple:
+    """
+    Returns `Resource` columns matching fields of `ResQueryData`.
+    """
+    return tuple(getattr(Resource, field) for field in ResQueryData._fields)
+
+
 def init_db() -> None:
     """
     Initiates the database and prepopulates needed tables
@@ -90,19 +295,34 @@ def init_db() -> None:
 
     session.commit()
 
+    # discard reference data cached before the tables were populated
+    # (imported here, because the cache module depends on this one)
+    from nightshift import reference_data
+
+    reference_data.invalidate()
+
+    create_event_partitions(session)
+    session.commit()
+
     # verify integrity of the database
     try:
         # check all tables were created
         insp = inspect(dal.engine)
-        assert sorted(insp.get_table_names()) == sorted(
+        partitions = session.execute(
+            text("SELECT relname FROM pg_class WHERE relispartition")
+        ).scalars()
+        tables = set(insp.get_table_names()) - set(partitions)
+        assert sorted(tables) == sorted(
             [
                 "event",
+                "event_daily_stats",
                 "library",
                 "output_file",
                 "resource",
                 "resource_category",
                 "rotten_apple",
                 "rotten_apple_resource",
+                "run_ledger",
                 "source_file",
                 "worldcat_query",
             ]
@@ -132,6 +352,27 @@ def init_db() -> None:
         session.close()
 
 
+def upgrade_db() -> Optional[int]:
+    """
+    Upgrades the database created with an earlier version of the bot.
+    Creates missing tables and recreates the Event table as a partitioned
+    table. Can be safely run on an up to date database.
+
+    Returns:
+        number of events copied to the partitioned Event table or None if
+        the table was already partitioned
+    """
+    dal = DataAccessLayer()
+    dal.connect()
+    session = dal.Session()
+    try:
+        copied = partition_event_table(session)
+        session.commit()
+    finally:
+        session.close()
+    return copied
+
+
 def add_event(session: Session, resource: Resource, status: str) -> Event:
     """
     Inserts an event row.
@@ -164,6 +405,40 @@ def add_event(session: Session, resource: Resource, status: str) -> Event:
     return instance
 
 
+def add_ledger_entry(
+    session: Session,
+    runId: int,
+    stage: str,
+    libraryId: Optional[int] = None,
+    resourceCategoryId: Optional[int] = None,
+    queryWindow: Optional[str] = None,
+) -> RunLedger:
+    """
+    Records in the run ledger completion of a unit of work.
+
+    Args:
+        session:                `sqlalchemy.Session` instance
+        runId:                  `datastore.RunLedger.runId` of the current run
+        stage:                  name of the completed stage
+        libraryId:              `datastore.Library.nid`
+        resourceCategoryId:     `datastore.ResourceCategory.nid`
+        queryWindow:            query period as 'minAge-maxAge' string
+
+    Returns:
+        `nightshift.datastore.RunLedger` instance
+    """
+    instance = RunLedger(
+        runId=runId,
+        stage=stage,
+        libraryId=libraryId,
+        resourceCategoryId=resourceCategoryId,
+        queryWindow=queryWindow,
+        timestamp=datetime.now(timezone.utc),
+    )
+    session.add(instance)
+    return instance
+
+
 def add_output_file(session: Session, libraryId: int, file_handle: str) -> OutputFile:
     """
     Adds OutputFile record to db.
@@ -224,6 +499,85 @@ def add_source_file(session: Session, libraryId: int, handle: str) -> SourceFile
     return instance
 
 
+def count_resources_to_delete(
+    session: Session, resourceCategoryId: int, age: int
+) -> int:
+    """
+    Counts resources of given category that are older than given age in days
+    since bib creation in Sierra and are due to be deleted from the database.
+
+    Args:
+        session:                `sqlalchemy.Session` instance
+        resourceCategoryId:     `nightshift.datastore.ResourceCategory.nid` identifier
+        age:                    number of days since bib created in Sierra
+
+    Returns:
+        number of resources
+    """
+    tally = (
+        session.query(func.count(Resource.nid))
+        .filter(
+            Resource.resourceCategoryId == resourceCategoryId,
+            Resource.bibDate < datetime.now(timezone.utc) - timedelta(days=age),
+        )
+        .scalar()
+    )
+    return tally
+
+
+def create_event_partitions(session: Session, months_ahead: int = 1) -> list[str]:
+    """
+    Creates monthly partitions of the Event table for the current month and
+    given number of following months, if they do not exist yet.
+    A month is skipped if the default partition already holds its events
+    (a monthly partition cannot be attached over them), so such events stay
+    in the default partition. Nothing is created if the Event table is not
+    partitioned (see `partition_event_table`).
+
+    Args:
+        session:                `sqlalchemy.Session` instance
+        months_ahead:           number of months following the current one
+
+    Returns:
+        list of names of created partitions
+    """
+    created: list[str] = []
+    if not event_table_partitioned(session):
+        return created
+
+    today = datetime.now(timezone.utc).date()
+    year, month = today.year, today.month
+    for _ in range(months_ahead + 1):
+        start = date(year, month, 1)
+        year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+        end = date(year, month, 1)
+        name = f"event_y{start.year}m{start.month:02}"
+
+        exists = session.execute(
+            text("SELECT to_regclass(:name) IS NOT NULL"), {"name": name}
+        ).scalar()
+        if exists:
+            continue
+        in_default = session.execute(
+            text(
+                "SELECT EXISTS (SELECT 1 FROM event_default "
+                "WHERE timestamp >= :start AND timestamp < :end)"
+            ),
+            {"start": start, "end": end},
+        ).scalar()
+        if in_default:
+            continue
+
+        session.execute(
+            text(
+                f"CREATE TABLE {name} PARTITION OF event "
+                f"FOR VALUES FROM ('{start}') TO ('{end}')"
+            )
+        )
+        created.append(name)
+    return created
+
+
 def delete_resources(session: Session, resourceCategoryId: int, age: int) -> int:
     """
     Deletes resources from the database based on category and days since
@@ -248,6 +602,155 @@ def delete_resources(session: Session, resourceCategoryId: int, age: int) -> int
     return rowcount
 
 
+def delete_resources_by_nid(session: Session, nids: list[int]) -> int:
+    """
+    Deletes resources with given identifiers. Their WorldCat queries are
+    removed by the database cascade.
+
+    Args:
+        session:                `sqlalchemy.Session` instance
+        nids:                   list of `nightshift.datastore.Resource.nid`
+
+    Returns:
+        number of deleted rows in the database
+    """
+    result = session.execute(
+        delete(Resource)
+        .where(Resource.nid.in_(nids))
+        .execution_options(synchronize_session=False)
+    )
+    return result.rowcount
+
+
+def event_table_partitioned(session: Session) -> bool:
+    """
+    Checks if the Event table is partitioned. The Event table of a database
+    created with an earlier version is not.
+
+    Args:
+        session:                `sqlalchemy.Session` instance
+
+    Returns:
+        bool
+    """
+    return session.execute(
+        text(
+            "SELECT EXISTS (SELECT 1 FROM pg_partitioned_table "
+            "WHERE partrelid = to_regclass('event'))"
+        )
+    ).scalar()
+
+
+def expire_resources(session: Session, resourceCategoryId: int, age: int) -> int:
+    """
+    Changes status from 'open' to 'expired' in resources with given category
+    and age in days since bib created in Sierra and records each change in the
+    Event table. Both are performed by a single set-based statement
+    (UPDATE ... RETURNING feeding INSERT INTO event ... SELECT), so no resources
+    are loaded from the database.
+
+    Args:
+        session:                `sqlalchemy.Session` instance
+        resourceCategoryId:     `nightshift.datastore.ResourceCategory.nid` identifier
+        age:                    number of days since bib created in Sierra
+
+    Returns:
+        number of expired resources
+    """
+    expired = (
+        update(Resource)
+        .where(
+            Resource.resourceCategoryId == resourceCategoryId,
+            Resource.status == "open",
+            Resource.bibDate < datetime.now(timezone.utc).date() - timedelta(days=age),
+        )
+        .values(status="expired")
+        .returning(
+            Resource.libraryId,
+            Resource.sierraId,
+            Resource.bibDate,
+            Resource.resourceCategoryId,
+        )
+        .cte("expired")
+    )
+    stmt = insert(Event).from_select(
+        [
+            Event.libraryId,
+            Event.sierraId,
+            Event.bibDate,
+            Event.resourceCategoryId,
+            Event.status,
+            Event.timestamp,
+        ],
+        select(
+            expired.c.libraryId,
+            expired.c.sierraId,
+            expired.c.bibDate,
+            expired.c.resourceCategoryId,
+            cast(literal("expired"), Event.status.type),
+            cast(literal(datetime.now(timezone.utc)), Event.timestamp.type),
+        ),
+    )
+    result = session.execute(stmt)
+    return result.rowcount
+
+
+def finalize_upgraded_resources(
+    session: Session, nids: list[int], outputId: int
+) -> int:
+    """
+    Changes status of given resources to 'bot_enhanced', records the output
+    file and enhancement time, and adds 'bot_enhanced' event for each of them.
+    All changes are made by a single statement (UPDATE ... RETURNING feeding
+    INSERT INTO event ... SELECT), so the whole batch takes one round trip
+    to the database. Changes are not committed.
+
+    Args:
+        session:                `sqlalchemy.Session` instance
+        nids:                   list of `nightshift.datastore.Resource.nid`
+        outputId:               `nightshift.datastore.OutputFile.nid`
+
+    Returns:
+        number of updated resources
+    """
+    if not nids:
+        return 0
+
+    timestamp = datetime.now(timezone.utc)
+    upgraded = (
+        update(Resource)
+        .where(Resource.nid == any_(literal(list(nids), ARRAY(Integer))))
+        .values(status="bot_enhanced", outputId=outputId, enhanceTimestamp=timestamp)
+        .returning(
+            Resource.libraryId,
+            Resource.sierraId,
+            Resource.bibDate,
+            Resource.resourceCategoryId,
+        )
+        .cte("upgraded")
+    )
+    stmt = insert(Event).from_select(
+        [
+            Event.libraryId,
+            Event.sierraId,
+            Event.bibDate,
+            Event.resourceCategoryId,
+            Event.status,
+            Event.timestamp,
+        ],
+        select(
+            upgraded.c.libraryId,
+            upgraded.c.sierraId,
+            upgraded.c.bibDate,
+            upgraded.c.resourceCategoryId,
+            cast(literal("bot_enhanced"), Event.status.type),
+            cast(literal(timestamp), Event.timestamp.type),
+        ),
+    )
+    result = session.execute(stmt)
+    return result.rowcount
+
+
 def insert_or_ignore(session, model, **kwargs):
     """
     Adds a new record to given table (model) or ignores if the same.
@@ -269,6 +772,153 @@ def insert_or_ignore(session, model, **kwargs):
         return instance
 
 
+def iter_new_resources(
+    session: Session,
+    libraryId: int,
+    page_size: int = 500,
+    columns: Optional[tuple] = None,
+) -> Iterator[Any]:
+    """
+    Streaming variant of `retrieve_new_resources`. Resources are retrieved
+    in pages grouped by the resource category and ordered by resource nid.
+
+    Args:
+        session:                `sqlalchemy.Session` instance
+        libraryId:              `Library.nid`
+        page_size:              number of resources retrieved at once
+        columns:                tuple of `Resource` columns to retrieve instead of
+                                full `Resource` instances, for example
+                                (Resource.nid, Resource.sierraId)
+
+    Yields:
+        `Resource` instances or rows of requested columns
+    """
+    key_columns = (Resource.resourceCategoryId, Resource.nid)
+    query = session.query(*_resource_entities(columns, key_columns)).filter(
+        Resource.libraryId == libraryId,
+        Resource.status == "open",
+        ~Resource.queries.any(),
+    )
+    yield from _paginate_by_keyset(query, key_columns, page_size)
+
+
+def iter_open_matched_resources_with_full_bib_obtained(
+    session: Session,
+    libraryId: int,
+    resourceCategoryId: int,
+    page_size: int = 500,
+    columns: Optional[tuple] = None,
+) -> Iterator[Any]:
+    """
+    Streaming variant of `retrieve_open_matched_resources_with_full_bib_obtained`.
+    Resources are retrieved in pages ordered by resource nid.
+
+    Args:
+        session:                `sqlalchemy.Session` instance
+        libraryId:              `nightshift.datastore.Library.nid`
+        resourceCategoryId:     `nightshift.datastore.ResourceCategory.nid`
+        page_size:              number of resources retrieved at once
+        columns:                tuple of `Resource` columns to retrieve instead of
+                                full `Resource` instances
+
+    Yields:
+        `Resource` instances or rows of requested columns
+    """
+    key_columns = (Resource.nid,)
+    query = session.query(*_resource_entities(columns, key_columns)).filter(
+        Resource.libraryId == libraryId,
+        Resource.resourceCategoryId == resourceCategoryId,
+        Resource.status == "open",
+        Resource.fullBib.isnot(None),
+    )
+    yield from _paginate_by_keyset(query, key_columns, page_size)
+
+
+def iter_open_matched_resources_without_full_bib(
+    session: Session,
+    libraryId: int,
+    page_size: int = 500,
+    columns: Optional[tuple] = None,
+) -> Iterator[Any]:
+    """
+    Streaming variant of `retrieve_open_matched_resources_without_full_bib`.
+    Resources are retrieved in pages grouped by the resource category and
+    ordered by resource nid.
+
+    Args:
+        session:                `sqlalchemy.Session` instance
+        libraryId:              `Library.nid`
+        page_size:              number of resources retrieved at once
+        columns:                tuple of `Resource` columns to retrieve instead of
+                                full `Resource` instances
+
+    Yields:
+        `Resource` instances or rows of requested columns
+    """
+    key_columns = (Resource.resourceCategoryId, Resource.nid)
+    query = session.query(*_resource_entities(columns, key_columns)).filter(
+        Resource.libraryId == libraryId,
+        Resource.status == "open",
+        Resource.oclcMatchNumber != None,
+        Resource.fullBib == None,
+    )
+    yield from _paginate_by_keyset(query, key_columns, page_size)
+
+
+def iter_open_older_resources(
+    session: Session,
+    libraryId: int,
+    resourceCategoryId: int,
+    minAge: int,
+    maxAge: int,
+    page_size: int = 500,
+    columns: Optional[tuple] = None,
+) -> Iterator[Any]:
+    """
+    Streaming variant of `retrieve_open_older_resources`. Resources are
+    retrieved in pages ordered by resource nid.
+
+    Args:
+        session:                `sqlalchemy.Session` instance
+        libraryId:              library id
+        resourceCategoryId:     resource category id
+        minAge:                 min number of days since bib creation date
+        maxAge:                 max numb of days since bib creation date
+        page_size:              number of resources retrieved at once
+        columns:                tuple of `Resource` columns to retrieve instead of
+                                full `Resource` instances
+
+    Yields:
+        `Resource` instances or rows of requested columns
+    """
+    # select only resources which age is between minAge & maxAge
+    subq = (
+        session.query(
+            Resource.nid, func.max(WorldcatQuery.timestamp).label("last_query")
+        )
+        .join(WorldcatQuery)
+        .filter(
+            Resource.libraryId == libraryId,
+            Resource.resourceCategoryId == resourceCategoryId,
+            Resource.status == "open",
+            Resource.oclcMatchNumber == None,
+            Resource.bibDate > datetime.now(timezone.utc) - timedelta(days=maxAge),
+            Resource.bibDate < datetime.now(timezone.utc) - timedelta(days=minAge),
+        )
+        .group_by(Resource.nid)
+        .subquery()
+    )
+
+    # select resources with last query before minAge of the given period
+    key_columns = (Resource.nid,)
+    query = (
+        session.query(*_resource_entities(columns, key_columns))
+        .join(subq, Resource.nid == subq.c.nid)
+        .filter(subq.c.last_query < Resource.bibDate + timedelta(days=minAge))
+    )
+    yield from _paginate_by_keyset(query, key_columns, page_size)
+
+
 def library_by_id(session: Session) -> dict[int, str]:
     """
     Creates a dictionary where the key is `datastore.Library.nid` and a value is the
@@ -304,6 +954,108 @@ def parse_query_days(query_days: str) -> list[tuple[int, int]]:
     return periods
 
 
+def partition_event_table(session: Session) -> Optional[int]:
+    """
+    Recreates the Event table of a database created with an earlier version
+    as a partitioned table. Existing events are copied to the new table,
+    monthly partitions are created for the current and the following month,
+    and the EventDailyStats rollup is recalculated. Does nothing if the Event
+    table is already partitioned.
+
+    Args:
+        session:                `sqlalchemy.Session` instance
+
+    Returns:
+        number of copied events or None if the table was already partitioned
+    """
+    if event_table_partitioned(session):
+        return None
+
+    # names of the primary key index and the nid sequence would collide
+    # with the ones of the new table
+    session.execute(text("ALTER TABLE event RENAME TO event_unpartitioned"))
+    session.execute(
+        text(
+            "ALTER TABLE event_unpartitioned "
+            "RENAME CONSTRAINT event_pkey TO event_unpartitioned_pkey"
+        )
+    )
+    session.execute(
+        text("ALTER SEQUENCE event_nid_seq RENAME TO event_unpartitioned_nid_seq")
+    )
+
+    Event.__table__.create(session.connection())
+    create_event_partitions(session)
+
+    columns = (
+        'nid, "timestamp", "libraryId", "sierraId", "bibDate", '
+        '"resourceCategoryId", status'
+    )
+    result = session.execute(
+        text(
+            f"INSERT INTO event ({columns}) "
+            f"SELECT {columns} FROM event_unpartitioned"
+        )
+    )
+    session.execute(
+        text(
+            "SELECT setval(pg_get_serial_sequence('event', 'nid'), max(nid)) FROM event"
+        )
+    )
+    session.execute(text("DROP TABLE event_unpartitioned"))
+    rebuild_daily_stats(session)
+    return result.rowcount
+
+
+def rebuild_daily_stats(session: Session) -> int:
+    """
+    Recalculates the EventDailyStats rollup from all rows in the Event table.
+    Needed only when the rollup is introduced to a database with existing
+    events or after events were inserted bypassing the trigger.
+
+    Args:
+        session:                `sqlalchemy.Session` instance
+
+    Returns:
+        number of rows in the rollup
+    """
+    session.execute(delete(EventDailyStats))
+    day = cast(Event.timestamp, Date)
+    stmt = insert(EventDailyStats).from_select(
+        [
+            EventDailyStats.day,
+            EventDailyStats.libraryId,
+            EventDailyStats.resourceCategoryId,
+            EventDailyStats.status,
+            EventDailyStats.tally,
+        ],
+        select(
+            day,
+            Event.libraryId,
+            Event.resourceCategoryId,
+            Event.status,
+            func.count(),
+        )
+        .where(Event.status.isnot(None))
+        .group_by(day, Event.libraryId, Event.resourceCategoryId, Event.status),
+    )
+    result = session.execute(stmt)
+    return result.rowcount
+
+
+def resource_query_data(resource: Resource) -> ResQueryData:
+    """
+    Copies from `datastore.Resource` instance data needed to query WorldCat.
+
+    Args:
+        resource:               `datastore.Resource` instance
+
+    Returns:
+        `ResQueryData` tuple
+    """
+    return ResQueryData(*(getattr(resource, field) for field in ResQueryData._fields))
+
+
 def resource_category_by_name(session: Session) -> dict[str, ResCatByName]:
     """
     Creates a dictionary of resource categories with names as the key.
@@ -332,6 +1084,97 @@ def resource_category_by_name(session: Session) -> dict[str, ResCatByName]:
     return data
 
 
+def retrieve_completed_run_units(session: Session, runId: int) -> set[RunUnit]:
+    """
+    Retrieves units of work completed during given run.
+
+    Args:
+        session:                `sqlalchemy.Session` instance
+        runId:                  `datastore.RunLedger.runId`
+
+    Returns:
+        set of (stage, libraryId, resourceCategoryId, queryWindow) tuples
+    """
+    results = (
+        session.query(
+            RunLedger.stage,
+            RunLedger.libraryId,
+            RunLedger.resourceCategoryId,
+            RunLedger.queryWindow,
+        )
+        .filter(RunLedger.runId == runId)
+        .all()
+    )
+    return {tuple(r) for r in results}
+
+
+def retrieve_daily_stats(
+    session: Session, start: date, end: Optional[date] = None
+) -> list[DailyStats]:
+    """
+    Retrieves from the EventDailyStats rollup counts of events per library,
+    resource category and status in given period.
+
+    Args:
+        session:                `sqlalchemy.Session` instance
+        start:                  first day of the period
+        end:                    last day of the period; defaults to today
+
+    Returns:
+        list of `DailyStats` tuples ordered by library, category, and status
+    """
+    if end is None:
+        end = datetime.now(timezone.utc).date()
+    rows = (
+        session.query(
+            Library.code,
+            ResourceCategory.name,
+            EventDailyStats.status,
+            func.sum(EventDailyStats.tally),
+        )
+        .join(Library, Library.nid == EventDailyStats.libraryId)
+        .join(
+            ResourceCategory, ResourceCategory.nid == EventDailyStats.resourceCategoryId
+        )
+        .filter(EventDailyStats.day >= start, EventDailyStats.day <= end)
+        .group_by(Library.code, ResourceCategory.name, EventDailyStats.status)
+        .order_by(Library.code, ResourceCategory.name, EventDailyStats.status)
+        .all()
+    )
+    return [DailyStats(*row[:3], int(row[3])) for row in rows]
+
+
+def retrieve_deletion_archive_rows(session: Session, nids: list[int]) -> list[dict]:
+    """
+    Retrieves full rows of resources with given identifiers together with their
+    WorldCat queries, so they can be archived before deletion.
+
+    Args:
+        session:                `sqlalchemy.Session` instance
+        nids:                   list of `nightshift.datastore.Resource.nid`
+
+    Returns:
+        list of dictionaries representing resource rows; WorldCat queries of
+        each resource are listed under 'queries' key
+    """
+    queries: dict[int, list[dict]] = dict()
+    for query in session.execute(
+        select(WorldcatQuery.__table__)
+        .where(WorldcatQuery.resourceId.in_(nids))
+        .order_by(WorldcatQuery.nid)
+    ).mappings():
+        queries.setdefault(query["resourceId"], []).append(dict(query))
+
+    rows = []
+    for resource in session.execute(
+        select(Resource.__table__).where(Resource.nid.in_(nids)).order_by(Resource.nid)
+    ).mappings():
+        row = dict(resource)
+        row["queries"] = queries.get(row["nid"], [])
+        rows.append(row)
+    return rows
+
+
 def retrieve_expired_resources(
     session: Session, resourceCategoryId: int, expiration_age: int
 ) -> list[Resource]:
@@ -361,6 +1204,43 @@ def retrieve_expired_resources(
     return resources
 
 
+def retrieve_nids_of_resources_to_delete(
+    session: Session,
+    resourceCategoryId: int,
+    age: int,
+    limit: int,
+    after_nid: int = 0,
+) -> list[int]:
+    """
+    Retrieves in order identifiers of resources of given category that are older
+    than given age in days since bib creation in Sierra. Results are paginated
+    by the `nid` (keyset pagination), so consecutive batches can be
+    retrieved without scanning already processed rows.
+
+    Args:
+        session:                `sqlalchemy.Session` instance
+        resourceCategoryId:     `nightshift.datastore.ResourceCategory.nid` identifier
+        age:                    number of days since bib created in Sierra
+        limit:                  max number of returned identifiers
+        after_nid:              retrieve only identifiers greater than this value
+
+    Returns:
+        list of `nightshift.datastore.Resource.nid`
+    """
+    nids = (
+        session.query(Resource.nid)
+        .filter(
+            Resource.resourceCategoryId == resourceCategoryId,
+            Resource.bibDate < datetime.now(timezone.utc) - timedelta(days=age),
+            Resource.nid > after_nid,
+        )
+        .order_by(Resource.nid)
+        .limit(limit)
+        .all()
+    )
+    return [n.nid for n in nids]
+
+
 def retrieve_new_resources(session: Session, libraryId: int) -> list[Resource]:
     """
     Retrieves resources that have been added to the db
@@ -384,6 +1264,26 @@ def retrieve_new_resources(session: Session, libraryId: int) -> list[Resource]:
     return resources
 
 
+def retrieve_new_resources_query_data(
+    session: Session, libraryId: int
+) -> list[ResQueryData]:
+    """
+    Retrieves the same resources as `retrieve_new_resources`, but loads only
+    columns needed to query WorldCat.
+
+    Args:
+        session:                `sqlalchemy.Session` instance
+        libraryId:              `Library.nid`
+
+    Returns:
+        list of `ResQueryData` tuples
+    """
+    rows = iter_new_resources(
+        session, libraryId, page_size=5000, columns=_res_query_data_columns()
+    )
+    return [ResQueryData(*row) for row in rows]
+
+
 def retrieve_open_older_resources(
     session: Session, libraryId: int, resourceCategoryId: int, minAge: int, maxAge: int
 ) -> list[Resource]:
@@ -430,6 +1330,35 @@ def retrieve_open_older_resources(
     return resources
 
 
+def retrieve_open_older_resources_query_data(
+    session: Session, libraryId: int, resourceCategoryId: int, minAge: int, maxAge: int
+) -> list[ResQueryData]:
+    """
+    Retrieves the same resources as `retrieve_open_older_resources`, but loads
+    only columns needed to query WorldCat. Results are ordered by resource nid.
+
+    Args:
+        session:                `sqlalchemy.Session` instance
+        libraryId:              library id
+        resourceCategoryId:     resource category id
+        minAge:                 min number of days since bib creation date
+        maxAge:                 max numb of days since bib creation date
+
+    Returns:
+        list of `ResQueryData` tuples
+    """
+    rows = iter_open_older_resources(
+        session,
+        libraryId,
+        resourceCategoryId,
+        minAge,
+        maxAge,
+        page_size=5000,
+        columns=_res_query_data_columns(),
+    )
+    return [ResQueryData(*row) for row in rows]
+
+
 def retrieve_open_matched_resources_without_full_bib(
     session: Session, libraryId: int
 ) -> list[Resource]:
@@ -530,6 +1459,31 @@ def retrieve_rotten_apples(session: Session) -> dict[int, list[str]]:
     return rotten_apples
 
 
+def retrieve_unfinished_run(session: Session) -> Optional[int]:
+    """
+    Retrieves id of the most recent run if it has not been completed.
+
+    Args:
+        session:                `sqlalchemy.Session` instance
+
+    Returns:
+        `datastore.RunLedger.runId` or None
+    """
+    runId = session.query(func.max(RunLedger.runId)).scalar()
+    if runId is None:
+        return None
+
+    completed = (
+        session.query(RunLedger.nid)
+        .filter(RunLedger.runId == runId, RunLedger.stage == "run_completed")
+        .first()
+    )
+    if completed:
+        return None
+    else:
+        return runId
+
+
 def set_resources_to_expired(
     session: Session, resourceCategoryId: int, age: int
 ) -> int:
@@ -557,6 +1511,23 @@ def set_resources_to_expired(
     return rowcount
 
 
+def start_run(session: Session) -> int:
+    """
+    Records in the run ledger beginning of a new run.
+
+    Args:
+        session:                `sqlalchemy.Session` instance
+
+    Returns:
+        `datastore.RunLedger.runId` of the new run
+    """
+    last_runId = session.query(func.max(RunLedger.runId)).scalar()
+    runId = (last_runId or 0) + 1
+    add_ledger_entry(session, runId, "run_started")
+    session.flush()
+    return runId
+
+
 def update_resource(session, sierraId, libraryId, **kwargs) -> Resource:
     """
     Updates Resource record.
@@ -585,3 +1556,26 @@ def update_resource(session, sierraId, libraryId, **kwargs) -> Resource:
         for key, value in kwargs.items():
             setattr(instance, key, value)
         return instance
+
+
+def update_resource_by_nid(session: Session, nid: int, **kwargs) -> int:
+    """
+    Updates Resource record without loading it from the database.
+    Changes are not reflected in `Resource` instances already loaded in the
+    session until they are refreshed (for example, after commit).
+
+    Args:
+        session:                `sqlalchemy.Session` instance
+        nid:                    `nightshift.datastore.Resource.nid`
+        kwargs:                 Resource table values to be updated as dictionary
+
+    Returns:
+        number of updated rows
+    """
+    result = session.execute(
+        update(Resource)
+        .where(Resource.nid == nid)
+        .values(**kwargs)
+        .execution_options(synchronize_session=False)
+    )
+    return result.rowcount
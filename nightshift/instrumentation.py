@@ -0,0 +1,282 @@
+# -*- coding: utf-8 -*-
+
+"""
+This module collects performance data of a NightShift run.
+
+Wall time, number of processed items, API calls, retries, database round trips
+and bytes transferred are recorded for each stage of the run and broken down by
+library and resource category. Counts are attributed to the innermost stage
+entered in the current thread; counts made outside of any stage are ignored.
+At the end of the run collected data is saved as a JSON report.
+"""
+from contextlib import contextmanager
+from datetime import datetime, timezone
+import json
+import logging
+import os
+import threading
+import time
+from typing import Iterator, Optional
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from nightshift import profiling
+
+
+logger = logging.getLogger("nightshift")
+
+
+COUNTERS = ("items", "apiCalls", "retries", "dbRoundTrips", "bytes")
+
+
+class StageStats:
+    """
+    Performance data of a single stage of the run for a library and
+    resource category.
+    """
+
+    def __init__(
+        self, stage: str, library: Optional[str] = None, category: Optional[str] = None
+    ) -> None:
+        """
+        Args:
+            stage:                      name of the stage
+            library:                    'NYP' or 'BPL'
+            category:                   name of resource category
+        """
+        self.stage = stage
+        self.library = library
+        self.category = category
+        self.wallTime = 0.0
+        self.counts = dict.fromkeys(COUNTERS, 0)
+
+    def as_dict(self) -> dict:
+        """
+        Returns stage data as a dictionary including throughput in items
+        per second.
+        """
+        if self.wallTime:
+            throughput: Optional[float] = round(self.counts["items"] / self.wallTime, 3)
+        else:
+            throughput = None
+        return dict(
+            stage=self.stage,
+            library=self.library,
+            category=self.category,
+            wallTime=round(self.wallTime, 3),
+            throughput=throughput,
+            **self.counts,
+        )
+
+
+class RunReport:
+    """
+    Performance data of a run. Safe to update from multiple threads.
+    """
+
+    def __init__(self, runId: Optional[int] = None) -> None:
+        """
+        Args:
+            runId:                      `datastore.RunLedger.runId` of the run
+        """
+        self.runId = runId
+        self.started = datetime.now(timezone.utc)
+        self.finished: Optional[datetime] = None
+        self.stages: dict[tuple, StageStats] = dict()
+        self._lock = threading.Lock()
+
+    def _stats(self, key: tuple) -> StageStats:
+        try:
+            return self.stages[key]
+        except KeyError:
+            stats = StageStats(*key)
+            self.stages[key] = stats
+            return stats
+
+    def add_time(self, key: tuple, seconds: float) -> None:
+        """
+        Adds wall time to the stage identified by (stage, library, category) key.
+        """
+        with self._lock:
+            self._stats(key).wallTime += seconds
+
+    def count(self, key: tuple, counter: str, n: int = 1) -> None:
+        """
+        Increments counter of the stage identified by (stage, library, category)
+        key.
+
+        Raises:
+            ValueError
+        """
+        if counter not in COUNTERS:
+            raise ValueError(
+                f"Invalid counter '{counter}'. Must be one of: {', '.join(COUNTERS)}."
+            )
+        with self._lock:
+            self._stats(key).counts[counter] += n
+
+    def total(self, counter: str, library: Optional[str] = None) -> int:
+        """
+        Returns total of the counter over all stages of the run or, if given,
+        over stages of the library.
+        """
+        with self._lock:
+            return sum(
+                stats.counts[counter]
+                for stats in self.stages.values()
+                if library is None or stats.library == library
+            )
+
+    def as_dict(self) -> dict:
+        """
+        Returns report as a dictionary. Stages are listed in order they
+        were first entered and are followed by run totals.
+        """
+        with self._lock:
+            stages = [stats.as_dict() for stats in self.stages.values()]
+        totals = {c: sum(s[c] for s in stages) for c in COUNTERS}
+        if self.finished:
+            wall_time: Optional[float] = round(
+                (self.finished - self.started).total_seconds(), 3
+            )
+            finished: Optional[str] = self.finished.isoformat()
+        else:
+            wall_time = None
+            finished = None
+        return dict(
+            runId=self.runId,
+            started=self.started.isoformat(),
+            finished=finished,
+            wallTime=wall_time,
+            stages=stages,
+            totals=totals,
+        )
+
+    def save(self, out_dir: str) -> str:
+        """
+        Saves report as a JSON file in the given directory.
+
+        Args:
+            out_dir:                    directory of the report file
+
+        Returns:
+            path of the report file
+        """
+        self.finished = datetime.now(timezone.utc)
+        stamp = self.finished.strftime("%Y%m%d%H%M%S")
+        if self.runId is None:
+            fh = os.path.join(out_dir, f"run-report-{stamp}.json")
+        else:
+            fh = os.path.join(out_dir, f"run-report-{self.runId}-{stamp}.json")
+        with open(fh, "w", encoding="utf-8") as out:
+            json.dump(self.as_dict(), out, indent=2)
+        return fh
+
+
+_report = RunReport()
+_local = threading.local()
+_listening = False
+
+
+def _count_db_round_trip(*args) -> None:
+    """
+    Counts database statements executed by any engine. Used as
+    SQLAlchemy's `before_cursor_execute` event listener.
+    """
+    record("dbRoundTrips")
+
+
+def _stack() -> list[tuple]:
+    try:
+        stack: list[tuple] = _local.stack
+    except AttributeError:
+        stack = []
+        _local.stack = stack
+    return stack
+
+
+def current_report() -> RunReport:
+    """
+    Returns report of the current run.
+    """
+    return _report
+
+
+def record(counter: str, n: int = 1) -> None:
+    """
+    Increments counter of the innermost stage entered in the current thread.
+    Does nothing outside of a stage.
+
+    Args:
+        counter:                    'items', 'apiCalls', 'retries',
+                                    'dbRoundTrips', or 'bytes'
+        n:                          increment
+    """
+    stack = _stack()
+    if stack:
+        _report.count(stack[-1], counter, n)
+
+
+def save_report(out_dir: Optional[str] = None) -> str:
+    """
+    Saves report of the current run as a JSON file.
+
+    Args:
+        out_dir:                    directory of the report file; if not given
+                                    `RUN_REPORT_DIR` environmental variable or
+                                    the current working directory is used
+
+    Returns:
+        path of the report file
+    """
+    if out_dir is None:
+        out_dir = os.getenv("RUN_REPORT_DIR") or os.getcwd()
+    return _report.save(out_dir)
+
+
+@contextmanager
+def stage(
+    name: str, library: Optional[str] = None, category: Optional[str] = None
+) -> Iterator[tuple]:
+    """
+    Measures wall time of a stage of the run and attributes to it any counts
+    made in the current thread until the stage is exited. The stage is profiled
+    if selected in `PROFILE_STAGES` (see `profiling` module).
+
+    Args:
+        name:                       name of the stage
+        library:                    'NYP' or 'BPL'
+        category:                   name of resource category
+
+    Yields:
+        (stage, library, category) key of the stage
+    """
+    key = (name, library, category)
+    stack = _stack()
+    stack.append(key)
+    start = time.perf_counter()
+    try:
+        with profiling.stage(name):
+            yield key
+    finally:
+        _report.add_time(key, time.perf_counter() - start)
+        stack.pop()
+
+
+def start_report(runId: Optional[int] = None) -> RunReport:
+    """
+    Begins a new report and starts counting database round trips.
+
+    Args:
+        runId:                      `datastore.RunLedger.runId` of the run
+
+    Returns:
+        `RunReport` instance
+    """
+    global _report, _listening
+    _report = RunReport(runId)
+    if not _listening:
+        event.listen(Engine, "before_cursor_execute", _count_db_round_trip)
+        _listening = True
+    return _report
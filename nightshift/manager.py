@@ -1,32 +1,201 @@
 """
 This module includes top level processes to be performed by the app
+
+`tasks` and `pipeline` modules, which load WorldCat, Sierra, SFTP and MARC
+clients, are imported only by processes that use them.
 """
 
+import base64
+from collections import namedtuple
+from datetime import date, datetime, timedelta, timezone
+import gzip
+from itertools import chain
+import json
 import logging
+import os
+import time
+from typing import Any, Mapping, Optional
 
+from sqlalchemy.orm.session import Session
 
-from nightshift.datastore import session_scope
+from nightshift import instrumentation
+from nightshift.budget import budget_config, RunBudget
+from nightshift.datastore import Resource, session_scope
 from nightshift.datastore_transactions import (
-    add_event,
-    delete_resources,
-    library_by_id,
-    resource_category_by_name,
-    retrieve_new_resources,
-    retrieve_expired_resources,
-    retrieve_open_matched_resources_with_full_bib_obtained,
-    retrieve_open_matched_resources_without_full_bib,
+    add_ledger_entry,
+    count_resources_to_delete,
+    create_event_partitions,
+    DailyStats,
+    delete_resources_by_nid,
+    event_table_partitioned,
+    expire_resources,
+    iter_open_matched_resources_with_full_bib_obtained,
+    iter_open_matched_resources_without_full_bib,
+    ResCatByName,
+    retrieve_completed_run_units,
+    retrieve_daily_stats,
+    retrieve_deletion_archive_rows,
+    retrieve_new_resources_query_data,
+    retrieve_nids_of_resources_to_delete,
     retrieve_open_older_resources,
-    set_resources_to_expired,
+    retrieve_open_older_resources_query_data,
+    retrieve_unfinished_run,
+    start_run,
 )
+from nightshift.ns_exceptions import BudgetExhausted
+from nightshift.reference_data import reference_data
 
 
-from nightshift.tasks import Tasks
+logger = logging.getLogger("nightshift")
 
 
-logger = logging.getLogger("nightshift")
+# requests a run would make in a stage for a library and resource category;
+# `uniqueRequests` counts identical requests (the same query, Sierra bib,
+# or OCLC number) once
+PLAN_STAGES = (
+    "new_search",
+    "sierra_check",
+    "older_search",
+    "full_bib_download",
+    "enhance",
+)
+
+PlanRow = namedtuple(
+    "PlanRow",
+    ["library", "resourceCategory", "stage", "resources", "requests", "uniqueRequests"],
+)
+
+
+class RunCheckpoints:
+    """
+    Keeps track of units of work completed during a run using the run ledger.
+    A unit of work is identified by a stage name, library, resource category
+    and query window.
+    Checkpointing is disabled if `runId` is None.
+    """
+
+    def __init__(self, db_session: Session, runId: Optional[int] = None) -> None:
+        """
+        Args:
+            db_session:                 `sqlalchemy.Session` instance
+            runId:                      `datastore.RunLedger.runId` of the run
+        """
+        self.db_session = db_session
+        self.runId = runId
+        if runId is not None:
+            self.completed = retrieve_completed_run_units(db_session, runId)
+        else:
+            self.completed = set()
+
+    def is_done(
+        self,
+        stage: str,
+        libraryId: Optional[int] = None,
+        resourceCategoryId: Optional[int] = None,
+        queryWindow: Optional[str] = None,
+    ) -> bool:
+        """
+        Checks if unit of work has been completed earlier in the run.
+        """
+        unit = (stage, libraryId, resourceCategoryId, queryWindow)
+        if unit in self.completed:
+            logger.info(
+                f"Skipping {stage} unit {unit[1:]} completed in run {self.runId}."
+            )
+            return True
+        else:
+            return False
+
+    def mark_done(
+        self,
+        stage: str,
+        libraryId: Optional[int] = None,
+        resourceCategoryId: Optional[int] = None,
+        queryWindow: Optional[str] = None,
+    ) -> None:
+        """
+        Records and commits completion of a unit of work.
+        """
+        if self.runId is not None:
+            add_ledger_entry(
+                self.db_session,
+                self.runId,
+                stage,
+                libraryId,
+                resourceCategoryId,
+                queryWindow,
+            )
+            self.completed.add((stage, libraryId, resourceCategoryId, queryWindow))
+        self.db_session.commit()
+
+
+def begin_run(resume: bool = False) -> int:
+    """
+    Records in the run ledger beginning of a new run or, if requested, finds
+    the most recent run that has not been completed.
+
+    Args:
+        resume:                 resumes the last unfinished run if True
+
+    Returns:
+        `datastore.RunLedger.runId`
+    """
+    with session_scope() as db_session:
+        runId = None
+        if resume:
+            runId = retrieve_unfinished_run(db_session)
+            if runId is None:
+                logger.info("No unfinished run to resume found.")
+            else:
+                logger.info(f"Resuming run {runId}.")
+
+        if runId is None:
+            runId = start_run(db_session)
+            logger.info(f"Starting run {runId}.")
+
+        return runId
+
+
+def complete_run(runId: int) -> None:
+    """
+    Records in the run ledger successful completion of the run.
+
+    Args:
+        runId:                  `datastore.RunLedger.runId`
+    """
+    with session_scope() as db_session:
+        add_ledger_entry(db_session, runId, "run_completed")
+    logger.info(f"Run {runId} completed.")
+
 
+def query_windows_by_expiry(
+    res_cat: Mapping[str, ResCatByName]
+) -> list[tuple[str, ResCatByName, int, int]]:
+    """
+    Lists query windows of all resource categories ordered by the number of days
+    left until resources in the window age out from the process. Windows with
+    the same number of days left keep the order of resource categories.
+
+    Args:
+        res_cat:                resource categories by name
+
+    Returns:
+        list of (category name, category data, min age, max age) tuples
+    """
+    windows = []
+    for res_category, res_cat_data in res_cat.items():
+        last_day = max(age_max for _, age_max in res_cat_data.queryDays)
+        for age_min, age_max in res_cat_data.queryDays:
+            windows.append(
+                (last_day - age_max, (res_category, res_cat_data, age_min, age_max))
+            )
+    windows.sort(key=lambda w: w[0])
+    return [w[1] for w in windows]
 
-def process_resources() -> None:
+
+def process_resources(
+    runId: Optional[int] = None, budget: Optional[RunBudget] = None
+) -> None:
     """
     Processes newly added and older not enhanced yet resources.
 
@@ -46,140 +215,726 @@ def process_resources() -> None:
         BPL Solr API if their status have changed since previous query (enhanced
         by staff, deleted, or suppressed). Records changes in status in the database.
     4. Selects again older and not enhanced resources and searches for matches in
-        WorldCat. Records any matching OCLC numbers.
+        WorldCat. Records any matching OCLC numbers. Steps 3 and 4 are performed
+        for one query window at a time, starting with windows closest to the end
+        of the query period, and oldest resources first.
     5. Downloads full bibliographic records for resources that were successfully matched
     6. Manipulates, serializes to MARC21 and outputs to SFTP resources with full bibs
         from WorldCat
     7. Updates status of resources that were successfully output to SFTP completing the
         process.
 
+    Each completed step is recorded in the run ledger when `runId` is given. Steps
+    completed earlier in the same run are skipped, which allows to resume an
+    interrupted run from the point of failure.
+
+    Steps 2-4 stop when API calls or time allowed for the run or the library
+    by the budget are used up. Remaining resources are left for the next run,
+    while resources already matched are still downloaded and output.
+
+    Args:
+        runId:                  `datastore.RunLedger.runId` of the current run
+        budget:                 `budget.RunBudget` instance; caps are read
+                                from environmental variables if not given
+
     """
+    from nightshift.tasks import Tasks
+
+    if budget is None:
+        budget = RunBudget(budget_config())
+
     with session_scope() as db_session:
 
-        lib_idx = library_by_id(db_session)
-        res_cat = resource_category_by_name(db_session)
+        data = reference_data(db_session)
+        lib_idx = data.libraries
+        res_cat = data.resourceCategories
+        checkpoints = RunCheckpoints(db_session, runId)
+        windows = query_windows_by_expiry(res_cat)
 
         for lib_nid, library in lib_idx.items():
 
             logger.info(f"Processing {library} resources.")
+            budget.start_library(library)
 
             # initiate Task client for the library
-            tasks = Tasks(db_session, library, lib_nid, res_cat)
+            tasks = Tasks(db_session, library, lib_nid, res_cat, budget)
 
             # ingest new resources
-            tasks.ingest_new_files()
-            logger.info(f"New {library} remote files have been ingested.")
-
-            # search newly added resources
-            resources = retrieve_new_resources(db_session, lib_nid)
+            if not checkpoints.is_done("ingest", lib_nid):
+                with instrumentation.stage("ingest", library):
+                    tasks.ingest_new_files()
+                logger.info(f"New {library} remote files have been ingested.")
+                checkpoints.mark_done("ingest", lib_nid)
+
+            # search new resources first, then older resources starting with windows
+            # closest to the end of their query period; searches stop when
+            # the budget is exhausted leaving remaining resources for the next run
+            try:
+                if not checkpoints.is_done("new_search", lib_nid):
+                    with instrumentation.stage("new_search", library):
+                        query_data = retrieve_new_resources_query_data(
+                            db_session, lib_nid
+                        )
+                        instrumentation.record("items", len(query_data))
+
+                        # perform searches for each resource and store results
+                        if query_data:
+                            tasks.get_worldcat_brief_bib_matches(query_data)
+                            logger.info(
+                                f"Obtaining Worldcat matches for {len(query_data)} "
+                                f"{library} new resources completed."
+                            )
+                    checkpoints.mark_done("new_search", lib_nid)
+
+                for res_category, res_cat_data, age_min, age_max in windows:
+                    window = f"{age_min}-{age_max}"
+
+                    # check & update status of older resources if changed in Sierra
+                    if not checkpoints.is_done(
+                        "sierra_check", lib_nid, res_cat_data.nid, window
+                    ):
+                        with instrumentation.stage(
+                            "sierra_check", library, res_category
+                        ):
+                            resources = retrieve_open_older_resources(
+                                db_session,
+                                lib_nid,
+                                res_cat_data.nid,
+                                age_min,
+                                age_max,
+                            )
+                            instrumentation.record("items", len(resources))
+                            # query Sierra platform to update their status if changed
+                            if resources:
+                                resources.sort(key=lambda r: r.bibDate)
+                                tasks.check_resources_sierra_state(resources)
+                                logger.info(
+                                    f"Checking Sierra status of {len(resources)} "
+                                    f"{library} {res_category} older resources "
+                                    "completed."
+                                )
+                        checkpoints.mark_done(
+                            "sierra_check", lib_nid, res_cat_data.nid, window
+                        )
 
-            # perform searches for each resource and store results
-            if resources:
-                tasks.get_worldcat_brief_bib_matches(resources)
-                logger.info(
-                    f"Obtaining Worldcat matches for {len(resources)} {library} "
-                    "new resources completed."
+                    # search again older resources dropping any resources already
+                    # enhanced or deleted
+                    if not checkpoints.is_done(
+                        "older_search", lib_nid, res_cat_data.nid, window
+                    ):
+                        with instrumentation.stage(
+                            "older_search", library, res_category
+                        ):
+                            query_data = retrieve_open_older_resources_query_data(
+                                db_session,
+                                lib_nid,
+                                res_cat_data.nid,
+                                age_min,
+                                age_max,
+                            )
+                            instrumentation.record("items", len(query_data))
+
+                            # perform WorldCat searches for open older query_data
+                            if query_data:
+                                query_data.sort(key=lambda r: r.bibDate)
+                                tasks.get_worldcat_brief_bib_matches(query_data)
+                                logger.info(
+                                    "Obtaining WorldCat matches for "
+                                    f"{len(query_data)} {library} {res_category} "
+                                    "older resources completed."
+                                )
+                        checkpoints.mark_done(
+                            "older_search", lib_nid, res_cat_data.nid, window
+                        )
+            except BudgetExhausted as exc:
+                logger.warning(
+                    f"Stopping {library} searches: {exc}. Remaining resources "
+                    "are left for the next run."
                 )
 
-            # check & update status of older resources if changed in Sierra
-            for res_category, res_cat_data in res_cat.items():
-                for age_min, age_max in res_cat_data.queryDays:
-                    resources = retrieve_open_older_resources(
-                        db_session,
-                        lib_nid,
-                        res_cat_data.nid,
-                        age_min,
-                        age_max,
+            # perform download of full records for matched resources; resources
+            # are loaded from the database in pages while they are downloaded
+            if not checkpoints.is_done("full_bib_download", lib_nid):
+                with instrumentation.stage("full_bib_download", library):
+                    downloaded = tasks.get_worldcat_full_bibs(
+                        iter_open_matched_resources_without_full_bib(
+                            db_session, lib_nid
+                        )
                     )
-                    # query Sierra platform to update their status if changed
-                    if resources:
-                        tasks.check_resources_sierra_state(resources)
+                    if downloaded:
                         logger.info(
-                            f"Checking Sierra status of {len(resources)} {library} "
-                            f"{res_category} older resources completed."
+                            f"Downloading {downloaded} {library} full records "
+                            "from WorldCat completed."
                         )
+                checkpoints.mark_done("full_bib_download", lib_nid)
 
-            # search again older resources dropping any resources already enhanced
-            # or deleted
+            # serialize as MARC21 and output to a file of enhanced bibs; resources
+            # with their full bibs are loaded from the database in pages
             for res_category, res_cat_data in res_cat.items():
-                for age_min, age_max in res_cat_data.queryDays:
-                    resources = retrieve_open_older_resources(
-                        db_session,
-                        lib_nid,
-                        res_cat_data.nid,
-                        age_min,
-                        age_max,
+                if checkpoints.is_done("enhance", lib_nid, res_cat_data.nid):
+                    continue
+                with instrumentation.stage("enhance", library, res_category):
+                    # manipulate Worldcat bibs, serialize to MARC21 and save to SFTP
+                    enhanced = tasks.enhance_and_output_bibs(
+                        res_category,
+                        iter_open_matched_resources_with_full_bib_obtained(
+                            db_session, lib_nid, res_cat_data.nid
+                        ),
                     )
-
-                    # perform WorldCat searches for open older resources
-                    if resources:
-                        tasks.get_worldcat_brief_bib_matches(resources)
+                    if enhanced:
                         logger.info(
-                            f"Obtaining WorldCat matches for {len(resources)} "
-                            f"{library} {res_category} older resources completed."
+                            f"Enhancement and serialization of {library} {res_category} "
+                            "complete."
+                        )
+                checkpoints.mark_done("enhance", lib_nid, res_cat_data.nid)
+
+
+def process_resources_streaming(
+    queue_size: int = 50,
+    runId: Optional[int] = None,
+    budget: Optional[RunBudget] = None,
+) -> None:
+    """
+    Processes newly added and older not enhanced yet resources in the streaming
+    mode.
+
+    Performs the same work as `process_resources`, but WorldCat searches,
+    downloads of full records and enhancement overlap. A resource matched in WorldCat
+    is passed immediately to the full bib download and then to the enhancement
+    while searches for other resources are still running.
+
+    1. Discovers new Sierra dump files on SFTP and adds records to the database.
+    2. Streams newly added resources through WorldCat search, full bib download
+        and enhancement stages. Resources matched or downloaded in an earlier,
+        interrupted run join the pipeline at the appropriate stage.
+    3. Selects older, not enhanced yet resources that can be queried in WorldCat
+        according to their schedule and checks via NYPL Platform or BPL Solr API
+        if their status have changed since previous query.
+    4. Streams older resources that are still open through the same stages.
+        Steps 3 and 4 are performed for one query window at a time, starting with
+        windows closest to the end of the query period, and oldest resources first.
+    5. Outputs for each resource category enhanced records to SFTP as a MARC21 file
+        and updates status of resources that were successfully output.
+
+    As in `process_resources`, completed steps are recorded in the run ledger
+    when `runId` is given and skipped if the run is resumed.
+
+    As in `process_resources`, steps 2-4 stop when the budget is exhausted,
+    while resources already matched are still downloaded, enhanced and output.
+
+    Args:
+        queue_size:             max number of resources waiting between stages
+        runId:                  `datastore.RunLedger.runId` of the current run
+        budget:                 `budget.RunBudget` instance; caps are read
+                                from environmental variables if not given
+    """
+    from nightshift.pipeline import StreamingPipeline
+    from nightshift.tasks import Tasks
+
+    if budget is None:
+        budget = RunBudget(budget_config())
+
+    with session_scope() as db_session:
+
+        data = reference_data(db_session)
+        lib_idx = data.libraries
+        res_cat = data.resourceCategories
+        checkpoints = RunCheckpoints(db_session, runId)
+        windows = query_windows_by_expiry(res_cat)
+
+        for lib_nid, library in lib_idx.items():
+
+            logger.info(f"Processing {library} resources in streaming mode.")
+            budget.start_library(library)
+
+            # initiate Task client for the library
+            tasks = Tasks(db_session, library, lib_nid, res_cat, budget)
+
+            # ingest new resources
+            if not checkpoints.is_done("ingest", lib_nid):
+                with instrumentation.stage("ingest", library):
+                    tasks.ingest_new_files()
+                logger.info(f"New {library} remote files have been ingested.")
+                checkpoints.mark_done("ingest", lib_nid)
+
+            if checkpoints.is_done("streaming", lib_nid):
+                continue
+
+            pipeline = StreamingPipeline(tasks, queue_size=queue_size)
+
+            # stream new resources first, together with leftovers of interrupted
+            # runs, then older resources starting with windows closest to the end
+            # of their query period; searches stop when the budget is exhausted
+            # leaving remaining resources for the next run
+            try:
+                with instrumentation.stage("streaming", library):
+                    search_resources = []
+                    if not checkpoints.is_done("new_search", lib_nid):
+                        search_resources = retrieve_new_resources_query_data(
+                            db_session, lib_nid
+                        )
+                    instrumentation.record("items", len(search_resources))
+
+                    # leftovers are loaded from the database in pages
+                    # while they are streamed
+                    download_resources = iter_open_matched_resources_without_full_bib(
+                        db_session, lib_nid
+                    )
+                    enhance_resources = chain.from_iterable(
+                        iter_open_matched_resources_with_full_bib_obtained(
+                            db_session, lib_nid, res_cat_data.nid
+                        )
+                        for res_cat_data in res_cat.values()
+                    )
+                    pipeline.stream(
+                        search_resources, download_resources, enhance_resources
+                    )
+                tasks.check_budget()
+                checkpoints.mark_done("new_search", lib_nid)
+
+                for res_category, res_cat_data, age_min, age_max in windows:
+                    window = f"{age_min}-{age_max}"
+
+                    # check & update status of older resources if changed in Sierra
+                    if not checkpoints.is_done(
+                        "sierra_check", lib_nid, res_cat_data.nid, window
+                    ):
+                        with instrumentation.stage(
+                            "sierra_check", library, res_category
+                        ):
+                            resources = retrieve_open_older_resources(
+                                db_session,
+                                lib_nid,
+                                res_cat_data.nid,
+                                age_min,
+                                age_max,
+                            )
+                            instrumentation.record("items", len(resources))
+                            if resources:
+                                resources.sort(key=lambda r: r.bibDate)
+                                tasks.check_resources_sierra_state(resources)
+                                logger.info(
+                                    f"Checking Sierra status of {len(resources)} "
+                                    f"{library} {res_category} older resources "
+                                    "completed."
+                                )
+                        checkpoints.mark_done(
+                            "sierra_check", lib_nid, res_cat_data.nid, window
                         )
 
-            # perform download of full records for matched resources
-            resources = retrieve_open_matched_resources_without_full_bib(
-                db_session, lib_nid
+                    # stream older resources still open after the Sierra check
+                    if not checkpoints.is_done(
+                        "older_search", lib_nid, res_cat_data.nid, window
+                    ):
+                        with instrumentation.stage("streaming", library, res_category):
+                            query_data = retrieve_open_older_resources_query_data(
+                                db_session,
+                                lib_nid,
+                                res_cat_data.nid,
+                                age_min,
+                                age_max,
+                            )
+                            instrumentation.record("items", len(query_data))
+                            if query_data:
+                                query_data.sort(key=lambda r: r.bibDate)
+                                pipeline.stream(query_data)
+                        tasks.check_budget()
+                        checkpoints.mark_done(
+                            "older_search", lib_nid, res_cat_data.nid, window
+                        )
+            except BudgetExhausted as exc:
+                logger.warning(
+                    f"Stopping {library} searches: {exc}. Remaining resources "
+                    "are left for the next run."
+                )
+
+            # output enhanced records of all streamed resources
+            with instrumentation.stage("streaming", library):
+                pipeline.output()
+            logger.info(f"Streaming {library} resources completed.")
+            checkpoints.mark_done("streaming", lib_nid)
+
+
+def event_stats(days: int = 30) -> list[DailyStats]:
+    """
+    Retrieves counts of events per library, resource category, and status
+    for given number of days from pre-aggregated daily stats.
+
+    Args:
+        days:                   number of days including today
+
+    Returns:
+        list of `datastore_transactions.DailyStats` tuples
+    """
+    start = datetime.now(timezone.utc).date() - timedelta(days=days - 1)
+    with session_scope() as db_session:
+        return retrieve_daily_stats(db_session, start)
+
+
+def plan_rates() -> dict[str, float]:
+    """
+    Reads from environment variables expected rates of requests used to
+    estimate duration of a run. Not set variables default to 2 WorldCat
+    searches, 5 Sierra lookups, and 2 WorldCat full bib downloads per second.
+
+    Returns:
+        dictionary of requests per second with stage name as key
+
+    Raises:
+        ValueError
+    """
+    rates = dict()
+    for stages, var, default in (
+        (("new_search", "older_search"), "PLAN_SEARCH_RATE", 2.0),
+        (("sierra_check",), "PLAN_SIERRA_RATE", 5.0),
+        (("full_bib_download",), "PLAN_FULL_BIB_RATE", 2.0),
+    ):
+        rate = float(os.getenv(var) or default)
+        if rate <= 0:
+            raise ValueError(f"Invalid {var}. Must be greater than 0.")
+        for stage in stages:
+            rates[stage] = rate
+    return rates
+
+
+def plan_duration(rows: list[PlanRow], rates: dict[str, float]) -> float:
+    """
+    Estimates duration in seconds of requests of a planned run.
+
+    Args:
+        rows:                   `PlanRow` tuples
+        rates:                  requests per second by stage (see `plan_rates`)
+
+    Returns:
+        number of seconds
+    """
+    return float(sum(r.requests / rates[r.stage] for r in rows if r.stage in rates))
+
+
+def plan_run() -> list[PlanRow]:
+    """
+    Plans processing of resources without making any requests to WorldCat,
+    Sierra or SFTP and without changing the database.
+
+    Runs the same selections of resources as `process_resources` and counts
+    for each library, resource category and stage resources and requests
+    the run would make:
+     - 'new_search' and 'older_search': WorldCat brief bib queries prepared for
+        each resource; searches stop at the first query with a match, so these
+        are upper limits
+     - 'sierra_check': NYPL Platform or BPL Solr lookups
+     - 'full_bib_download': WorldCat full bib downloads of already matched
+        resources; resources matched during the run are downloaded as well
+     - 'enhance': output files with enhanced records
+
+    Resources in files not yet ingested from SFTP are not included.
+
+    Returns:
+        list of `PlanRow` tuples
+    """
+    from nightshift.comms.worldcat import Worldcat
+
+    plan: dict[tuple, list] = dict()
+
+    def add(library, category, stage, resources, requests, keys):
+        row = plan.setdefault((library, category, stage), [0, 0, set()])
+        row[0] += resources
+        row[1] += requests
+        row[2].update(keys)
+
+    with session_scope() as db_session:
+        data = reference_data(db_session)
+        lib_idx = data.libraries
+        res_cat = data.resourceCategories
+        cat_names = {data.nid: name for name, data in res_cat.items()}
+        rotten_apples = data.rottenApples
+
+        for lib_nid, library in lib_idx.items():
+            worldcat = Worldcat(library, connect=False)
+            query_templates = worldcat.build_query_templates(rotten_apples)
+
+            def add_searches(stage, query_data):
+                for resource, payloads in worldcat.plan_queries(
+                    query_data, query_templates=query_templates
+                ):
+                    add(
+                        library,
+                        cat_names.get(resource.resourceCategoryId),
+                        stage,
+                        1,
+                        len(payloads),
+                        [tuple(sorted(p.items())) for p in payloads],
+                    )
+
+            add_searches(
+                "new_search", retrieve_new_resources_query_data(db_session, lib_nid)
             )
-            if resources:
-                tasks.get_worldcat_full_bibs(resources)
-                logger.info(
-                    f"Downloading {len(resources)} {library} {res_category} "
-                    "full records from WorldCat completed."
+
+            for res_category, res_cat_data in res_cat.items():
+                for age_min, age_max in res_cat_data.queryDays:
+                    resources = retrieve_open_older_resources(
+                        db_session, lib_nid, res_cat_data.nid, age_min, age_max
+                    )
+                    add(
+                        library,
+                        res_category,
+                        "sierra_check",
+                        len(resources),
+                        len(resources),
+                        [r.sierraId for r in resources],
+                    )
+                    add_searches(
+                        "older_search",
+                        retrieve_open_older_resources_query_data(
+                            db_session, lib_nid, res_cat_data.nid, age_min, age_max
+                        ),
+                    )
+
+            for row in iter_open_matched_resources_without_full_bib(
+                db_session,
+                lib_nid,
+                columns=(Resource.resourceCategoryId, Resource.oclcMatchNumber),
+            ):
+                add(
+                    library,
+                    cat_names.get(row.resourceCategoryId),
+                    "full_bib_download",
+                    1,
+                    1,
+                    [row.oclcMatchNumber],
                 )
 
-            # serialize as MARC21 and output to a file of enhanced bibs
+            # full bibs are not loaded, only resources are counted
             for res_category, res_cat_data in res_cat.items():
-                resources = retrieve_open_matched_resources_with_full_bib_obtained(
-                    db_session, lib_nid, res_cat_data.nid
+                tally = sum(
+                    1
+                    for _ in iter_open_matched_resources_with_full_bib_obtained(
+                        db_session, lib_nid, res_cat_data.nid, columns=(Resource.nid,)
+                    )
                 )
+                if tally:
+                    add(library, res_category, "enhance", tally, 1, [None])
 
-                # manipulate Worldcat bibs, serialize to MARC21 and save to SFTP
-                if resources:
-                    tasks.enhance_and_output_bibs(res_category, resources)
+        libraries = list(lib_idx.values())
+        db_session.rollback()
 
-                    logger.info(
-                        f"Enhancement and serialization of {library} {res_category} "
-                        "complete."
-                    )
+    return [
+        PlanRow(library, category, stage, resources, requests, len(keys))
+        for (library, category, stage), (resources, requests, keys) in sorted(
+            plan.items(),
+            key=lambda i: (libraries.index(i[0][0]), PLAN_STAGES.index(i[0][2])),
+        )
+        if resources
+    ]
 
 
-def perform_db_maintenance() -> None:
+def perform_db_maintenance(runId: Optional[int] = None) -> None:
     """
     Marks resources as expired or deletes them if past certain age.
+
+    Maintenance of each resource category is recorded in the run ledger when
+    `runId` is given and skipped if the run is resumed.
+
+    Args:
+        runId:                  `datastore.RunLedger.runId` of the current run
     """
     with session_scope() as db_session:
 
-        res_cat = resource_category_by_name(db_session)
+        res_cat = reference_data(db_session).resourceCategories
+        checkpoints = RunCheckpoints(db_session, runId)
+
+        # make sure monthly partitions of the Event table exist ahead of time
+        if event_table_partitioned(db_session):
+            for partition in create_event_partitions(db_session):
+                logger.info(f"Created Event table partition {partition}.")
+            db_session.commit()
+        else:
+            logger.warning(
+                "Event table is not partitioned. Skipping creation of its "
+                "partitions. Run 'upgrade' command to partition the table."
+            )
 
         for res_category, res_cat_data in res_cat.items():
 
-            # set to expired
-            expiration_age = res_cat_data.queryDays[-1][1]
+            if checkpoints.is_done("maintenance", None, res_cat_data.nid):
+                continue
+
+            with instrumentation.stage("maintenance", category=res_category):
+                # set to expired and record status change for statistical purposes
+                # in Event table
+                expiration_age = res_cat_data.queryDays[-1][1]
+                tally = expire_resources(db_session, res_cat_data.nid, expiration_age)
+                db_session.commit()
+                instrumentation.record("items", tally)
+                logger.info(
+                    f"Changed {tally} {res_category} resource(s) status to 'expired'."
+                )
+
+                # delete resources 3 months older after they expired
+                deletion_age = expiration_age + 90
+                tally = purge_resources(
+                    db_session, res_category, res_cat_data.nid, deletion_age
+                )
+                instrumentation.record("items", tally)
+                logger.info(
+                    f"Deleted {tally} {res_category} resource(s) older than "
+                    f"{deletion_age} days from the database."
+                )
+            checkpoints.mark_done("maintenance", None, res_cat_data.nid)
+
+
+def _archive_default(value: Any) -> Any:
+    """
+    Serializes to JSON values of archived rows not supported by the `json` module.
+    Bytes (for example full MARC records) are encoded as base64 and stored
+    together with the name of the encoding, so they can be restored unaltered.
+    """
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    elif isinstance(value, bytes):
+        return dict(encoding="base64", data=base64.b64encode(value).decode("ascii"))
+    else:
+        return str(value)
 
-            # record status change for statistical purposes in Event table
-            resources = retrieve_expired_resources(
-                db_session, res_cat_data.nid, expiration_age
-            )
-            for resource in resources:
-                add_event(db_session, resource, status="expired")
 
-            # change status in Resource table
-            tally = set_resources_to_expired(
-                db_session, res_cat_data.nid, age=expiration_age
+def purge_config() -> tuple[int, float, Optional[str]]:
+    """
+    Reads from environment variables settings of deletion of aged-out resources.
+    Not set variables default to batches of 1000 resources, no pause between
+    batches, and no archiving of deleted rows.
+
+    Returns:
+        tuple of batch size, pause between batches in seconds, and archive
+        directory
+
+    Raises:
+        ValueError
+    """
+    batch_size = int(os.getenv("PURGE_BATCH_SIZE") or 1000)
+    pause = float(os.getenv("PURGE_PAUSE") or 0)
+    archive_dir = os.getenv("PURGE_ARCHIVE_DIR") or None
+    if batch_size < 1:
+        raise ValueError("Invalid PURGE_BATCH_SIZE. Must be greater than 0.")
+    if pause < 0:
+        raise ValueError("Invalid PURGE_PAUSE. Must not be negative.")
+    return (batch_size, pause, archive_dir)
+
+
+def purge_resources(
+    db_session: Session,
+    res_category: str,
+    resourceCategoryId: int,
+    age: int,
+    dry_run: bool = False,
+    archive_dir: Optional[str] = None,
+) -> int:
+    """
+    Deletes from the database resources of given category older than given age
+    in days since bib creation in Sierra. Resources are deleted in batches
+    keyed by the `nid` and each batch is committed separately to avoid long
+    running transactions. Batch size and pause between batches are configured
+    with PURGE_BATCH_SIZE and PURGE_PAUSE environment variables.
+
+    Args:
+        db_session:             `sqlalchemy.Session` instance
+        res_category:           name of resource category
+        resourceCategoryId:     `nightshift.datastore.ResourceCategory.nid`
+        age:                    number of days since bib created in Sierra
+        dry_run:                only counts resources to be deleted when True
+        archive_dir:            directory where deleted rows are archived to
+                                a gzip compressed JSON lines file before
+                                deletion; defaults to PURGE_ARCHIVE_DIR
+                                environment variable
+
+    Returns:
+        number of deleted resources (or resources to be deleted in the dry run)
+    """
+    batch_size, pause, default_archive_dir = purge_config()
+    if archive_dir is None:
+        archive_dir = default_archive_dir
+
+    total = count_resources_to_delete(db_session, resourceCategoryId, age)
+    if dry_run:
+        logger.info(
+            f"Dry run: {total} {res_category} resource(s) older than {age} days "
+            "would be deleted from the database."
+        )
+        return total
+
+    if total == 0:
+        return 0
+
+    archive = None
+    if archive_dir:
+        stamp = datetime.now(timezone.utc).strftime("%Y%m%d%H%M%S")
+        archive_file = os.path.join(
+            archive_dir, f"purged-{res_category}-{stamp}.jsonl.gz"
+        )
+        archive = gzip.open(archive_file, "wt", encoding="utf-8")
+        logger.info(f"Archiving deleted {res_category} resources to {archive_file}.")
+
+    deleted = 0
+    last_nid = 0
+    try:
+        while True:
+            nids = retrieve_nids_of_resources_to_delete(
+                db_session, resourceCategoryId, age, batch_size, last_nid
             )
+            if not nids:
+                break
+
+            if archive is not None:
+                for row in retrieve_deletion_archive_rows(db_session, nids):
+                    archive.write(json.dumps(row, default=_archive_default) + "\n")
+                archive.flush()
+
+            deleted += delete_resources_by_nid(db_session, nids)
             db_session.commit()
+            last_nid = nids[-1]
             logger.info(
-                f"Changed {tally} {res_category} resource(s) status to 'expired'."
+                f"Deleted batch of {len(nids)} {res_category} resource(s) "
+                f"({deleted}/{total})."
             )
 
-            # delete resources 3 months older after they expired
-            deletion_age = expiration_age + 90
-            tally = delete_resources(db_session, res_cat_data.nid, deletion_age)
-            db_session.commit()
-            logger.info(
-                f"Deleted {tally} {res_category} resource(s) older than "
-                f"{deletion_age} days from the database."
+            if len(nids) < batch_size:
+                break
+            if pause:
+                time.sleep(pause)
+    finally:
+        if archive is not None:
+            archive.close()
+
+    return deleted
+
+
+def purge_aged_resources(
+    dry_run: bool = False, archive_dir: Optional[str] = None
+) -> None:
+    """
+    Deletes from the database resources of all categories that are past their
+    deletion age (3 months after expiration) without performing any other
+    maintenance tasks.
+
+    Args:
+        dry_run:                only counts and reports resources to be deleted
+                                when True
+        archive_dir:            directory where deleted rows are archived before
+                                deletion
+    """
+    with session_scope() as db_session:
+        res_cat = reference_data(db_session).resourceCategories
+        for res_category, res_cat_data in res_cat.items():
+            deletion_age = res_cat_data.queryDays[-1][1] + 90
+            tally = purge_resources(
+                db_session,
+                res_category,
+                res_cat_data.nid,
+                deletion_age,
+                dry_run=dry_run,
+                archive_dir=archive_dir,
             )
+            if not dry_run:
+                logger.info(
+                    f"Deleted {tally} {res_category} resource(s) older than "
+                    f"{deletion_age} days from the database."
+                )
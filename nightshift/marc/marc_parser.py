@@ -10,7 +10,7 @@ evideo)
 from io import BytesIO
 import logging
 import pickle
-from typing import Any, BinaryIO, Iterator, Optional, Union
+from typing import Any, BinaryIO, Iterator, Mapping, Optional, Union
 
 from bookops_marc import SierraBibReader, Bib
 from bookops_marc.bib import pymarc_record_to_local_bib
@@ -61,7 +61,7 @@ class BibReader:
         marc_target: Union[BytesIO, BinaryIO],
         library: str,
         libraryId: int,
-        resource_categories: dict[str, ResCatByName],
+        resource_categories: Mapping[str, ResCatByName],
         hide_utf8_warnings: bool = True,
     ) -> None:
         """
@@ -88,7 +88,7 @@ class BibReader:
             )
             raise TypeError("Invalid 'marc_target' argument. Must be file-like object.")
 
-        if not isinstance(resource_categories, dict):
+        if not isinstance(resource_categories, Mapping):
             logger.error("Invalid 'resource_categories' argument.")
             raise TypeError(
                 "Invalid 'resource_categories' argument. Must be a dictionary with a "
@@ -208,6 +208,6 @@ class BibReader:
             standardNumber=standardNumber,
             status="open",
         )
-        logger.debug(f"Parsed resource: {resource}")
+        logger.debug("Parsed resource: %s", resource)
 
         return resource
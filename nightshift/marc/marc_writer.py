@@ -6,6 +6,7 @@ into MARC21.
 """
 import logging
 import pickle
+from typing import Mapping
 
 from pymarc import Field, Subfield
 
@@ -18,6 +19,34 @@ from .marc_parser import worldcat_response_to_bib
 logger = logging.getLogger("nightshift")
 
 
+# distributors of e-resources whose 710 tags are removed from WorldCat bibs
+ERESOURCE_VENDORS = ("overdrive", "cloudlibrary", "3m", "recorded books")
+
+# genre terms of resource categories: (term of subject fields to be removed,
+# LCGFT term added to 655 tag if missing from subject fields)
+GENRE_TERMS = {
+    "ebook": ("electronic books", None),
+    "eaudio": ("electronic audiobooks", "Audiobooks."),
+    "evideo": (None, "Internet videos."),
+}
+
+
+def is_eresource_vendor(field: Field) -> bool:
+    """
+    Determines if the field is a 710 tag of an e-resource distributor.
+
+    Args:
+        field:                          `pymarc.Field` instance
+
+    Returns:
+        bool
+    """
+    if field.tag != "710":
+        return False
+    value = field.value().lower()
+    return any(vendor in value for vendor in ERESOURCE_VENDORS)
+
+
 class BibEnhancer:
     """
     A class used for upgrading MARC records.
@@ -28,7 +57,8 @@ class BibEnhancer:
     Invoking `manipulate()` method on the instance of this class does the following:
      - encodes matching Sierra bib to be overlaid (matching bib # in 907 - BPL
         or 945 - NYPL)
-     - removes unwanted MARC tags specified in `constants.RESOURCE_CATEGORIES`,
+     - removes unwanted MARC tags specified in `constants.RESOURCE_CATEGORIES`
+        and e-resource vendor tags,
      - deletes 6xx from unsupported thesauri,
      - adds local tags preserved from the original Sierra bib specified in
         `constants.RESOURCE_CATEGORIES`
@@ -49,7 +79,7 @@ class BibEnhancer:
         self,
         resource: Resource,
         library: str,
-        resource_categories: dict[int, ResCatById],
+        resource_categories: Mapping[int, ResCatById],
     ) -> None:
         """
         Initiates BibEnhancer by parsing WorldCat MARC XML byte string received
@@ -82,15 +112,12 @@ class BibEnhancer:
         a call number can be constructed.
         """
 
-        # delete unwanted MARC tags
+        # delete unwanted MARC tags and e-resources vendor tags
         self._purge_tags()
 
         # remove 6xx tags with terms from unsupported thesauri
         self.bib.remove_unsupported_subjects()
 
-        # remove e-resources vendor tags
-        self._remove_eresource_vendors()
-
         # if does not meet criteria delete Worldcat bib
         if not self._is_acceptable():
             logger.info(
@@ -138,8 +165,9 @@ class BibEnhancer:
                 with open(file_path, "ab") as out:
                     out.write(self.bib.as_marc())
                     logger.debug(
-                        f"Saving to file {self.library} record "
-                        f"b{self.resource.sierraId}a."
+                        "Saving to file %s record b%sa.",
+                        self.library,
+                        self.resource.sierraId,
                     )
             except OSError as exc:
                 logger.error(f"Unable to save record to a temp file. Error {exc}.")
@@ -192,10 +220,13 @@ class BibEnhancer:
                 tag=tag, indicators=[" ", " "], subfields=[Subfield("a", value)]
             )
             self.bib.add_field(call_number)
-            logger.debug(
-                f"Added {call_number.value()} to {self.library} "
-                f"b{self.resource.sierraId}a."
-            )
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(
+                    "Added %s to %s b%sa.",
+                    call_number.value(),
+                    self.library,
+                    self.resource.sierraId,
+                )
             return True
         else:
             logger.warning(
@@ -247,70 +278,56 @@ class BibEnhancer:
             ],
         )
         self.bib.add_field(command_tag)
-        logger.debug(
-            f"Added 949 command tag: {command_tag.value()} to {self.library} "
-            f"b{self.resource.sierraId}a."
-        )
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(
+                "Added 949 command tag: %s to %s b%sa.",
+                command_tag.value(),
+                self.library,
+                self.resource.sierraId,
+            )
 
     def _clean_up_genre_tags(self) -> None:
         """
-        Adds genre tags to e-resources.
+        Adds genre tags to e-resources. Subject fields with unsupported genre terms
+        are removed in a single pass over the fields of the bib.
         """
         try:
             resource_cat = self._res_cat[self.resource.resourceCategoryId].name
         except KeyError:
             resource_cat = None
 
-        if resource_cat == "ebook":
-            for field in self.bib.subjects:
-                if "electronic books" in field.value().lower():
-                    self.bib.remove_field(field)
-
-        elif resource_cat == "eaudio":
-
-            # 'Audiobooks' term
-            # remove electronic audiobooks
-            for field in self.bib.subjects:
-                if "electronic audiobooks" in field.value().lower():
-                    self.bib.remove_field(field)
-
-            # but keep lcgft audiobooks
-            found = False
-            for field in self.bib.subjects:
-                if "audiobooks." in field.value().lower():
-                    found = True
-                    break
-            if not found:
-                self.bib.add_field(
-                    Field(
-                        tag="655",
-                        indicators=[" ", "7"],
-                        subfields=[
-                            Subfield("a", "Audiobooks."),
-                            Subfield("2", "lcgft"),
-                        ],
-                    )
-                )
-                logger.debug("Added 'Audiobooks' LCGFT genre to 655 tag.")
-
-        elif resource_cat == "evideo":
-            found = False
-            for field in self.bib.subjects:
-                if "internet videos." in field.value().lower():
+        if resource_cat not in GENRE_TERMS:
+            return
+        unwanted, required = GENRE_TERMS[resource_cat]
+
+        subjects = {id(field) for field in self.bib.subjects}
+        fields = []
+        found = False
+        for field in self.bib.fields:
+            if id(field) in subjects:
+                value = field.value().lower()
+                if unwanted is not None and unwanted in value:
+                    continue
+                if required is not None and required.lower() in value:
                     found = True
-                    break
-            if not found:
-                self.bib.add_field(
-                    Field(
-                        tag="655",
-                        indicators=[" ", "7"],
-                        subfields=[
-                            Subfield("a", "Internet videos."),
-                            Subfield("2", "lcgft"),
-                        ],
-                    )
+            fields.append(field)
+        self.bib.fields = fields
+
+        added = []
+        if required is not None and not found:
+            self.bib.add_field(
+                Field(
+                    tag="655",
+                    indicators=[" ", "7"],
+                    subfields=[
+                        Subfield("a", required),
+                        Subfield("2", "lcgft"),
+                    ],
                 )
-                logger.debug("Added 'Internet videos' LCGFT genre to 655 tag.")
+            )
+            added.append(required.rstrip("."))
+        if added:
+            logger.debug("Added '%s' LCGFT genre to 655 tag.", ", ".join(added))
 
     def _add_local_tags(self) -> None:
         """
@@ -323,13 +340,16 @@ class BibEnhancer:
                 self.bib.add_ordered_field(tag)
                 fields.append(tag.tag)
             logger.debug(
-                f"Added following local fields {fields} to {self.library} "
-                f"b{self.resource.sierraId}a."
+                "Added following local fields %s to %s b%sa.",
+                fields,
+                self.library,
+                self.resource.sierraId,
             )
         else:
             logger.debug(
-                f"No local tags to keep were found for {self.library} "
-                f"b{self.resource.sierraId}a."
+                "No local tags to keep were found for %s b%sa.",
+                self.library,
+                self.resource.sierraId,
             )
 
     def _add_initials_tag(self) -> None:
@@ -351,7 +371,10 @@ class BibEnhancer:
             )
         )
         logger.debug(
-            f"Added initials tag {tag} to {self.library} b{self.resource.sierraId}a."
+            "Added initials tag %s to %s b%sa.",
+            tag,
+            self.library,
+            self.resource.sierraId,
         )
 
     def _add_sierraId(self) -> None:
@@ -438,30 +461,29 @@ class BibEnhancer:
 
     def _purge_tags(self) -> None:
         """
-        Removes MARC tags indicated in `constants.RESOURCE_CATEGORIES`
-        from the WorldCat bib.
+        Removes MARC tags indicated in `constants.RESOURCE_CATEGORIES` and 710 tags
+        of e-resource vendors from the WorldCat bib in a single pass over its fields.
         """
         try:
-            for tag in self._res_cat[self.resource.resourceCategoryId].dstTags2Delete:
-                if tag in self.bib:
-                    self.bib.remove_fields(tag)
-            logger.debug(
-                f"Removed {self._res_cat[self.resource.resourceCategoryId].dstTags2Delete} from "
-                f"{self.library} b{self.resource.sierraId}a."
+            tags = frozenset(
+                self._res_cat[self.resource.resourceCategoryId].dstTags2Delete
             )
         except KeyError:
             logger.warning("Encountered unsupported resource category.")
-
-    def _remove_eresource_vendors(self) -> None:
-        """
-        Removes from e-resource bib any tags indicating distributor
-        """
-        vendors = ["overdrive", "cloudlibrary", "3m", "recorded books"]
-
-        for tag in self.bib.get_fields("710"):
-            for vendor in vendors:
-                if vendor in tag.value().lower():
-                    self.bib.remove_field(tag)
+            tags = frozenset()
+
+        self.bib.fields = [
+            field
+            for field in self.bib.fields
+            if field.tag not in tags and not is_eresource_vendor(field)
+        ]
+        if tags:
+            logger.debug(
+                "Removed %s from %s b%sa.",
+                sorted(tags),
+                self.library,
+                self.resource.sierraId,
+            )
 
     def _remove_oclc_prefix(self, controlNo: str) -> str:
         """
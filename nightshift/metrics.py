@@ -0,0 +1,346 @@
+# -*- coding: utf-8 -*-
+
+"""
+This module provides Prometheus-style metrics of NightShift operation.
+
+Counters, histograms and gauges are kept in memory and can be exposed in the
+Prometheus text format either by writing them to a file picked up by the node
+exporter's textfile collector or through an optional local HTTP endpoint.
+"""
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import logging
+import os
+import threading
+import time
+from typing import Iterator, Optional
+
+
+logger = logging.getLogger("nightshift")
+
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", r"\\").replace("\n", r"\n").replace('"', r"\"")
+
+
+def _format_labels(names: tuple, values: tuple, extra: str = "") -> str:
+    pairs = [f'{n}="{_escape(str(v))}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    if pairs:
+        return "{" + ",".join(pairs) + "}"
+    else:
+        return ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(value)
+
+
+class _Metric:
+    """
+    Base class of metrics. Values are kept for each combination of label values.
+    """
+
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = ()) -> None:
+        """
+        Args:
+            name:                       metric name
+            documentation:              metric description
+            labelnames:                 names of labels of the metric
+        """
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values: dict[tuple, object] = dict()
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def _key(self, labels: dict) -> tuple:
+        """
+        Returns label values in the order of metric's label names.
+
+        Raises:
+            ValueError
+        """
+        if set(labels) != set(self.labelnames):
+            raise ValueError(
+                f"Invalid labels of '{self.name}' metric. "
+                f"Expected: {', '.join(self.labelnames) or 'none'}."
+            )
+        return tuple(labels[n] for n in self.labelnames)
+
+    def clear(self) -> None:
+        """
+        Removes all recorded values.
+        """
+        with self._lock:
+            self._values.clear()
+
+    def expose(self) -> list[str]:
+        """
+        Returns metric in the Prometheus text format as a list of lines.
+        """
+        lines = [
+            f"# HELP {self.name} {_escape(self.documentation)}",
+            f"# TYPE {self.name} {self.kind}",
+        ]
+        with self._lock:
+            items = sorted(self._values.items(), key=lambda i: str(i[0]))
+            lines.extend(self._samples(items))
+        return lines
+
+    def _samples(self, items: list) -> list[str]:
+        return [
+            f"{self.name}{_format_labels(self.labelnames, k)} {_format_value(v)}"
+            for k, v in items
+        ]
+
+
+class Counter(_Metric):
+    """
+    Metric which value can only increase.
+    """
+
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        """
+        Increments counter.
+
+        Raises:
+            ValueError
+        """
+        if amount < 0:
+            raise ValueError("Counter can only be incremented by non-negative amount.")
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount  # type: ignore
+
+    def value(self, **labels) -> float:
+        """
+        Returns current value of the counter.
+        """
+        return self._values.get(self._key(labels), 0)  # type: ignore
+
+
+class Gauge(_Metric):
+    """
+    Metric which value can go up and down.
+    """
+
+    kind = "gauge"
+
+    def set(self, value: float, **labels) -> None:
+        """
+        Sets gauge to the given value.
+        """
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def value(self, **labels) -> float:
+        """
+        Returns current value of the gauge.
+        """
+        return self._values.get(self._key(labels), 0)  # type: ignore
+
+
+class Histogram(_Metric):
+    """
+    Metric that counts observations in cumulative buckets.
+    """
+
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: tuple = (),
+        buckets: tuple = DEFAULT_BUCKETS,
+    ) -> None:
+        """
+        Args:
+            name:                       metric name
+            documentation:              metric description
+            labelnames:                 names of labels of the metric
+            buckets:                    upper bounds of buckets
+        """
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+
+    def observe(self, value: float, **labels) -> None:
+        """
+        Records an observation.
+        """
+        key = self._key(labels)
+        with self._lock:
+            try:
+                counts, total = self._values[key]  # type: ignore
+            except KeyError:
+                counts, total = [0] * len(self.buckets), 0.0
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            self._values[key] = (counts, total + value)
+
+    @contextmanager
+    def time(self, **labels) -> Iterator[None]:
+        """
+        Observes duration in seconds of the enclosed block of code.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def count(self, **labels) -> int:
+        """
+        Returns number of observations.
+        """
+        try:
+            counts: list[int] = self._values[self._key(labels)][0]  # type: ignore
+        except KeyError:
+            return 0
+        return counts[-1]
+
+    def _samples(self, items: list) -> list[str]:
+        lines = []
+        for k, (counts, total) in items:
+            for bound, n in zip(self.buckets, counts):
+                le = 'le="' + _format_value(bound) + '"'
+                lines.append(
+                    f"{self.name}_bucket{_format_labels(self.labelnames, k, le)} {n}"
+                )
+            labels = _format_labels(self.labelnames, k)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {counts[-1]}")
+        return lines
+
+
+REGISTRY: list[_Metric] = []
+
+
+WORLDCAT_REQUEST_SECONDS = Histogram(
+    "nightshift_worldcat_request_seconds",
+    "Latency of WorldCat Metadata API requests.",
+    ("library", "endpoint"),
+)
+WORLDCAT_QUERIES = Counter(
+    "nightshift_worldcat_queries_total",
+    "WorldCat brief bib searches of resources by result.",
+    ("library", "category", "result"),
+)
+SIERRA_REQUEST_SECONDS = Histogram(
+    "nightshift_sierra_request_seconds",
+    "Latency of NYPL Platform and BPL Solr Sierra bib lookups.",
+    ("library",),
+)
+SFTP_BYTES = Counter(
+    "nightshift_sftp_bytes_total",
+    "Bytes transferred to and from SFTP.",
+    ("direction",),
+)
+DB_FLUSH_SECONDS = Histogram(
+    "nightshift_db_flush_seconds",
+    "Duration of database session flushes.",
+)
+QUEUE_DEPTH = Gauge(
+    "nightshift_pipeline_queue_depth",
+    "Number of items waiting between stages of the streaming pipeline.",
+    ("queue",),
+)
+
+
+def exposition() -> str:
+    """
+    Returns all registered metrics in the Prometheus text format.
+    """
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.expose())
+    return "\n".join(lines) + "\n"
+
+
+def write_textfile(path: str) -> None:
+    """
+    Writes metrics to a file for the node exporter's textfile collector.
+    The file is replaced atomically, so the collector never reads
+    a partially written file.
+
+    Args:
+        path:                       path of the file; should have '.prom'
+                                    extension
+    """
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(exposition())
+    os.replace(tmp_path, path)
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self) -> None:
+        if self.path.split("?")[0] not in ("/", "/metrics"):
+            self.send_error(404)
+            return
+        body = exposition().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format: str, *args) -> None:
+        # keep scrapes out of the application log
+        pass
+
+
+def start_http_server(port: int, addr: str = "127.0.0.1") -> ThreadingHTTPServer:
+    """
+    Serves metrics on `/metrics` path from a daemon thread.
+
+    Args:
+        port:                       port number; 0 selects a free port
+        addr:                       address to bind to
+
+    Returns:
+        `http.server.ThreadingHTTPServer` instance; call its `shutdown`
+        method to stop serving
+    """
+    server = ThreadingHTTPServer((addr, port), _MetricsHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    logger.info(f"Serving metrics on http://{addr}:{server.server_port}/metrics.")
+    return server
+
+
+def metrics_config() -> tuple[Optional[str], Optional[int]]:
+    """
+    Reads metrics export settings from environmental variables.
+
+    Returns:
+        (textfile path, HTTP port)
+
+    Raises:
+        ValueError
+    """
+    textfile = os.getenv("METRICS_TEXTFILE") or None
+    port = os.getenv("METRICS_PORT") or None
+    if port is None:
+        return (textfile, None)
+    try:
+        port_number = int(port)
+    except ValueError:
+        raise ValueError("Invalid METRICS_PORT value. Must be an integer.")
+    if not 0 < port_number < 65536:
+        raise ValueError("Invalid METRICS_PORT value. Must be between 1 and 65535.")
+    return (textfile, port_number)
@@ -5,6 +5,14 @@ This module contains NightShift exceptions
 """
 
 
+class BudgetExhausted(Exception):
+    """
+    Exception raised when API calls or time allowed for a run are used up
+    """
+
+    pass
+
+
 class DriveError(Exception):
     """
     Exception raised when SFTP/Drive error is encountered
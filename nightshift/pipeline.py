@@ -0,0 +1,372 @@
+# -*- coding: utf-8 -*-
+
+"""
+This module provides streaming mode of processing resources.
+
+In the streaming mode WorldCat brief bib searches, full bib downloads and enhancement
+of records overlap. A resource matched in WorldCat is handed over immediately to the
+full bib download stage and then to the enhancement stage while searches for other
+resources are still running. Stages are connected with bounded queues, so a slow
+stage applies back pressure to the stages before it.
+
+Network stages (searching and downloading) run in worker threads that never touch
+the database. All database operations, MARC manipulation and serialization happen
+in the calling thread.
+"""
+import logging
+import queue
+import threading
+from typing import Any, Iterable, Optional, Sequence, Union
+
+from nightshift import instrumentation, metrics
+from nightshift.comms.worldcat import BriefBibResponse, Worldcat
+from nightshift.datastore import Resource
+from nightshift.datastore_transactions import ResQueryData, resource_query_data
+from nightshift.ns_exceptions import BudgetExhausted
+from nightshift.tasks import Tasks
+
+
+logger = logging.getLogger("nightshift")
+
+
+# marks the end of a stream of items passed between stages
+_DONE = object()
+
+
+class StreamingPipeline:
+    """
+    Searches WorldCat, downloads full bibs and enhances records of a single
+    library in overlapping stages. Enhanced records are serialized to a temporary
+    file for each resource category, and, as in the staged mode, each file is
+    output to SFTP when all stages complete.
+    """
+
+    def __init__(self, tasks: Tasks, queue_size: int = 50) -> None:
+        """
+        Args:
+            tasks:                      `tasks.Tasks` instance of processed library
+            queue_size:                 max number of items waiting between stages
+        """
+        if queue_size < 1:
+            raise ValueError("Invalid 'queue_size' argument. Must be greater than 0.")
+
+        self.tasks = tasks
+        self.queue_size = queue_size
+
+        self._search_q: queue.Queue = queue.Queue(maxsize=queue_size)
+        self._download_q: queue.Queue = queue.Queue(maxsize=queue_size)
+        self._bib_q: queue.Queue = queue.Queue(maxsize=queue_size)
+        self._stop = threading.Event()
+        self._errors: list[Exception] = []
+
+        self._outputs: dict[str, tuple[str, list[ResQueryData], list[ResQueryData]]] = (
+            dict()
+        )
+
+    def run(
+        self,
+        search_resources: Sequence[Union[Resource, ResQueryData]],
+        download_resources: Sequence[Union[Resource, ResQueryData]] = [],
+        enhance_resources: Sequence[Resource] = [],
+    ) -> None:
+        """
+        Processes given resources through the pipeline and outputs enhanced
+        records.
+
+        Args:
+            search_resources:           resources to be searched in WorldCat;
+                                        `Resource` instances or lightweight
+                                        `ResQueryData` tuples
+            download_resources:         resources already matched in WorldCat
+                                        that need a full bib
+            enhance_resources:          resources with already obtained full bib
+
+        Raises:
+            any error raised by a network stage after processing of already
+            obtained results completes
+        """
+        self.stream(search_resources, download_resources, enhance_resources)
+        self.output()
+
+    def stream(
+        self,
+        search_resources: Sequence[Union[Resource, ResQueryData]],
+        download_resources: Iterable[Union[Resource, ResQueryData]] = [],
+        enhance_resources: Iterable[Resource] = [],
+    ) -> None:
+        """
+        Processes given resources through the pipeline. Can be called several
+        times to stream resources in batches of decreasing priority; enhanced
+        records of all batches are collected until `output` is called. Once
+        a network stage fails, following batches are not streamed.
+
+        Args:
+            search_resources:           resources to be searched in WorldCat;
+                                        `Resource` instances or lightweight
+                                        `ResQueryData` tuples
+            download_resources:         resources already matched in WorldCat
+                                        that need a full bib; can be a generator
+                                        that loads them from the database in pages
+            enhance_resources:          resources with already obtained full bib;
+                                        can be a generator that loads them from
+                                        the database in pages
+        """
+        if self._errors:
+            return
+
+        logger.info(
+            f"Streaming {len(search_resources)} {self.tasks.library} resources "
+            "through WorldCat search, full bib download, and enhancement stages."
+        )
+
+        if search_resources:
+            self.tasks.prepare_worldcat_queries()
+
+        self._stop.clear()
+
+        snapshots = [self._snapshot(resource) for resource in search_resources]
+
+        searcher = threading.Thread(
+            target=self._search_worker, args=(snapshots,), daemon=True
+        )
+        downloader = threading.Thread(target=self._download_worker, daemon=True)
+        downloader.start()
+        searcher.start()
+
+        try:
+            for resource in enhance_resources:
+                instrumentation.record("items")
+                self._enhance(resource)
+
+            for matched in download_resources:
+                instrumentation.record("items")
+                self._hand_off(self._snapshot(matched))
+
+            search_done = False
+            bibs_done = False
+            while not bibs_done:
+                self._sample_queue_depths()
+                if not search_done:
+                    bibs_done = self._drain_bibs()
+                    try:
+                        item = self._search_q.get(timeout=0.1)
+                    except queue.Empty:
+                        continue
+                    if item is _DONE:
+                        search_done = True
+                        self._hand_off(_DONE)
+                    else:
+                        self._record_search(*item)
+                else:
+                    bibs_done = self._process_bib(self._bib_q.get())
+        finally:
+            self._stop.set()
+
+        searcher.join()
+        downloader.join()
+        self._sample_queue_depths()
+
+    def _drain_bibs(self) -> bool:
+        """
+        Processes all full bibs waiting in the queue without blocking.
+
+        Returns:
+            True when end of the download stage has been reached
+        """
+        while True:
+            try:
+                item = self._bib_q.get_nowait()
+            except queue.Empty:
+                return False
+            if self._process_bib(item):
+                return True
+
+    def _enhance(self, resource: Resource) -> None:
+        """
+        Enhances and serializes resource to a temporary file of its category.
+
+        Args:
+            resource:                   `datastore.Resource` instance
+        """
+        try:
+            category = self.tasks._res_cat_idx[resource.resourceCategoryId].name
+        except KeyError:
+            logger.warning(
+                "Encountered unsupported resource category. Skipping "
+                f"{self.tasks.library} b{resource.sierraId}a."
+            )
+            return
+
+        if category not in self._outputs:
+            out_fh = self._temp_file(category)
+            self.tasks.reset_temp_file(out_fh)
+            self._outputs[category] = (out_fh, [], [])
+
+        out_fh, enhanced, skipped = self._outputs[category]
+        if self.tasks.enhance_and_serialize_bib(resource, out_fh):
+            enhanced.append(resource_query_data(resource))
+        else:
+            skipped.append(resource_query_data(resource))
+        self.tasks.db_session.commit()
+
+    def _get(self, q: queue.Queue) -> Any:
+        """
+        Blocks until an item is available in the queue or the pipeline is stopped.
+        """
+        while not self._stop.is_set():
+            try:
+                return q.get(timeout=0.1)
+            except queue.Empty:
+                continue
+        return _DONE
+
+    def _hand_off(self, item: Any) -> None:
+        """
+        Passes item to the download stage. While the download queue is full
+        downloaded bibs are processed to make room for it.
+        """
+        while True:
+            try:
+                self._download_q.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                self._drain_bibs()
+
+    def output(self) -> None:
+        """
+        Outputs temporary files of each category to SFTP and finalizes status
+        of enhanced resources.
+
+        Raises:
+            any error raised by a network stage while streaming
+        """
+        for category, (out_fh, enhanced, skipped) in self._outputs.items():
+            logger.info(
+                f"Enhanced and serialized {len(enhanced)} and skipped "
+                f"{len(skipped)} {self.tasks.library} {category} record(s)."
+            )
+            if enhanced:
+                src_file: Optional[str] = out_fh
+            else:
+                src_file = None
+            remote_file = self.tasks.transfer_to_drive(category, src_file)
+            self.tasks.update_status_to_upgraded(remote_file, enhanced)
+
+        if self._errors:
+            raise self._errors[0]
+
+    def _process_bib(self, item: Any) -> bool:
+        """
+        Stores downloaded full bib and passes resource to enhancement.
+
+        Returns:
+            True when end of the download stage has been reached
+        """
+        if item is _DONE:
+            return True
+        snapshot, full_bib = item
+        resource = self.tasks.record_full_bib(snapshot, full_bib)
+        self.tasks.db_session.commit()
+        self._enhance(resource)
+        return False
+
+    def _put(self, q: queue.Queue, item: Any) -> None:
+        """
+        Blocks until there is room in the queue or the pipeline is stopped.
+        """
+        while not self._stop.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    def _record_search(
+        self, snapshot: ResQueryData, response: BriefBibResponse
+    ) -> None:
+        """
+        Persists WorldCat brief bib search results and passes matched resources
+        to the download stage.
+        """
+        self.tasks.record_brief_bib_response(snapshot, response)
+        self.tasks.db_session.commit()
+        if response.is_match:
+            self._hand_off(snapshot._replace(oclcMatchNumber=response.oclc_number))
+
+    def _sample_queue_depths(self) -> None:
+        """
+        Updates gauges of number of items waiting between stages.
+        """
+        metrics.QUEUE_DEPTH.set(self._search_q.qsize(), queue="search")
+        metrics.QUEUE_DEPTH.set(self._download_q.qsize(), queue="download")
+        metrics.QUEUE_DEPTH.set(self._bib_q.qsize(), queue="full_bib")
+
+    def _snapshot(self, resource: Union[Resource, ResQueryData]) -> ResQueryData:
+        """
+        Converts resource to a tuple that can be safely passed to worker threads.
+        """
+        if isinstance(resource, ResQueryData):
+            return resource
+        return resource_query_data(resource)
+
+    def _temp_file(self, category: str) -> str:
+        return f"temp-{self.tasks.library}-{category}.mrc"
+
+    def _search_worker(self, snapshots: list[ResQueryData]) -> None:
+        """
+        Searches WorldCat for brief bibs until the budget of the run is
+        exhausted. Runs in a worker thread.
+        """
+        try:
+            if snapshots:
+                with instrumentation.stage("streaming_search", self.tasks.library):
+                    instrumentation.record("items", len(snapshots))
+                    self.tasks.check_budget()
+                    with Worldcat(self.tasks.library) as worldcat:
+                        results = worldcat.get_brief_bibs(
+                            snapshots,
+                            rotten_apples=self.tasks.rotten_apples,
+                            query_templates=self.tasks.query_templates,
+                        )
+                        for snapshot, response in results:
+                            if self._stop.is_set():
+                                break
+                            self._put(self._search_q, (snapshot, response))
+
+                            # stop before the next resource is searched
+                            self.tasks.check_budget()
+        except BudgetExhausted as exc:
+            logger.warning(
+                f"Stopping {self.tasks.library} searches: {exc}. Remaining "
+                "resources are left for the next run."
+            )
+        except Exception as exc:
+            self._errors.append(exc)
+        finally:
+            self._put(self._search_q, _DONE)
+
+    def _download_worker(self) -> None:
+        """
+        Downloads full bibs from WorldCat. Runs in a worker thread.
+        """
+        worldcat = None
+        try:
+            with instrumentation.stage("streaming_download", self.tasks.library):
+                while True:
+                    snapshot = self._get(self._download_q)
+                    if snapshot is _DONE:
+                        break
+                    instrumentation.record("items")
+                    if worldcat is None:
+                        worldcat = Worldcat(self.tasks.library)
+                    for _, full_bib in worldcat.get_full_bibs([snapshot]):
+                        self._put(self._bib_q, (snapshot, full_bib))
+        except Exception as exc:
+            self._errors.append(exc)
+            # keep consuming, so the main thread is never blocked on a full queue
+            while self._get(self._download_q) is not _DONE:
+                pass
+        finally:
+            if worldcat is not None:
+                worldcat.session.close()
+            self._put(self._bib_q, _DONE)
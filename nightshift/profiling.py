@@ -0,0 +1,192 @@
+# -*- coding: utf-8 -*-
+
+"""
+This module profiles NightShift runs with cProfile.
+
+The whole run is profiled when the bot is launched with the `--profile` option.
+Selected stages of the run (for example 'new_search' or 'enhance', see
+`instrumentation.stage`) are profiled separately when their names are listed in
+the `PROFILE_STAGES` environmental variable ('all' profiles every stage); time
+spent in the same stage for different libraries and resource categories is
+accumulated in a single profile of the stage. Stage profiling is suspended while
+the whole run is profiled.
+
+At the end of the run profiles are saved as `.prof` files that can be read with
+`pstats` or tools like snakeviz, and a summary of the top functions by
+cumulative time is written to the run log.
+
+Only the thread that entered the profiled run or stage is profiled, so work done
+by worker threads in the streaming mode is not included.
+"""
+from collections import namedtuple
+from contextlib import contextmanager
+import cProfile
+from datetime import datetime, timezone
+import io
+import logging
+import os
+import pstats
+import threading
+from typing import Iterator, Optional
+
+
+logger = logging.getLogger("nightshift")
+
+
+ProfileConfig = namedtuple("ProfileConfig", ["stages", "topN", "outDir"])
+
+
+_run_profile: Optional[cProfile.Profile] = None
+_stage_profiles: dict[str, cProfile.Profile] = dict()
+_stages: frozenset[str] = frozenset()
+_active = threading.Lock()
+
+
+def profile_config() -> ProfileConfig:
+    """
+    Reads profiling settings from environmental variables.
+
+    Returns:
+        `ProfileConfig` tuple
+
+    Raises:
+        ValueError
+    """
+    stages = os.getenv("PROFILE_STAGES") or ""
+    top_n = os.getenv("PROFILE_TOP_N") or "25"
+    try:
+        topN = int(top_n)
+    except ValueError:
+        raise ValueError("Invalid PROFILE_TOP_N value. Must be an integer.")
+    if topN < 1:
+        raise ValueError("Invalid PROFILE_TOP_N value. Must be a positive integer.")
+    outDir = os.getenv("PROFILE_DIR") or os.getenv("RUN_REPORT_DIR") or os.getcwd()
+    return ProfileConfig(
+        frozenset(s.strip() for s in stages.split(",") if s.strip()), topN, outDir
+    )
+
+
+def is_profiled(name: str) -> bool:
+    """
+    Determines if given stage of the run is profiled separately.
+
+    Args:
+        name:                       name of the stage
+    """
+    return name in _stages or "all" in _stages
+
+
+def start_profiling(run: bool = False, stages: frozenset[str] = frozenset()) -> None:
+    """
+    Discards earlier profiles and begins profiling of the current run.
+
+    Args:
+        run:                        profiles the whole run when True
+        stages:                     names of stages to profile separately
+    """
+    global _run_profile, _stage_profiles, _stages
+    stop_run_profile()
+    _run_profile = None
+    _stage_profiles = dict()
+    _stages = stages
+    if run:
+        _run_profile = cProfile.Profile()
+        _run_profile.enable()
+
+
+def stop_run_profile() -> None:
+    """
+    Stops profiling of the whole run.
+    """
+    if _run_profile is not None:
+        _run_profile.disable()
+
+
+@contextmanager
+def stage(name: str) -> Iterator[None]:
+    """
+    Profiles the block if the stage is selected for profiling and no other
+    profile is collected at the moment.
+
+    Args:
+        name:                       name of the stage
+    """
+    if not is_profiled(name) or _run_profile is not None:
+        yield
+        return
+
+    # cProfile can not collect two profiles at the same time
+    if not _active.acquire(blocking=False):
+        yield
+        return
+    try:
+        profile = _stage_profiles.setdefault(name, cProfile.Profile())
+        try:
+            profile.enable()
+        except ValueError:
+            # another profiler is already active in the interpreter
+            yield
+            return
+        try:
+            yield
+        finally:
+            profile.disable()
+    finally:
+        _active.release()
+
+
+def summary(profile: cProfile.Profile, topN: int = 25) -> str:
+    """
+    Returns a table of the top functions by cumulative time.
+
+    Args:
+        profile:                    `cProfile.Profile` instance
+        topN:                       number of functions
+
+    Returns:
+        summary as text
+    """
+    out = io.StringIO()
+    stats = pstats.Stats(profile, stream=out)
+    stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(topN)
+    return out.getvalue()
+
+
+def save_profiles(
+    out_dir: str, runId: Optional[int] = None, topN: int = 25
+) -> list[str]:
+    """
+    Stops profiling, saves collected profiles in the given directory and
+    logs their summaries.
+
+    Args:
+        out_dir:                    directory of the profile files
+        runId:                      `datastore.RunLedger.runId` of the run
+        topN:                       number of functions in logged summaries
+
+    Returns:
+        list of paths of saved profile files
+    """
+    global _run_profile
+    stop_run_profile()
+    profiles = dict()
+    if _run_profile is not None:
+        profiles["run"] = _run_profile
+    for name, profile in _stage_profiles.items():
+        profiles[f"stage-{name}"] = profile
+    _run_profile = None
+    _stage_profiles.clear()
+
+    stamp = datetime.now(timezone.utc).strftime("%Y%m%d%H%M%S")
+    prefix = "profile" if runId is None else f"profile-{runId}"
+    saved = []
+    for name, profile in profiles.items():
+        profile.create_stats()
+        if not profile.stats:
+            continue
+        text = summary(profile, topN)
+        fh = os.path.join(out_dir, f"{prefix}-{name}-{stamp}.prof")
+        profile.dump_stats(fh)
+        saved.append(fh)
+        logger.info(f"Top {topN} functions of {name} profile ({fh}):\n{text}")
+    return saved
@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+
+"""
+This module keeps reference data of the datastore (libraries, resource categories
+and rotten apples) in memory.
+
+Reference tables are populated by `datastore_transactions.init_db` and rarely
+change, so they are queried once per process on first use and shared by all
+stages of a run and by worker threads of the streaming mode. Cached data is
+immutable: tag lists are frozensets, query windows are tuples, and dictionaries
+are read-only views. The cache must be invalidated with `invalidate` whenever
+reference tables change.
+"""
+from collections import namedtuple
+import threading
+from types import MappingProxyType
+from typing import Optional
+
+from sqlalchemy.orm.session import Session
+
+from nightshift.datastore_transactions import (
+    library_by_id,
+    ResCatById,
+    resource_category_by_name,
+    retrieve_rotten_apples,
+)
+
+
+ReferenceData = namedtuple(
+    "ReferenceData",
+    ["libraries", "resourceCategories", "resourceCategoriesById", "rottenApples"],
+)
+
+
+_cache: Optional[ReferenceData] = None
+_lock = threading.Lock()
+
+
+def load(session: Session) -> ReferenceData:
+    """
+    Queries reference tables and precomputes data used by the bot.
+
+    Args:
+        session:                `sqlalchemy.Session` instance
+
+    Returns:
+        `ReferenceData` tuple of read-only dictionaries: library codes by
+        `datastore.Library.nid`, `ResCatByName` tuples by category name,
+        `ResCatById` tuples by `datastore.ResourceCategory.nid`, and tuples
+        of rotten apples' OCLC codes by `datastore.ResourceCategory.nid`
+    """
+    res_cat = dict()
+    for name, data in resource_category_by_name(session).items():
+        res_cat[name] = data._replace(
+            srcTags2Keep=frozenset(data.srcTags2Keep),
+            dstTags2Delete=frozenset(data.dstTags2Delete),
+            queryDays=tuple(data.queryDays),
+        )
+    res_cat_idx = {
+        data.nid: ResCatById(name, *data[1:]) for name, data in res_cat.items()
+    }
+    rotten_apples = {
+        nid: tuple(codes) for nid, codes in retrieve_rotten_apples(session).items()
+    }
+    return ReferenceData(
+        MappingProxyType(library_by_id(session)),
+        MappingProxyType(res_cat),
+        MappingProxyType(res_cat_idx),
+        MappingProxyType(rotten_apples),
+    )
+
+
+def reference_data(session: Session) -> ReferenceData:
+    """
+    Returns cached reference data loading it first if needed.
+
+    Args:
+        session:                `sqlalchemy.Session` instance
+
+    Returns:
+        `ReferenceData` tuple
+    """
+    global _cache
+    with _lock:
+        if _cache is None:
+            _cache = load(session)
+        return _cache
+
+
+def cached() -> Optional[ReferenceData]:
+    """
+    Returns cached reference data or None if not loaded yet.
+    """
+    return _cache
+
+
+def invalidate() -> None:
+    """
+    Discards cached reference data. Data is loaded again on the next use.
+    """
+    global _cache
+    with _lock:
+        _cache = None
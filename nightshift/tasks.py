@@ -6,24 +6,31 @@ This module provides the manager methods to perform particular tasks
 from datetime import datetime, timezone
 import logging
 import os
-from typing import Optional
+import time
+from typing import Iterable, Mapping, Optional, Sequence, Union
 
+from sqlalchemy import event
 from sqlalchemy.orm.session import Session
 
-from nightshift.comms.worldcat import Worldcat
+from nightshift import instrumentation, metrics, reference_data
+from nightshift.budget import RunBudget
+from nightshift.comms.worldcat import BriefBibResponse, QueryTemplate, Worldcat
 from nightshift.comms.sierra_search_platform import NypPlatform, BplSolr
 from nightshift.comms.storage import get_credentials, Drive
 from nightshift.datastore import Resource, WorldcatQuery
 from nightshift.datastore_transactions import (
+    EventSink,
     ResCatById,
     ResCatByName,
-    add_event,
+    ResQueryData,
     add_output_file,
     add_resource,
     add_source_file,
+    finalize_upgraded_resources,
+    resource_query_data,
     retrieve_processed_files,
-    retrieve_rotten_apples,
     update_resource,
+    update_resource_by_nid,
 )
 from nightshift.marc.marc_parser import BibReader
 from nightshift.marc.marc_writer import BibEnhancer
@@ -32,6 +39,16 @@ from nightshift.ns_exceptions import DriveError
 logger = logging.getLogger("nightshift")
 
 
+def _flush_started(session: Session, *args) -> None:
+    session.info["flush_started"] = time.perf_counter()
+
+
+def _flush_completed(session: Session, *args) -> None:
+    started = session.info.pop("flush_started", None)
+    if started is not None:
+        metrics.DB_FLUSH_SECONDS.observe(time.perf_counter() - started)
+
+
 class Tasks:
     """
     Handles various operations related to ingesting new files, searching Worldcat,
@@ -43,7 +60,8 @@ class Tasks:
         db_session: Session,
         library: str,
         libraryId: int,
-        resource_categories: dict[str, ResCatByName],
+        resource_categories: Mapping[str, ResCatByName],
+        budget: Optional[RunBudget] = None,
     ) -> None:
         """
         Args:
@@ -52,13 +70,36 @@ class Tasks:
             libraryId:                          `datastore.Library.nid`
             resource_categories:                dictionary by category name with
                                                 associated data
+            budget:                             `budget.RunBudget` instance
+                                                limiting Sierra checks and
+                                                WorldCat searches
         """
         self.db_session = db_session
         self.library = library
         self.libraryId = libraryId
+        self.budget = budget
         self._res_cat = resource_categories
-        self._res_cat_idx = self._create_resource_category_idx()
-        self.rotten_apples: dict[int, list[str]] = dict()
+        self._res_cat_idx: Mapping[int, ResCatById]
+        data = reference_data.cached()
+        if data is not None and resource_categories is data.resourceCategories:
+            # reuse the index precomputed by the reference data cache
+            self._res_cat_idx = data.resourceCategoriesById
+        else:
+            self._res_cat_idx = self._create_resource_category_idx()
+        self.rotten_apples: Mapping[int, Sequence[str]] = dict()
+        self.query_templates: Optional[Mapping[int, tuple[QueryTemplate, ...]]] = None
+        # all Tasks of a session share its sink, so listeners are registered once
+        if db_session is not None:
+            self.events = EventSink.of_session(db_session)
+        else:
+            self.events = EventSink(db_session)
+
+        # time database flushes of the session
+        if db_session is not None and not event.contains(
+            db_session, "before_flush", _flush_started
+        ):
+            event.listen(db_session, "before_flush", _flush_started)
+            event.listen(db_session, "after_flush", _flush_completed)
 
     def _create_resource_category_idx(self) -> dict[int, ResCatById]:
         """
@@ -79,14 +120,25 @@ class Tasks:
             )
         return res_cat_idx
 
-    def _create_rotten_apples_idx(self) -> dict[int, list[str]]:
+    def _create_rotten_apples_idx(self) -> Mapping[int, Sequence[str]]:
         """
         Creates a dictionary of forbidden organization codes which records
         should be excluded from retrieved from Worldcat results
         """
-        rotten_apples = retrieve_rotten_apples(self.db_session)
+        data = reference_data.reference_data(self.db_session)
+        rotten_apples: Mapping[int, Sequence[str]] = data.rottenApples
         return rotten_apples
 
+    def check_budget(self) -> None:
+        """
+        Stops the task if the run or library budget is exhausted.
+
+        Raises:
+            BudgetExhausted
+        """
+        if self.budget is not None:
+            self.budget.check(self.library)
+
     def check_resources_sierra_state(self, resources: list[Resource]) -> None:
         """
         Checks and updates status & suppression of records using
@@ -96,7 +148,12 @@ class Tasks:
         Args:
             resources:                      list of `nightshift.datastore.Resource`
                                             instances to be checked
+
+        Raises:
+            BudgetExhausted
         """
+        self.check_budget()
+
         if self.library == "NYP":
             sierra_platform = NypPlatform()
         elif self.library == "BPL":
@@ -112,114 +169,164 @@ class Tasks:
             f"Checking {self.library} Sierra status for {len(resources)} resources."
         )
 
-        for resource in resources:
-            response = sierra_platform.get_sierra_bib(resource.sierraId)
-            resource.suppressed = response.is_suppressed()
-            resource.status = response.get_status()
-
-            if resource.status in ("staff_enhanced", "staff_deleted"):
-                add_event(self.db_session, resource, status=resource.status)
+        try:
+            for resource in resources:
+                self.check_budget()
+                response = sierra_platform.get_sierra_bib(resource.sierraId)
+                resource.suppressed = response.is_suppressed()
+                resource.status = response.get_status()
 
-            # persist changes
-            self.db_session.commit()
+                if resource.status in ("staff_enhanced", "staff_deleted"):
+                    self.events.add(resource, status=resource.status)
 
-        sierra_platform.close()
+                # persist changes
+                self.db_session.commit()
+        finally:
+            sierra_platform.close()
 
     def enhance_and_output_bibs(
-        self, resource_category: str, resources: list[Resource]
-    ) -> None:
+        self, resource_category: str, resources: Iterable[Resource]
+    ) -> int:
         """
         Manipulates downloaded WorldCat records, serializes them into MARC21 format
-        and saves produced file to SFTP
+        and saves produced file to SFTP. Nothing is saved to SFTP if none of
+        the records was enhanced.
 
         Args:
             resource_category:              name of resource category being
                                             processed
-            resources:                      list of `nightshift.datastore.Resource`
-                                            instances to be processed
+            resources:                      `nightshift.datastore.Resource`
+                                            instances to be processed; can be
+                                            a generator that loads them from
+                                            the database in pages
+
+        Returns:
+            number of enhanced resources
         """
         # manipulate records and save to a temporary file
         temp_file, enhanced_resources = self.manipulate_and_serialize_bibs(
             resource_category, resources
         )
+        if temp_file is None:
+            return 0
 
         # move temporary file to SFTP
         remote_file = self.transfer_to_drive(resource_category, temp_file)
 
         # finalize datastore resource status
         self.update_status_to_upgraded(remote_file, enhanced_resources)
+        return len(enhanced_resources)
+
+    def enhance_and_serialize_bib(self, resource: Resource, out_fh: str) -> bool:
+        """
+        Merges Sierra brief bib data of a single resource with its WorldCat full bib
+        and appends the result as MARC21 to the given file. Resources that fail
+        the enhancement are reset to allow a later date query.
+
+        Args:
+            resource:                       `nightshift.datastore.Resource`
+                                            instance with full bib obtained
+            out_fh:                         path of the file where records are saved
 
-    def get_worldcat_brief_bib_matches(self, resources: list[Resource]) -> None:
+        Returns:
+            bool
+        """
+        be = BibEnhancer(resource, self.library, self._res_cat_idx)
+        be.manipulate()
+        if be.bib is not None:
+            be.save2file(out_fh)
+            logger.debug(
+                f"{self.library} b{resource.sierraId}a has been output "
+                f"to '{out_fh}'."
+            )
+            return True
+        else:
+            # update to blank state to allow later date query
+            update_resource(
+                self.db_session,
+                resource.sierraId,
+                resource.libraryId,
+                oclcMatchNumber=None,
+                fullBib=None,
+            )
+            logger.warning(
+                f"{self.library} b{resource.sierraId}a enhancement incomplete. "
+                "Skipping."
+            )
+            return False
+
+    def get_worldcat_brief_bib_matches(
+        self, resources: list[Union[Resource, ResQueryData]]
+    ) -> None:
         """
         Queries Worldcat for given resources and persists responses
         in the database.
 
         Args:
             resources:                      list of `nightshift.datastore.Resource`
-                                            instances
+                                            instances or lightweight
+                                            `ResQueryData` tuples
+
+        Raises:
+            BudgetExhausted
         """
+        self.check_budget()
         logger.info(
             f"Searching Worldcat for brief records for {len(resources)} resources."
         )
 
-        if not self.rotten_apples:
-            self.rotten_apples = self._create_rotten_apples_idx()
+        self.prepare_worldcat_queries()
 
         with Worldcat(self.library) as worldcat:
             results = worldcat.get_brief_bibs(
-                resources, rotten_apples=self.rotten_apples
+                resources,
+                rotten_apples=self.rotten_apples,
+                query_templates=self.query_templates,
             )
             for resource, response in results:
-                if response.is_match:
-                    instance = update_resource(
-                        self.db_session,
-                        resource.sierraId,
-                        resource.libraryId,
-                        oclcMatchNumber=response.oclc_number,
-                    )
-                    instance.queries.append(
-                        WorldcatQuery(
-                            resourceId=resource.nid,
-                            match=True,
-                            response=response.as_json,
-                        )
-                    )
-
-                    # add event for stats
-                    add_event(self.db_session, resource, status="worldcat_hit")
-                else:
-                    resource.queries.append(
-                        WorldcatQuery(match=False, response=response.as_json)
-                    )
-                    add_event(self.db_session, resource, status="worldcat_miss")
+                self.record_brief_bib_response(resource, response)
                 self.db_session.commit()
 
-    def get_worldcat_full_bibs(self, resources: list[Resource]) -> None:
+                # stop before the next resource is searched
+                self.check_budget()
+
+    def get_worldcat_full_bibs(
+        self, resources: Iterable[Union[Resource, ResQueryData]]
+    ) -> int:
         """
         Requests full bibliographic records from MetadataAPI service and
-        stores the responses in the db.
+        stores the responses in the db. WorldCat session is opened only when
+        the first resource is retrieved.
 
         Args:
-            resources:                      list of `nightshift.datastore.Resource`
-                                            instances
-        """
-        logger.info(
-            f"Downloading full records from WorldCat for {len(resources)} resources."
-        )
-        with Worldcat(self.library) as worldcat:
-            results = worldcat.get_full_bibs(resources)
-            for resource, response in results:
-                update_resource(
-                    self.db_session,
-                    resource.sierraId,
-                    resource.libraryId,
-                    fullBib=response,
-                )
+            resources:                      `nightshift.datastore.Resource`
+                                            instances or `ResQueryData` tuples;
+                                            can be a generator that loads them
+                                            from the database in pages
 
-                # commit each full bib response in case something
-                # breaks during this lengthy process;
-                # this should save time if process need to be restarted
-                self.db_session.commit()
+        Returns:
+            number of downloaded full records
+        """
+        logger.info(f"Downloading full records from WorldCat for {self.library}.")
+        downloaded = 0
+        worldcat = None
+        try:
+            for resource in resources:
+                if worldcat is None:
+                    worldcat = Worldcat(self.library)
+                for _, response in worldcat.get_full_bibs([resource]):
+                    self.record_full_bib(resource, response)
+
+                    # commit each full bib response in case something
+                    # breaks during this lengthy process;
+                    # this should save time if process need to be restarted
+                    self.db_session.commit()
+                    downloaded += 1
+                    instrumentation.record("items")
+        finally:
+            if worldcat is not None:
+                worldcat.session.close()
+        return downloaded
 
     def ingest_new_files(self) -> None:
         """
@@ -255,6 +362,7 @@ class Tasks:
                     add_resource(self.db_session, resource)
 
                 self.db_session.commit()
+                instrumentation.record("items", n)
                 logger.info(f"Ingested {n} records from the file '{handle}'.")
 
     def isolate_unprocessed_files(self, drive: Drive) -> list[str]:
@@ -285,65 +393,41 @@ class Tasks:
     def manipulate_and_serialize_bibs(
         self,
         resource_category: str,
-        resources: list[Resource],
+        resources: Iterable[Resource],
         out_fh: str = "temp.mrc",
-    ) -> tuple[Optional[str], list[Resource]]:
+    ) -> tuple[Optional[str], list[ResQueryData]]:
         """
         Merges Sierra brief bibs data with WorldCat full bib,
-        and serializes them into MARC21 format
+        and serializes them into MARC21 format. Only lightweight copies of
+        enhanced resources are kept, so their full bibs can be released from
+        memory once they are serialized.
 
         Args:
             resource_category:              name of resource category ('ebook', etc.)
-            resources:                      list of `nightshift.datastore.Resource`
-                                            instances
+            resources:                      `nightshift.datastore.Resource`
+                                            instances; can be a generator that
+                                            loads them from the database in pages
             out_fh:                         path of the file where records are saved
 
         Returns:
-            tuple (output file, list of enhanced resources)
+            tuple (output file, list of `ResQueryData` tuples of enhanced resources)
         """
         enhanced_resources = []
-        skipped_resources = []
+        skipped = 0
 
         # make sure to start from scratch
-        try:
-            os.remove(out_fh)
-        except FileNotFoundError:
-            pass
-        except OSError as exc:
-            logger.error(
-                f"Unable to empty temp file '{out_fh}' before appending MARC "
-                f"records. Error {exc}"
-            )
-            raise
+        self.reset_temp_file(out_fh)
 
         for resource in resources:
-            be = BibEnhancer(resource, self.library, self._res_cat_idx)
-            be.manipulate()
-            if be.bib is not None:
-                be.save2file(out_fh)
-                logger.debug(
-                    f"{self.library} b{resource.sierraId}a has been output "
-                    f"to '{out_fh}'."
-                )
-                enhanced_resources.append(resource)
+            instrumentation.record("items")
+            if self.enhance_and_serialize_bib(resource, out_fh):
+                enhanced_resources.append(resource_query_data(resource))
             else:
-                # update to blank state to allow later date query
-                update_resource(
-                    self.db_session,
-                    resource.sierraId,
-                    resource.libraryId,
-                    oclcMatchNumber=None,
-                    fullBib=None,
-                )
-                logger.warning(
-                    f"{self.library} b{resource.sierraId}a enhancement incomplete. "
-                    "Skipping."
-                )
-                skipped_resources.append(resource)
+                skipped += 1
 
         logger.info(
             f"Enhanced and serialized {len(enhanced_resources)} and skipped "
-            f"{len(skipped_resources)} {self.library} {resource_category} record(s)."
+            f"{skipped} {self.library} {resource_category} record(s)."
         )
         self.db_session.commit()
 
@@ -352,6 +436,108 @@ class Tasks:
         else:
             return (None, enhanced_resources)
 
+    def prepare_worldcat_queries(self) -> None:
+        """
+        Creates the rotten apples index and compiles WorldCat query templates
+        of resource categories. Both are created once and reused by all
+        searches of the instance.
+        """
+        if not self.rotten_apples:
+            self.rotten_apples = self._create_rotten_apples_idx()
+        if self.query_templates is None:
+            with Worldcat(self.library, connect=False) as worldcat:
+                self.query_templates = worldcat.build_query_templates(
+                    self.rotten_apples
+                )
+
+    def record_brief_bib_response(
+        self, resource: Union[Resource, ResQueryData], response: BriefBibResponse
+    ) -> None:
+        """
+        Records results of WorldCat brief bib search for a resource: the query,
+        a matching OCLC number if found, and appropriate event. Matches rejected
+        by the pre-screen of brief records are recorded as misses, so the
+        resource is searched again at a later date.
+        The resource is updated by its nid without being loaded from the database.
+        Changes are not committed.
+
+        Args:
+            resource:                       `nightshift.datastore.Resource` instance
+                                            or `ResQueryData` tuple
+            response:                       `BriefBibResponse` instance
+        """
+        self.db_session.add(
+            WorldcatQuery(
+                resourceId=resource.nid,
+                match=response.is_match,
+                response=response.as_json,
+            )
+        )
+        try:
+            category = self._res_cat_idx[resource.resourceCategoryId].name
+        except KeyError:
+            category = "unknown"
+        if response.is_match:
+            update_resource_by_nid(
+                self.db_session, resource.nid, oclcMatchNumber=response.oclc_number
+            )
+
+            # add event for stats
+            self.events.add(resource, status="worldcat_hit")
+            metrics.WORLDCAT_QUERIES.inc(
+                library=self.library, category=category, result="hit"
+            )
+        else:
+            self.events.add(resource, status="worldcat_miss")
+            metrics.WORLDCAT_QUERIES.inc(
+                library=self.library,
+                category=category,
+                result="miss" if response.rejection is None else "rejected",
+            )
+
+    def record_full_bib(
+        self, resource: Union[Resource, ResQueryData], full_bib: bytes
+    ) -> Resource:
+        """
+        Stores WorldCat full bib obtained for a resource.
+        Changes are not committed.
+
+        Args:
+            resource:                       `nightshift.datastore.Resource` instance
+                                            or `ResQueryData` tuple
+            full_bib:                       MARC XML returned by MetadataAPI
+
+        Returns:
+            updated `nightshift.datastore.Resource` instance
+        """
+        return update_resource(
+            self.db_session,
+            resource.sierraId,
+            resource.libraryId,
+            fullBib=full_bib,
+        )
+
+    def reset_temp_file(self, out_fh: str) -> None:
+        """
+        Deletes a local temporary file before any MARC records are appended to it.
+
+        Args:
+            out_fh:                         path of the temporary file
+
+        Raises:
+            OSError
+        """
+        try:
+            os.remove(out_fh)
+        except FileNotFoundError:
+            pass
+        except OSError as exc:
+            logger.error(
+                f"Unable to empty temp file '{out_fh}' before appending MARC "
+                f"records. Error {exc}"
+            )
+            raise
+
     def transfer_to_drive(
         self, resource_category: str, src_file: Optional[str]
     ) -> Optional[str]:
@@ -390,16 +576,17 @@ class Tasks:
     def update_status_to_upgraded(
         self,
         out_file_handle: Optional[str],
-        resources: list[Resource],
+        resources: Sequence[Union[Resource, ResQueryData]],
     ) -> None:
         """
         Upgrades given resources status to "bot_enhanced" and records output file id.
-        Adds appropriate event record to the database.
+        Adds appropriate event record to the database. All resources are updated
+        with a single statement.
 
         Args:
             out_file_handle:                handle of the output file
             resources:                      list of `nightshift.datastore.Resource`
-                                            instances
+                                            instances or `ResQueryData` tuples
         """
         if out_file_handle is not None:
 
@@ -411,17 +598,9 @@ class Tasks:
                 self.db_session, self.libraryId, out_file_handle
             )
 
-            for resource in resources:
-                update_resource(
-                    self.db_session,
-                    resource.sierraId,
-                    resource.libraryId,
-                    status="bot_enhanced",
-                    outputId=out_file_record.nid,
-                    enhanceTimestamp=datetime.now(timezone.utc),
-                )
-
-                add_event(self.db_session, resource, status="bot_enhanced")
+            finalize_upgraded_resources(
+                self.db_session, [r.nid for r in resources], out_file_record.nid
+            )
 
             self.db_session.commit()
         else:
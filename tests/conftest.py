@@ -5,13 +5,14 @@ import os
 import paramiko
 import pytest
 import requests
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, text
 from sqlalchemy.orm import sessionmaker
 from bookops_worldcat import WorldcatAccessToken, MetadataSession
 from bookops_worldcat.errors import WorldcatRequestError
 import yaml
 
 
+from nightshift import reference_data
 from nightshift.comms.storage import get_credentials, Drive
 from nightshift.comms.worldcat import Worldcat
 from nightshift.constants import LIBRARIES, RESOURCE_CATEGORIES, ROTTEN_APPLES
@@ -28,6 +29,8 @@ from nightshift.datastore import (
 )
 from nightshift.datastore_transactions import ResCatById, ResCatByName, parse_query_days
 
+from .fake_services import FakeServices, FakeSftp
+
 
 class FakeUtcNow(datetime.datetime):
     @classmethod
@@ -190,12 +193,14 @@ def test_session(test_connection):
     Base.metadata.create_all(engine)
     Session = sessionmaker(bind=engine)
     session = Session()
+    reference_data.invalidate()
 
     yield session
     session.close()
 
     # teardown
     Base.metadata.drop_all(engine)
+    reference_data.invalidate()
 
 
 @pytest.fixture
@@ -235,6 +240,36 @@ def test_data_rich(stub_resource, test_session, test_data_core):
     test_session.commit()
 
 
+@pytest.fixture
+def unpartitioned_event_table(test_session, test_data_core):
+    # Event table as created by versions before partitioning was introduced
+    test_session.execute(text("DROP TABLE event"))
+    test_session.execute(
+        text(
+            "CREATE TABLE event ("
+            "nid SERIAL PRIMARY KEY, "
+            '"timestamp" TIMESTAMP WITHOUT TIME ZONE, '
+            '"libraryId" INTEGER NOT NULL REFERENCES library (nid), '
+            '"sierraId" INTEGER NOT NULL, '
+            '"bibDate" DATE NOT NULL, '
+            '"resourceCategoryId" INTEGER NOT NULL '
+            "REFERENCES resource_category (nid), "
+            "status status)"
+        )
+    )
+    now = datetime.datetime.now(datetime.timezone.utc)
+    for timestamp in (now, now - datetime.timedelta(days=400)):
+        test_session.execute(
+            text(
+                'INSERT INTO event ("timestamp", "libraryId", "sierraId", '
+                '"bibDate", "resourceCategoryId", status) '
+                "VALUES (:timestamp, 1, 11111111, :bibDate, 1, 'expired')"
+            ),
+            {"timestamp": timestamp, "bibDate": timestamp.date()},
+        )
+    test_session.commit()
+
+
 # SFTP / newtowrked drive #############
 
 
@@ -265,6 +300,34 @@ def mock_drive(mock_sftp_env):
         yield drive
 
 
+@pytest.fixture
+def fake_sftp(monkeypatch, tmp_path):
+    """
+    Local SFTP server serving `tmp_path` directory with NightShift
+    directories created
+    """
+    (tmp_path / "sierra_dumps_dir").mkdir()
+    (tmp_path / "load_dir").mkdir()
+    with FakeSftp(str(tmp_path)) as server:
+        monkeypatch.setenv("SFTP_HOST", server.host)
+        monkeypatch.setenv("SFTP_PORT", str(server.port))
+        monkeypatch.setenv("SFTP_USER", server.user)
+        monkeypatch.setenv("SFTP_PASSW", server.password)
+        monkeypatch.setenv("SFTP_NS_SRC", "sierra_dumps_dir")
+        monkeypatch.setenv("SFTP_NS_DST", "load_dir")
+        yield server
+
+
+@pytest.fixture
+def fake_services(tmp_path):
+    """
+    All fake services with default settings; requests to WorldCat and NYPL
+    Platform are routed to them
+    """
+    with FakeServices(sftpRoot=str(tmp_path)) as services:
+        yield services
+
+
 # Worldcat fixtures ########
 
 
@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+
+"""
+Local stand-ins for services NightShift talks to: OCLC authorization server
+and WorldCat Metadata API, NYPL Platform, BPL Solr, and SFTP drive. Each has
+configurable latency, error rate and rate limit (`ServiceConfig`), so
+NightShift can be load tested and benchmarked without outbound calls.
+
+Example:
+
+    with FakeServices(sftpRoot="/tmp/drive", worldcat=ServiceConfig(latency=0.2)):
+        with Tasks(db_session, "NYP", ...) as tasks:
+            ...
+
+Inside the `FakeServices` block requests made with the `requests` library
+to production hosts are sent to the local fakes, and environmental variables
+with credentials of all services point to them.
+"""
+import os
+from typing import Optional
+
+from .base import ServiceConfig, route_requests
+from .sftp import FakeSftp
+from .sierra import FakePlatform, FakeSolr
+from .synthetic import SyntheticCatalog
+from .worldcat import FakeWorldcat, full_bib
+
+
+class FakeServices:
+    """
+    Starts all fake services, routes traffic to them and sets environmental
+    variables used by NightShift to connect to them. Use as a context manager.
+    """
+
+    def __init__(
+        self,
+        sftpRoot: Optional[str] = None,
+        worldcat: ServiceConfig = ServiceConfig(),
+        platform: ServiceConfig = ServiceConfig(),
+        solr: ServiceConfig = ServiceConfig(),
+        sftp: ServiceConfig = ServiceConfig(),
+        catalog: Optional[SyntheticCatalog] = None,
+    ) -> None:
+        """
+        Args:
+            sftpRoot:                   local directory served by the fake SFTP;
+                                        SFTP is not started if not given
+            worldcat:                   WorldCat Metadata API `ServiceConfig`
+            platform:                   NYPL Platform `ServiceConfig`
+            solr:                       BPL Solr `ServiceConfig`
+            sftp:                       SFTP `ServiceConfig`
+            catalog:                    `SyntheticCatalog` answering WorldCat
+                                        searches and full bib requests
+        """
+        self.worldcat = FakeWorldcat(worldcat, catalog=catalog)
+        self.platform = FakePlatform(platform)
+        self.solr = FakeSolr(solr)
+        self.sftp = FakeSftp(sftpRoot, sftp) if sftpRoot else None
+        self._routing = route_requests({})
+        self._saved_env: dict[str, Optional[str]] = dict()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *args):
+        self.stop()
+
+    @property
+    def env(self) -> dict[str, str]:
+        """
+        Environmental variables pointing NightShift to the running fakes.
+        """
+        env = {
+            "WCNYP_KEY": "fake_key",
+            "WCNYP_SECRET": "fake_secret",
+            "WCBPL_KEY": "fake_key",
+            "WCBPL_SECRET": "fake_secret",
+            "NYPL_PLATFORM_CLIENT": "fake_client",
+            "NYPL_PLATFORM_SECRET": "fake_secret",
+            "NYPL_PLATFORM_OAUTH": self.platform.url,
+            "NYPL_PLATFORM_ENV": "prod",
+            "BPL_SOLR_CLIENT_KEY": "fake_key",
+            "BPL_SOLR_ENDPOINT": f"{self.solr.url}/solr/bibs/select",
+        }
+        if self.sftp is not None:
+            env.update(
+                {
+                    "SFTP_HOST": self.sftp.host,
+                    "SFTP_PORT": str(self.sftp.port),
+                    "SFTP_USER": self.sftp.user,
+                    "SFTP_PASSW": self.sftp.password,
+                    "SFTP_NS_SRC": "sierra_dumps_dir",
+                    "SFTP_NS_DST": "load_dir",
+                }
+            )
+        return env
+
+    @property
+    def routes(self) -> dict[str, str]:
+        """
+        Production URL prefixes mapped to base URLs of the running fakes.
+        """
+        routes = {}
+        for service in (self.worldcat, self.platform):
+            for host in service.hosts:
+                routes[host] = service.url
+        return routes
+
+    def start(self) -> None:
+        """
+        Starts fake services, routes requests to them and sets environmental
+        variables.
+        """
+        for service in (self.worldcat, self.platform, self.solr):
+            service.start()
+        if self.sftp is not None:
+            for directory in ("sierra_dumps_dir", "load_dir"):
+                os.makedirs(os.path.join(self.sftp.root, directory), exist_ok=True)
+            self.sftp.start()
+        self._routing = route_requests(self.routes)
+        self._routing.__enter__()
+        for key, value in self.env.items():
+            self._saved_env[key] = os.environ.get(key)
+            os.environ[key] = value
+
+    def stop(self) -> None:
+        """
+        Restores environmental variables and routing, and stops fake services.
+        """
+        for key, value in self._saved_env.items():
+            if value is None:
+                os.environ.pop(key, None)
+            else:
+                os.environ[key] = value
+        self._saved_env = dict()
+        self._routing.__exit__(None, None, None)
+        for service in (self.worldcat, self.platform, self.solr):
+            service.stop()
+        if self.sftp is not None:
+            self.sftp.stop()
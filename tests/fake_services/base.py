@@ -0,0 +1,283 @@
+# -*- coding: utf-8 -*-
+
+"""
+Building blocks shared by fake services: behavior settings, throttling of
+requests, a threaded local HTTP server, and routing of `requests` traffic
+from production hosts to local servers.
+"""
+from collections import namedtuple
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import random
+import threading
+import time
+from typing import Iterator, Optional, Union
+from urllib.parse import parse_qs, urlsplit
+import zlib
+
+from requests.adapters import HTTPAdapter
+
+
+# Behavior of a fake service:
+#   latency     seconds added to each request
+#   jitter      max random seconds added on top of latency
+#   errorRate   fraction (0-1) of requests that fail
+#   errorStatus HTTP status code of failed requests
+#   rateLimit   max number of requests per second; requests over the limit
+#               are rejected with HTTP 429 (SFTP operations wait instead)
+#   seed        seed of random errors and jitter
+ServiceConfig = namedtuple(
+    "ServiceConfig",
+    ["latency", "jitter", "errorRate", "errorStatus", "rateLimit", "seed"],
+    defaults=(0.0, 0.0, 0.0, 500, None, None),
+)
+Reply = namedtuple("Reply", ["status", "body", "contentType"])
+
+
+class Throttle:
+    """
+    Applies `ServiceConfig` latency, errors and rate limit to requests.
+    Safe to use from multiple threads.
+    """
+
+    def __init__(self, config: ServiceConfig) -> None:
+        """
+        Args:
+            config:                     `ServiceConfig` instance
+        """
+        self.config = config
+        self._random = random.Random(config.seed)
+        self._lock = threading.Lock()
+        self._tokens = float(config.rateLimit or 0)
+        self._refilled = time.monotonic()
+
+    def _take_token(self) -> float:
+        """
+        Takes a token from the bucket. Returns 0 if a token was available,
+        otherwise number of seconds until the next token.
+        """
+        rate = self.config.rateLimit
+        now = time.monotonic()
+        self._tokens = min(max(rate, 1.0), self._tokens + (now - self._refilled) * rate)
+        self._refilled = now
+        if self._tokens >= 1:
+            self._tokens -= 1
+            return 0.0
+        return (1 - self._tokens) / rate
+
+    def admit(self, wait: bool = False) -> bool:
+        """
+        Checks request against the rate limit.
+
+        Args:
+            wait:                       wait for the rate limit instead of
+                                        rejecting the request
+
+        Returns:
+            bool
+        """
+        if not self.config.rateLimit:
+            return True
+        while True:
+            with self._lock:
+                delay = self._take_token()
+            if not delay:
+                return True
+            if not wait:
+                return False
+            time.sleep(delay)
+
+    def delay(self) -> None:
+        """
+        Sleeps for the configured latency.
+        """
+        seconds = self.config.latency
+        if self.config.jitter:
+            with self._lock:
+                seconds += self._random.uniform(0, self.config.jitter)
+        if seconds:
+            time.sleep(seconds)
+
+    def fails(self) -> bool:
+        """
+        Decides if the request should fail.
+        """
+        if not self.config.errorRate:
+            return False
+        with self._lock:
+            return self._random.random() < self.config.errorRate
+
+
+class _FakeRequestHandler(BaseHTTPRequestHandler):
+    server: "_FakeHTTPServer"
+
+    def _dispatch(self, method: str) -> None:
+        service = self.server.service
+        parts = urlsplit(self.path)
+        query = {k: v[-1] for k, v in parse_qs(parts.query).items()}
+        length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(length) if length else b""
+
+        reply = service.process(method, parts.path, query, body)
+
+        self.send_response(reply.status)
+        if reply.status == 429:
+            self.send_header("Retry-After", "1")
+        self.send_header("Content-Type", reply.contentType)
+        self.send_header("Content-Length", str(len(reply.body)))
+        self.end_headers()
+        self.wfile.write(reply.body)
+
+    def do_GET(self) -> None:
+        self._dispatch("GET")
+
+    def do_POST(self) -> None:
+        self._dispatch("POST")
+
+    def log_message(self, format: str, *args) -> None:
+        # keep fake traffic out of the test output
+        pass
+
+
+class _FakeHTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+    service: "FakeHTTPService"
+
+
+class FakeHTTPService:
+    """
+    Base class of fake HTTP services. Subclasses implement `handle` method.
+    Served requests are counted by endpoint name in `requests` dictionary.
+    """
+
+    hosts: tuple = ()
+
+    def __init__(self, config: ServiceConfig = ServiceConfig()) -> None:
+        """
+        Args:
+            config:                     `ServiceConfig` instance
+        """
+        self.config = config
+        self.throttle = Throttle(config)
+        self.requests: dict[str, int] = dict()
+        self._lock = threading.Lock()
+        self._server: Optional[_FakeHTTPServer] = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+    @property
+    def url(self) -> str:
+        """
+        Base URL of the running service.
+        """
+        if self._server is None:
+            raise RuntimeError("Service is not running.")
+        return f"http://127.0.0.1:{self._server.server_port}"
+
+    def _count(self, endpoint: str) -> None:
+        with self._lock:
+            self.requests[endpoint] = self.requests.get(endpoint, 0) + 1
+
+    def handle(self, method: str, path: str, query: dict, body: bytes) -> Reply:
+        """
+        Returns reply to a request. Implemented by subclasses.
+        """
+        raise NotImplementedError
+
+    def process(self, method: str, path: str, query: dict, body: bytes) -> Reply:
+        """
+        Applies rate limit, latency and errors before handling a request.
+        """
+        if not self.throttle.admit():
+            self._count("rate_limited")
+            return json_reply({"message": "Too many requests."}, 429)
+        self.throttle.delay()
+        if self.throttle.fails():
+            self._count("errors")
+            return json_reply({"message": "Simulated error."}, self.config.errorStatus)
+        return self.handle(method, path, query, body)
+
+    def start(self) -> "FakeHTTPService":
+        """
+        Starts serving requests from a daemon thread on a free local port.
+        """
+        server = _FakeHTTPServer(("127.0.0.1", 0), _FakeRequestHandler)
+        server.service = self
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        self._server = server
+        return self
+
+    def stop(self) -> None:
+        """
+        Stops the service.
+        """
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+
+def json_reply(data: Union[dict, list], status: int = 200) -> Reply:
+    return Reply(status, json.dumps(data).encode("utf-8"), "application/json")
+
+
+def not_found() -> Reply:
+    return json_reply({"message": "Not found."}, 404)
+
+
+def stable_fraction(value: str) -> float:
+    """
+    Maps a string to a number between 0 and 1 that is the same in every run.
+    """
+    return zlib.crc32(value.encode("utf-8")) / 2**32
+
+
+def token_data(expires_in: int = 1199) -> dict:
+    """
+    Returns body of a successful OAuth client credentials grant response.
+    Includes fields read by both WorldCat and NYPL Platform clients.
+    """
+    expires_at = datetime.now(timezone.utc) + timedelta(seconds=expires_in)
+    return {
+        "access_token": "tk_fake_access_token",
+        "token_type": "bearer",
+        "expires_in": expires_in,
+        "expires_at": expires_at.strftime("%Y-%m-%d %H:%M:%SZ"),
+        "scope": "WorldCatMetadataAPI",
+    }
+
+
+@contextmanager
+def route_requests(routes: dict[str, str]) -> Iterator[None]:
+    """
+    Sends requests made with the `requests` library to URLs starting with
+    any of the given prefixes to the matching local URL instead. Works for
+    all clients built on `requests`, including token requests that do not
+    use a session.
+
+    Args:
+        routes:                     dictionary where key is a URL prefix, for
+                                    example 'https://oauth.oclc.org', and value
+                                    base URL of a fake service
+    """
+    send = HTTPAdapter.send
+
+    def _send(adapter, request, *args, **kwargs):
+        for prefix, target in routes.items():
+            if request.url.startswith(prefix):
+                request.url = target + request.url[len(prefix) :]
+                break
+        return send(adapter, request, *args, **kwargs)
+
+    HTTPAdapter.send = _send  # type: ignore
+    try:
+        yield
+    finally:
+        HTTPAdapter.send = send  # type: ignore
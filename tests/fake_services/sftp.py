@@ -0,0 +1,224 @@
+# -*- coding: utf-8 -*-
+
+"""
+Fake SFTP server backed by a local directory. Serves the operations used by
+`nightshift.comms.storage.Drive`.
+"""
+import os
+import socket
+import threading
+from typing import Optional
+
+import paramiko
+from paramiko.sftp import SFTP_FAILURE, SFTP_OK
+
+from .base import ServiceConfig, Throttle
+
+
+class _SftpHandle(paramiko.SFTPHandle):
+    def stat(self):
+        try:
+            return paramiko.SFTPAttributes.from_stat(os.fstat(self.readfile.fileno()))
+        except OSError as exc:
+            return paramiko.SFTPServer.convert_errno(exc.errno)
+
+
+class _LocalSFTPInterface(paramiko.SFTPServerInterface):
+    """
+    Maps SFTP operations to files in a local root directory.
+    """
+
+    def __init__(self, server, root: str, throttle: Throttle, *args, **kwargs):
+        super().__init__(server, *args, **kwargs)
+        self.root = root
+        self.throttle = throttle
+
+    def _local_path(self, path: str) -> str:
+        return os.path.join(self.root, os.path.normpath("/" + path).lstrip("/"))
+
+    def _throttled(self) -> bool:
+        """
+        Waits for the rate limit and latency. Returns True if the operation
+        should fail.
+        """
+        self.throttle.admit(wait=True)
+        self.throttle.delay()
+        return self.throttle.fails()
+
+    def list_folder(self, path):
+        if self._throttled():
+            return SFTP_FAILURE
+        local_path = self._local_path(path)
+        try:
+            entries = []
+            for name in sorted(os.listdir(local_path)):
+                attr = paramiko.SFTPAttributes.from_stat(
+                    os.stat(os.path.join(local_path, name))
+                )
+                attr.filename = name
+                entries.append(attr)
+            return entries
+        except OSError as exc:
+            return paramiko.SFTPServer.convert_errno(exc.errno)
+
+    def stat(self, path):
+        if self._throttled():
+            return SFTP_FAILURE
+        try:
+            return paramiko.SFTPAttributes.from_stat(os.stat(self._local_path(path)))
+        except OSError as exc:
+            return paramiko.SFTPServer.convert_errno(exc.errno)
+
+    lstat = stat
+
+    def open(self, path, flags, attr):
+        if self._throttled():
+            return SFTP_FAILURE
+        local_path = self._local_path(path)
+        try:
+            fd = os.open(local_path, flags | getattr(os, "O_BINARY", 0), 0o644)
+        except OSError as exc:
+            return paramiko.SFTPServer.convert_errno(exc.errno)
+        if flags & os.O_WRONLY:
+            mode = "ab" if flags & os.O_APPEND else "wb"
+        elif flags & os.O_RDWR:
+            mode = "a+b" if flags & os.O_APPEND else "r+b"
+        else:
+            mode = "rb"
+        f = os.fdopen(fd, mode)
+        handle = _SftpHandle(flags)
+        handle.filename = local_path
+        handle.readfile = f
+        handle.writefile = f
+        return handle
+
+    def remove(self, path):
+        if self._throttled():
+            return SFTP_FAILURE
+        try:
+            os.remove(self._local_path(path))
+        except OSError as exc:
+            return paramiko.SFTPServer.convert_errno(exc.errno)
+        return SFTP_OK
+
+    def rename(self, oldpath, newpath):
+        if self._throttled():
+            return SFTP_FAILURE
+        try:
+            os.rename(self._local_path(oldpath), self._local_path(newpath))
+        except OSError as exc:
+            return paramiko.SFTPServer.convert_errno(exc.errno)
+        return SFTP_OK
+
+    def mkdir(self, path, attr):
+        try:
+            os.mkdir(self._local_path(path))
+        except OSError as exc:
+            return paramiko.SFTPServer.convert_errno(exc.errno)
+        return SFTP_OK
+
+    def chattr(self, path, attr):
+        return SFTP_OK
+
+
+class _SshServer(paramiko.ServerInterface):
+    def __init__(self, user: str, password: str) -> None:
+        self.user = user
+        self.password = password
+
+    def check_auth_password(self, username, password):
+        if (username, password) == (self.user, self.password):
+            return paramiko.AUTH_SUCCESSFUL
+        return paramiko.AUTH_FAILED
+
+    def get_allowed_auths(self, username):
+        return "password"
+
+    def check_channel_request(self, kind, chanid):
+        if kind == "session":
+            return paramiko.OPEN_SUCCEEDED
+        return paramiko.OPEN_FAILED_ADMINISTRATIVELY_PROHIBITED
+
+
+class FakeSftp:
+    """
+    Local SFTP server serving files of the `root` directory. Latency, errors
+    and rate limit of `ServiceConfig` are applied to each file operation;
+    operations over the rate limit wait.
+    """
+
+    def __init__(
+        self,
+        root: str,
+        config: ServiceConfig = ServiceConfig(),
+        user: str = "nightshift",
+        password: str = "sftp_password",
+    ) -> None:
+        """
+        Args:
+            root:                       local directory served as the SFTP root
+            config:                     `ServiceConfig` instance
+            user:                       accepted user name
+            password:                   accepted password
+        """
+        self.root = root
+        self.config = config
+        self.throttle = Throttle(config)
+        self.user = user
+        self.password = password
+        self.host = "127.0.0.1"
+        self.port = 0
+        self._host_key = paramiko.RSAKey.generate(2048)
+        self._sock: Optional[socket.socket] = None
+        self._transports: list[paramiko.Transport] = []
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def _accept(self) -> None:
+        while self._sock is not None:
+            try:
+                conn, _ = self._sock.accept()
+            except OSError:
+                return
+            transport = paramiko.Transport(conn)
+            transport.add_server_key(self._host_key)
+            transport.set_subsystem_handler(
+                "sftp",
+                paramiko.SFTPServer,
+                _LocalSFTPInterface,
+                self.root,
+                self.throttle,
+            )
+            try:
+                transport.start_server(server=_SshServer(self.user, self.password))
+            except (paramiko.SSHException, EOFError):
+                continue
+            self._transports.append(transport)
+
+    def start(self) -> "FakeSftp":
+        """
+        Starts accepting connections on a free local port.
+        """
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.bind((self.host, 0))
+        sock.listen(8)
+        self.port = sock.getsockname()[1]
+        self._sock = sock
+        threading.Thread(target=self._accept, daemon=True).start()
+        return self
+
+    def stop(self) -> None:
+        """
+        Stops the server and closes open connections.
+        """
+        sock, self._sock = self._sock, None
+        if sock is not None:
+            sock.close()
+        for transport in self._transports:
+            transport.close()
+        self._transports = []
@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+
+"""
+Fakes of NYPL Platform and BPL Solr endpoints used by
+`nightshift.comms.sierra_search_platform` to check status of Sierra bibs.
+"""
+import re
+
+from .base import (
+    FakeHTTPService,
+    Reply,
+    ServiceConfig,
+    json_reply,
+    not_found,
+    stable_fraction,
+    token_data,
+)
+
+
+class _FakeSierra(FakeHTTPService):
+    """
+    Base class of fake Sierra search services. Bibs are reported as deleted,
+    upgraded by staff, or still brief, based on their number, so the same bib
+    has the same status in every run.
+    """
+
+    def __init__(
+        self,
+        config: ServiceConfig = ServiceConfig(),
+        deletedRate: float = 0.0,
+        enhancedRate: float = 0.0,
+    ) -> None:
+        """
+        Args:
+            config:                     `ServiceConfig` instance
+            deletedRate:                fraction (0-1) of bibs deleted in Sierra
+            enhancedRate:               fraction (0-1) of bibs upgraded by staff
+        """
+        super().__init__(config)
+        self.deletedRate = deletedRate
+        self.enhancedRate = enhancedRate
+
+    def status(self, sierraId: str) -> str:
+        """
+        Returns 'staff_deleted', 'staff_enhanced' or 'open' status of a bib.
+        """
+        fraction = stable_fraction(f"b{sierraId}")
+        if fraction < self.deletedRate:
+            return "staff_deleted"
+        elif fraction < self.deletedRate + self.enhancedRate:
+            return "staff_enhanced"
+        else:
+            return "open"
+
+
+class FakePlatform(_FakeSierra):
+    """
+    Fake NYPL Platform: token and Sierra bib endpoints.
+    """
+
+    hosts = (
+        "https://platform.nypl.org",
+        "https://qa-platform.nypl.org",
+        "https://dev-platform.nypl.org",
+    )
+
+    def handle(self, method: str, path: str, query: dict, body: bytes) -> Reply:
+        if method == "POST" and path.endswith("/token"):
+            self._count("token")
+            return json_reply(token_data())
+
+        found = re.search(r"/bibs/sierra-nypl/(\d+)$", path)
+        if method == "GET" and found:
+            self._count("get_bib")
+            sierraId = found.group(1)
+            status = self.status(sierraId)
+            if status == "staff_enhanced":
+                var_fields = [{"marcTag": "003", "content": "OCoLC", "subfields": None}]
+            else:
+                var_fields = [
+                    {
+                        "marcTag": "091",
+                        "content": None,
+                        "subfields": [{"tag": "a", "content": "eNYPL Book"}],
+                    }
+                ]
+            return json_reply(
+                {
+                    "data": {
+                        "id": sierraId,
+                        "nyplSource": "sierra-nypl",
+                        "deleted": status == "staff_deleted",
+                        "suppressed": False,
+                        "varFields": var_fields,
+                    },
+                    "count": 1,
+                    "statusCode": 200,
+                }
+            )
+
+        return not_found()
+
+
+class FakeSolr(_FakeSierra):
+    """
+    Fake BPL Solr: bib number search endpoint. Any path is accepted as
+    the endpoint.
+    """
+
+    def handle(self, method: str, path: str, query: dict, body: bytes) -> Reply:
+        if method != "GET":
+            return not_found()
+
+        self._count("search_bibNo")
+        found = re.search(r"(\d+)", query.get("q", ""))
+        if not found:
+            return json_reply({"response": {"numFound": 0, "start": 0, "docs": []}})
+        sierraId = found.group(1)
+        status = self.status(sierraId)
+        doc = {
+            "id": sierraId,
+            "suppressed": False,
+            "bs_deleted_in_sierra": status == "staff_deleted",
+            "call_number": "eBOOK",
+        }
+        if status == "staff_enhanced":
+            doc["ss_marc_tag_003"] = "OCoLC"
+        return json_reply({"response": {"numFound": 1, "start": 0, "docs": [doc]}})
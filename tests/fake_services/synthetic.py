@@ -0,0 +1,548 @@
+# -*- coding: utf-8 -*-
+
+"""
+Generator of synthetic Sierra MARC21 dumps and matching WorldCat Metadata API
+full bibs for scale testing of ingest, matching and enhancement.
+
+Records are derived from their position in the dump and the seed, so the same
+dump can be produced again without storing it, and identifiers of a record
+(OverDrive reserve ID in 037, ISBN) can be mapped back to its work and OCLC
+number without keeping an index in memory. A share of records can repeat an
+earlier work under a new Sierra bib number (duplicates).
+
+Command line use:
+
+    python -m tests.fake_services.synthetic NYP 100000 NYP-synthetic-pout.mrc \\
+        --seed 1 --duplicate-rate 0.05 --full-bibs-dir full_bibs/
+"""
+import argparse
+import os
+import random
+import re
+from typing import BinaryIO, Iterator, Optional
+from xml.sax.saxutils import escape
+
+from pymarc import Field, Record, Subfield
+
+
+DEFAULT_MIX = {"ebook": 0.6, "eaudio": 0.25, "evideo": 0.05, "print": 0.1}
+
+# record type (leader position 6) of each category
+RECORD_TYPES = {"ebook": "a", "eaudio": "i", "evideo": "g", "print": "a"}
+
+CALL_NUMBERS = {
+    "NYP": {"ebook": "eNYPL BOOK", "eaudio": "eNYPL AUDIO", "evideo": "eNYPL VIDEO"},
+    "BPL": {"ebook": "eBOOK", "eaudio": "eAUDIO", "evideo": "eVIDEO"},
+}
+
+WORDS = (
+    "river night garden winter house stone silent city light shadow journey "
+    "empire letters island secret fire memory ocean mountain last first lost "
+    "song country story daughter king wild blue summer voices road"
+).split()
+SURNAMES = (
+    "Smith Garcia Nowak Okafor Chen Rossi Kowalski Haddad Silva Murphy Tanaka "
+    "Johansson Dubois Ivanova Mensah Patel Cohen Schmidt Moreau Lindqvist"
+).split()
+FORENAMES = (
+    "Anna Marek Jane Luis Amara Wei Sofia Omar Grace Kenji Elena Tomasz Ruth "
+    "Daniel Maya Samuel Ines Noah Zofia Adam"
+).split()
+SUBJECTS = (
+    "Fiction Mystery Romance History Biography Science Travel Cooking Poetry "
+    "Business Self-help Fantasy Thrillers Music Health"
+).split()
+
+# odd multipliers scrambling work number in the last group of reserve IDs;
+# the scrambling is reversed with their modular inverses
+_MOD = 2**48
+_SCRAMBLE = (0x5DEECE66D, 0x9E3779B97F4B)
+_UNSCRAMBLE = tuple(pow(m, -1, _MOD) for m in _SCRAMBLE)
+_OCLC_BASE = 1000000000
+_ISBN_PREFIX = "9798"
+
+
+def _scramble(w: int) -> int:
+    x = (w * _SCRAMBLE[0]) % _MOD
+    x ^= x >> 24
+    return (x * _SCRAMBLE[1]) % _MOD
+
+
+def _unscramble(x: int) -> int:
+    x = (x * _UNSCRAMBLE[1]) % _MOD
+    # xor with a shift of at least half the width is its own inverse
+    x ^= x >> 24
+    return (x * _UNSCRAMBLE[0]) % _MOD
+
+
+def isbn13(body: str) -> str:
+    """
+    Completes 12 digits of ISBN-13 with a check digit.
+    """
+    total = sum(int(d) * (1 if n % 2 == 0 else 3) for n, d in enumerate(body))
+    return f"{body}{(10 - total % 10) % 10}"
+
+
+def sierra_check_digit(bibNo: int) -> str:
+    """
+    Calculates Sierra check digit of a record number.
+    """
+    total = sum(int(d) * (n + 2) for n, d in enumerate(reversed(str(bibNo))))
+    check = total % 11
+    return "x" if check == 10 else str(check)
+
+
+class SyntheticCatalog:
+    """
+    Deterministic source of Sierra bibs and matching WorldCat full bibs.
+    Can be passed as `catalog` to `FakeWorldcat`.
+    """
+
+    def __init__(
+        self,
+        library: str = "NYP",
+        seed: int = 0,
+        mix: dict[str, float] = DEFAULT_MIX,
+        duplicateRate: float = 0.0,
+        matchRate: float = 1.0,
+        rejectRate: float = 0.0,
+        firstBibNo: int = 20000000,
+    ) -> None:
+        """
+        Args:
+            library:                    'NYP' or 'BPL'
+            seed:                       seed of generated data
+            mix:                        share of each resource category
+                                        ('ebook', 'eaudio', 'evideo', 'print')
+            duplicateRate:              fraction (0-1) of records repeating an
+                                        earlier work
+            matchRate:                  fraction (0-1) of works found in WorldCat
+            rejectRate:                 fraction (0-1) of WorldCat full bibs not
+                                        meeting minimum criteria (all uppercase
+                                        title)
+            firstBibNo:                 Sierra bib number of the first record
+
+        Raises:
+            ValueError
+        """
+        if library not in CALL_NUMBERS:
+            raise ValueError("Invalid library argument. Must be 'NYP' or 'BPL'.")
+        unknown = set(mix) - set(RECORD_TYPES)
+        if unknown or not sum(mix.values()):
+            raise ValueError(
+                f"Invalid mix argument. Categories must be: {', '.join(RECORD_TYPES)}."
+            )
+        self.library = library
+        self.seed = seed
+        self.mix = mix
+        self.duplicateRate = duplicateRate
+        self.matchRate = matchRate
+        self.rejectRate = rejectRate
+        self.firstBibNo = firstBibNo
+        self._categories = list(mix)
+        self._weights = [mix[c] for c in self._categories]
+
+    def _work_of_record(self, n: int) -> int:
+        # a duplicate repeats work of a random earlier record
+        while n:
+            rng = random.Random(f"{self.seed}-record-{n}")
+            if rng.random() >= self.duplicateRate:
+                break
+            n = rng.randrange(n)
+        return n
+
+    def work(self, w: int) -> dict:
+        """
+        Returns descriptive data of a work.
+
+        Args:
+            w:                          work number
+
+        Returns:
+            dictionary of work data
+        """
+        rng = random.Random(f"{self.seed}-work-{w}")
+        category = rng.choices(self._categories, self._weights)[0]
+        words = rng.sample(WORDS, rng.randint(2, 5))
+        scrambled = _scramble(w)
+        reserve_id = (
+            f"{rng.getrandbits(32):08X}-{rng.getrandbits(16):04X}-"
+            f"4{rng.getrandbits(12):03X}-{8 + rng.getrandbits(2):X}"
+            f"{rng.getrandbits(12):03X}-{scrambled:012X}"
+        )
+        return dict(
+            work=w,
+            category=category,
+            title=" ".join(words).capitalize(),
+            forename=rng.choice(FORENAMES),
+            surname=rng.choice(SURNAMES),
+            subject=rng.choice(SUBJECTS),
+            year=str(rng.randint(1990, 2024)),
+            isbn=isbn13(f"{_ISBN_PREFIX}{w:08d}"),
+            reserveId=reserve_id,
+            titleId=str(100000 + w),
+            matched=rng.random() < self.matchRate,
+            rejected=rng.random() < self.rejectRate,
+        )
+
+    def bib(self, n: int) -> Record:
+        """
+        Returns n-th Sierra bib of the dump.
+
+        Args:
+            n:                          position of the record in the dump
+
+        Returns:
+            `pymarc.Record` instance
+        """
+        data = self.work(self._work_of_record(n))
+        category = data["category"]
+        bibNo = self.firstBibNo + n
+        author = f"{data['surname']}, {data['forename']}."
+
+        record = Record(leader=f"00000n{RECORD_TYPES[category]}m a2200000Ka 4500")
+        if category == "print":
+            record.add_field(Field(tag="001", data=f"BT{data['work']:010d}"))
+        else:
+            record.add_field(Field(tag="001", data=f"ODN{data['titleId']:0>10}"))
+        record.add_field(
+            Field(tag="008", data=f"240101s{data['year']}    nyu     o     000 0 eng d")
+        )
+        record.add_field(
+            Field(
+                tag="020",
+                indicators=[" ", " "],
+                subfields=[Subfield("a", data["isbn"])],
+            )
+        )
+        if category != "print":
+            record.add_field(
+                Field(
+                    tag="037",
+                    indicators=[" ", " "],
+                    subfields=[
+                        Subfield("a", data["reserveId"]),
+                        Subfield("b", "OverDrive, Inc."),
+                        Subfield("n", "http://www.overdrive.com"),
+                    ],
+                )
+            )
+            record.add_field(
+                Field(
+                    tag="091",
+                    indicators=[" ", " "],
+                    subfields=[Subfield("a", CALL_NUMBERS[self.library][category])],
+                )
+            )
+        record.add_field(
+            Field(tag="100", indicators=["1", " "], subfields=[Subfield("a", author)])
+        )
+        record.add_field(
+            Field(
+                tag="245",
+                indicators=["1", "0"],
+                subfields=[
+                    Subfield("a", f"{data['title']} /"),
+                    Subfield("c", f"{data['forename']} {data['surname']}."),
+                ],
+            )
+        )
+        record.add_field(
+            Field(
+                tag="264",
+                indicators=[" ", "1"],
+                subfields=[Subfield("c", f"{data['year']}.")],
+            )
+        )
+        record.add_field(
+            Field(
+                tag="650",
+                indicators=[" ", "7"],
+                subfields=[
+                    Subfield("a", f"{data['subject']}."),
+                    Subfield("2", "OverDrive"),
+                ],
+            )
+        )
+        if category != "print":
+            record.add_field(
+                Field(
+                    tag="710",
+                    indicators=["2", " "],
+                    subfields=[
+                        Subfield("a", "OverDrive, Inc.,"),
+                        Subfield("e", "distributor"),
+                    ],
+                )
+            )
+            record.add_field(
+                Field(
+                    tag="856",
+                    indicators=["4", "0"],
+                    subfields=[
+                        Subfield(
+                            "u",
+                            "http://link.overdrive.com/?websiteID=37&titleID="
+                            f"{data['titleId']}",
+                        )
+                    ],
+                )
+            )
+        record.add_field(
+            Field(
+                tag="907",
+                indicators=[" ", " "],
+                subfields=[
+                    Subfield("a", f".b{bibNo}{sierra_check_digit(bibNo)}"),
+                    Subfield("b", "01-02-24"),
+                    Subfield("c", "01-02-2024 19:07"),
+                ],
+            )
+        )
+        record.add_field(
+            Field(
+                tag="998",
+                indicators=[" ", " "],
+                subfields=[
+                    Subfield("a", "ia"),
+                    Subfield("b", "01-02-24"),
+                    Subfield("c", "m"),
+                    Subfield("d", "z"),
+                    Subfield("e", "a"),
+                    Subfield("f", "eng"),
+                    Subfield("g", "nyu"),
+                    Subfield("h", "0"),
+                    Subfield("i", "1"),
+                ],
+            )
+        )
+        return record
+
+    def bibs(self, count: int, start: int = 0) -> Iterator[Record]:
+        """
+        Yields Sierra bibs of the dump.
+
+        Args:
+            count:                      number of records
+            start:                      position of the first record
+        """
+        for n in range(start, start + count):
+            yield self.bib(n)
+
+    def write_dump(self, out: BinaryIO, count: int, start: int = 0) -> int:
+        """
+        Writes Sierra bibs as MARC21 to a binary stream.
+
+        Args:
+            out:                        binary file-like object
+            count:                      number of records
+            start:                      position of the first record
+
+        Returns:
+            number of written records
+        """
+        written = 0
+        for record in self.bibs(count, start):
+            out.write(record.as_marc())
+            written += 1
+        return written
+
+    def _work_of_identifier(self, identifier: str) -> Optional[int]:
+        found = re.fullmatch(
+            r"[0-9A-F]{8}-[0-9A-F]{4}-4[0-9A-F]{3}-[89AB][0-9A-F]{3}-([0-9A-F]{12})",
+            identifier,
+        )
+        if found:
+            w = _unscramble(int(found.group(1), 16))
+            if self.work(w)["reserveId"] == identifier:
+                return w
+            return None
+        if re.fullmatch(rf"{_ISBN_PREFIX}\d{{9}}", identifier):
+            w = int(identifier[len(_ISBN_PREFIX) : -1])
+            if isbn13(identifier[:-1]) == identifier:
+                return w
+        return None
+
+    def match(self, identifier: str) -> Optional[str]:
+        """
+        Returns OCLC number of the work with the given OverDrive reserve ID or
+        ISBN, if the work is found in WorldCat.
+
+        Args:
+            identifier:                 OverDrive reserve ID or ISBN
+
+        Returns:
+            OCLC number
+        """
+        w = self._work_of_identifier(identifier)
+        if w is None or not self.work(w)["matched"]:
+            return None
+        return str(_OCLC_BASE + w)
+
+    def brief_record(self, oclcNumber: str) -> Optional[dict]:
+        """
+        Returns MetadataAPI brief record of a matched work consistent with
+        its full bib.
+
+        Args:
+            oclcNumber:                 OCLC number
+
+        Returns:
+            brief record as dictionary
+        """
+        data = self._matched_work(oclcNumber)
+        if data is None:
+            return None
+        title = data["title"].upper() if data["rejected"] else data["title"]
+        return {
+            "oclcNumber": oclcNumber,
+            "title": title,
+            "creator": f"{data['forename']} {data['surname']}",
+            "language": "eng",
+            "isbns": [data["isbn"]],
+        }
+
+    def _matched_work(self, oclcNumber: str) -> Optional[dict]:
+        try:
+            w = int(oclcNumber) - _OCLC_BASE
+        except ValueError:
+            return None
+        if w < 0:
+            return None
+        data = self.work(w)
+        if not data["matched"]:
+            return None
+        return data
+
+    def full_bib(self, oclcNumber: str) -> Optional[bytes]:
+        """
+        Returns MetadataAPI MARC XML full bib of a matched work.
+
+        Args:
+            oclcNumber:                 OCLC number
+
+        Returns:
+            MARC XML as bytes
+        """
+        data = self._matched_work(oclcNumber)
+        if data is None:
+            return None
+        title = data["title"].upper() if data["rejected"] else data["title"]
+        if data["category"] == "print":
+            extent = "320 pages ;"
+        else:
+            extent = "1 online resource"
+        return FULL_BIB_TEMPLATE.format(
+            recordType=RECORD_TYPES[data["category"]],
+            oclcNumber=oclcNumber,
+            year=data["year"],
+            isbn=data["isbn"],
+            author=escape(f"{data['surname']}, {data['forename']},"),
+            title=escape(title),
+            statement=escape(f"{data['forename']} {data['surname']}."),
+            extent=extent,
+            subject=escape(data["subject"]),
+        ).encode("utf-8")
+
+    def write_full_bibs(self, out_dir: str, count: int, start: int = 0) -> int:
+        """
+        Writes full bibs of matched works of the dump as '{oclcNumber}.xml' files.
+
+        Args:
+            out_dir:                    directory of full bib files
+            count:                      number of records of the dump
+            start:                      position of the first record
+
+        Returns:
+            number of written files
+        """
+        written = 0
+        seen = set()
+        for n in range(start, start + count):
+            w = self._work_of_record(n)
+            if w in seen:
+                continue
+            seen.add(w)
+            oclcNumber = str(_OCLC_BASE + w)
+            full_bib = self.full_bib(oclcNumber)
+            if full_bib is None:
+                continue
+            with open(os.path.join(out_dir, f"{oclcNumber}.xml"), "wb") as f:
+                f.write(full_bib)
+            written += 1
+        return written
+
+
+FULL_BIB_TEMPLATE = """<?xml version="1.0" encoding="UTF-8"?>
+<record xmlns="http://www.loc.gov/MARC21/slim">
+  <leader>00000c{recordType}m a2200000 i 4500</leader>
+  <controlfield tag="001">on{oclcNumber}</controlfield>
+  <controlfield tag="003">OCoLC</controlfield>
+  <controlfield tag="005">20240101120000.0</controlfield>
+  <controlfield tag="008">240101s{year}    nyu     o     000 1 eng d</controlfield>
+  <datafield tag="020" ind1=" " ind2=" ">
+    <subfield code="a">{isbn}</subfield>
+  </datafield>
+  <datafield tag="040" ind1=" " ind2=" ">
+    <subfield code="a">DLC</subfield>
+    <subfield code="b">eng</subfield>
+    <subfield code="e">rda</subfield>
+    <subfield code="c">DLC</subfield>
+  </datafield>
+  <datafield tag="100" ind1="1" ind2=" ">
+    <subfield code="a">{author}</subfield>
+    <subfield code="e">author.</subfield>
+  </datafield>
+  <datafield tag="245" ind1="1" ind2="0">
+    <subfield code="a">{title} /</subfield>
+    <subfield code="c">{statement}</subfield>
+  </datafield>
+  <datafield tag="264" ind1=" " ind2="1">
+    <subfield code="a">New York :</subfield>
+    <subfield code="b">Synthetic Press,</subfield>
+    <subfield code="c">{year}.</subfield>
+  </datafield>
+  <datafield tag="300" ind1=" " ind2=" ">
+    <subfield code="a">{extent}</subfield>
+  </datafield>
+  <datafield tag="650" ind1=" " ind2="0">
+    <subfield code="a">{subject}.</subfield>
+  </datafield>
+</record>
+"""
+
+
+def main(args: Optional[list] = None) -> None:
+    parser = argparse.ArgumentParser(
+        description="Generates synthetic Sierra MARC21 dump and WorldCat full bibs."
+    )
+    parser.add_argument("library", choices=["NYP", "BPL"])
+    parser.add_argument("count", type=int, help="number of records in the dump")
+    parser.add_argument("out", help="path of the MARC21 dump file")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--duplicate-rate", type=float, default=0.0)
+    parser.add_argument("--match-rate", type=float, default=1.0)
+    parser.add_argument("--reject-rate", type=float, default=0.0)
+    parser.add_argument(
+        "--full-bibs-dir", help="directory to write matching WorldCat full bibs to"
+    )
+    ns = parser.parse_args(args)
+
+    catalog = SyntheticCatalog(
+        ns.library,
+        seed=ns.seed,
+        duplicateRate=ns.duplicate_rate,
+        matchRate=ns.match_rate,
+        rejectRate=ns.reject_rate,
+    )
+    with open(ns.out, "wb") as out:
+        written = catalog.write_dump(out, ns.count)
+    print(f"Wrote {written} records to {ns.out}.")
+    if ns.full_bibs_dir:
+        os.makedirs(ns.full_bibs_dir, exist_ok=True)
+        written = catalog.write_full_bibs(ns.full_bibs_dir, ns.count)
+        print(f"Wrote {written} full bibs to {ns.full_bibs_dir}.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,188 @@
+# -*- coding: utf-8 -*-
+
+"""
+Fake of OCLC authorization server and WorldCat Metadata API endpoints used by
+`nightshift.comms.worldcat`: token, brief bibs search, and bib get.
+"""
+import re
+from typing import Any, Optional
+from xml.sax.saxutils import escape
+import zlib
+
+from .base import (
+    FakeHTTPService,
+    Reply,
+    ServiceConfig,
+    json_reply,
+    not_found,
+    stable_fraction,
+    token_data,
+)
+
+
+FULL_BIB_TEMPLATE = """<?xml version="1.0" encoding="UTF-8"?>
+<record xmlns="http://www.loc.gov/MARC21/slim">
+  <leader>00000cam a2200000 i 4500</leader>
+  <controlfield tag="001">ocn{oclcNumber}</controlfield>
+  <controlfield tag="003">OCoLC</controlfield>
+  <controlfield tag="005">20240101120000.0</controlfield>
+  <controlfield tag="008">240101s2024    nyu     o     000 1 eng d</controlfield>
+  <datafield tag="040" ind1=" " ind2=" ">
+    <subfield code="a">DLC</subfield>
+    <subfield code="b">eng</subfield>
+    <subfield code="e">rda</subfield>
+    <subfield code="c">DLC</subfield>
+  </datafield>
+  <datafield tag="100" ind1="1" ind2=" ">
+    <subfield code="a">Doe, Jane,</subfield>
+    <subfield code="e">author.</subfield>
+  </datafield>
+  <datafield tag="245" ind1="1" ind2="0">
+    <subfield code="a">{title} /</subfield>
+    <subfield code="c">Jane Doe.</subfield>
+  </datafield>
+  <datafield tag="264" ind1=" " ind2="1">
+    <subfield code="a">New York :</subfield>
+    <subfield code="b">Fake Publisher,</subfield>
+    <subfield code="c">2024.</subfield>
+  </datafield>
+  <datafield tag="300" ind1=" " ind2=" ">
+    <subfield code="a">1 online resource</subfield>
+  </datafield>
+  <datafield tag="650" ind1=" " ind2="0">
+    <subfield code="a">Libraries</subfield>
+    <subfield code="v">Fiction.</subfield>
+  </datafield>
+</record>
+"""
+
+
+class FakeWorldcat(FakeHTTPService):
+    """
+    Fake WorldCat Metadata API. Serves tokens for any credentials.
+
+    Brief bib searches are resolved by the first identifier in the query
+    (for example '123' in 'sn=123 NOT lv:3'), or by each identifier of a packed
+    query (for example '(bn:1 OR bn:2) AND x0:print'). Brief records found by
+    ISBN ('bn:' queries) list the identifier in `isbns`. If `matches` is given, only
+    identifiers found in it are matched to its OCLC numbers; otherwise
+    a `matchRate` share of identifiers is matched to OCLC numbers derived
+    from the identifier, the same in every run. Full bibs are served from
+    `records` or built from `FULL_BIB_TEMPLATE`. If `catalog` is given (for
+    example `synthetic.SyntheticCatalog`), its `match`, `brief_record` and
+    `full_bib` methods are used instead.
+    """
+
+    hosts = ("https://oauth.oclc.org", "https://metadata.api.oclc.org")
+
+    def __init__(
+        self,
+        config: ServiceConfig = ServiceConfig(),
+        matchRate: float = 1.0,
+        matches: Optional[dict[str, str]] = None,
+        records: Optional[dict[str, bytes]] = None,
+        catalog: Optional[Any] = None,
+    ) -> None:
+        """
+        Args:
+            config:                     `ServiceConfig` instance
+            matchRate:                  fraction (0-1) of searched identifiers
+                                        with a match when `matches` is not given
+            matches:                    dictionary where key is an identifier
+                                        and value an OCLC number
+            records:                    dictionary where key is an OCLC number
+                                        and value a MARC XML record
+            catalog:                    object with `match(identifier)`,
+                                        `brief_record(oclcNumber)` and
+                                        `full_bib(oclcNumber)` methods
+        """
+        super().__init__(config)
+        self.matchRate = matchRate
+        self.matches = matches
+        self.records = records or dict()
+        self.catalog = catalog
+
+    def _identifiers(self, q: str) -> list[tuple[str, str]]:
+        found = re.match(r"\s*\(([^)]*)\)", q)
+        terms = found.group(1).split(" OR ") if found else [q]
+        identifiers = []
+        for term in terms:
+            found = re.match(r"\s*(\w+)[=:]\s*(\S+)", term)
+            if found:
+                identifiers.append((found.group(1), found.group(2)))
+        return identifiers
+
+    def _match(self, identifier: str) -> Optional[str]:
+        if self.catalog is not None:
+            return self.catalog.match(identifier)
+        if self.matches is not None:
+            return self.matches.get(identifier)
+        if stable_fraction(identifier) < self.matchRate:
+            return str(10000000 + zlib.crc32(identifier.encode("utf-8")) % 90000000)
+        return None
+
+    def handle(self, method: str, path: str, query: dict, body: bytes) -> Reply:
+        if method == "POST" and path.endswith("/token"):
+            self._count("token")
+            return json_reply(token_data())
+
+        if method == "GET" and path.endswith("/worldcat/search/brief-bibs"):
+            self._count("brief_bibs_search")
+            records = []
+            for index, identifier in self._identifiers(query.get("q", "")):
+                oclcNumber = self._match(identifier)
+                if oclcNumber is None:
+                    continue
+                if self.catalog is not None:
+                    record = self.catalog.brief_record(oclcNumber)
+                else:
+                    record = {
+                        "oclcNumber": oclcNumber,
+                        "title": f"Fake title {oclcNumber}",
+                        "creator": "Jane Doe",
+                        "language": "eng",
+                    }
+                    if index == "bn":
+                        record["isbns"] = [identifier]
+                records.append(record)
+            records = records[: int(query.get("limit", 1))]
+            if not records:
+                return json_reply({"numberOfRecords": 0})
+            return json_reply(
+                {"numberOfRecords": len(records), "briefRecords": records}
+            )
+
+        found = re.search(r"/worldcat/manage/bibs/(\d+)$", path)
+        if method == "GET" and found:
+            self._count("bib_get")
+            oclcNumber = found.group(1)
+            if self.catalog is not None:
+                record = self.catalog.full_bib(oclcNumber)
+                if record is None:
+                    return not_found()
+            else:
+                try:
+                    record = self.records[oclcNumber]
+                except KeyError:
+                    record = full_bib(oclcNumber)
+            return Reply(200, record, "application/marcxml+xml")
+
+        return not_found()
+
+
+def full_bib(oclcNumber: str, title: Optional[str] = None) -> bytes:
+    """
+    Returns MARC XML full bib that meets NightShift's minimum criteria.
+
+    Args:
+        oclcNumber:                 OCLC number of the record
+        title:                      title of the record
+
+    Returns:
+        MARC XML as bytes
+    """
+    if title is None:
+        title = f"Fake title {oclcNumber}"
+    return FULL_BIB_TEMPLATE.format(oclcNumber=oclcNumber, title=escape(title)).encode(
+        "utf-8"
+    )
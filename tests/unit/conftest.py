@@ -181,6 +181,24 @@ def patch_perform_db_maintenance(monkeypatch):
     monkeypatch.setattr(manager, "perform_db_maintenance", _patch)
 
 
+@pytest.fixture
+def patch_run_ledger(monkeypatch):
+    def _begin(*args, **kwargs):
+        return 1
+
+    def _complete(*args, **kwargs):
+        return
+
+    monkeypatch.setattr(manager, "begin_run", _begin)
+    monkeypatch.setattr(manager, "complete_run", _complete)
+
+
+@pytest.fixture
+def patch_run_report_dir(monkeypatch, tmp_path):
+    monkeypatch.setenv("RUN_REPORT_DIR", str(tmp_path))
+    return tmp_path
+
+
 @pytest.fixture
 def mock_drive_unprocessed_files(monkeypatch):
     """
@@ -251,11 +269,14 @@ def mock_get_worldcat_full_bibs(monkeypatch, test_session):
         test_session = args[0].db_session
         resources = args[1]
         fullBib = b'<?xml version=\'1.0\' encoding=\'UTF-8\'?>\n<entry xmlns="http://www.w3.org/2005/Atom">\n  <content type="application/xml">\n    <response xmlns="http://worldcat.org/rb" mimeType="application/vnd.oclc.marc21+xml">\n      <record xmlns="http://www.loc.gov/MARC21/slim">\n        <leader>00000cam a2200000Ia 4500</leader>\n        <controlfield tag="001">ocn850939580</controlfield>\n        <controlfield tag="003">OCoLC</controlfield>\n        <controlfield tag="005">20190426152409.0</controlfield>\n        <controlfield tag="008">120827s2012    nyua   a      000 f eng d</controlfield>\n        <datafield tag="040" ind1=" " ind2=" ">\n          <subfield code="a">OCPSB</subfield>\n          <subfield code="b">eng</subfield>\n          <subfield code="c">OCPSB</subfield>\n          <subfield code="d">OCPSB</subfield>\n          <subfield code="d">OCLCQ</subfield>\n          <subfield code="d">OCPSB</subfield>\n          <subfield code="d">OCLCQ</subfield>\n          <subfield code="d">NYP</subfield>\n    </datafield>\n        <datafield tag="035" ind1=" " ind2=" ">\n          <subfield code="a">(OCoLC)850939580</subfield>\n    </datafield>\n        <datafield tag="020" ind1=" " ind2=" ">\n          <subfield code="a">some isbn</subfield>\n    </datafield>\n        <datafield tag="049" ind1=" " ind2=" ">\n          <subfield code="a">NYPP</subfield>\n    </datafield>\n        <datafield tag="100" ind1="0" ind2=" ">\n          <subfield code="a">OCLC RecordBuilder.</subfield>\n    </datafield>\n        <datafield tag="245" ind1="1" ind2="0">\n          <subfield code="a">Record Builder Added This Test Record</subfield>\n    <subfield code="c">spam.</subfield>\n    </datafield>\n        <datafield tag="300" ind1=" " ind2=" ">\n          <subfield code="a">1 online resource</subfield>\n    </datafield>\n        <datafield tag="336" ind1=" " ind2=" ">\n          <subfield code="a">text</subfield>\n          <subfield code="b">txt</subfield>\n          <subfield code="2">rdacontent</subfield>\n    </datafield>\n        <datafield tag="337" ind1=" " ind2=" ">\n          <subfield code="a">unmediated</subfield>\n          <subfield code="b">n</subfield>\n          <subfield code="2">rdamedia</subfield>\n    </datafield>\n        <datafield tag="500" ind1=" " ind2=" ">\n          <subfield code="a">TEST RECORD -- DO NOT USE.</subfield>\n    </datafield>\n        <datafield tag="500" ind1=" " ind2=" ">\n          <subfield code="a">Added Field by MarcEdit.</subfield>\n    </datafield>\n  <datafield tag="650" ind1=" " ind2="0">\n          <subfield code="a">Test.</subfield>\n    </datafield>\n        </record>\n    </response>\n  </content>\n  <id>http://worldcat.org/oclc/850939580</id>\n  <link href="http://worldcat.org/oclc/850939580"/>\n</entry>'  # noqa: E501
+        downloaded = 0
         for res in resources:
             datastore_transactions.update_resource(
                 test_session, res.sierraId, res.libraryId, fullBib=fullBib
             )
-        test_session.commit()
+            test_session.commit()
+            downloaded += 1
+        return downloaded
 
     monkeypatch.setattr(Tasks, "get_worldcat_full_bibs", _patch)
 
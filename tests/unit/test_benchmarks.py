@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+import json
+
+import pytest
+
+from benchmarks import Measurement, Regression, compare, load_results, save_results
+from benchmarks.__main__ import main
+from benchmarks.cases import (
+    Case,
+    Options,
+    bib_enhancer,
+    bib_reader,
+    debug_logging,
+    retrieve_latency,
+)
+
+
+OPTIONS = Options(records=20, tableSizes=[40], repeat=1, latency=0.0, seed=0)
+
+
+@pytest.mark.parametrize(
+    "value,higherIsBetter,expectation",
+    [
+        (85.0, True, []),
+        (79.0, True, [Regression("foo", 100.0, 79.0, -0.21)]),
+        (500.0, True, []),
+        (115.0, False, []),
+        (121.0, False, [Regression("foo", 100.0, 121.0, 0.21)]),
+        (10.0, False, []),
+    ],
+)
+def test_compare(value, higherIsBetter, expectation):
+    baseline = [Measurement("foo", 100.0, "unit", higherIsBetter)]
+    regressions = compare(
+        [Measurement("foo", value, "unit", higherIsBetter)], baseline, 0.2
+    )
+    assert [r._replace(change=round(r.change, 2)) for r in regressions] == expectation
+
+
+def test_compare_without_baseline():
+    assert compare([Measurement("foo", 1.0, "s", False)], [], 0.2) == []
+
+
+def test_compare_invalid_tolerance():
+    with pytest.raises(ValueError):
+        compare([], [], -0.1)
+
+
+def test_save_and_load_results(tmp_path):
+    out = tmp_path / "results.json"
+    measurements = [Measurement("foo", 1.5, "records/s", True)]
+    save_results(str(out), measurements, OPTIONS._asdict())
+
+    with open(out, "r") as f:
+        data = json.load(f)
+    assert data["options"]["records"] == 20
+    assert load_results(str(out)) == measurements
+
+
+def test_main(monkeypatch, tmp_path, capsys):
+    value = 100.0
+    cases = {
+        "foo": Case(lambda options: [Measurement("foo", value, "x/s", True)], False),
+        "bar": Case(lambda options: [Measurement("bar", 1.0, "s", False)], True),
+    }
+    monkeypatch.setattr("benchmarks.__main__.CASES", cases)
+    baseline = str(tmp_path / "baseline.json")
+
+    assert main(["--out", baseline]) == 0
+    assert [m.name for m in load_results(baseline)] == ["foo"]
+
+    value = 70.0
+    assert main(["--baseline", baseline, "--tolerance", "0.35"]) == 0
+    assert main(["--baseline", baseline]) == 1
+    assert "REGRESSION foo: 70.000 vs baseline 100.000 (-30.0%)" in (
+        capsys.readouterr().out
+    )
+
+    with pytest.raises(SystemExit):
+        main(["--only", "bar"])
+
+
+def test_bib_reader_and_enhancer_cases():
+    assert bib_reader(OPTIONS)[0].value > 0
+    assert bib_enhancer(OPTIONS)[0].value > 0
+
+
+def test_debug_logging_case():
+    measurements = debug_logging(OPTIONS)
+    assert [m.name for m in measurements] == [
+        "debug_parsed_resource_eager",
+        "debug_parsed_resource_lazy",
+        "debug_query_payload_eager",
+        "debug_query_payload_lazy",
+        "prep_query_payloads",
+    ]
+    assert all(m.value > 0 for m in measurements)
+
+
+def test_retrieve_latency_case(mock_db_env, test_session):
+    measurements = retrieve_latency(OPTIONS)
+    assert len(measurements) == 5
+    assert all(m.name.endswith("@40") and m.unit == "ms" for m in measurements)
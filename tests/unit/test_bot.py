@@ -1,14 +1,91 @@
 """
 Tests bot.py module
 """
+
 from contextlib import nullcontext as does_not_raise
 import os
 import logging
+import subprocess
+import sys
 
 import pytest
 import yaml
 
-from nightshift.bot import config_local_env_variables, configure_database, main, run
+import nightshift
+from nightshift import datastore_transactions, manager
+from nightshift.datastore_transactions import DailyStats
+from nightshift.bot import (
+    config_local_env_variables,
+    configure_database,
+    main,
+    run,
+    upgrade_database,
+)
+
+
+# cumulative import time of `nightshift.bot` in microseconds
+IMPORT_TIME_BUDGET = 100000
+
+# packages loaded only by actions that process resources
+HEAVY_PACKAGES = {
+    "bookops_bpl_solr",
+    "bookops_marc",
+    "bookops_nypl_platform",
+    "bookops_worldcat",
+    "loggly",
+    "paramiko",
+    "pymarc",
+    "requests",
+}
+
+
+def _import_times(statement: str) -> dict[str, int]:
+    """
+    Runs statement in a new interpreter with `-X importtime` and returns
+    cumulative import times in microseconds of imported modules.
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", statement],
+        capture_output=True,
+        text=True,
+        cwd=os.path.dirname(os.path.dirname(nightshift.__file__)),
+    )
+    assert result.returncode == 0, result.stderr
+    times = dict()
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        _, cumulative, name = line[len("import time:") :].split("|")
+        if cumulative.strip().isdigit():
+            times[name.strip()] = int(cumulative)
+    return times
+
+
+def test_bot_import_time_budget():
+    times = _import_times("import nightshift.bot")
+    assert not {name.split(".")[0] for name in times} & HEAVY_PACKAGES
+    assert "sqlalchemy" not in times
+    assert times["nightshift.bot"] < IMPORT_TIME_BUDGET
+
+
+@pytest.mark.parametrize(
+    "statement",
+    [
+        "from nightshift import bot, datastore_transactions;"
+        "datastore_transactions.init_db = lambda: None;"
+        "bot.main(['init', 'prod'])",
+        "from nightshift import bot, datastore_transactions;"
+        "datastore_transactions.upgrade_db = lambda: None;"
+        "bot.main(['upgrade', 'prod'])",
+        "from nightshift import bot, manager;"
+        "manager.event_stats = lambda days: [];"
+        "bot.main(['stats', 'prod'])",
+    ],
+)
+def test_short_actions_do_not_import_clients(statement):
+    times = _import_times(statement)
+    assert "nightshift.tasks" not in times
+    assert not {name.split(".")[0] for name in times} & HEAVY_PACKAGES
 
 
 def test_config_local_env_variables():
@@ -81,6 +158,8 @@ def test_run_local(
     mock_log_env,
     patch_process_resources,
     patch_perform_db_maintenance,
+    patch_run_ledger,
+    patch_run_report_dir,
 ):
     with caplog.at_level(logging.INFO):
         run(env="local")
@@ -89,6 +168,54 @@ def test_run_local(
     assert "Processing resources completed." in caplog.text
     assert "Database maintenance completed." in caplog.text
 
+    reports = list(patch_run_report_dir.glob("run-report-1-*.json"))
+    assert len(reports) == 1
+    assert f"Run report saved to {reports[0]}." in caplog.text
+
+
+def test_run_metrics_textfile(
+    monkeypatch,
+    tmp_path,
+    caplog,
+    patch_config_local_env_variables,
+    mock_log_env,
+    patch_process_resources,
+    patch_perform_db_maintenance,
+    patch_run_ledger,
+    patch_run_report_dir,
+):
+    textfile = str(tmp_path / "nightshift.prom")
+    monkeypatch.setenv("METRICS_TEXTFILE", textfile)
+    with caplog.at_level(logging.INFO):
+        run(env="local")
+
+    assert f"Metrics saved to {textfile}." in caplog.text
+    with open(textfile, "r") as f:
+        assert "# TYPE nightshift_worldcat_queries_total counter" in f.read()
+
+
+def test_run_profile(
+    monkeypatch,
+    tmp_path,
+    caplog,
+    patch_config_local_env_variables,
+    mock_log_env,
+    patch_process_resources,
+    patch_perform_db_maintenance,
+    patch_run_ledger,
+    patch_run_report_dir,
+):
+    profile_dir = tmp_path / "profiles"
+    profile_dir.mkdir()
+    monkeypatch.setenv("PROFILE_DIR", str(profile_dir))
+    monkeypatch.setenv("PROFILE_TOP_N", "5")
+    with caplog.at_level(logging.INFO):
+        main(["run", "local", "--profile"])
+
+    profiles = list(profile_dir.glob("profile-1-run-*.prof"))
+    assert len(profiles) == 1
+    assert f"Top 5 functions of run profile ({profiles[0]}):" in caplog.text
+
 
 @pytest.mark.parametrize("arg", ["local", "prod"])
 def test_main_init_arg(arg, patch_init_db, patch_config_local_env_variables, capfd):
@@ -99,12 +226,45 @@ def test_main_init_arg(arg, patch_init_db, patch_config_local_env_variables, cap
     assert f"NightShift {arg} database successfully set up." in captured.out
 
 
+@pytest.mark.parametrize(
+    "copied,message",
+    [
+        (
+            5,
+            "NightShift local database successfully upgraded. "
+            "Copied 5 event(s) to the partitioned event table.",
+        ),
+        (None, "NightShift local database is up to date."),
+    ],
+)
+def test_upgrade_database(
+    copied, message, monkeypatch, patch_config_local_env_variables, capfd
+):
+    monkeypatch.setattr(datastore_transactions, "upgrade_db", lambda: copied)
+
+    upgrade_database(env="local")
+
+    captured = capfd.readouterr()
+    assert captured.out == f"{message}\n"
+
+
+def test_main_upgrade_arg(monkeypatch, patch_config_local_env_variables, capfd):
+    monkeypatch.setattr(datastore_transactions, "upgrade_db", lambda: None)
+
+    main(["upgrade", "prod"])
+
+    captured = capfd.readouterr()
+    assert "NightShift prod database is up to date." in captured.out
+
+
 @pytest.mark.parametrize("arg", ["local", "prod"])
 def test_main_run_arg(
     arg,
     patch_config_local_env_variables,
     patch_process_resources,
     patch_perform_db_maintenance,
+    patch_run_ledger,
+    patch_run_report_dir,
     mock_log_env,
     caplog,
 ):
@@ -112,3 +272,150 @@ def test_main_run_arg(
         main(["run", f"{arg}"])
 
     assert f"Launching {arg} NightShift..." in caplog.text
+
+
+@pytest.fixture
+def patch_process_resources_streaming(monkeypatch):
+    def _patch(*args, **kwargs):
+        logging.getLogger("nightshift").info("Streaming mode.")
+
+    monkeypatch.setattr(manager, "process_resources_streaming", _patch)
+
+
+def test_main_run_arg_streaming(
+    patch_config_local_env_variables,
+    patch_process_resources_streaming,
+    patch_perform_db_maintenance,
+    patch_run_ledger,
+    patch_run_report_dir,
+    mock_log_env,
+    caplog,
+):
+    with caplog.at_level(logging.INFO):
+        main(["run", "local", "--streaming"])
+
+    assert "Streaming mode." in caplog.text
+    assert "Processing resources completed." in caplog.text
+
+
+def test_main_resume_arg(
+    monkeypatch,
+    patch_config_local_env_variables,
+    patch_process_resources,
+    patch_perform_db_maintenance,
+    patch_run_report_dir,
+    mock_log_env,
+):
+    calls = []
+
+    def _begin(*args, **kwargs):
+        calls.append(("begin", kwargs["resume"]))
+        return 3
+
+    def _complete(*args, **kwargs):
+        calls.append(("complete", args[0]))
+
+    monkeypatch.setattr(manager, "begin_run", _begin)
+    monkeypatch.setattr(manager, "complete_run", _complete)
+
+    main(["resume", "local"])
+
+    assert calls == [("begin", True), ("complete", 3)]
+
+
+@pytest.mark.parametrize(
+    "args,expectation",
+    [
+        ([], (False, None)),
+        (["--dry-run"], (True, None)),
+        (["--archive-dir", "archive"], (False, "archive")),
+    ],
+)
+def test_main_purge_arg(
+    args,
+    expectation,
+    monkeypatch,
+    patch_config_local_env_variables,
+    mock_log_env,
+    caplog,
+):
+    calls = []
+
+    def _patch(*args, **kwargs):
+        calls.append((kwargs["dry_run"], kwargs["archive_dir"]))
+
+    monkeypatch.setattr(manager, "purge_aged_resources", _patch)
+
+    with caplog.at_level(logging.INFO):
+        main(["purge", "local"] + args)
+
+    assert calls == [expectation]
+    assert "Launching local NightShift purge of aged-out resources..." in caplog.text
+    assert "Purge completed." in caplog.text
+
+
+@pytest.mark.parametrize(
+    "args,days",
+    [([], 30), (["--days", "7"], 7)],
+)
+def test_main_stats_arg(
+    args, days, monkeypatch, patch_config_local_env_variables, capfd
+):
+    def _patch(*args, **kwargs):
+        assert args[0] == days
+        return [DailyStats("NYP", "ebook", "bot_enhanced", 5)]
+
+    monkeypatch.setattr(manager, "event_stats", _patch)
+
+    main(["stats", "local"] + args)
+
+    captured = capfd.readouterr()
+    assert f"NightShift local events in the last {days} day(s):" in captured.out
+    assert "NYP\tebook\tbot_enhanced\t5" in captured.out
+
+
+def test_main_plan_arg(monkeypatch, patch_config_local_env_variables, capfd):
+    monkeypatch.setattr(
+        manager,
+        "plan_run",
+        lambda: [
+            manager.PlanRow("NYP", "ebook", "new_search", 100, 180, 150),
+            manager.PlanRow("BPL", "ebook", "new_search", 20, 20, 20),
+            manager.PlanRow("NYP", "ebook", "full_bib_download", 50, 50, 49),
+        ],
+    )
+    monkeypatch.setenv("PLAN_SEARCH_RATE", "2")
+    monkeypatch.setenv("PLAN_FULL_BIB_RATE", "1")
+
+    main(["plan", "local"])
+
+    captured = capfd.readouterr()
+    assert "NightShift local run plan:\nNYP\tebook\tnew_search\t100\t180\t150\n" in (
+        captured.out
+    )
+    assert "Total new_search: 120 resources, 200 requests (170 unique)." in (
+        captured.out
+    )
+    assert "Total full_bib_download: 50 resources, 50 requests (49 unique)." in (
+        captured.out
+    )
+    assert "Estimated duration of requests: 0:02:30." in captured.out
+
+
+def test_main_plan_arg_nothing_to_process(
+    monkeypatch, patch_config_local_env_variables, capfd
+):
+    monkeypatch.setattr(manager, "plan_run", lambda: [])
+    main(["plan", "prod"])
+    captured = capfd.readouterr()
+    assert "No resources to process." in captured.out
+    assert "Estimated duration of requests: 0:00:00." in captured.out
+
+
+def test_main_stats_arg_no_events(monkeypatch, patch_config_local_env_variables, capfd):
+    monkeypatch.setattr(manager, "event_stats", lambda *args: [])
+
+    main(["stats", "prod"])
+
+    captured = capfd.readouterr()
+    assert "No events found." in captured.out
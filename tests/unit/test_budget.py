@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+import pytest
+
+from nightshift import instrumentation
+from nightshift.budget import BudgetConfig, budget_config, RunBudget
+from nightshift.ns_exceptions import BudgetExhausted
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr("nightshift.budget.time.monotonic", lambda: now[0])
+    return now
+
+
+def _api_calls(library, n):
+    with instrumentation.stage("new_search", library):
+        instrumentation.record("apiCalls", n)
+
+
+def test_budget_config_defaults(monkeypatch):
+    for name in (
+        "RUN_MAX_API_CALLS",
+        "RUN_MAX_SECONDS",
+        "LIBRARY_MAX_API_CALLS",
+        "LIBRARY_MAX_SECONDS",
+    ):
+        monkeypatch.delenv(name, raising=False)
+    assert budget_config() == (None, None, None, None)
+
+
+def test_budget_config(monkeypatch):
+    monkeypatch.setenv("RUN_MAX_API_CALLS", "5000")
+    monkeypatch.setenv("RUN_MAX_SECONDS", "3600")
+    monkeypatch.setenv("LIBRARY_MAX_API_CALLS", "3000")
+    monkeypatch.setenv("LIBRARY_MAX_SECONDS", "")
+    assert budget_config() == (5000, 3600, 3000, None)
+
+
+@pytest.mark.parametrize("arg", ["foo", "0", "-1"])
+def test_budget_config_invalid_cap(monkeypatch, arg):
+    monkeypatch.setenv("RUN_MAX_SECONDS", arg)
+    with pytest.raises(ValueError) as exc:
+        budget_config()
+    assert "Invalid RUN_MAX_SECONDS value." in str(exc.value)
+
+
+def test_run_budget_unlimited(clock):
+    instrumentation.start_report()
+    budget = RunBudget()
+    budget.start_library("NYP")
+    _api_calls("NYP", 10000)
+    clock[0] += 100000
+    assert budget.exhausted("NYP") is None
+
+
+def test_run_budget_spent(clock):
+    instrumentation.start_report()
+    _api_calls("NYP", 5)
+    budget = RunBudget()
+    _api_calls("NYP", 2)
+    clock[0] += 10
+    budget.start_library("BPL")
+    _api_calls("BPL", 3)
+    clock[0] += 5
+    assert budget.spent() == (5, 15.0)
+    assert budget.spent("BPL") == (3, 5.0)
+
+
+@pytest.mark.parametrize(
+    "config,library,calls,seconds,expectation",
+    [
+        (BudgetConfig(runApiCalls=10), "NYP", 9, 0, None),
+        (
+            BudgetConfig(runApiCalls=10),
+            "NYP",
+            10,
+            0,
+            "run budget of 10 API calls exhausted",
+        ),
+        (
+            BudgetConfig(runSeconds=60),
+            None,
+            0,
+            60,
+            "run budget of 60 seconds exhausted",
+        ),
+        (BudgetConfig(libraryApiCalls=10), None, 10, 0, None),
+        (
+            BudgetConfig(libraryApiCalls=10),
+            "NYP",
+            10,
+            0,
+            "NYP budget of 10 API calls exhausted",
+        ),
+        (
+            BudgetConfig(librarySeconds=60),
+            "NYP",
+            0,
+            60,
+            "NYP budget of 60 seconds exhausted",
+        ),
+    ],
+)
+def test_run_budget_exhausted(clock, config, library, calls, seconds, expectation):
+    instrumentation.start_report()
+    budget = RunBudget(config)
+    budget.start_library("NYP")
+    _api_calls("NYP", calls)
+    clock[0] += seconds
+    assert budget.exhausted(library) == expectation
+
+
+def test_run_budget_library_caps_reset_for_each_library(clock):
+    instrumentation.start_report()
+    budget = RunBudget(BudgetConfig(runApiCalls=20, libraryApiCalls=10))
+    budget.start_library("NYP")
+    _api_calls("NYP", 10)
+    assert budget.exhausted("NYP") is not None
+
+    budget.start_library("BPL")
+    assert budget.exhausted("BPL") is None
+    _api_calls("BPL", 10)
+    assert budget.exhausted("BPL") == "run budget of 20 API calls exhausted"
+
+
+def test_run_budget_check(clock):
+    instrumentation.start_report()
+    budget = RunBudget(BudgetConfig(runSeconds=60))
+    budget.check("NYP")
+    clock[0] += 60
+    with pytest.raises(BudgetExhausted) as exc:
+        budget.check("NYP")
+    assert str(exc.value) == "run budget of 60 seconds exhausted"
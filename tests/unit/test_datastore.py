@@ -13,12 +13,14 @@ from nightshift.datastore import (
     conf_db,
     DataAccessLayer,
     Event,
+    EventDailyStats,
     Library,
     OutputFile,
     Resource,
     ResourceCategory,
     RottenApple,
     RottenAppleResource,
+    RunLedger,
     session_scope,
     SourceFile,
     WorldcatQuery,
@@ -81,6 +83,23 @@ def test_Event_tbl_repr():
     )
 
 
+def test_EventDailyStats_tbl_repr():
+    today = datetime.now(timezone.utc).date()
+    assert (
+        str(
+            EventDailyStats(
+                day=today,
+                libraryId=1,
+                resourceCategoryId=1,
+                status="worldcat_hit",
+                tally=5,
+            )
+        )
+        == f"<EventDailyStats(day='{today}', libraryId='1', resourceCategoryId='1', "
+        "status='worldcat_hit', tally='5')>"
+    )
+
+
 def test_Library_tbl_repr():
     assert str(Library(nid=1, code="foo")) == "<Library(nid='1', code='foo')>"
 
@@ -161,6 +180,24 @@ def test_RottenAppleResource_tbl_repr():
     )
 
 
+def test_RunLedger_tbl_repr():
+    stamp = datetime.now()
+    assert str(
+        RunLedger(
+            nid=1,
+            runId=2,
+            stage="sierra_check",
+            libraryId=1,
+            resourceCategoryId=3,
+            queryWindow="30-90",
+            timestamp=stamp,
+        )
+    ) == (
+        f"<RunLedger(nid='1', runId='2', stage='sierra_check', libraryId='1', "
+        f"resourceCategoryId='3', queryWindow='30-90', timestamp='{stamp}')>"
+    )
+
+
 def test_SourceFile_tbl_repr():
     stamp = datetime.now()
     assert str(SourceFile(nid=1, libraryId=2, handle="foo.mrc", timestamp=stamp)) == (
@@ -3,65 +3,102 @@ from datetime import datetime, timedelta, timezone
 from contextlib import nullcontext as does_not_raise
 
 import pytest
-from sqlalchemy import create_engine, inspect
+from sqlalchemy import create_engine, inspect, text
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.orm.exc import NoResultFound
 from sqlalchemy.exc import IntegrityError
 
 
+from nightshift import reference_data
 from nightshift.constants import RESOURCE_CATEGORIES
 
 from nightshift.datastore import (
     Base,
     Event,
+    EventDailyStats,
     Library,
     Resource,
     ResourceCategory,
     RottenApple,
     RottenAppleResource,
+    RunLedger,
     SourceFile,
     WorldcatQuery,
 )
 from nightshift.datastore_transactions import (
+    EventSink,
     ResCatById,
+    ResQueryData,
     ResCatByName,
     add_event,
+    add_ledger_entry,
     add_output_file,
     add_resource,
     add_source_file,
+    count_resources_to_delete,
+    create_event_partitions,
     delete_resources,
+    delete_resources_by_nid,
+    event_table_partitioned,
+    expire_resources,
+    finalize_upgraded_resources,
     init_db,
     insert_or_ignore,
+    iter_new_resources,
+    iter_open_matched_resources_with_full_bib_obtained,
+    iter_open_matched_resources_without_full_bib,
+    iter_open_older_resources,
     library_by_id,
     parse_query_days,
+    partition_event_table,
+    rebuild_daily_stats,
     resource_category_by_name,
+    resource_query_data,
+    retrieve_completed_run_units,
+    retrieve_daily_stats,
+    retrieve_deletion_archive_rows,
     retrieve_expired_resources,
     retrieve_open_matched_resources_with_full_bib_obtained,
     retrieve_open_matched_resources_without_full_bib,
     retrieve_new_resources,
+    retrieve_new_resources_query_data,
+    retrieve_nids_of_resources_to_delete,
     retrieve_open_older_resources,
+    retrieve_open_older_resources_query_data,
     retrieve_processed_files,
     retrieve_rotten_apples,
+    retrieve_unfinished_run,
     set_resources_to_expired,
+    start_run,
     update_resource,
+    update_resource_by_nid,
+    upgrade_db,
 )
 
 
-def test_init_db(mock_db_env, test_connection):
+def test_init_db(monkeypatch, mock_db_env, test_connection):
     # make sure drop any tables left over after any previous
     # failed test
     engine = create_engine(test_connection)
     Base.metadata.drop_all(engine)
+    monkeypatch.setattr(reference_data, "_cache", "stale reference data")
 
     # initiate database
     with does_not_raise():
         init_db()
+    assert reference_data.cached() is None
 
     # verify tables created and populated
+    today = datetime.now(timezone.utc).date()
+    next_month = (today.replace(day=1) + timedelta(days=32)).replace(day=1)
     insp = inspect(engine)
     assert sorted(insp.get_table_names()) == sorted(
         [
             "event",
+            "event_daily_stats",
+            "event_default",
+            f"event_y{today.year}m{today.month:02}",
+            f"event_y{next_month.year}m{next_month.month:02}",
             "library",
             "output_file",
             "source_file",
@@ -69,6 +106,7 @@ def test_init_db(mock_db_env, test_connection):
             "rotten_apple",
             "rotten_apple_resource",
             "resource_category",
+            "run_ledger",
             "worldcat_query",
         ]
     )
@@ -127,6 +165,19 @@ def test_add_event_always_insert(test_session, test_data_rich):
     assert len(results) == 2
 
 
+def test_add_ledger_entry(test_session, test_data_core):
+    entry = add_ledger_entry(test_session, 1, "sierra_check", 1, 2, "30-90")
+    test_session.commit()
+
+    assert entry.nid == 1
+    assert entry.runId == 1
+    assert entry.stage == "sierra_check"
+    assert entry.libraryId == 1
+    assert entry.resourceCategoryId == 2
+    assert entry.queryWindow == "30-90"
+    assert isinstance(entry.timestamp, datetime)
+
+
 def test_add_output_file(test_session, test_data_core):
     result = add_output_file(test_session, 1, "bar.mrc")
     assert result.nid == 1
@@ -200,6 +251,140 @@ def test_add_source_file(test_session, test_data_core):
     assert rec.handle == "bar.mrc"
 
 
+@pytest.fixture
+def resources_of_various_age(test_session, test_data_core):
+    for n, age in enumerate([300, 10, 400, 280], start=1):
+        test_session.add(
+            Resource(
+                nid=n,
+                sierraId=22222220 + n,
+                libraryId=1,
+                sourceId=1,
+                resourceCategoryId=1,
+                status="expired",
+                bibDate=datetime.now(timezone.utc).date() - timedelta(days=age),
+                queries=[WorldcatQuery(match=False, response={"foo": n})],
+            )
+        )
+    test_session.commit()
+
+
+def test_count_resources_to_delete(test_session, resources_of_various_age):
+    assert count_resources_to_delete(test_session, 1, 270) == 3
+    assert count_resources_to_delete(test_session, 1, 500) == 0
+    assert count_resources_to_delete(test_session, 2, 270) == 0
+
+
+def test_create_event_partitions(test_session, test_data_core):
+    today = datetime.now(timezone.utc).date()
+    months = [today.replace(day=1)]
+    for _ in range(2):
+        months.append((months[-1] + timedelta(days=32)).replace(day=1))
+    names = [f"event_y{m.year}m{m.month:02}" for m in months]
+
+    assert create_event_partitions(test_session, months_ahead=2) == names
+    assert create_event_partitions(test_session, months_ahead=2) == []
+    test_session.commit()
+
+    test_session.add(
+        Event(
+            libraryId=1,
+            sierraId=11111111,
+            bibDate=today,
+            resourceCategoryId=1,
+            status="expired",
+            timestamp=datetime.now(timezone.utc),
+        )
+    )
+    test_session.commit()
+    partition = test_session.execute(
+        text("SELECT tableoid::regclass::text FROM event")
+    ).scalar()
+    assert partition == names[0]
+
+
+def test_create_event_partitions_skips_month_in_default_partition(
+    test_session, test_data_core
+):
+    today = datetime.now(timezone.utc).date()
+    test_session.add(
+        Event(
+            libraryId=1,
+            sierraId=11111111,
+            bibDate=today,
+            resourceCategoryId=1,
+            status="expired",
+            timestamp=datetime.now(timezone.utc),
+        )
+    )
+    test_session.commit()
+
+    next_month = (today.replace(day=1) + timedelta(days=32)).replace(day=1)
+    assert create_event_partitions(test_session) == [
+        f"event_y{next_month.year}m{next_month.month:02}"
+    ]
+
+
+def test_create_event_partitions_unpartitioned_table(
+    test_session, unpartitioned_event_table
+):
+    assert create_event_partitions(test_session) == []
+
+
+def test_event_table_partitioned(test_session, test_data_core):
+    assert event_table_partitioned(test_session) is True
+
+
+def test_event_table_partitioned_false(test_session, unpartitioned_event_table):
+    assert event_table_partitioned(test_session) is False
+
+
+def test_partition_event_table(test_session, unpartitioned_event_table):
+    today = datetime.now(timezone.utc).date()
+
+    assert partition_event_table(test_session) == 2
+    test_session.commit()
+
+    assert event_table_partitioned(test_session) is True
+    partitions = test_session.execute(
+        text("SELECT tableoid::regclass::text FROM event ORDER BY nid")
+    ).scalars()
+    assert list(partitions) == [
+        f"event_y{today.year}m{today.month:02}",
+        "event_default",
+    ]
+    assert test_session.execute(
+        text("SELECT to_regclass('event_unpartitioned') IS NULL")
+    ).scalar()
+    assert sum(s.tally for s in test_session.query(EventDailyStats).all()) == 2
+
+    # nid sequence continues numbering of copied events
+    event = Event(
+        libraryId=1,
+        sierraId=11111111,
+        bibDate=today,
+        resourceCategoryId=1,
+        status="expired",
+        timestamp=datetime.now(timezone.utc),
+    )
+    test_session.add(event)
+    test_session.commit()
+    assert event.nid == 3
+
+    # the rollup is maintained by the trigger of the new table
+    assert sum(s.tally for s in test_session.query(EventDailyStats).all()) == 3
+
+    assert partition_event_table(test_session) is None
+
+
+def test_upgrade_db(mock_db_env, test_session, unpartitioned_event_table):
+    test_session.close()
+
+    assert upgrade_db() == 2
+    assert event_table_partitioned(test_session) is True
+    assert upgrade_db() is None
+
+
 def test_delete_resources(test_session, test_data_rich):
     nid = RESOURCE_CATEGORIES["ebook"]["nid"]
     last_period = RESOURCE_CATEGORIES["ebook"]["queryDays"].split(",")[-1]
@@ -269,6 +454,171 @@ def test_delete_resources_too_early(test_session, test_data_rich):
     assert len(result) == 2
 
 
+def test_delete_resources_by_nid(test_session, resources_of_various_age):
+    assert delete_resources_by_nid(test_session, [1, 3]) == 2
+    test_session.commit()
+
+    assert [r.nid for r in test_session.query(Resource).order_by(Resource.nid)] == [
+        2,
+        4,
+    ]
+    assert sorted(q.resourceId for q in test_session.query(WorldcatQuery)) == [2, 4]
+
+
+def test_event_sink_inserts_on_commit(test_session, test_data_rich):
+    resource = test_session.query(Resource).filter_by(nid=1).one()
+    sink = EventSink(test_session)
+    sink.add(resource, status="worldcat_hit")
+    sink.add(resource, status="bot_enhanced")
+
+    assert len(sink.buffer) == 2
+    assert test_session.query(Event).count() == 0
+
+    test_session.commit()
+
+    assert sink.buffer == []
+    events = test_session.query(Event).order_by(Event.nid).all()
+    assert [e.status for e in events] == ["worldcat_hit", "bot_enhanced"]
+    assert events[0].libraryId == 1
+    assert events[0].sierraId == 11111111
+    assert events[0].bibDate == resource.bibDate
+    assert events[0].resourceCategoryId == 1
+    assert events[0].timestamp.date() == datetime.now(timezone.utc).date()
+
+
+def test_event_sink_flush(test_session, test_data_rich):
+    resource = test_session.query(Resource).filter_by(nid=1).one()
+    sink = EventSink(test_session)
+    assert sink.flush() == 0
+
+    sink.add(resource, status="worldcat_miss")
+    assert sink.flush() == 1
+    assert sink.buffer == []
+    assert test_session.query(Event).count() == 1
+
+
+def test_event_sink_discards_on_rollback(test_session, test_data_rich):
+    resource = test_session.query(Resource).filter_by(nid=1).one()
+    sink = EventSink(test_session)
+    sink.add(resource, status="worldcat_miss")
+
+    test_session.rollback()
+    test_session.commit()
+
+    assert sink.buffer == []
+    assert test_session.query(Event).count() == 0
+
+
+def test_event_sink_close(test_session, test_data_rich):
+    resource = test_session.query(Resource).filter_by(nid=1).one()
+    sink = EventSink(test_session)
+    sink.add(resource, status="worldcat_miss")
+    sink.close()
+
+    test_session.commit()
+
+    assert sink.buffer == []
+    assert test_session.query(Event).count() == 0
+
+    sink.add(resource, status="worldcat_hit")
+    test_session.commit()
+    assert test_session.query(Event).count() == 1
+
+
+def test_event_sink_of_session(test_session, test_data_rich):
+    resource = test_session.query(Resource).filter_by(nid=1).one()
+    sink = EventSink.of_session(test_session)
+    assert EventSink.of_session(test_session) is sink
+
+    sink.add(resource, status="worldcat_hit")
+    EventSink.of_session(test_session).add(resource, status="bot_enhanced")
+    test_session.commit()
+
+    assert test_session.query(Event).count() == 2
+
+
+@pytest.mark.parametrize(
+    "age_offset,status,tally", [(1, "expired", 1), (-1, "open", 0)]
+)
+def test_expire_resources(test_session, test_data_rich, age_offset, status, tally):
+    nid = RESOURCE_CATEGORIES["ebook"]["nid"]
+    last_period = RESOURCE_CATEGORIES["ebook"]["queryDays"].split(",")[-1]
+    last_day = int(last_period.split("-")[-1])
+    bib_date = (
+        datetime.now(timezone.utc) - timedelta(days=last_day + age_offset)
+    ).date()
+
+    test_session.add(
+        Resource(
+            sierraId=22222222,
+            libraryId=1,
+            sourceId=1,
+            resourceCategoryId=1,
+            status="open",
+            bibDate=bib_date,
+        )
+    )
+    test_session.commit()
+
+    result = expire_resources(test_session, nid, last_day)
+    test_session.commit()
+    assert result == tally
+
+    resource_not_changed = (
+        test_session.query(Resource).filter_by(sierraId=11111111).one()
+    )
+    resource = test_session.query(Resource).filter_by(sierraId=22222222).one()
+    assert resource_not_changed.status == "bot_enhanced"
+    assert resource.status == status
+
+    events = test_session.query(Event).all()
+    assert len(events) == tally
+    for event in events:
+        assert event.libraryId == 1
+        assert event.sierraId == 22222222
+        assert event.bibDate == bib_date
+        assert event.resourceCategoryId == 1
+        assert event.status == "expired"
+        assert event.timestamp is not None
+
+
+def test_finalize_upgraded_resources(test_session, test_data_core):
+    for n in range(1, 4):
+        test_session.add(
+            Resource(
+                nid=n,
+                sierraId=22222220 + n,
+                libraryId=1,
+                sourceId=1,
+                resourceCategoryId=1,
+                status="open",
+                bibDate=datetime.now(timezone.utc).date(),
+            )
+        )
+    out_file = add_output_file(test_session, 1, "foo.mrc")
+    test_session.commit()
+
+    assert finalize_upgraded_resources(test_session, [1, 3], out_file.nid) == 2
+    test_session.commit()
+
+    resources = test_session.query(Resource).order_by(Resource.nid).all()
+    assert [r.status for r in resources] == ["bot_enhanced", "open", "bot_enhanced"]
+    assert [r.outputId for r in resources] == [out_file.nid, None, out_file.nid]
+    assert resources[0].enhanceTimestamp is not None
+    assert resources[1].enhanceTimestamp is None
+
+    events = test_session.query(Event).order_by(Event.sierraId).all()
+    assert [(e.sierraId, e.status) for e in events] == [
+        (22222221, "bot_enhanced"),
+        (22222223, "bot_enhanced"),
+    ]
+    assert events[0].timestamp == resources[0].enhanceTimestamp
+
+
+def test_finalize_upgraded_resources_no_resources(test_session, test_data_core):
+    assert finalize_upgraded_resources(test_session, [], 1) == 0
+
+
 def test_insert_or_ignore_new(test_session):
     rec = insert_or_ignore(test_session, Library, code="NYP")
     test_session.commit()
@@ -317,6 +667,134 @@ def test_insert_or_ignore_resubmitted_changed_record_exception(
         test_session.commit()
 
 
+@pytest.fixture
+def resources_for_streaming(test_session, test_data_core):
+    bib_date = datetime.now(timezone.utc) - timedelta(days=60)
+    data = [
+        # nid, category, oclc #, full bib, queried
+        (1, 2, None, None, False),
+        (2, 1, None, None, False),
+        (3, 1, None, None, True),
+        (4, 2, "1234", None, True),
+        (5, 1, "1234", None, True),
+        (6, 1, "1234", b"<foo/>", True),
+        (7, 1, None, None, False),
+        (8, 1, "1234", b"<foo/>", True),
+        (9, 1, None, None, True),
+    ]
+    for nid, res_cat_id, oclc_number, full_bib, queried in data:
+        if queried:
+            queries = [
+                WorldcatQuery(match=False, timestamp=bib_date + timedelta(days=1))
+            ]
+        else:
+            queries = []
+        test_session.add(
+            Resource(
+                nid=nid,
+                sierraId=22222220 + nid,
+                libraryId=1,
+                bibDate=bib_date,
+                resourceCategoryId=res_cat_id,
+                sourceId=1,
+                oclcMatchNumber=oclc_number,
+                fullBib=full_bib,
+                status="open",
+                queries=queries,
+            )
+        )
+    test_session.commit()
+
+
+@pytest.mark.parametrize("page_size", [1, 2, 500])
+def test_iter_resources_match_retrieve_functions(
+    test_session, resources_for_streaming, page_size
+):
+    assert [
+        r.nid for r in iter_new_resources(test_session, 1, page_size=page_size)
+    ] == [r.nid for r in retrieve_new_resources(test_session, 1)]
+    assert [
+        r.nid
+        for r in iter_open_matched_resources_without_full_bib(
+            test_session, 1, page_size=page_size
+        )
+    ] == [
+        r.nid for r in retrieve_open_matched_resources_without_full_bib(test_session, 1)
+    ]
+    assert [
+        r.nid
+        for r in iter_open_matched_resources_with_full_bib_obtained(
+            test_session, 1, 1, page_size=page_size
+        )
+    ] == sorted(
+        r.nid
+        for r in retrieve_open_matched_resources_with_full_bib_obtained(
+            test_session, 1, 1
+        )
+    )
+    assert [
+        r.nid
+        for r in iter_open_older_resources(
+            test_session, 1, 1, 30, 90, page_size=page_size
+        )
+    ] == sorted(
+        r.nid for r in retrieve_open_older_resources(test_session, 1, 1, 30, 90)
+    )
+
+
+def test_query_data_match_retrieve_functions(test_session, resources_for_streaming):
+    new = retrieve_new_resources_query_data(test_session, 1)
+    assert all(isinstance(r, ResQueryData) for r in new)
+    assert new == [
+        resource_query_data(r) for r in retrieve_new_resources(test_session, 1)
+    ]
+
+    older = retrieve_open_older_resources_query_data(test_session, 1, 1, 30, 90)
+    assert all(isinstance(r, ResQueryData) for r in older)
+    assert older == sorted(
+        (
+            resource_query_data(r)
+            for r in retrieve_open_older_resources(test_session, 1, 1, 30, 90)
+        ),
+        key=lambda r: r.nid,
+    )
+
+
+def test_iter_new_resources_order(test_session, resources_for_streaming):
+    assert [r.nid for r in iter_new_resources(test_session, 1, page_size=1)] == [
+        2,
+        7,
+        1,
+    ]
+
+
+def test_iter_open_older_resources(test_session, resources_for_streaming):
+    assert [r.nid for r in iter_open_older_resources(test_session, 1, 1, 30, 90)] == [
+        3,
+        9,
+    ]
+
+
+def test_iter_resources_columns(test_session, resources_for_streaming):
+    rows = list(
+        iter_new_resources(test_session, 1, page_size=2, columns=(Resource.sierraId,))
+    )
+    assert [r.sierraId for r in rows] == [22222222, 22222227, 22222221]
+    assert not isinstance(rows[0], Resource)
+
+    rows = list(
+        iter_open_matched_resources_with_full_bib_obtained(
+            test_session, 1, 1, columns=(Resource.nid, Resource.oclcMatchNumber)
+        )
+    )
+    assert rows == [(6, "1234"), (8, "1234")]
+
+
+def test_iter_resources_invalid_page_size(test_session, resources_for_streaming):
+    with pytest.raises(ValueError):
+        list(iter_new_resources(test_session, 1, page_size=0))
+
+
 def test_library_by_id(test_session, test_data_core):
     assert library_by_id(test_session) == {1: "NYP", 2: "BPL"}
 
@@ -329,6 +807,54 @@ def test_parse_query_days(arg, expectation):
     assert parse_query_days(arg) == expectation
 
 
+def test_event_daily_stats_rollup_trigger(test_session, test_data_core):
+    stamp = datetime.now(timezone.utc)
+    for status in ["worldcat_hit", "worldcat_hit", "bot_enhanced", None]:
+        test_session.add(
+            Event(
+                libraryId=1,
+                sierraId=11111111,
+                bibDate=stamp.date(),
+                resourceCategoryId=1,
+                status=status,
+                timestamp=stamp,
+            )
+        )
+    test_session.commit()
+
+    rows = test_session.query(EventDailyStats).order_by(EventDailyStats.status).all()
+    assert [
+        (r.day, r.libraryId, r.resourceCategoryId, r.status, r.tally) for r in rows
+    ] == [
+        (stamp.date(), 1, 1, "bot_enhanced", 1),
+        (stamp.date(), 1, 1, "worldcat_hit", 2),
+    ]
+
+
+def test_rebuild_daily_stats(test_session, test_data_core):
+    stamp = datetime.now(timezone.utc)
+    for status in ["expired", "expired", "worldcat_miss"]:
+        test_session.add(
+            Event(
+                libraryId=2,
+                sierraId=11111111,
+                bibDate=stamp.date(),
+                resourceCategoryId=1,
+                status=status,
+                timestamp=stamp - timedelta(days=1),
+            )
+        )
+    test_session.commit()
+    test_session.query(EventDailyStats).delete()
+    test_session.commit()
+
+    assert rebuild_daily_stats(test_session) == 2
+    test_session.commit()
+    rows = test_session.query(EventDailyStats).order_by(EventDailyStats.status).all()
+    assert [(r.status, r.tally) for r in rows] == [("expired", 2), ("worldcat_miss", 1)]
+    assert rows[0].day == (stamp - timedelta(days=1)).date()
+
+
 @pytest.mark.parametrize(
     "nid, name, formatBpl, formatNyp, srcTags, dstTags, days",
     [
@@ -397,6 +923,60 @@ def test_resource_category_by_name(
     assert rs[name].queryDays == days
 
 
+def test_retrieve_completed_run_units(test_session, test_data_core):
+    add_ledger_entry(test_session, 1, "run_started")
+    add_ledger_entry(test_session, 1, "ingest", 1)
+    add_ledger_entry(test_session, 1, "sierra_check", 1, 1, "30-90")
+    add_ledger_entry(test_session, 2, "ingest", 2)
+    test_session.commit()
+
+    assert retrieve_completed_run_units(test_session, 1) == {
+        ("run_started", None, None, None),
+        ("ingest", 1, None, None),
+        ("sierra_check", 1, 1, "30-90"),
+    }
+    assert retrieve_completed_run_units(test_session, 3) == set()
+
+
+def test_retrieve_daily_stats(test_session, test_data_core):
+    today = datetime.now(timezone.utc).date()
+    for day, libraryId, status, tally in [
+        (today, 1, "worldcat_hit", 3),
+        (today - timedelta(days=1), 1, "worldcat_hit", 2),
+        (today - timedelta(days=1), 2, "expired", 1),
+        (today - timedelta(days=10), 1, "worldcat_hit", 5),
+    ]:
+        test_session.add(
+            EventDailyStats(
+                day=day,
+                libraryId=libraryId,
+                resourceCategoryId=1,
+                status=status,
+                tally=tally,
+            )
+        )
+    test_session.commit()
+
+    rows = retrieve_daily_stats(test_session, today - timedelta(days=1))
+    assert rows == [("BPL", "ebook", "expired", 1), ("NYP", "ebook", "worldcat_hit", 5)]
+    assert rows[0].library == "BPL"
+    assert rows[1].tally == 5
+
+    assert retrieve_daily_stats(
+        test_session, today - timedelta(days=10), today - timedelta(days=10)
+    ) == [("NYP", "ebook", "worldcat_hit", 5)]
+
+
+def test_retrieve_deletion_archive_rows(test_session, resources_of_various_age):
+    rows = retrieve_deletion_archive_rows(test_session, [3, 1])
+    assert [r["nid"] for r in rows] == [1, 3]
+    assert rows[0]["sierraId"] == 22222221
+    assert rows[0]["status"] == "expired"
+    assert len(rows[0]["queries"]) == 1
+    assert rows[0]["queries"][0]["resourceId"] == 1
+    assert rows[0]["queries"][0]["response"] == {"foo": 1}
+
+
 def test_retrieve_expired_resources(test_session, test_data_rich):
     # single test record serves as control data
     # it should not be caught by this query
@@ -669,6 +1249,19 @@ def test_retrieve_open_older_resources_invalid_resources(
     assert [r.nid for r in res] == expectation
 
 
+@pytest.mark.parametrize(
+    "limit,after_nid,expectation",
+    [(10, 0, [1, 3, 4]), (2, 0, [1, 3]), (2, 3, [4]), (2, 4, [])],
+)
+def test_retrieve_nids_of_resources_to_delete(
+    test_session, resources_of_various_age, limit, after_nid, expectation
+):
+    assert (
+        retrieve_nids_of_resources_to_delete(test_session, 1, 270, limit, after_nid)
+        == expectation
+    )
+
+
 def test_retrieve_new_resources(test_session, test_data_core):
 
     # BPL resources
@@ -864,6 +1457,20 @@ def test_retrieve_rotten_apples(test_session, test_data_core):
     assert orgs == {1: ["UKAHL", "UAH", "FOO"], 2: ["UKAHL"], 3: ["UKAHL"]}
 
 
+def test_retrieve_unfinished_run(test_session, test_data_core):
+    assert retrieve_unfinished_run(test_session) is None
+
+    add_ledger_entry(test_session, 1, "run_started")
+    add_ledger_entry(test_session, 1, "run_completed")
+    test_session.commit()
+    assert retrieve_unfinished_run(test_session) is None
+
+    add_ledger_entry(test_session, 2, "run_started")
+    add_ledger_entry(test_session, 2, "ingest", 1)
+    test_session.commit()
+    assert retrieve_unfinished_run(test_session) == 2
+
+
 def test_set_resources_to_expired(test_session, test_data_rich, stub_resource):
     nid = RESOURCE_CATEGORIES["ebook"]["nid"]
     last_period = RESOURCE_CATEGORIES["ebook"]["queryDays"].split(",")[-1]
@@ -926,6 +1533,18 @@ def test_set_resources_to_expired_too_early(
     assert resource_set_to_expired.status == "open"
 
 
+def test_start_run(test_session, test_data_core):
+    assert start_run(test_session) == 1
+    assert start_run(test_session) == 2
+    test_session.commit()
+
+    entries = test_session.query(RunLedger).all()
+    assert [(e.runId, e.stage) for e in entries] == [
+        (1, "run_started"),
+        (2, "run_started"),
+    ]
+
+
 def test_update_resource(test_session):
     lib_rec = insert_or_ignore(test_session, Library, code="NYP")
     cat_rec = insert_or_ignore(
@@ -966,3 +1585,15 @@ def test_update_resource(test_session):
 def test_update_resource_instance_does_not_exist(test_session):
     with pytest.raises(NoResultFound):
         update_resource(test_session, sierraId=22222222, libraryId=1, status="expired")
+
+
+def test_update_resource_by_nid(test_session, resources_for_streaming):
+    assert update_resource_by_nid(test_session, 2, oclcMatchNumber="5678") == 1
+    test_session.commit()
+
+    res = test_session.query(Resource).filter_by(nid=2).one()
+    assert res.oclcMatchNumber == "5678"
+
+
+def test_update_resource_by_nid_instance_does_not_exist(test_session):
+    assert update_resource_by_nid(test_session, 1, status="expired") == 0
@@ -0,0 +1,289 @@
+# -*- coding: utf-8 -*-
+from io import BytesIO
+import time
+
+import pytest
+from pymarc import MARCReader, parse_xml_to_array
+import requests
+
+from nightshift.comms.storage import Drive, get_credentials
+from nightshift.comms.worldcat import Worldcat
+
+from ..fake_services import (
+    FakePlatform,
+    FakeSolr,
+    FakeWorldcat,
+    ServiceConfig,
+    route_requests,
+)
+from ..fake_services.base import Throttle
+from ..fake_services.synthetic import (
+    SyntheticCatalog,
+    isbn13,
+    main,
+    sierra_check_digit,
+)
+
+
+def test_throttle_defaults():
+    throttle = Throttle(ServiceConfig())
+    assert throttle.admit()
+    assert not throttle.fails()
+
+
+def test_throttle_rate_limit():
+    throttle = Throttle(ServiceConfig(rateLimit=2))
+    assert throttle.admit()
+    assert throttle.admit()
+    assert not throttle.admit()
+
+    start = time.monotonic()
+    assert throttle.admit(wait=True)
+    assert time.monotonic() - start > 0.2
+
+
+def test_throttle_error_rate():
+    throttle = Throttle(ServiceConfig(errorRate=0.5, seed=1))
+    failed = sum(throttle.fails() for _ in range(1000))
+    assert 400 < failed < 600
+
+
+def test_throttle_latency():
+    throttle = Throttle(ServiceConfig(latency=0.05, jitter=0.01))
+    start = time.monotonic()
+    throttle.delay()
+    assert 0.05 <= time.monotonic() - start
+
+
+def test_fake_service_errors_and_rate_limit():
+    with FakeWorldcat(ServiceConfig(errorRate=1.0, errorStatus=503)) as service:
+        response = requests.post(f"{service.url}/token")
+        assert response.status_code == 503
+        assert service.requests == {"errors": 1}
+
+    with FakeWorldcat(ServiceConfig(rateLimit=1)) as service:
+        responses = [requests.post(f"{service.url}/token") for _ in range(2)]
+        assert [r.status_code for r in responses] == [200, 429]
+        assert responses[1].headers["Retry-After"] == "1"
+
+
+def test_fake_service_url_not_running():
+    with pytest.raises(RuntimeError):
+        FakeWorldcat().url
+
+
+def test_route_requests():
+    with FakeWorldcat() as service:
+        with route_requests({"https://metadata.api.oclc.org": service.url}):
+            response = requests.get(
+                "https://metadata.api.oclc.org/worldcat/manage/bibs/12345"
+            )
+    assert response.status_code == 200
+    assert b'<controlfield tag="001">ocn12345</controlfield>' in response.content
+    assert requests.adapters.HTTPAdapter.send.__name__ == "send"
+
+
+@pytest.mark.parametrize(
+    "matchRate,matches,expectation",
+    [
+        (1.0, None, 1),
+        (0.0, None, 0),
+        (0.0, {"ODN0001": "123"}, 1),
+        (1.0, {"foo": "123"}, 0),
+    ],
+)
+def test_fake_worldcat_brief_bibs_search(matchRate, matches, expectation):
+    with FakeWorldcat(matchRate=matchRate, matches=matches) as service:
+        response = requests.get(
+            f"{service.url}/worldcat/search/brief-bibs",
+            params={"q": "sn=ODN0001 NOT lv:3"},
+        )
+    assert response.json()["numberOfRecords"] == expectation
+    assert service.requests == {"brief_bibs_search": 1}
+
+
+def test_fake_worldcat_matches_are_stable():
+    with FakeWorldcat() as service:
+        numbers = [
+            requests.get(
+                f"{service.url}/worldcat/search/brief-bibs",
+                params={"q": "bn:9781234567890"},
+            ).json()["briefRecords"][0]["oclcNumber"]
+            for _ in range(2)
+        ]
+    assert numbers[0] == numbers[1]
+
+
+def test_fake_worldcat_serves_records():
+    with FakeWorldcat(records={"1": b"<record/>"}) as service:
+        response = requests.get(f"{service.url}/worldcat/manage/bibs/1")
+        assert response.content == b"<record/>"
+        response = requests.get(f"{service.url}/foo")
+        assert response.status_code == 404
+
+
+def test_worldcat_against_fake(fake_services, stub_resource):
+    stub_resource.distributorNumber = "ODN0001"
+    with Worldcat("NYP") as worldcat:
+        results = list(worldcat.get_brief_bibs([stub_resource]))
+        assert results[0][1].is_match
+
+        stub_resource.oclcMatchNumber = results[0][1].oclc_number
+        full_bibs = list(worldcat.get_full_bibs([stub_resource]))
+
+    assert b"<record" in full_bibs[0][1]
+    assert fake_services.worldcat.requests == {
+        "token": 1,
+        "brief_bibs_search": 1,
+        "bib_get": 1,
+    }
+
+
+@pytest.mark.parametrize(
+    "deletedRate,enhancedRate,expectation",
+    [(0.0, 0.0, "open"), (1.0, 0.0, "staff_deleted"), (0.0, 1.0, "staff_enhanced")],
+)
+def test_fake_sierra_status(deletedRate, enhancedRate, expectation):
+    assert (
+        FakePlatform(deletedRate=deletedRate, enhancedRate=enhancedRate).status(
+            "22222222"
+        )
+        == expectation
+    )
+
+
+def test_fake_platform():
+    with FakePlatform(deletedRate=1.0) as service:
+        token = requests.post(f"{service.url}/oauth/token").json()
+        response = requests.get(f"{service.url}/api/v0.1/bibs/sierra-nypl/22222222")
+    assert token["access_token"]
+    assert response.json()["data"]["id"] == "22222222"
+    assert response.json()["data"]["deleted"]
+
+
+def test_fake_solr():
+    with FakeSolr(enhancedRate=1.0) as service:
+        response = requests.get(
+            f"{service.url}/solr/bibs/select", params={"q": "id:12345678"}
+        )
+    doc = response.json()["response"]["docs"][0]
+    assert doc["id"] == "12345678"
+    assert doc["ss_marc_tag_003"] == "OCoLC"
+
+
+def test_fake_sftp_latency(fake_sftp):
+    fake_sftp.throttle = Throttle(ServiceConfig(latency=0.1))
+    with Drive(*get_credentials()) as drive:
+        start = time.monotonic()
+        drive.list_src_directory()
+        assert time.monotonic() - start >= 0.1
+
+
+def test_fake_sftp(fake_sftp, tmp_path_factory):
+    root = fake_sftp.root
+    with open(f"{root}/sierra_dumps_dir/NYP-foo.out", "wb") as f:
+        f.write(b"spam")
+    local_file = tmp_path_factory.mktemp("local") / "bar.mrc"
+    local_file.write_bytes(b"eggs")
+
+    with Drive(*get_credentials()) as drive:
+        assert drive.list_src_directory() == ["NYP-foo.out"]
+        assert drive.fetch_file("NYP-foo.out").read() == b"spam"
+        remote_fh = drive.output_file(str(local_file), "NYP-bar")
+        assert drive.check_file_exists(f"load_dir/{remote_fh}")
+
+    with open(f"{root}/load_dir/{remote_fh}", "rb") as f:
+        assert f.read() == b"eggs"
+
+
+@pytest.mark.parametrize("bibNo,expectation", [(22509420, "4"), (22509422, "8")])
+def test_sierra_check_digit(bibNo, expectation):
+    assert sierra_check_digit(bibNo) == expectation
+
+
+def test_isbn13():
+    assert isbn13("978007183074") == "9780071830744"
+
+
+@pytest.mark.parametrize(
+    "library,mix", [("foo", {"ebook": 1.0}), ("NYP", {"foo": 1.0}), ("NYP", {})]
+)
+def test_synthetic_catalog_invalid_arguments(library, mix):
+    with pytest.raises(ValueError):
+        SyntheticCatalog(library, mix=mix)
+
+
+def test_synthetic_catalog_dump():
+    catalog = SyntheticCatalog("BPL", seed=1, duplicateRate=0.2)
+    out = BytesIO()
+    assert catalog.write_dump(out, 500) == 500
+    out.seek(0)
+    records = list(MARCReader(out))
+
+    assert len(records) == 500
+    assert records[0]["907"]["a"] == ".b200000007"
+    assert {r.leader[6] + r["001"].data[:3] for r in records} == {
+        "aODN",
+        "iODN",
+        "gODN",
+        "aBT0",
+    }
+    reserve_ids = [r["037"]["a"] for r in records if "037" in r]
+    assert all(r["037"]["b"] == "OverDrive, Inc." for r in records if "037" in r)
+    assert 0.1 < 1 - len(set(reserve_ids)) / len(reserve_ids) < 0.3
+
+
+def test_synthetic_catalog_is_deterministic():
+    first, second = BytesIO(), BytesIO()
+    SyntheticCatalog(seed=5).write_dump(first, 50)
+    SyntheticCatalog(seed=5).write_dump(second, 50)
+    assert first.getvalue() == second.getvalue()
+
+
+def test_synthetic_catalog_match_and_full_bib():
+    catalog = SyntheticCatalog(mix={"ebook": 1.0}, rejectRate=1.0)
+    bib = catalog.bib(7)
+    oclcNumber = catalog.match(bib["037"]["a"])
+    assert oclcNumber == catalog.match(bib["020"]["a"])
+    assert catalog.match("9781234567890") is None
+    assert catalog.match("foo") is None
+
+    record = parse_xml_to_array(BytesIO(catalog.full_bib(oclcNumber)))[0]
+    assert record["001"].data == f"on{oclcNumber}"
+    assert record["245"]["a"].isupper()
+    assert catalog.full_bib("foo") is None
+
+    brief = catalog.brief_record(oclcNumber)
+    assert brief["title"].isupper()
+    assert brief["isbns"] == [bib["020"]["a"]]
+    assert catalog.brief_record("foo") is None
+
+
+def test_synthetic_catalog_match_rate():
+    catalog = SyntheticCatalog(matchRate=0.0)
+    assert catalog.match(catalog.bib(1)["020"]["a"]) is None
+    assert catalog.full_bib("1000000001") is None
+
+
+def test_fake_worldcat_catalog():
+    catalog = SyntheticCatalog(mix={"ebook": 1.0})
+    reserve_id = catalog.bib(3)["037"]["a"]
+    with FakeWorldcat(catalog=catalog) as service:
+        brief = requests.get(
+            f"{service.url}/worldcat/search/brief-bibs",
+            params={"q": f"sn={reserve_id} NOT lv:3"},
+        ).json()
+        oclcNumber = brief["briefRecords"][0]["oclcNumber"]
+        full = requests.get(f"{service.url}/worldcat/manage/bibs/{oclcNumber}")
+        missing = requests.get(f"{service.url}/worldcat/manage/bibs/1")
+    assert oclcNumber == "1000000003"
+    assert full.content == catalog.full_bib(oclcNumber)
+    assert missing.status_code == 404
+
+
+def test_synthetic_main(tmp_path):
+    out = tmp_path / "NYP-synthetic-pout.mrc"
+    main(["NYP", "20", str(out), "--full-bibs-dir", str(tmp_path / "full_bibs")])
+    with open(out, "rb") as f:
+        assert len(list(MARCReader(f))) == 20
+    assert len(list((tmp_path / "full_bibs").iterdir())) == 20
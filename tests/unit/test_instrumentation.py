@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+import json
+import threading
+
+import pytest
+
+from nightshift import instrumentation
+from nightshift.datastore import Resource
+from nightshift.instrumentation import RunReport, StageStats
+
+
+def test_stage_stats_as_dict():
+    stats = StageStats("new_search", "NYP")
+    stats.wallTime = 2.0
+    stats.counts["items"] = 10
+    stats.counts["apiCalls"] = 12
+    assert stats.as_dict() == {
+        "stage": "new_search",
+        "library": "NYP",
+        "category": None,
+        "wallTime": 2.0,
+        "throughput": 5.0,
+        "items": 10,
+        "apiCalls": 12,
+        "retries": 0,
+        "dbRoundTrips": 0,
+        "bytes": 0,
+    }
+
+
+def test_stage_stats_as_dict_no_wall_time():
+    assert StageStats("enhance", "BPL", "ebook").as_dict()["throughput"] is None
+
+
+def test_run_report_count_invalid_counter():
+    report = RunReport()
+    with pytest.raises(ValueError):
+        report.count(("ingest", "NYP", None), "foo")
+
+
+def test_run_report_totals():
+    report = RunReport(1)
+    report.count(("ingest", "NYP", None), "items", 3)
+    report.count(("ingest", "BPL", None), "items", 2)
+    report.count(("enhance", "NYP", "ebook"), "bytes", 100)
+    data = report.as_dict()
+    assert data["runId"] == 1
+    assert data["finished"] is None
+    assert [(s["stage"], s["library"], s["category"]) for s in data["stages"]] == [
+        ("ingest", "NYP", None),
+        ("ingest", "BPL", None),
+        ("enhance", "NYP", "ebook"),
+    ]
+    assert data["totals"] == {
+        "items": 5,
+        "apiCalls": 0,
+        "retries": 0,
+        "dbRoundTrips": 0,
+        "bytes": 100,
+    }
+    assert report.total("items") == 5
+    assert report.total("items", "NYP") == 3
+    assert report.total("apiCalls", "BPL") == 0
+
+
+def test_record_attributed_to_innermost_stage():
+    report = instrumentation.start_report()
+    instrumentation.record("items")
+    with instrumentation.stage("new_search", "NYP"):
+        instrumentation.record("items", 5)
+        with instrumentation.stage("older_search", "NYP", "ebook"):
+            instrumentation.record("apiCalls", 2)
+        instrumentation.record("apiCalls")
+
+    assert report.stages[("new_search", "NYP", None)].counts["items"] == 5
+    assert report.stages[("new_search", "NYP", None)].counts["apiCalls"] == 1
+    assert report.stages[("older_search", "NYP", "ebook")].counts["apiCalls"] == 2
+    assert report.stages[("new_search", "NYP", None)].wallTime > 0
+    assert len(report.stages) == 2
+
+
+def test_stage_records_wall_time_on_error():
+    report = instrumentation.start_report()
+    with pytest.raises(RuntimeError):
+        with instrumentation.stage("ingest", "NYP"):
+            raise RuntimeError
+    assert report.stages[("ingest", "NYP", None)].wallTime > 0
+
+    # stage is exited
+    instrumentation.record("items")
+    assert report.stages[("ingest", "NYP", None)].counts["items"] == 0
+
+
+def test_stage_is_thread_local():
+    report = instrumentation.start_report()
+
+    def _worker():
+        with instrumentation.stage("streaming_search", "NYP"):
+            instrumentation.record("apiCalls", 3)
+
+    with instrumentation.stage("streaming", "NYP"):
+        worker = threading.Thread(target=_worker)
+        worker.start()
+        worker.join()
+        instrumentation.record("items", 1)
+
+    assert report.stages[("streaming", "NYP", None)].counts["apiCalls"] == 0
+    assert report.stages[("streaming", "NYP", None)].counts["items"] == 1
+    assert report.stages[("streaming_search", "NYP", None)].counts["apiCalls"] == 3
+
+
+def test_db_round_trips(test_session, test_data_core):
+    report = instrumentation.start_report()
+    with instrumentation.stage("new_search", "NYP"):
+        test_session.query(Resource).all()
+        test_session.query(Resource).all()
+    assert report.stages[("new_search", "NYP", None)].counts["dbRoundTrips"] == 2
+
+
+def test_save_report(tmp_path):
+    instrumentation.start_report(5)
+    with instrumentation.stage("ingest", "NYP"):
+        instrumentation.record("items", 2)
+
+    fh = instrumentation.save_report(str(tmp_path))
+
+    assert fh.startswith(str(tmp_path / "run-report-5-"))
+    with open(fh, "r") as f:
+        data = json.load(f)
+    assert data["runId"] == 5
+    assert data["finished"] is not None
+    assert data["wallTime"] >= 0
+    assert data["stages"][0]["items"] == 2
+    assert data["totals"]["items"] == 2
+
+
+def test_save_report_env_dir(monkeypatch, tmp_path):
+    monkeypatch.setenv("RUN_REPORT_DIR", str(tmp_path))
+    instrumentation.start_report()
+    fh = instrumentation.save_report()
+    assert fh.startswith(str(tmp_path / "run-report-"))
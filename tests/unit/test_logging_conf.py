@@ -2,9 +2,47 @@
 Tests logging_config.py module
 """
 
+import logging
+import queue
+import threading
+
 import pytest
+import requests
+
+from nightshift.config import logging_conf
+from nightshift.config.logging_conf import (
+    BoundedQueueHandler,
+    LogglyBulkHandler,
+    configure_logging,
+    get_handlers,
+    get_queue_settings,
+    get_token,
+    log_conf,
+    stop_logging,
+)
+
+
+@pytest.fixture
+def restore_logger():
+    logger = logging.getLogger("nightshift")
+    level, handlers = logger.level, list(logger.handlers)
+    yield
+    stop_logging()
+    for handler in list(logger.handlers):
+        logger.removeHandler(handler)
+    for handler in handlers:
+        logger.addHandler(handler)
+    logger.setLevel(level)
+
 
-from nightshift.config.logging_conf import get_handlers, get_token, log_conf
+def _record(msg, level=logging.INFO):
+    return logging.LogRecord("nightshift", level, __file__, 1, msg, None, None)
+
+
+def _response(status_code=200):
+    response = requests.Response()
+    response.status_code = status_code
+    return response
 
 
 def test_get_handlers(mock_log_env):
@@ -40,6 +78,237 @@ def test_log_conf(mock_log_env):
     ]
     assert (
         conf["handlers"]["loggly"]["url"]
-        == "https://logs-01.loggly.com/inputs/ns_token_here/tag/python"
+        == "https://logs-01.loggly.com/bulk/ns_token_here/tag/python/"
     )
     assert conf["loggers"]["nightshift"]["handlers"] == ["console", "file", "loggly"]
+
+
+def test_log_conf_default_level(mock_log_env):
+    assert log_conf()["loggers"]["nightshift"]["level"] == "DEBUG"
+
+
+def test_log_conf_level(mock_log_env, monkeypatch):
+    monkeypatch.setenv("LOG_LEVEL", "INFO")
+    assert log_conf()["loggers"]["nightshift"]["level"] == "INFO"
+
+
+def test_get_queue_settings_default():
+    assert get_queue_settings() == (10000, "drop")
+
+
+def test_get_queue_settings(monkeypatch):
+    monkeypatch.setenv("LOG_QUEUE_SIZE", "50")
+    monkeypatch.setenv("LOG_QUEUE_POLICY", "block")
+    assert get_queue_settings() == (50, "block")
+
+
+@pytest.mark.parametrize(
+    "size,policy",
+    [("foo", "drop"), ("0", "drop"), ("10", "foo")],
+)
+def test_get_queue_settings_invalid(monkeypatch, size, policy):
+    monkeypatch.setenv("LOG_QUEUE_SIZE", size)
+    monkeypatch.setenv("LOG_QUEUE_POLICY", policy)
+    with pytest.raises(ValueError):
+        get_queue_settings()
+
+
+def test_bounded_queue_handler_invalid_policy():
+    with pytest.raises(ValueError):
+        BoundedQueueHandler(queue.Queue(), "foo")
+
+
+def test_bounded_queue_handler_drop_policy():
+    log_queue = queue.Queue(maxsize=1)
+    handler = BoundedQueueHandler(log_queue, "drop")
+    handler.handle(_record("foo"))
+    handler.handle(_record("bar"))
+    handler.handle(_record("baz"))
+    assert handler.dropped == 2
+    assert log_queue.get_nowait().getMessage() == "foo"
+
+
+def test_bounded_queue_handler_does_not_drop_warnings():
+    log_queue = queue.Queue(maxsize=1)
+    handler = BoundedQueueHandler(log_queue, "drop")
+    handler.handle(_record("foo"))
+    producer = threading.Thread(
+        target=handler.handle, args=(_record("bar", logging.WARNING),)
+    )
+    producer.start()
+    producer.join(0.1)
+
+    # the handler waits for room in the queue
+    assert producer.is_alive()
+    assert log_queue.get().getMessage() == "foo"
+    producer.join(1)
+    assert not producer.is_alive()
+    assert log_queue.get_nowait().getMessage() == "bar"
+    assert handler.dropped == 0
+
+
+def test_loggly_bulk_handler_batches(monkeypatch):
+    posted = []
+
+    def mock_post(self, url, data, **kwargs):
+        posted.append((url, data))
+        return _response()
+
+    monkeypatch.setattr(requests.Session, "post", mock_post)
+    handler = LogglyBulkHandler(
+        "https://logs-01.loggly.com/bulk/foo/tag/python/",
+        capacity=2,
+        flushInterval=60,
+    )
+    handler.handle(_record("foo"))
+    assert posted == []
+
+    handler.handle(_record("bar\nbaz"))
+    handler.handle(_record("spam"))
+    handler.close()
+
+    assert posted == [
+        ("https://logs-01.loggly.com/bulk/foo/tag/python/", b"foo\nbar\\nbaz"),
+        ("https://logs-01.loggly.com/bulk/foo/tag/python/", b"spam"),
+    ]
+
+
+def test_loggly_bulk_handler_flush_interval(monkeypatch):
+    posted = []
+
+    def mock_post(self, url, data, **kwargs):
+        posted.append(data)
+        return _response()
+
+    monkeypatch.setattr(requests.Session, "post", mock_post)
+    handler = LogglyBulkHandler("https://example.com", capacity=100, flushInterval=0)
+    handler.handle(_record("foo"))
+    handler.close()
+    assert posted == [b"foo"]
+
+
+def test_loggly_bulk_handler_flush_level(monkeypatch):
+    posted = []
+
+    def mock_post(self, url, data, **kwargs):
+        posted.append(data)
+        return _response()
+
+    monkeypatch.setattr(requests.Session, "post", mock_post)
+    handler = LogglyBulkHandler("https://example.com", capacity=100, flushInterval=60)
+    handler.handle(_record("foo", logging.WARNING))
+    assert posted == []
+
+    handler.handle(_record("bar", logging.ERROR))
+    assert posted == [b"foo\nbar"]
+    handler.close()
+
+
+def test_loggly_bulk_handler_flushed_by_timer(monkeypatch):
+    posted = threading.Event()
+
+    def mock_post(self, url, data, **kwargs):
+        posted.set()
+        return _response()
+
+    monkeypatch.setattr(requests.Session, "post", mock_post)
+    handler = LogglyBulkHandler("https://example.com", capacity=100, flushInterval=0.05)
+    try:
+        handler.handle(_record("foo", logging.WARNING))
+        assert posted.wait(5)
+        assert handler.buffer == []
+    finally:
+        handler.close()
+
+
+def test_loggly_bulk_handler_request_error(monkeypatch):
+    def mock_post(self, url, data, **kwargs):
+        raise requests.ConnectionError
+
+    errors = []
+    monkeypatch.setattr(requests.Session, "post", mock_post)
+    handler = LogglyBulkHandler("https://example.com", capacity=1)
+    monkeypatch.setattr(handler, "handleError", lambda record: errors.append(record))
+    handler.handle(_record("foo"))
+    assert len(errors) == 1
+    assert handler.buffer == []
+
+
+@pytest.mark.parametrize("status_code", [400, 403, 500])
+def test_loggly_bulk_handler_rejected_batch(monkeypatch, capsys, status_code):
+    monkeypatch.setattr(
+        requests.Session, "post", lambda *args, **kwargs: _response(status_code)
+    )
+    handler = LogglyBulkHandler("https://example.com", capacity=2, flushInterval=60)
+    handler.handle(_record("foo"))
+    handler.handle(_record("bar"))
+    handler.close()
+
+    assert handler.buffer == []
+    assert (
+        f"Loggly rejected a batch of 2 log record(s) with HTTP status {status_code}."
+        in capsys.readouterr().err
+    )
+
+
+def test_configure_logging(monkeypatch, tmp_path, restore_logger):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv("LOG_HANDLERS", "file")
+    monkeypatch.setenv("LOGGLY_TOKEN", "ns_token_here")
+    monkeypatch.setenv("LOG_QUEUE_SIZE", "5")
+    try:
+        listener = configure_logging()
+        logger = logging.getLogger("nightshift")
+        assert len(logger.handlers) == 1
+        assert isinstance(logger.handlers[0], BoundedQueueHandler)
+        assert logger.handlers[0].queue.maxsize == 5
+        assert [type(h) for h in listener.handlers] == [
+            logging.handlers.RotatingFileHandler
+        ]
+
+        logger.info("Test message.")
+    finally:
+        stop_logging()
+
+    assert logging_conf._listener is None
+    assert logging.getLogger("nightshift").handlers == []
+    assert "Test message." in (tmp_path / "nightshift.log").read_text()
+
+
+def test_configure_logging_raises_logger_level(monkeypatch, tmp_path, restore_logger):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv("LOG_HANDLERS", "loggly")
+    monkeypatch.setenv("LOGGLY_TOKEN", "ns_token_here")
+    try:
+        configure_logging()
+        logger = logging.getLogger("nightshift")
+        assert logger.level == logging.WARNING
+        assert not logger.isEnabledFor(logging.DEBUG)
+    finally:
+        stop_logging()
+
+
+def test_configure_logging_restarts_listener(monkeypatch, tmp_path, restore_logger):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv("LOG_HANDLERS", "file")
+    monkeypatch.setenv("LOGGLY_TOKEN", "ns_token_here")
+    try:
+        first = configure_logging()
+        second = configure_logging()
+        assert first is not second
+        assert first._thread is None
+        assert len(logging.getLogger("nightshift").handlers) == 1
+    finally:
+        stop_logging()
+
+
+def test_stop_logging_reports_dropped_records(monkeypatch, tmp_path, restore_logger):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv("LOG_HANDLERS", "file")
+    monkeypatch.setenv("LOGGLY_TOKEN", "ns_token_here")
+    try:
+        configure_logging()
+        logging_conf._queue_handler.dropped = 3
+    finally:
+        stop_logging()
+    assert "Dropped 3 log record(s)" in (tmp_path / "nightshift.log").read_text()
@@ -1,13 +1,45 @@
+import base64
 from contextlib import nullcontext as does_not_raise
 from datetime import datetime, timedelta, timezone
+import gzip
+import json
 import logging
+from types import SimpleNamespace
 
 import pytest
 
+from nightshift.budget import BudgetConfig, RunBudget
 from nightshift.comms.storage import get_credentials, Drive
 from nightshift.constants import RESOURCE_CATEGORIES
-from nightshift.datastore import Event, Resource, WorldcatQuery
-from nightshift.manager import process_resources, perform_db_maintenance
+from nightshift.datastore import (
+    Event,
+    EventDailyStats,
+    Resource,
+    RunLedger,
+    WorldcatQuery,
+)
+from nightshift.comms.worldcat import Worldcat
+from nightshift.datastore_transactions import add_ledger_entry, ResCatByName
+from nightshift.manager import (
+    begin_run,
+    complete_run,
+    event_stats,
+    process_resources,
+    process_resources_streaming,
+    perform_db_maintenance,
+    plan_duration,
+    plan_rates,
+    plan_run,
+    PlanRow,
+    purge_aged_resources,
+    purge_config,
+    purge_resources,
+    query_windows_by_expiry,
+)
+from nightshift.ns_exceptions import BudgetExhausted
+from nightshift.pipeline import StreamingPipeline
+from nightshift.reference_data import reference_data
+from nightshift.tasks import Tasks
 
 
 class TestProcessResourcesMocked:
@@ -166,3 +198,528 @@ def test_perform_db_maintenance_delete(
     )
     resource = test_session.query(Resource).filter_by(sierraId=22222222).one_or_none()
     assert isinstance(resource, expectation)
+
+
+def test_perform_db_maintenance_creates_event_partitions(
+    caplog, env_var, test_session, test_data_core
+):
+    today = datetime.now(timezone.utc).date()
+    with caplog.at_level(logging.INFO):
+        perform_db_maintenance()
+
+    assert (
+        f"Created Event table partition event_y{today.year}m{today.month:02}."
+        in caplog.text
+    )
+
+
+def test_perform_db_maintenance_unpartitioned_event_table(
+    caplog, env_var, test_session, unpartitioned_event_table
+):
+    with caplog.at_level(logging.WARNING):
+        perform_db_maintenance()
+
+    assert (
+        "Event table is not partitioned. Skipping creation of its partitions. "
+        "Run 'upgrade' command to partition the table."
+    ) in caplog.text
+
+
+def test_event_stats(env_var, test_session, test_data_core):
+    today = datetime.now(timezone.utc).date()
+    for days, tally in [(0, 2), (29, 3), (30, 7)]:
+        test_session.add(
+            EventDailyStats(
+                day=today - timedelta(days=days),
+                libraryId=1,
+                resourceCategoryId=1,
+                status="bot_enhanced",
+                tally=tally,
+            )
+        )
+    test_session.commit()
+
+    assert event_stats() == [("NYP", "ebook", "bot_enhanced", 5)]
+    assert event_stats(days=1) == [("NYP", "ebook", "bot_enhanced", 2)]
+
+
+@pytest.fixture
+def aged_out_resources(test_session, test_data_core):
+    for n in range(1, 6):
+        test_session.add(
+            Resource(
+                sierraId=22222220 + n,
+                libraryId=1,
+                sourceId=1,
+                resourceCategoryId=1,
+                status="expired",
+                bibDate=datetime.now(timezone.utc).date() - timedelta(days=300),
+                queries=[WorldcatQuery(match=False)],
+            )
+        )
+    test_session.commit()
+
+
+def test_plan_rates_defaults(monkeypatch):
+    for var in ("PLAN_SEARCH_RATE", "PLAN_SIERRA_RATE", "PLAN_FULL_BIB_RATE"):
+        monkeypatch.delenv(var, raising=False)
+    assert plan_rates() == {
+        "new_search": 2.0,
+        "older_search": 2.0,
+        "sierra_check": 5.0,
+        "full_bib_download": 2.0,
+    }
+
+
+def test_plan_rates_invalid(monkeypatch):
+    monkeypatch.setenv("PLAN_SIERRA_RATE", "0")
+    with pytest.raises(ValueError):
+        plan_rates()
+
+
+def test_plan_duration():
+    rows = [
+        PlanRow("NYP", "ebook", "new_search", 10, 20, 18),
+        PlanRow("NYP", "ebook", "sierra_check", 5, 5, 5),
+        PlanRow("NYP", "ebook", "enhance", 3, 1, 1),
+    ]
+    assert plan_duration(rows, {"new_search": 2.0, "sierra_check": 5.0}) == 11.0
+
+
+def test_plan_run(monkeypatch, env_var, test_session, test_data_core):
+    def _fail(*args, **kwargs):
+        raise AssertionError("Unexpected request for an access token.")
+
+    monkeypatch.setattr(Worldcat, "_get_access_token", _fail)
+
+    today = datetime.now(timezone.utc).date()
+    older = today - timedelta(days=45)
+    resources = [
+        # new resources with the same reserve ID
+        dict(sierraId=1, distributorNumber="ODN1", bibDate=today),
+        dict(sierraId=2, distributorNumber="ODN1", bibDate=today),
+        # older, not matched resource
+        dict(
+            sierraId=3,
+            distributorNumber="ODN3",
+            bibDate=older,
+            queries=[WorldcatQuery(match=False, timestamp=older)],
+        ),
+        # matched resources with and without full bib
+        dict(
+            sierraId=4,
+            bibDate=today,
+            oclcMatchNumber="44",
+            queries=[WorldcatQuery(match=True)],
+        ),
+        dict(
+            sierraId=5,
+            bibDate=today,
+            oclcMatchNumber="55",
+            fullBib=b"<record/>",
+            queries=[WorldcatQuery(match=True)],
+        ),
+    ]
+    for data in resources:
+        test_session.add(
+            Resource(
+                libraryId=1, sourceId=1, resourceCategoryId=1, status="open", **data
+            )
+        )
+    test_session.commit()
+
+    assert plan_run() == [
+        ("NYP", "ebook", "new_search", 2, 2, 1),
+        ("NYP", "ebook", "sierra_check", 1, 1, 1),
+        ("NYP", "ebook", "older_search", 1, 1, 1),
+        ("NYP", "ebook", "full_bib_download", 1, 1, 1),
+        ("NYP", "ebook", "enhance", 1, 1, 1),
+    ]
+    assert test_session.query(WorldcatQuery).count() == 3
+
+
+def test_purge_config_defaults(monkeypatch):
+    monkeypatch.delenv("PURGE_BATCH_SIZE", raising=False)
+    monkeypatch.delenv("PURGE_PAUSE", raising=False)
+    monkeypatch.delenv("PURGE_ARCHIVE_DIR", raising=False)
+    assert purge_config() == (1000, 0.0, None)
+
+
+def test_purge_config_from_env(monkeypatch):
+    monkeypatch.setenv("PURGE_BATCH_SIZE", "50")
+    monkeypatch.setenv("PURGE_PAUSE", "0.5")
+    monkeypatch.setenv("PURGE_ARCHIVE_DIR", "archive")
+    assert purge_config() == (50, 0.5, "archive")
+
+
+@pytest.mark.parametrize(
+    "var,value", [("PURGE_BATCH_SIZE", "0"), ("PURGE_PAUSE", "-1")]
+)
+def test_purge_config_invalid(monkeypatch, var, value):
+    monkeypatch.setenv(var, value)
+    with pytest.raises(ValueError):
+        purge_config()
+
+
+def test_purge_resources_in_batches(
+    caplog, monkeypatch, test_session, aged_out_resources
+):
+    monkeypatch.setenv("PURGE_BATCH_SIZE", "2")
+    monkeypatch.setenv("PURGE_PAUSE", "1.5")
+    pauses = []
+    monkeypatch.setattr("nightshift.manager.time.sleep", pauses.append)
+
+    with caplog.at_level(logging.INFO):
+        tally = purge_resources(test_session, "ebook", 1, 270)
+
+    assert tally == 5
+    assert pauses == [1.5, 1.5]
+    assert "Deleted batch of 2 ebook resource(s) (2/5)." in caplog.text
+    assert "Deleted batch of 1 ebook resource(s) (5/5)." in caplog.text
+    assert test_session.query(Resource).count() == 0
+    assert test_session.query(WorldcatQuery).count() == 0
+
+
+def test_purge_resources_dry_run(caplog, test_session, aged_out_resources):
+    with caplog.at_level(logging.INFO):
+        tally = purge_resources(test_session, "ebook", 1, 270, dry_run=True)
+
+    assert tally == 5
+    assert (
+        "Dry run: 5 ebook resource(s) older than 270 days would be deleted "
+        "from the database." in caplog.text
+    )
+    assert test_session.query(Resource).count() == 5
+
+
+def test_purge_resources_archive(tmpdir, test_session, aged_out_resources):
+    tally = purge_resources(test_session, "ebook", 1, 270, archive_dir=str(tmpdir))
+
+    assert tally == 5
+    files = tmpdir.listdir()
+    assert len(files) == 1
+    assert files[0].basename.startswith("purged-ebook-")
+    with gzip.open(str(files[0]), "rt", encoding="utf-8") as f:
+        rows = [json.loads(line) for line in f]
+    assert [r["sierraId"] for r in rows] == [
+        22222221,
+        22222222,
+        22222223,
+        22222224,
+        22222225,
+    ]
+    assert rows[0]["status"] == "expired"
+    assert len(rows[0]["queries"]) == 1
+    assert rows[0]["queries"][0]["match"] is False
+
+
+def test_purge_resources_archive_full_bib(tmpdir, test_session, aged_out_resources):
+    full_bib = b"00026nam a2200025 a 4500\xff\x00\x1e\xe9\x1d"
+    test_session.query(Resource).filter_by(sierraId=22222221).update(
+        {"fullBib": full_bib}
+    )
+    test_session.commit()
+
+    purge_resources(test_session, "ebook", 1, 270, archive_dir=str(tmpdir))
+
+    with gzip.open(str(tmpdir.listdir()[0]), "rt", encoding="utf-8") as f:
+        rows = [json.loads(line) for line in f]
+    assert rows[0]["fullBib"]["encoding"] == "base64"
+    assert base64.b64decode(rows[0]["fullBib"]["data"]) == full_bib
+    assert rows[1]["fullBib"] is None
+
+
+def test_purge_aged_resources(
+    caplog, env_var, test_session, test_data_core, aged_out_resources
+):
+    with caplog.at_level(logging.INFO):
+        purge_aged_resources()
+
+    assert "Deleted 5 ebook resource(s) older than 270 days" in caplog.text
+    assert test_session.query(Resource).count() == 0
+
+
+def test_process_resources_streaming(
+    monkeypatch,
+    env_var,
+    test_session,
+    test_data_core,
+    mock_sftp_env,
+    mock_drive_unprocessed_files,
+    mock_drive_fetch_file,
+    mock_check_resources_sierra_state_open,
+):
+    streamed = dict()
+    output = []
+
+    def _stream(*args):
+        pipeline = args[0]
+        streamed.setdefault(pipeline.tasks.library, []).append(
+            [r.sierraId for r in args[1]]
+        )
+
+    def _output(pipeline):
+        output.append(pipeline.tasks.library)
+
+    monkeypatch.setattr(StreamingPipeline, "stream", _stream)
+    monkeypatch.setattr(StreamingPipeline, "output", _output)
+
+    with does_not_raise():
+        process_resources_streaming()
+
+    assert len(streamed["NYP"]) == 1
+    assert len(streamed["NYP"][0]) == 2
+    assert streamed["BPL"] == [[]]
+    assert output == ["NYP", "BPL"]
+
+
+@pytest.fixture
+def mock_streaming_calls(monkeypatch):
+    calls = []
+
+    def _stream(pipeline, search_resources, *args):
+        calls.append(
+            (
+                "stream",
+                pipeline.tasks.library,
+                [getattr(r, "window", r) for r in search_resources],
+            )
+        )
+
+    def _output(pipeline):
+        calls.append(("output", pipeline.tasks.library))
+
+    monkeypatch.setattr(StreamingPipeline, "stream", _stream)
+    monkeypatch.setattr(StreamingPipeline, "output", _output)
+    monkeypatch.setattr(
+        "nightshift.manager.retrieve_new_resources_query_data",
+        lambda *args: ["new resource"],
+    )
+    monkeypatch.setattr(
+        "nightshift.manager.retrieve_open_older_resources",
+        lambda *args: [SimpleNamespace(bibDate=None)],
+    )
+    monkeypatch.setattr(
+        "nightshift.manager.retrieve_open_older_resources_query_data",
+        lambda db, lib, cat, age_min, age_max: [
+            SimpleNamespace(bibDate=None, window=(cat, age_min, age_max))
+        ],
+    )
+    return calls
+
+
+def test_process_resources_streaming_priority(
+    monkeypatch,
+    env_var,
+    test_session,
+    test_data_core,
+    mock_sftp_env,
+    mock_drive_unprocessed_files_empty,
+    mock_streaming_calls,
+):
+    def _check(tasks, resources):
+        mock_streaming_calls.append(("sierra_check", tasks.library))
+
+    monkeypatch.setattr(Tasks, "check_resources_sierra_state", _check)
+
+    process_resources_streaming()
+
+    res_cat = reference_data(test_session).resourceCategories
+    expected = []
+    for library in ("NYP", "BPL"):
+        expected.append(("stream", library, ["new resource"]))
+        for _, res_cat_data, age_min, age_max in query_windows_by_expiry(res_cat):
+            expected.append(("sierra_check", library))
+            expected.append(("stream", library, [(res_cat_data.nid, age_min, age_max)]))
+        expected.append(("output", library))
+    assert mock_streaming_calls == expected
+
+
+def test_process_resources_streaming_budget_exhausted(
+    monkeypatch,
+    caplog,
+    env_var,
+    test_session,
+    test_data_core,
+    mock_sftp_env,
+    mock_drive_unprocessed_files_empty,
+    mock_streaming_calls,
+):
+    def _check(*args):
+        raise BudgetExhausted("run budget of 10 API calls exhausted")
+
+    monkeypatch.setattr(Tasks, "check_resources_sierra_state", _check)
+
+    with caplog.at_level(logging.WARNING):
+        process_resources_streaming(budget=RunBudget(BudgetConfig(runApiCalls=10)))
+
+    # new resources are searched even if the budget runs out in Sierra checks
+    assert mock_streaming_calls == [
+        ("stream", "NYP", ["new resource"]),
+        ("output", "NYP"),
+        ("stream", "BPL", ["new resource"]),
+        ("output", "BPL"),
+    ]
+    assert (
+        "Stopping NYP searches: run budget of 10 API calls exhausted. "
+        "Remaining resources are left for the next run."
+    ) in caplog.text
+
+
+def test_begin_run_new(env_var, test_session, test_data_core):
+    assert begin_run() == 1
+    assert begin_run() == 2
+
+
+@pytest.mark.parametrize(
+    "completed,expectation",
+    [(False, 1), (True, 2)],
+)
+def test_begin_run_resume(
+    env_var, test_session, test_data_core, completed, expectation
+):
+    add_ledger_entry(test_session, 1, "run_started")
+    if completed:
+        add_ledger_entry(test_session, 1, "run_completed")
+    test_session.commit()
+
+    assert begin_run(resume=True) == expectation
+
+
+def test_complete_run(env_var, test_session, test_data_core):
+    runId = begin_run()
+    complete_run(runId)
+
+    stages = [e.stage for e in test_session.query(RunLedger).order_by(RunLedger.nid)]
+    assert stages == ["run_started", "run_completed"]
+
+
+def test_process_resources_records_run_ledger(
+    env_var,
+    test_session,
+    test_data_core,
+    mock_sftp_env,
+    mock_drive_unprocessed_files_empty,
+):
+    add_ledger_entry(test_session, 1, "run_started")
+    test_session.commit()
+
+    process_resources(runId=1)
+
+    units = {
+        (e.stage, e.libraryId, e.resourceCategoryId, e.queryWindow)
+        for e in test_session.query(RunLedger).all()
+    }
+    assert ("ingest", 1, None, None) in units
+    assert ("new_search", 2, None, None) in units
+    assert ("sierra_check", 1, 1, "30-90") in units
+    assert ("older_search", 2, 3, "30-90") in units
+    assert ("full_bib_download", 1, None, None) in units
+    assert ("enhance", 2, 11, None) in units
+
+
+def test_query_windows_by_expiry():
+    res_cat = dict(
+        ebook=ResCatByName(1, "a", "b", [], [], [(30, 90), (90, 180)]),
+        print=ResCatByName(2, "a", "b", [], [], [(15, 30), (30, 45)]),
+        eaudio=ResCatByName(3, "a", "b", [], [], [(30, 90)]),
+    )
+    windows = [(w[0], w[2], w[3]) for w in query_windows_by_expiry(res_cat)]
+    assert windows == [
+        ("ebook", 90, 180),
+        ("print", 30, 45),
+        ("eaudio", 30, 90),
+        ("print", 15, 30),
+        ("ebook", 30, 90),
+    ]
+
+
+def test_process_resources_budget_exhausted(
+    monkeypatch,
+    caplog,
+    env_var,
+    test_session,
+    test_data_core,
+    mock_sftp_env,
+    mock_drive_unprocessed_files_empty,
+):
+    searched = []
+    downloaded = []
+
+    def _search(*args):
+        searched.append(args[0].library)
+        raise BudgetExhausted(f"{args[0].library} budget of 10 API calls exhausted")
+
+    def _download(*args):
+        downloaded.append((args[0].library, list(args[1])))
+        return 1
+
+    monkeypatch.setattr(Tasks, "get_worldcat_brief_bib_matches", _search)
+    monkeypatch.setattr(Tasks, "get_worldcat_full_bibs", _download)
+    monkeypatch.setattr(
+        "nightshift.manager.retrieve_new_resources_query_data",
+        lambda *args: ["query data"],
+    )
+    monkeypatch.setattr(
+        "nightshift.manager.iter_open_matched_resources_without_full_bib",
+        lambda *args: iter(["matched resource"]),
+    )
+
+    add_ledger_entry(test_session, 1, "run_started")
+    test_session.commit()
+
+    with caplog.at_level(logging.WARNING):
+        process_resources(runId=1, budget=RunBudget(BudgetConfig(libraryApiCalls=10)))
+
+    assert searched == ["NYP", "BPL"]
+    assert downloaded == [("NYP", ["matched resource"]), ("BPL", ["matched resource"])]
+    assert (
+        "Stopping NYP searches: NYP budget of 10 API calls exhausted. "
+        "Remaining resources are left for the next run."
+    ) in caplog.text
+    stages = {e.stage for e in test_session.query(RunLedger).all()}
+    assert stages == {"run_started", "ingest", "full_bib_download", "enhance"}
+
+
+def test_process_resources_resume_skips_completed_units(
+    monkeypatch,
+    caplog,
+    env_var,
+    test_session,
+    test_data_core,
+    mock_sftp_env,
+):
+    ingested = []
+
+    def _ingest(*args):
+        ingested.append(args[0].library)
+
+    monkeypatch.setattr(Tasks, "ingest_new_files", _ingest)
+
+    add_ledger_entry(test_session, 1, "run_started")
+    add_ledger_entry(test_session, 1, "ingest", 1)
+    test_session.commit()
+
+    with caplog.at_level(logging.INFO):
+        process_resources(runId=1)
+
+    assert ingested == ["BPL"]
+    assert "Skipping ingest unit (1, None, None) completed in run 1." in caplog.text
+
+
+def test_perform_db_maintenance_resume_skips_completed_units(
+    env_var, test_session, test_data_rich, caplog
+):
+    add_ledger_entry(test_session, 1, "run_started")
+    add_ledger_entry(test_session, 1, "maintenance", None, 1)
+    test_session.commit()
+
+    with caplog.at_level(logging.INFO):
+        perform_db_maintenance(runId=1)
+
+    assert "resource(s) status to 'expired'" in caplog.text
+    assert "Changed 0 ebook resource(s) status to 'expired'." not in caplog.text
+    entries = (
+        test_session.query(RunLedger).filter_by(runId=1, stage="maintenance").all()
+    )
+    assert len(entries) == 11
@@ -4,6 +4,7 @@ from datetime import date
 from io import BytesIO
 import logging
 import pickle
+from types import MappingProxyType
 
 from bookops_marc import Bib
 from pymarc import Field, Subfield
@@ -61,6 +62,16 @@ def test_BibReader_invalid_resource_categories_arg(caplog):
     assert "Invalid 'resource_categories' argument" in caplog.text
 
 
+def test_BibReader_read_only_resource_categories(stub_res_cat_by_name):
+    reader = BibReader(
+        "tests/nyp-ebook-sample.mrc",
+        "NYP",
+        1,
+        MappingProxyType(stub_res_cat_by_name),
+    )
+    assert len(list(reader)) == 2
+
+
 def test_BibReader_iterator(stub_res_cat_by_name):
     reader = BibReader("tests/nyp-ebook-sample.mrc", "NYP", 1, stub_res_cat_by_name)
     with does_not_raise():
@@ -683,10 +683,36 @@ class TestBibEnhancer:
         be.bib.add_field(
             Field(tag="710", indicators=[" ", "0"], subfields=[Subfield("a", vendor)])
         )
-        be._remove_eresource_vendors()
+        be._purge_tags()
 
         assert len(be.bib.get_fields("710")) == 0
 
+    def test_purge_tags_keeps_order_of_remaining_fields(
+        self, stub_resource, stub_res_cat_by_id
+    ):
+        be = BibEnhancer(stub_resource, "NYP", stub_res_cat_by_id)
+        be.bib.fields = []
+        for tag, value in [
+            ("020", "978123456789x"),
+            ("245", "Title"),
+            ("710", "Overdrive, Inc. 3M Company"),
+            ("710", "Some publisher"),
+            ("856", "url_here"),
+            ("650", "Test."),
+            ("938", "foo"),
+        ]:
+            be.bib.add_field(
+                Field(tag=tag, indicators=[" ", " "], subfields=[Subfield("a", value)])
+            )
+
+        be._purge_tags()
+
+        assert [(f.tag, f.value()) for f in be.bib.fields] == [
+            ("245", "Title"),
+            ("710", "Some publisher"),
+            ("650", "Test."),
+        ]
+
     @pytest.mark.parametrize("arg", ["ocm12345", "ocn12345", "on12345", "12345"])
     def test_remove_oclc_prefix(self, stub_resource, stub_res_cat_by_id, arg):
         be = BibEnhancer(stub_resource, "NYP", stub_res_cat_by_id)
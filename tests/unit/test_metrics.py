@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+from urllib.error import HTTPError
+from urllib.request import urlopen
+
+import pytest
+
+from nightshift import metrics
+from nightshift.metrics import Counter, Gauge, Histogram
+
+
+@pytest.fixture
+def registry(monkeypatch):
+    monkeypatch.setattr(metrics, "REGISTRY", [])
+    return metrics.REGISTRY
+
+
+def test_counter(registry):
+    counter = Counter("test_total", "Test counter.", ("library",))
+    counter.inc(library="NYP")
+    counter.inc(2, library="NYP")
+    counter.inc(library="BPL")
+    assert counter.value(library="NYP") == 3
+    assert counter.expose() == [
+        "# HELP test_total Test counter.",
+        "# TYPE test_total counter",
+        'test_total{library="BPL"} 1',
+        'test_total{library="NYP"} 3',
+    ]
+
+
+def test_counter_negative_amount(registry):
+    counter = Counter("test_total", "Test counter.")
+    with pytest.raises(ValueError):
+        counter.inc(-1)
+
+
+@pytest.mark.parametrize(
+    "labels",
+    [{}, {"library": "NYP", "foo": "bar"}, {"foo": "bar"}],
+)
+def test_invalid_labels(registry, labels):
+    counter = Counter("test_total", "Test counter.", ("library",))
+    with pytest.raises(ValueError):
+        counter.inc(**labels)
+
+
+def test_label_values_escaped(registry):
+    gauge = Gauge("test_gauge", "Test gauge.", ("queue",))
+    gauge.set(1, queue='a"b\\c\nd')
+    assert gauge.expose()[-1] == 'test_gauge{queue="a\\"b\\\\c\\nd"} 1'
+
+
+def test_gauge(registry):
+    gauge = Gauge("test_depth", "Test gauge.", ("queue",))
+    gauge.set(5, queue="search")
+    gauge.set(2, queue="search")
+    assert gauge.value(queue="search") == 2
+    assert gauge.expose()[-1] == 'test_depth{queue="search"} 2'
+
+
+def test_histogram(registry):
+    histogram = Histogram("test_seconds", "Test histogram.", buckets=(0.1, 1.0))
+    histogram.observe(0.05)
+    histogram.observe(0.5)
+    histogram.observe(5.0)
+    assert histogram.count() == 3
+    assert histogram.expose() == [
+        "# HELP test_seconds Test histogram.",
+        "# TYPE test_seconds histogram",
+        'test_seconds_bucket{le="0.1"} 1',
+        'test_seconds_bucket{le="1.0"} 2',
+        'test_seconds_bucket{le="+Inf"} 3',
+        "test_seconds_sum 5.55",
+        "test_seconds_count 3",
+    ]
+
+
+def test_histogram_time(registry):
+    histogram = Histogram("test_seconds", "Test histogram.", ("endpoint",))
+    with pytest.raises(RuntimeError):
+        with histogram.time(endpoint="bib_get"):
+            raise RuntimeError
+    assert histogram.count(endpoint="bib_get") == 1
+    assert histogram.count(endpoint="brief_bibs_search") == 0
+
+
+def test_write_textfile(registry, tmp_path):
+    Counter("test_total", "Test counter.").inc()
+    path = tmp_path / "nightshift.prom"
+    metrics.write_textfile(str(path))
+    assert path.read_text() == (
+        "# HELP test_total Test counter.\n# TYPE test_total counter\ntest_total 1\n"
+    )
+    assert [p.name for p in tmp_path.iterdir()] == ["nightshift.prom"]
+
+
+def test_start_http_server(registry):
+    Counter("test_total", "Test counter.").inc()
+    server = metrics.start_http_server(0)
+    try:
+        port = server.server_address[1]
+        with urlopen(f"http://127.0.0.1:{port}/metrics") as response:
+            assert response.status == 200
+            assert b"test_total 1\n" in response.read()
+        with pytest.raises(HTTPError):
+            urlopen(f"http://127.0.0.1:{port}/foo")
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+@pytest.mark.parametrize(
+    "textfile,port,expectation",
+    [
+        ("", "", (None, None)),
+        ("/tmp/ns.prom", "", ("/tmp/ns.prom", None)),
+        ("", "9100", (None, 9100)),
+    ],
+)
+def test_metrics_config(monkeypatch, textfile, port, expectation):
+    monkeypatch.setenv("METRICS_TEXTFILE", textfile)
+    monkeypatch.setenv("METRICS_PORT", port)
+    assert metrics.metrics_config() == expectation
+
+
+@pytest.mark.parametrize("port", ["foo", "0", "70000"])
+def test_metrics_config_invalid_port(monkeypatch, port):
+    monkeypatch.setenv("METRICS_PORT", port)
+    with pytest.raises(ValueError):
+        metrics.metrics_config()
+
+
+def test_registered_metrics_exposition():
+    text = metrics.exposition()
+    for name in (
+        "nightshift_worldcat_request_seconds",
+        "nightshift_worldcat_queries_total",
+        "nightshift_sierra_request_seconds",
+        "nightshift_sftp_bytes_total",
+        "nightshift_db_flush_seconds",
+        "nightshift_pipeline_queue_depth",
+    ):
+        assert f"# TYPE {name} " in text
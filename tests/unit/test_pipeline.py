@@ -0,0 +1,249 @@
+# -*- coding: utf-8 -*-
+from contextlib import nullcontext as does_not_raise
+from datetime import datetime, timezone
+import logging
+import os
+
+from bookops_worldcat.errors import WorldcatRequestError
+import pytest
+
+from nightshift import instrumentation
+from nightshift.budget import BudgetConfig, RunBudget
+from nightshift.comms.worldcat import Worldcat
+from nightshift.datastore import Event, Resource
+from nightshift.pipeline import StreamingPipeline
+from nightshift.tasks import Tasks
+
+
+@pytest.fixture
+def new_resource(test_session, test_data_core):
+    test_session.add(
+        Resource(
+            nid=1,
+            sierraId=11111111,
+            libraryId=1,
+            resourceCategoryId=1,
+            sourceId=1,
+            bibDate=datetime.now(timezone.utc).date(),
+            title="Pride and prejudice.",
+            distributorNumber="123",
+            status="open",
+        )
+    )
+    test_session.commit()
+
+
+@pytest.fixture
+def mock_full_bibs(monkeypatch, stub_resource):
+    full_bib = stub_resource.fullBib
+
+    def _patch(*args):
+        for resource in args[1]:
+            yield (resource, full_bib)
+
+    monkeypatch.setattr(Worldcat, "get_full_bibs", _patch)
+
+
+@pytest.fixture
+def cleanup_temp_files():
+    yield
+    for category in ("ebook", "eaudio", "evideo"):
+        try:
+            os.remove(f"temp-NYP-{category}.mrc")
+        except FileNotFoundError:
+            pass
+
+
+def test_streaming_pipeline_invalid_queue_size(test_session, stub_res_cat_by_name):
+    tasks = Tasks(test_session, "NYP", 1, stub_res_cat_by_name)
+    with pytest.raises(ValueError):
+        StreamingPipeline(tasks, queue_size=0)
+
+
+@pytest.mark.parametrize("queue_size", [1, 50])
+def test_streaming_pipeline_match(
+    queue_size,
+    caplog,
+    test_session,
+    new_resource,
+    stub_res_cat_by_name,
+    mock_worldcat_creds,
+    mock_successful_post_token_response,
+    mock_successful_session_get_request,
+    mock_full_bibs,
+    mock_transfer_to_drive,
+    cleanup_temp_files,
+):
+    resources = test_session.query(Resource).all()
+    tasks = Tasks(test_session, "NYP", 1, stub_res_cat_by_name)
+
+    with does_not_raise():
+        with caplog.at_level(logging.INFO):
+            StreamingPipeline(tasks, queue_size=queue_size).run(resources)
+
+    assert "Enhanced and serialized 1 and skipped 0 NYP ebook record(s)." in caplog.text
+
+    res = test_session.query(Resource).filter_by(nid=1).one()
+    assert len(res.queries) == 1
+    assert res.queries[0].match
+    assert res.oclcMatchNumber == "44959645"
+    assert res.fullBib is not None
+    assert res.status == "bot_enhanced"
+    assert res.outputId is not None
+    assert res.enhanceTimestamp is not None
+
+    events = [e.status for e in test_session.query(Event).order_by(Event.nid).all()]
+    assert events == ["worldcat_hit", "bot_enhanced"]
+
+
+def test_streaming_pipeline_no_match(
+    test_session,
+    new_resource,
+    stub_res_cat_by_name,
+    mock_worldcat_creds,
+    mock_successful_post_token_response,
+    mock_successful_session_get_request_no_matches,
+    mock_transfer_to_drive,
+):
+    resources = test_session.query(Resource).all()
+    tasks = Tasks(test_session, "NYP", 1, stub_res_cat_by_name)
+    StreamingPipeline(tasks).run(resources)
+
+    res = test_session.query(Resource).filter_by(nid=1).one()
+    assert len(res.queries) == 1
+    assert res.queries[0].match is False
+    assert res.oclcMatchNumber is None
+    assert res.status == "open"
+
+    event = test_session.query(Event).one()
+    assert event.status == "worldcat_miss"
+
+
+def test_streaming_pipeline_budget_exhausted(
+    caplog,
+    test_session,
+    new_resource,
+    stub_res_cat_by_name,
+    mock_worldcat_creds,
+    mock_successful_post_token_response,
+    mock_successful_session_get_request,
+    mock_full_bibs,
+    mock_transfer_to_drive,
+    cleanup_temp_files,
+):
+    test_session.add(
+        Resource(
+            nid=2,
+            sierraId=11111112,
+            libraryId=1,
+            resourceCategoryId=1,
+            sourceId=1,
+            bibDate=datetime.now(timezone.utc).date(),
+            title="Emma.",
+            distributorNumber="124",
+            status="open",
+        )
+    )
+    test_session.commit()
+    resources = test_session.query(Resource).order_by(Resource.nid).all()
+
+    instrumentation.start_report()
+    budget = RunBudget(BudgetConfig(libraryApiCalls=1))
+    budget.start_library("NYP")
+    tasks = Tasks(test_session, "NYP", 1, stub_res_cat_by_name, budget)
+    with caplog.at_level(logging.WARNING):
+        StreamingPipeline(tasks).run(resources)
+
+    assert (
+        "Stopping NYP searches: NYP budget of 1 API calls exhausted. "
+        "Remaining resources are left for the next run."
+    ) in caplog.text
+
+    # the match found before the budget ran out is still enhanced
+    res = test_session.query(Resource).filter_by(nid=1).one()
+    assert res.status == "bot_enhanced"
+    res = test_session.query(Resource).filter_by(nid=2).one()
+    assert res.queries == []
+    assert res.status == "open"
+
+
+def test_streaming_pipeline_resources_at_later_stages(
+    test_session,
+    test_data_rich,
+    stub_res_cat_by_name,
+    mock_worldcat_creds,
+    mock_successful_post_token_response,
+    mock_full_bibs,
+    mock_transfer_to_drive,
+    cleanup_temp_files,
+):
+    resource = test_session.query(Resource).filter_by(nid=1).one()
+    resource.status = "open"
+    resource.fullBib = None
+    test_session.commit()
+
+    tasks = Tasks(test_session, "NYP", 1, stub_res_cat_by_name)
+    StreamingPipeline(tasks).run([], download_resources=[resource])
+
+    res = test_session.query(Resource).filter_by(nid=1).one()
+    assert res.status == "bot_enhanced"
+    assert res.outputId == 2
+
+
+def test_streaming_pipeline_search_error(
+    test_session,
+    new_resource,
+    stub_res_cat_by_name,
+    mock_worldcat_creds,
+    mock_successful_post_token_response,
+    mock_session_error,
+    mock_transfer_to_drive,
+):
+    resources = test_session.query(Resource).all()
+    tasks = Tasks(test_session, "NYP", 1, stub_res_cat_by_name)
+    with pytest.raises(WorldcatRequestError):
+        StreamingPipeline(tasks).run(resources)
+
+    res = test_session.query(Resource).filter_by(nid=1).one()
+    assert res.status == "open"
+    assert res.queries == []
+
+
+def test_streaming_pipeline_batches(
+    caplog,
+    test_session,
+    new_resource,
+    stub_res_cat_by_name,
+    mock_worldcat_creds,
+    mock_successful_post_token_response,
+    mock_successful_session_get_request,
+    mock_full_bibs,
+    mock_transfer_to_drive,
+    cleanup_temp_files,
+):
+    test_session.add(
+        Resource(
+            nid=2,
+            sierraId=22222222,
+            libraryId=1,
+            resourceCategoryId=1,
+            sourceId=1,
+            bibDate=datetime.now(timezone.utc).date(),
+            title="Emma.",
+            distributorNumber="456",
+            status="open",
+        )
+    )
+    test_session.commit()
+    first, second = test_session.query(Resource).order_by(Resource.nid).all()
+    tasks = Tasks(test_session, "NYP", 1, stub_res_cat_by_name)
+    pipeline = StreamingPipeline(tasks)
+
+    with caplog.at_level(logging.INFO):
+        pipeline.stream([first])
+        pipeline.stream([second])
+        pipeline.output()
+
+    assert "Enhanced and serialized 2 and skipped 0 NYP ebook record(s)." in caplog.text
+    statuses = [r.status for r in test_session.query(Resource).all()]
+    assert statuses == ["bot_enhanced", "bot_enhanced"]
@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+import logging
+import os
+import pstats
+
+import pytest
+
+from nightshift import instrumentation, profiling
+
+
+def _busy(n=2000):
+    return sum(i * i for i in range(n))
+
+
+@pytest.fixture(autouse=True)
+def reset_profiling():
+    yield
+    # stop and discard profiles left by the test
+    profiling.start_profiling()
+
+
+def test_profile_config_defaults(monkeypatch, tmp_path):
+    monkeypatch.delenv("PROFILE_STAGES", raising=False)
+    monkeypatch.delenv("PROFILE_TOP_N", raising=False)
+    monkeypatch.delenv("PROFILE_DIR", raising=False)
+    monkeypatch.setenv("RUN_REPORT_DIR", str(tmp_path))
+    assert profiling.profile_config() == (frozenset(), 25, str(tmp_path))
+
+
+def test_profile_config(monkeypatch):
+    monkeypatch.setenv("PROFILE_STAGES", "new_search, enhance,")
+    monkeypatch.setenv("PROFILE_TOP_N", "10")
+    monkeypatch.setenv("PROFILE_DIR", "profiles")
+    assert profiling.profile_config() == (
+        frozenset(["new_search", "enhance"]),
+        10,
+        "profiles",
+    )
+
+
+@pytest.mark.parametrize("arg", ["foo", "0"])
+def test_profile_config_invalid_top_n(monkeypatch, arg):
+    monkeypatch.setenv("PROFILE_TOP_N", arg)
+    with pytest.raises(ValueError):
+        profiling.profile_config()
+
+
+@pytest.mark.parametrize(
+    "stages,expectation",
+    [(frozenset(), False), (frozenset(["enhance"]), True), (frozenset(["all"]), True)],
+)
+def test_is_profiled(stages, expectation):
+    profiling.start_profiling(stages=stages)
+    assert profiling.is_profiled("enhance") is expectation
+
+
+def test_run_profile(tmp_path, caplog):
+    profiling.start_profiling(run=True)
+    _busy()
+    with caplog.at_level(logging.INFO):
+        saved = profiling.save_profiles(str(tmp_path), runId=3, topN=5)
+
+    assert len(saved) == 1
+    assert os.path.basename(saved[0]).startswith("profile-3-run-")
+    assert "_busy" in str(pstats.Stats(saved[0]).stats)
+    assert f"Top 5 functions of run profile ({saved[0]}):" in caplog.text
+    assert profiling.save_profiles(str(tmp_path)) == []
+
+
+def test_stage_profiles(tmp_path):
+    profiling.start_profiling(stages=frozenset(["enhance"]))
+    for category in ("ebook", "eaudio"):
+        with instrumentation.stage("enhance", "NYP", category):
+            _busy()
+    with instrumentation.stage("new_search", "NYP"):
+        _busy()
+
+    saved = profiling.save_profiles(str(tmp_path))
+    assert len(saved) == 1
+    assert os.path.basename(saved[0]).startswith("profile-stage-enhance-")
+    calls = [v[1] for k, v in pstats.Stats(saved[0]).stats.items() if k[2] == "_busy"]
+    assert calls == [2]
+
+
+def test_stage_not_profiled_during_run_profile(tmp_path):
+    profiling.start_profiling(run=True, stages=frozenset(["all"]))
+    with profiling.stage("enhance"):
+        _busy()
+    saved = profiling.save_profiles(str(tmp_path))
+    assert [os.path.basename(fh)[:12] for fh in saved] == ["profile-run-"]
+
+
+def test_nested_stages_profiled_once(tmp_path):
+    profiling.start_profiling(stages=frozenset(["all"]))
+    with profiling.stage("streaming"):
+        with profiling.stage("streaming_search"):
+            _busy()
+    saved = profiling.save_profiles(str(tmp_path))
+    assert len(saved) == 1
+    assert "stage-streaming-" in saved[0]
@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+import pytest
+
+from nightshift import reference_data
+from nightshift.datastore import Library, RottenApple, RottenAppleResource
+from nightshift.datastore_transactions import ResCatById, ResCatByName
+
+
+def test_load(test_session, test_data_core):
+    data = reference_data.load(test_session)
+    assert data.libraries == {1: "NYP", 2: "BPL"}
+    assert data.resourceCategories["ebook"] == ResCatByName(
+        1,
+        "x",
+        "z",
+        frozenset(["020", "037", "856"]),
+        frozenset(["020", "029", "037", "090", "263", "856", "910", "938"]),
+        ((30, 90), (90, 180)),
+    )
+    assert data.resourceCategoriesById[1] == ResCatById(
+        "ebook", *data.resourceCategories["ebook"][1:]
+    )
+    assert len(data.resourceCategoriesById) == 11
+    assert data.rottenApples == {1: ("UKAHL", "UAH"), 2: ("UKAHL",), 3: ("UKAHL",)}
+
+
+def test_load_is_read_only(test_session, test_data_core):
+    data = reference_data.load(test_session)
+    with pytest.raises(TypeError):
+        data.libraries[3] = "QPL"
+    with pytest.raises(TypeError):
+        data.rottenApples[1] = ("FOO",)
+    with pytest.raises(AttributeError):
+        data.resourceCategories["ebook"].dstTags2Delete.add("245")
+
+
+def test_reference_data_cached_until_invalidated(test_session, test_data_core):
+    assert reference_data.cached() is None
+    data = reference_data.reference_data(test_session)
+    assert reference_data.cached() is data
+
+    test_session.add(Library(nid=3, code="QPL"))
+    test_session.add(RottenApple(nid=3, code="FOO"))
+    test_session.commit()
+    test_session.add(RottenAppleResource(resourceCategoryId=1, rottenAppleId=3))
+    test_session.commit()
+    assert reference_data.reference_data(test_session) is data
+    assert 3 not in data.libraries
+
+    reference_data.invalidate()
+    assert reference_data.cached() is None
+    data = reference_data.reference_data(test_session)
+    assert data.libraries[3] == "QPL"
+    assert data.rottenApples[1] == ("UKAHL", "UAH", "FOO")
@@ -7,10 +7,17 @@ import os
 from pymarc import MARCReader
 import pytest
 
+from nightshift import instrumentation, metrics, reference_data
+from nightshift.comms.worldcat import BriefBibResponse, Worldcat
+from nightshift.budget import BudgetConfig, RunBudget
 from nightshift.constants import ROTTEN_APPLES
 from nightshift.datastore import Event, Resource, OutputFile, SourceFile
-from nightshift.datastore_transactions import ResCatByName, ResCatById
-from nightshift.ns_exceptions import DriveError
+from nightshift.datastore_transactions import (
+    ResCatByName,
+    ResCatById,
+    iter_open_matched_resources_with_full_bib_obtained,
+)
+from nightshift.ns_exceptions import BudgetExhausted, DriveError
 from nightshift.tasks import Tasks
 
 from ..conftest import (
@@ -36,10 +43,44 @@ def test_create_resource_category_idx(test_session, stub_res_cat_by_name):
     assert res[9].queryDays == [(15, 30), (30, 60)]
 
 
+def test_resource_category_idx_reused_from_reference_data(
+    test_session, test_data_core, stub_res_cat_by_name
+):
+    data = reference_data.reference_data(test_session)
+    tasks = Tasks(test_session, "NYP", 1, data.resourceCategories)
+    assert tasks._res_cat_idx is data.resourceCategoriesById
+
+    tasks = Tasks(test_session, "NYP", 1, stub_res_cat_by_name)
+    assert tasks._res_cat_idx is not data.resourceCategoriesById
+    assert tasks._res_cat_idx[1].srcTags2Keep == ["020", "037", "856"]
+
+
+def test_tasks_share_event_sink_of_session(
+    test_session, test_data_core, stub_res_cat_by_name
+):
+    nyp = Tasks(test_session, "NYP", 1, stub_res_cat_by_name)
+    bpl = Tasks(test_session, "BPL", 2, stub_res_cat_by_name)
+    assert nyp.events is bpl.events
+
+    resource = Resource(
+        libraryId=1,
+        sierraId=11111111,
+        bibDate=datetime.now(timezone.utc).date(),
+        resourceCategoryId=1,
+    )
+    nyp.events.add(resource, status="worldcat_hit")
+    bpl.events.add(resource, status="worldcat_miss")
+    test_session.commit()
+    assert [e.status for e in test_session.query(Event).order_by(Event.nid)] == [
+        "worldcat_hit",
+        "worldcat_miss",
+    ]
+
+
 def test_create_rotten_apples_idx(test_session, test_data_core, stub_res_cat_by_name):
     tasks = Tasks(test_session, "NYP", 1, stub_res_cat_by_name)
     res = tasks._create_rotten_apples_idx()
-    assert res == {1: ["UKAHL", "UAH"], 2: ["UKAHL"], 3: ["UKAHL"]}
+    assert res == {1: ("UKAHL", "UAH"), 2: ("UKAHL",), 3: ("UKAHL",)}
 
 
 def test_check_resources_sierra_state_nyp_platform(
@@ -158,6 +199,28 @@ def test_check_resources_sierra_state_bpl_solr_no_record(
     assert event.status == "staff_deleted"
 
 
+def test_check_resources_sierra_state_budget_exhausted(
+    test_session,
+    test_data_rich,
+    stub_res_cat_by_name,
+    mock_solr_env,
+    mock_failed_solr_session_response,
+):
+    resource = test_session.query(Resource).filter_by(nid=1).one()
+    resource.status = "open"
+    test_session.commit()
+
+    budget = RunBudget(BudgetConfig(runSeconds=60))
+    budget.started -= 60
+    tasks = Tasks(test_session, "BPL", 2, stub_res_cat_by_name, budget)
+    with pytest.raises(BudgetExhausted):
+        tasks.check_resources_sierra_state([resource])
+
+    resource = test_session.query(Resource).filter_by(nid=1).one()
+    assert resource.status == "open"
+    assert test_session.query(Event).one_or_none() is None
+
+
 def test_check_resources_sierra_state_invalid_library_arg(caplog):
     with pytest.raises(ValueError):
         with caplog.at_level(logging.ERROR):
@@ -200,6 +263,97 @@ def test_enhance_and_output_bibs(
     assert resource.enhanceTimestamp is not None
 
 
+def test_enhance_and_output_bibs_paginated(
+    monkeypatch, test_session, test_data_core, stub_resource, stub_res_cat_by_name
+):
+    for sierraId in (11111111, 22222222):
+        test_session.add(
+            Resource(
+                sierraId=sierraId,
+                libraryId=1,
+                resourceCategoryId=1,
+                sourceId=1,
+                bibDate=datetime.now(timezone.utc).date(),
+                title="TITLE",
+                status="open",
+                oclcMatchNumber="850939580",
+                fullBib=stub_resource.fullBib,
+            )
+        )
+    test_session.commit()
+    outputs = []
+
+    def _transfer(tasks, resource_category, src_file):
+        outputs.append(src_file)
+        return "foo.mrc"
+
+    monkeypatch.setattr(Tasks, "transfer_to_drive", _transfer)
+
+    tasks = Tasks(test_session, "NYP", 1, stub_res_cat_by_name)
+    resources = iter_open_matched_resources_with_full_bib_obtained(
+        test_session, 1, 1, page_size=1
+    )
+    assert tasks.enhance_and_output_bibs("ebook", resources) == 2
+    os.remove("temp.mrc")
+
+    assert outputs == ["temp.mrc"]
+    statuses = [r.status for r in test_session.query(Resource).all()]
+    assert statuses == ["bot_enhanced", "bot_enhanced"]
+
+
+def test_enhance_and_output_bibs_no_resources(
+    monkeypatch, test_session, stub_res_cat_by_name
+):
+    def _transfer(*args):
+        raise AssertionError("SFTP should not be connected")
+
+    monkeypatch.setattr(Tasks, "transfer_to_drive", _transfer)
+
+    tasks = Tasks(test_session, "NYP", 1, stub_res_cat_by_name)
+    assert tasks.enhance_and_output_bibs("ebook", iter([])) == 0
+
+
+def test_get_worldcat_brief_bib_matches_builds_query_templates_once(
+    monkeypatch,
+    test_session,
+    test_data_core,
+    stub_res_cat_by_name,
+    mock_worldcat_creds,
+    mock_successful_post_token_response,
+    mock_successful_session_get_request,
+):
+    test_session.add(
+        Resource(
+            nid=1,
+            sierraId=11111111,
+            libraryId=1,
+            resourceCategoryId=1,
+            sourceId=1,
+            bibDate=datetime.now(timezone.utc).date(),
+            title="Pride and prejudice.",
+            distributorNumber="123",
+            status="open",
+        )
+    )
+    test_session.commit()
+    built = []
+    build = Worldcat.build_query_templates
+
+    def _build(*args):
+        built.append(args[1])
+        return build(*args)
+
+    monkeypatch.setattr(Worldcat, "build_query_templates", _build)
+    resources = test_session.query(Resource).filter_by(nid=1).all()
+    tasks = Tasks(test_session, "NYP", 1, stub_res_cat_by_name)
+    tasks.get_worldcat_brief_bib_matches(resources)
+    tasks.get_worldcat_brief_bib_matches(resources)
+
+    assert built == [tasks.rotten_apples]
+    assert tasks.query_templates[1][0].suffix == " NOT lv:3 NOT cs=UKAHL NOT cs=UAH"
+    assert len(test_session.query(Resource).filter_by(nid=1).one().queries) == 2
+
+
 def test_get_worldcat_brief_bib_matches_success(
     test_session,
     test_data_core,
@@ -224,8 +378,13 @@ def test_get_worldcat_brief_bib_matches_success(
     test_session.commit()
     resources = test_session.query(Resource).filter_by(nid=1).all()
     tasks = Tasks(test_session, "NYP", 1, stub_res_cat_by_name)
+    hits = metrics.WORLDCAT_QUERIES.value(library="NYP", category="ebook", result="hit")
     tasks.get_worldcat_brief_bib_matches(resources)
 
+    assert (
+        metrics.WORLDCAT_QUERIES.value(library="NYP", category="ebook", result="hit")
+        == hits + 1
+    )
     res = test_session.query(Resource).filter_by(nid=1).all()[0]
     query = res.queries[0]
     assert query.nid == 1
@@ -245,6 +404,44 @@ def test_get_worldcat_brief_bib_matches_success(
     assert event.status == "worldcat_hit"
 
 
+def test_get_worldcat_brief_bib_matches_budget_exhausted(
+    test_session,
+    test_data_core,
+    stub_res_cat_by_name,
+    mock_worldcat_creds,
+    mock_successful_post_token_response,
+    mock_successful_session_get_request,
+):
+    for nid in (1, 2):
+        test_session.add(
+            Resource(
+                nid=nid,
+                sierraId=11111110 + nid,
+                libraryId=1,
+                resourceCategoryId=1,
+                sourceId=1,
+                bibDate=datetime.now(timezone.utc).date(),
+                title="Pride and prejudice.",
+                distributorNumber=f"12{nid}",
+                status="open",
+            )
+        )
+    test_session.commit()
+    resources = test_session.query(Resource).order_by(Resource.nid).all()
+
+    instrumentation.start_report()
+    budget = RunBudget(BudgetConfig(libraryApiCalls=1))
+    budget.start_library("NYP")
+    tasks = Tasks(test_session, "NYP", 1, stub_res_cat_by_name, budget)
+    with pytest.raises(BudgetExhausted):
+        with instrumentation.stage("new_search", "NYP"):
+            tasks.get_worldcat_brief_bib_matches(resources)
+
+    # the second resource is left for the next run
+    resources = test_session.query(Resource).order_by(Resource.nid).all()
+    assert [len(r.queries) for r in resources] == [1, 0]
+
+
 @pytest.mark.parametrize("library,library_id", [("NYP", 1), ("BPL", 2)])
 def test_get_worldcat_brief_bib_matches_failed(
     library,
@@ -272,8 +469,15 @@ def test_get_worldcat_brief_bib_matches_failed(
     test_session.commit()
     resources = test_session.query(Resource).filter_by(nid=1).all()
     tasks = Tasks(test_session, library, library_id, stub_res_cat_by_name)
+    misses = metrics.WORLDCAT_QUERIES.value(
+        library=library, category="ebook", result="miss"
+    )
     tasks.get_worldcat_brief_bib_matches(resources)
 
+    assert (
+        metrics.WORLDCAT_QUERIES.value(library=library, category="ebook", result="miss")
+        == misses + 1
+    )
     res = test_session.query(Resource).filter_by(nid=1).all()[0]
     query = res.queries[0]
     assert query.nid == 1
@@ -294,6 +498,50 @@ def test_get_worldcat_brief_bib_matches_failed(
     assert event.status == "worldcat_miss"
 
 
+def test_record_brief_bib_response_rejected_by_prescreen(
+    test_session, test_data_core, stub_res_cat_by_name
+):
+    test_session.add(
+        Resource(
+            nid=1,
+            sierraId=11111111,
+            libraryId=1,
+            resourceCategoryId=1,
+            sourceId=1,
+            bibDate=datetime.now(timezone.utc).date(),
+            title="Pride and prejudice.",
+            distributorNumber="123",
+            status="open",
+        )
+    )
+    test_session.commit()
+    resource = test_session.query(Resource).filter_by(nid=1).one()
+    response = BriefBibResponse(
+        {
+            "numberOfRecords": 1,
+            "briefRecords": [{"oclcNumber": "123", "title": "PRIDE AND PREJUDICE."}],
+        }
+    )
+    tasks = Tasks(test_session, "NYP", 1, stub_res_cat_by_name)
+    rejected = metrics.WORLDCAT_QUERIES.value(
+        library="NYP", category="ebook", result="rejected"
+    )
+    tasks.record_brief_bib_response(resource, response)
+    tasks.events.flush()
+    test_session.commit()
+
+    assert (
+        metrics.WORLDCAT_QUERIES.value(
+            library="NYP", category="ebook", result="rejected"
+        )
+        == rejected + 1
+    )
+    res = test_session.query(Resource).filter_by(nid=1).one()
+    assert res.queries[0].match is False
+    assert res.oclcMatchNumber is None
+    assert test_session.query(Event).one().status == "worldcat_miss"
+
+
 def test_get_worldcat_full_bibs(
     test_session,
     test_data_core,
@@ -325,6 +573,18 @@ def test_get_worldcat_full_bibs(
     assert res.fullBib == MockSuccessfulHTTP200SessionResponse().content
 
 
+def test_get_worldcat_full_bibs_no_resources(
+    monkeypatch, test_session, stub_res_cat_by_name
+):
+    def _connect(*args, **kwargs):
+        raise AssertionError("WorldCat should not be connected")
+
+    monkeypatch.setattr(Worldcat, "__init__", _connect)
+
+    tasks = Tasks(test_session, "NYP", 1, stub_res_cat_by_name)
+    assert tasks.get_worldcat_full_bibs(iter([])) == 0
+
+
 def test_ingest_new_files(
     sftpserver, test_session, test_data_core, stub_res_cat_by_name, mock_sftp_env
 ):
@@ -352,6 +612,20 @@ def test_ingest_new_files(
     assert len(resources) == 2
 
 
+def test_ingest_new_files_with_cached_reference_data(
+    sftpserver, test_session, test_data_core, mock_sftp_env
+):
+    with open("tests/nyp-ebook-sample.mrc", "rb") as test_file:
+        marc_data = test_file.read()
+
+    data = reference_data.reference_data(test_session)
+    with sftpserver.serve_content({"sierra_dumps_dir": {"NYP-bar-pout": marc_data}}):
+        tasks = Tasks(test_session, "NYP", 1, data.resourceCategories)
+        tasks.ingest_new_files()
+
+    assert test_session.query(Resource).count() == 2
+
+
 def test_ingest_new_files_empty_file(
     sftpserver, test_session, test_data_core, stub_res_cat_by_name, mock_sftp_env
 ):
@@ -15,8 +15,10 @@ from bookops_worldcat.errors import (
     WorldcatRequestError,
 )
 
+from nightshift import metrics
+from nightshift.constants import RESOURCE_CATEGORIES
 from nightshift.datastore import Resource
-from nightshift.comms.worldcat import Worldcat, BriefBibResponse
+from nightshift.comms.worldcat import Worldcat, BriefBibResponse, QueryTemplate
 
 
 class TestBriefBibResponse:
@@ -32,6 +34,76 @@ class TestBriefBibResponse:
         assert data.is_match is False
         assert data.oclc_number is None
 
+    def test_match_from_json_data(self):
+        data = BriefBibResponse(
+            {"numberOfRecords": 1, "briefRecords": [{"oclcNumber": "123"}]}
+        )
+        assert data.is_match
+        assert data.oclc_number == "123"
+
+    @pytest.mark.parametrize(
+        "title,creator,expectation",
+        [
+            ("Pride and prejudice.", "Jane Austen", None),
+            ("1984", None, None),
+            (None, None, None),
+            ("PRIDE AND PREJUDICE.", "Jane Austen", "uppercase title"),
+            ("Pride and prejudice \u00a9.", "Jane Austen", "characters encoding"),
+            ("Pride and prejudice.", "Jane \u2117usten", "characters encoding"),
+        ],
+    )
+    def test_prescreen(self, title, creator, expectation):
+        data = BriefBibResponse(
+            {
+                "numberOfRecords": 1,
+                "briefRecords": [
+                    {"oclcNumber": "123", "title": title, "creator": creator}
+                ],
+            }
+        )
+        assert data.rejection == expectation
+        assert data.is_match is (expectation is None)
+        assert data.oclc_number == "123"
+
+    def test_prescreen_no_matches(self):
+        data = BriefBibResponse({"numberOfRecords": 0})
+        assert data.rejection is None
+        assert data.is_match is False
+
+
+class FakeBriefBibsResponse:
+    def __init__(self, data):
+        self.data = data
+        self.content = b"some content here"
+        self.url = "request_url_here"
+
+    def json(self):
+        return self.data
+
+
+@pytest.fixture
+def packed_search(monkeypatch, mock_Worldcat):
+    """
+    Records queries of brief bibs searches and returns brief records of
+    ISBNs found in the `catalog` dictionary (ISBN: OCLC number).
+    """
+    queries = []
+    catalog = {"9780001": "1", "9780002": "2", "9780003": "3"}
+
+    def _search(**kwargs):
+        queries.append((kwargs["q"], kwargs["limit"]))
+        records = [
+            {"oclcNumber": oclc, "isbns": [isbn]}
+            for isbn, oclc in catalog.items()
+            if f"bn:{isbn}" in kwargs["q"]
+        ]
+        return FakeBriefBibsResponse(
+            {"numberOfRecords": len(records), "briefRecords": records}
+        )
+
+    monkeypatch.setattr(mock_Worldcat.session, "brief_bibs_search", _search)
+    return queries
+
 
 class TestWorldcatMocked:
     """Tests Worldcat class methods with mocking all interactions with OCLC service"""
@@ -51,6 +123,24 @@ class TestWorldcatMocked:
 
         assert reader.library == arg.upper()
 
+    def test_init_without_connecting(self, monkeypatch):
+        def _fail(*args, **kwargs):
+            raise AssertionError("Unexpected request for an access token.")
+
+        monkeypatch.setattr(Worldcat, "_get_access_token", _fail)
+        with Worldcat("NYP", connect=False) as reader:
+            assert reader.connected is False
+            templates = reader.build_query_templates({})
+            assert reader._prep_resource_queries_payloads(
+                Resource(resourceCategoryId=1, distributorNumber="123"), templates
+            ) == [
+                {
+                    "q": "sn=123 NOT lv:3",
+                    "itemType": "book",
+                    "itemSubType": "book-digital",
+                }
+            ]
+
     def test_get_credentials(self, mock_Worldcat):
         assert mock_Worldcat._get_credentials() == {
             "key": "lib_key",
@@ -78,6 +168,34 @@ class TestWorldcatMocked:
                 Worldcat("NYP")
         assert "Unable to obtain NYP Worldcat MetadataAPI access token." in caplog.text
 
+    def test_build_query_templates(self, mock_Worldcat):
+        templates = mock_Worldcat.build_query_templates({1: ["FOO"], 4: ["BAR"]})
+        assert sorted(templates.keys()) == sorted(
+            v["nid"] for v in RESOURCE_CATEGORIES.values()
+        )
+        assert templates[1] == (
+            QueryTemplate(
+                "distributorNumber",
+                "sn=",
+                " NOT lv:3 NOT cs=FOO",
+                {"itemType": "book", "itemSubType": "book-digital"},
+            ),
+        )
+        assert [t.field for t in templates[4]] == ["standardNumber", "congressNumber"]
+        assert [t.suffix for t in templates[4]] == [" NOT cs=BAR", " NOT cs=BAR"]
+        assert [t.suffix for t in templates[5]] == ["", ""]
+
+    def test_prep_resource_queries_payloads_unknown_category(self, mock_Worldcat):
+        resource = Resource(
+            resourceCategoryId=99, sierraId=22222222, distributorNumber="111"
+        )
+        assert (
+            mock_Worldcat._prep_resource_queries_payloads(
+                resource, mock_Worldcat.build_query_templates({})
+            )
+            == []
+        )
+
     def test_create_worldcat_session(self, mock_Worldcat):
         assert isinstance(mock_Worldcat.session, MetadataSession)
 
@@ -207,11 +325,54 @@ class TestWorldcatMocked:
         )
         with caplog.at_level(logging.DEBUG):
             payloads = mock_Worldcat._prep_resource_queries_payloads(
-                resource, rotten_apples
+                resource, mock_Worldcat.build_query_templates(rotten_apples)
             )
         assert payloads == expectation
         assert f"Query payload for NYP Sierra bib # b22222222a: {expectation}."
 
+    def test_plan_queries(self, monkeypatch, mock_Worldcat):
+        def _fail(*args, **kwargs):
+            raise AssertionError("Unexpected WorldCat request.")
+
+        monkeypatch.setattr(Worldcat, "_search_brief_bibs", _fail)
+        resources = [
+            Resource(nid=1, resourceCategoryId=1, distributorNumber="111"),
+            Resource(nid=2, resourceCategoryId=1),
+        ]
+        assert list(mock_Worldcat.plan_queries(resources, {1: ["FOO"]})) == [
+            (
+                resources[0],
+                [
+                    {
+                        "q": "sn=111 NOT lv:3 NOT cs=FOO",
+                        "itemType": "book",
+                        "itemSubType": "book-digital",
+                    }
+                ],
+            ),
+            (resources[1], []),
+        ]
+
+    def test_plan_queries_with_query_templates(self, mock_Worldcat):
+        templates = mock_Worldcat.build_query_templates({})
+        resource = Resource(nid=1, resourceCategoryId=1, distributorNumber="111")
+        assert list(
+            mock_Worldcat.plan_queries(
+                [resource], {1: ["FOO"]}, query_templates=templates
+            )
+        ) == [
+            (
+                resource,
+                [
+                    {
+                        "q": "sn=111 NOT lv:3",
+                        "itemType": "book",
+                        "itemSubType": "book-digital",
+                    }
+                ],
+            )
+        ]
+
     def test_get_brief_bibs(
         self, caplog, mock_Worldcat, mock_successful_session_get_request
     ):
@@ -223,10 +384,19 @@ class TestWorldcatMocked:
             title="TEST TITLE",
             distributorNumber="111",
         )
+        requests = metrics.WORLDCAT_REQUEST_SECONDS.count(
+            library="NYP", endpoint="brief_bibs_search"
+        )
         with caplog.at_level(logging.DEBUG):
             result = next(mock_Worldcat.get_brief_bibs([resource]))
 
         assert isinstance(result, tuple)
+        assert (
+            metrics.WORLDCAT_REQUEST_SECONDS.count(
+                library="NYP", endpoint="brief_bibs_search"
+            )
+            == requests + 1
+        )
 
         resource, data = result
         assert isinstance(resource, Resource)
@@ -308,3 +478,125 @@ class TestWorldcatMocked:
         assert isinstance(resource, Resource)
         assert resource.nid == 2
         assert isinstance(response, BriefBibResponse)
+
+    @pytest.mark.parametrize("arg,expectation", [(None, 1), ("", 1), ("25", 25)])
+    def test_pack_size(self, monkeypatch, mock_Worldcat, arg, expectation):
+        if arg is None:
+            monkeypatch.delenv("WORLDCAT_PACK_SIZE", raising=False)
+        else:
+            monkeypatch.setenv("WORLDCAT_PACK_SIZE", arg)
+        assert mock_Worldcat._pack_size() == expectation
+
+    @pytest.mark.parametrize("arg", ["foo", "0", "51"])
+    def test_pack_size_invalid(self, monkeypatch, mock_Worldcat, arg):
+        monkeypatch.setenv("WORLDCAT_PACK_SIZE", arg)
+        with pytest.raises(ValueError) as exc:
+            mock_Worldcat._pack_size()
+        assert "Invalid WORLDCAT_PACK_SIZE value." in str(exc.value)
+
+    def test_get_brief_bibs_packed(self, caplog, mock_Worldcat, packed_search):
+        resources = [
+            Resource(nid=1, sierraId=1, resourceCategoryId=4, standardNumber="9780001"),
+            Resource(nid=2, sierraId=2, resourceCategoryId=4, standardNumber="9780009"),
+            Resource(nid=3, sierraId=3, resourceCategoryId=1, distributorNumber="O1"),
+            Resource(
+                nid=4, sierraId=4, resourceCategoryId=4, standardNumber="978-0002"
+            ),
+            Resource(nid=5, sierraId=5, resourceCategoryId=4, standardNumber="9780003"),
+        ]
+        with caplog.at_level(logging.DEBUG):
+            results = list(
+                mock_Worldcat.get_brief_bibs(resources, {4: ["FOO"]}, pack_size=4)
+            )
+
+        assert [(r.nid, d.oclc_number) for r, d in results] == [
+            (1, "1"),
+            (2, None),
+            (3, None),
+            (4, "2"),
+            (5, "3"),
+        ]
+        assert packed_search == [
+            ("(bn:9780001 OR bn:9780009 OR bn:9780002) NOT cs=FOO", 50),
+            ("bn:9780009 NOT cs=FOO", 1),
+            ("sn=O1 NOT lv:3", 1),
+            ("bn:9780003 NOT cs=FOO", 1),
+        ]
+        assert "Match found for NYP Sierra bib # b1a in packed query." in caplog.text
+
+    def test_get_brief_bibs_packed_most_widely_held_record(
+        self, monkeypatch, mock_Worldcat
+    ):
+        def _search(**kwargs):
+            return FakeBriefBibsResponse(
+                {
+                    "numberOfRecords": 3,
+                    "briefRecords": [
+                        {"oclcNumber": "1", "isbns": ["9780001"]},
+                        {"oclcNumber": "2", "isbns": ["9780002", "9780001"]},
+                        {"oclcNumber": "3", "isbns": ["9780002"]},
+                    ],
+                }
+            )
+
+        monkeypatch.setattr(mock_Worldcat.session, "brief_bibs_search", _search)
+        resources = [
+            Resource(nid=1, sierraId=1, resourceCategoryId=4, standardNumber="9780001"),
+            Resource(nid=2, sierraId=2, resourceCategoryId=4, standardNumber="9780002"),
+        ]
+        results = list(mock_Worldcat.get_brief_bibs(resources, pack_size=2))
+        assert [d.oclc_number for _, d in results] == ["1", "2"]
+
+    def test_get_brief_bibs_not_packed_by_default(
+        self, monkeypatch, mock_Worldcat, packed_search
+    ):
+        monkeypatch.delenv("WORLDCAT_PACK_SIZE", raising=False)
+        resources = [
+            Resource(nid=1, sierraId=1, resourceCategoryId=4, standardNumber="9780001"),
+            Resource(nid=2, sierraId=2, resourceCategoryId=4, standardNumber="9780002"),
+        ]
+        results = list(mock_Worldcat.get_brief_bibs(resources))
+        assert [d.oclc_number for _, d in results] == ["1", "2"]
+        assert packed_search == [("bn:9780001", 1), ("bn:9780002", 1)]
+
+    def test_get_brief_bibs_rejected_by_prescreen(
+        self, caplog, monkeypatch, mock_Worldcat
+    ):
+        queries = []
+
+        def _search(**kwargs):
+            queries.append(kwargs["q"])
+            if kwargs["q"].startswith("ln:"):
+                record = {"oclcNumber": "2", "title": "Title"}
+            else:
+                record = {"oclcNumber": "1", "title": "TITLE", "isbns": ["9780001"]}
+            return FakeBriefBibsResponse(
+                {"numberOfRecords": 1, "briefRecords": [record]}
+            )
+
+        monkeypatch.setattr(mock_Worldcat.session, "brief_bibs_search", _search)
+        resources = [
+            Resource(
+                nid=n,
+                sierraId=n,
+                resourceCategoryId=4,
+                standardNumber=f"978000{n}",
+                congressNumber=str(n),
+            )
+            for n in (1, 2)
+        ]
+        with caplog.at_level(logging.DEBUG):
+            results = list(mock_Worldcat.get_brief_bibs(resources, pack_size=2))
+
+        assert [d.oclc_number for _, d in results] == ["2", "2"]
+        assert queries == [
+            "(bn:9780001 OR bn:9780002)",
+            "bn:9780001",
+            "ln:1",
+            "bn:9780002",
+            "ln:2",
+        ]
+        assert (
+            "Worldcat record # 1 for NYP Sierra bib # b1a failed pre-screen "
+            "(uppercase title)." in caplog.text
+        )